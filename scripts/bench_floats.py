@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Measure loads() throughput on float-heavy documents.
+
+The corpus is generated: a GeoJSON polygon layer in the style of
+canada.json (coordinates printed with 15 to 17 significant digits), an
+array of short prices and an array of floats in exponent notation.
+
+    python scripts/bench_floats.py [seconds]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import simplejson as json
+
+
+def make_corpus():
+    rnd = random.Random(42)
+    rings = [[[rnd.uniform(-141.0, -52.0), rnd.uniform(41.0, 83.0)]
+              for _ in range(2000)]
+             for _ in range(50)]
+    geo = json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'name': 'Canada'},
+         'geometry': {'type': 'Polygon', 'coordinates': rings}}]})
+    prices = json.dumps([round(rnd.uniform(0, 1000), 2)
+                         for _ in range(100000)])
+    exponents = json.dumps(['%.6e' % rnd.lognormvariate(0, 30)
+                            for _ in range(100000)]).replace('"', '')
+    return [('geojson', geo), ('prices', prices), ('exponents', exponents)]
+
+
+def bench(doc, duration):
+    count = 0
+    start = time.time()
+    while True:
+        json.loads(doc)
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            return len(doc) * count / elapsed / 1e6
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print('Python %s, speedups %s' % (
+        sys.version.split()[0],
+        'on' if json._import_c_make_encoder() else 'off'))
+    for name, doc in make_corpus():
+        print('%-10s %8d bytes: %7.1f MB/s  (bytes: %7.1f MB/s)' % (
+            name, len(doc), bench(doc, duration),
+            bench(doc.encode('utf-8'), duration)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Measure loads()/dumps() throughput of the shared default decoder and
+encoder as the number of threads grows.
+
+On a free-threaded build (python3.13t and later, run with PYTHON_GIL=0)
+throughput should scale close to linearly with the thread count, up to
+the number of cores. With the GIL it stays flat.
+
+    python scripts/bench_threads.py [max_threads] [seconds]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import simplejson as json
+
+DOC = json.dumps(dict(
+    ('key%d' % i, {'id': i, 'name': 'item %d' % i, 'tags': ['a', 'b'],
+                   'price': i * 1.25, 'active': i % 2 == 0})
+    for i in range(50)))
+OBJ = json.loads(DOC)
+
+
+def run(func, threads, duration):
+    counts = [0] * threads
+    start = threading.Event()
+    deadline = []
+
+    def worker(n):
+        start.wait()
+        stop = deadline[0]
+        count = 0
+        while time.time() < stop:
+            for _ in range(20):
+                func()
+            count += 20
+        counts[n] = count
+
+    workers = [threading.Thread(target=worker, args=(n,))
+               for n in range(threads)]
+    for t in workers:
+        t.start()
+    deadline.append(time.time() + duration)
+    start.set()
+    for t in workers:
+        t.join()
+    return sum(counts) / duration
+
+
+def main():
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python %s, speedups %s, GIL %s' % (
+        sys.version.split()[0],
+        'on' if json._import_c_make_encoder() else 'off',
+        'enabled' if gil else 'disabled'))
+    for name, func in [('loads', lambda: json.loads(DOC)),
+                       ('dumps', lambda: json.dumps(OBJ))]:
+        base = None
+        threads = 1
+        while threads <= max_threads:
+            rate = run(func, threads, duration)
+            if base is None:
+                base = rate
+            print('%s %2d threads: %9.0f calls/s  %5.2fx' % (
+                name, threads, rate, rate / base))
+            threads *= 2
+
+
+if __name__ == '__main__':
+    main()
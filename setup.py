@@ -91,7 +91,8 @@ def run_setup(with_binary):
                 Extension(
                     "simplejson._speedups",
                     sources=["simplejson/_speedups.c"],
-                    depends=["simplejson/_speedups_scan.h"],
+                    depends=["simplejson/_speedups_scan.h",
+                             "simplejson/_speedups_float.h"],
                 ),
             ],
             cmdclass=dict(cmdclass, build_ext=ve_build_ext),
@@ -99,39 +99,38 @@ Using simplejson.tool from the shell to validate and pretty-print::
 Parsing multiple documents serialized as JSON lines (newline-delimited JSON)::
 
     >>> import simplejson as json
-    >>> def loads_lines(docs):
-    ...     for doc in docs.splitlines():
-    ...         yield json.loads(doc)
-    ...
-    >>> sum(doc["count"] for doc in loads_lines('{"count":1}\n{"count":2}\n{"count":3}\n'))
+    >>> sum(doc["count"] for doc in json.iter_lines('{"count":1}\n{"count":2}\n{"count":3}\n'))
     6
 
 Serializing multiple objects to JSON lines (newline-delimited JSON)::
 
     >>> import simplejson as json
-    >>> def dumps_lines(objs):
-    ...     for obj in objs:
-    ...         yield json.dumps(obj, separators=(',',':')) + '\n'
-    ...
-    >>> ''.join(dumps_lines([{'count': 1}, {'count': 2}, {'count': 3}]))
+    >>> from simplejson.compat import StringIO
+    >>> io = StringIO()
+    >>> json.dump_lines([{'count': 1}, {'count': 2}, {'count': 3}], io, separators=(',',':'))
+    >>> io.getvalue()
     '{"count":1}\n{"count":2}\n{"count":3}\n'
 
 """
 from __future__ import absolute_import
 __version__ = '4.1.1'
 __all__ = [
-    'dump', 'dumps', 'load', 'loads',
+    'dump', 'dumps', 'dumpb', 'dump_lines', 'dumps_many', 'load', 'loads',
+    'loads_many', 'iterparse', 'iter_array', 'iter_lines', 'validate',
     'JSONDecoder', 'JSONDecodeError', 'JSONEncoder',
-    'OrderedDict', 'simple_first', 'RawJSON'
+    'OrderedDict', 'simple_first', 'RawJSON', 'LazyObject', 'LazyArray',
+    'StructuralIndex',
 ]
 
 __author__ = 'Bob Ippolito <bob@redivi.com>'
 
+import sys
 from decimal import Decimal
 
 from .errors import JSONDecodeError
 from .raw_json import RawJSON
-from .decoder import JSONDecoder
+from .lazy import LazyObject, LazyArray
+from .decoder import JSONDecoder, StructuralIndex, READ_CHUNK_SIZE
 from .encoder import JSONEncoder, JSONEncoderForHTML
 
 def _import_OrderedDict():
@@ -152,6 +151,10 @@ def _import_c_make_encoder():
 
 _default_encoder = JSONEncoder()
 
+# Target size of the strings dump() passes to fp.write(); the document
+# is encoded incrementally so it is never held in memory in full.
+_DUMP_CHUNK_SIZE = 64 * 1024
+
 def dump(obj, fp, skipkeys=False, ensure_ascii=True, check_circular=True,
          allow_nan=False, cls=None, indent=None, separators=None,
          encoding='utf-8', default=None, use_decimal=True,
@@ -250,13 +253,13 @@ def dump(obj, fp, skipkeys=False, ensure_ascii=True, check_circular=True,
         and not ignore_nan and int_as_string_bitcount is None
         and not kw
     ):
-        iterable = _default_encoder.iterencode(obj)
+        iterable = _default_encoder.iterencode(obj, _DUMP_CHUNK_SIZE)
     else:
         if cls is None:
             cls = JSONEncoder
-        iterable = cls(skipkeys=skipkeys, ensure_ascii=ensure_ascii,
-            check_circular=check_circular, allow_nan=allow_nan, indent=indent,
-            separators=separators, encoding=encoding,
+        kw.update(skipkeys=skipkeys, ensure_ascii=ensure_ascii,
+            check_circular=check_circular, allow_nan=allow_nan,
+            indent=indent, separators=separators, encoding=encoding,
             default=default, use_decimal=use_decimal,
             namedtuple_as_object=namedtuple_as_object,
             tuple_as_array=tuple_as_array,
@@ -266,8 +269,17 @@ def dump(obj, fp, skipkeys=False, ensure_ascii=True, check_circular=True,
             item_sort_key=item_sort_key,
             for_json=for_json,
             ignore_nan=ignore_nan,
-            int_as_string_bitcount=int_as_string_bitcount,
-            **kw).iterencode(obj)
+            int_as_string_bitcount=int_as_string_bitcount)
+        key = _options_key(JSONEncoder, cls, kw)
+        encoder = _cache_get(_encoder_cache, key)
+        if encoder is None:
+            encoder = cls(**kw)
+            _cache_set(_encoder_cache, key, encoder)
+        if cls is JSONEncoder:
+            iterable = encoder.iterencode(obj, _DUMP_CHUNK_SIZE)
+        else:
+            # A subclass may override iterencode() without chunk_size
+            iterable = encoder.iterencode(obj)
     # could accelerate with writelines in some versions of Python, at
     # a debuggability cost
     for chunk in iterable:
@@ -379,7 +391,7 @@ def dumps(obj, skipkeys=False, ensure_ascii=True, check_circular=True,
         return _default_encoder.encode(obj)
     if cls is None:
         cls = JSONEncoder
-    return cls(
+    kw.update(
         skipkeys=skipkeys, ensure_ascii=ensure_ascii,
         check_circular=check_circular, allow_nan=allow_nan, indent=indent,
         separators=separators, encoding=encoding, default=default,
@@ -392,8 +404,136 @@ def dumps(obj, skipkeys=False, ensure_ascii=True, check_circular=True,
         item_sort_key=item_sort_key,
         for_json=for_json,
         ignore_nan=ignore_nan,
-        int_as_string_bitcount=int_as_string_bitcount,
-        **kw).encode(obj)
+        int_as_string_bitcount=int_as_string_bitcount)
+    key = _options_key(JSONEncoder, cls, kw)
+    encoder = _cache_get(_encoder_cache, key)
+    if encoder is None:
+        encoder = cls(**kw)
+        _cache_set(_encoder_cache, key, encoder)
+    return encoder.encode(obj)
+
+
+def dumpb(obj, **kw):
+    """Serialize ``obj`` to a JSON formatted ``bytes`` object encoded
+    as UTF-8.
+
+    Takes the same arguments as :func:`dumps` and returns the same
+    result as ``dumps(obj, **kw).encode('utf-8')``, but the C extension
+    writes the UTF-8 output directly instead of building a ``str`` first.
+
+    """
+    return _make_encoder(kw).encode_bytes(obj)
+
+
+def dump_lines(iterable, fp, as_bytes=False, **kw):
+    """Serialize each object of ``iterable`` as one line of JSON lines
+    (newline-delimited JSON) to ``fp`` (a ``.write()``-supporting
+    file-like object), each followed by ``'\\n'``.
+
+    One encoder is used for all of the objects, and the output is written
+    in large blocks rather than with a ``fp.write()`` call per object. If
+    *as_bytes* is true, UTF-8 encoded bytes are written, for ``fp``
+    opened in binary mode. The other keyword arguments are the same as
+    for :func:`dumps`, except that *indent* can not be used.
+
+    """
+    encoder = _make_encoder(kw)
+    for chunk in encoder.iterencode_lines(iterable, _DUMP_CHUNK_SIZE,
+                                          as_bytes):
+        fp.write(chunk)
+
+
+def dumps_many(objs, workers=None, return_exceptions=False, **kw):
+    """Serialize each object of the iterable ``objs`` to a JSON formatted
+    ``str`` and return them as a list, in the same order.
+
+    The options are parsed and the encoder is created once for the whole
+    batch. If *workers* is greater than 1 and the interpreter is running
+    without the GIL (a free-threaded build), the objects are split
+    between that many threads, otherwise they are encoded one after the
+    other. If *return_exceptions* is true, an :exc:`Exception` raised
+    for an object is put in its place in the list instead of being
+    raised. The other keyword arguments are the same as for
+    :func:`dumps`.
+
+    """
+    return _run_batches(_make_encoder(kw).encode_many, objs, workers,
+                        return_exceptions)
+
+
+def _make_encoder(kw):
+    # The encoder that dumps() would use for these keyword arguments
+    if not kw:
+        return _default_encoder
+    cls = kw.pop('cls', None) or JSONEncoder
+    key = _options_key(JSONEncoder, cls, kw)
+    encoder = _cache_get(_encoder_cache, key)
+    if encoder is None:
+        encoder = cls(**kw)
+        _cache_set(_encoder_cache, key, encoder)
+    return encoder
+
+
+# The encoders and decoders made for the options of recent calls that did
+# not use the defaults, so that calls with the same options reuse them.
+# A cache is cleared when it is full, like the pattern cache of re.
+_MAXCACHE = 64
+_encoder_cache = {}
+_decoder_cache = {}
+
+
+def _options_key(base, cls, kw):
+    # The cache key for cls(**kw), or None if cls is a subclass of base,
+    # which may keep state of its own. The types are there so that e.g.
+    # int_as_string_bitcount=1.0 is not taken for 1.
+    if cls is not base:
+        return None
+    return tuple(sorted((name, type(value), value)
+                        for name, value in kw.items()))
+
+
+def _cache_get(cache, key):
+    if key is None:
+        return None
+    try:
+        return cache.get(key)
+    except TypeError:
+        # An unhashable option, e.g. separators given as a list
+        return None
+
+
+def _cache_set(cache, key, value):
+    if key is None:
+        return
+    try:
+        hash(key)
+    except TypeError:
+        return
+    if len(cache) >= _MAXCACHE:
+        cache.clear()
+    cache[key] = value
+
+
+def _run_batches(func, items, workers, return_exceptions):
+    # Call func(batch, return_exceptions) for items, split into one batch
+    # per thread when threads can run Python code in parallel
+    items = list(items)
+    if workers is None:
+        workers = 1
+    elif workers < 1:
+        raise ValueError("workers must be greater than 0")
+    workers = min(workers, len(items))
+    if workers <= 1 or getattr(sys, '_is_gil_enabled', lambda: True)():
+        return func(items, return_exceptions)
+    from concurrent.futures import ThreadPoolExecutor
+    size = -(-len(items) // workers)
+    batches = [items[i:i + size] for i in range(0, len(items), size)]
+    rval = []
+    with ThreadPoolExecutor(len(batches)) as pool:
+        for batch in pool.map(func, batches,
+                              [return_exceptions] * len(batches)):
+            rval.extend(batch)
+    return rval
 
 
 _default_decoder = JSONDecoder()
@@ -517,6 +657,8 @@ def loads(s, encoding=None, cls=None, object_hook=None, parse_float=None,
         return _default_decoder.decode(s)
     if cls is None:
         cls = JSONDecoder
+    if encoding is not None:
+        kw['encoding'] = encoding
     if object_hook is not None:
         kw['object_hook'] = object_hook
     if object_pairs_hook is not None:
@@ -535,7 +677,116 @@ def loads(s, encoding=None, cls=None, object_hook=None, parse_float=None,
         kw['parse_float'] = Decimal
     if allow_nan:
         kw['allow_nan'] = True
-    return cls(encoding=encoding, **kw).decode(s)
+    key = _options_key(JSONDecoder, cls, kw)
+    decoder = _cache_get(_decoder_cache, key)
+    if decoder is None:
+        decoder = cls(**kw)
+        _cache_set(_decoder_cache, key, decoder)
+    return decoder.decode(s)
+
+
+def _make_decoder(kw):
+    # The decoder that loads() would use for these keyword arguments
+    if not kw:
+        return _default_decoder
+    cls = kw.pop('cls', None) or JSONDecoder
+    if kw.pop('use_decimal', False):
+        if kw.get('parse_float') is not None:
+            raise TypeError("use_decimal=True implies parse_float=Decimal")
+        kw['parse_float'] = Decimal
+    key = _options_key(JSONDecoder, cls, kw)
+    decoder = _cache_get(_decoder_cache, key)
+    if decoder is None:
+        decoder = cls(**kw)
+        _cache_set(_decoder_cache, key, decoder)
+    return decoder
+
+
+def iterparse(fp, **kw):
+    """Parse the JSON document ``fp`` (a ``.read()``-supporting file-like
+    object, or a ``str``, ``unicode`` or ``bytes`` instance) incrementally
+    and generate ``(event, value, prefix)`` tuples for its tokens, without
+    building the objects and arrays. See :meth:`JSONDecoder.iterparse`.
+
+    >>> import simplejson as json
+    >>> for event in json.iterparse('[1, [true, null]]'):
+    ...     print(event)
+    ('start_array', None, '')
+    ('number', 1, 'item')
+    ('start_array', None, 'item')
+    ('boolean', True, 'item.item')
+    ('null', None, 'item.item')
+    ('end_array', None, 'item')
+    ('end_array', None, '')
+
+    *chunk_size* is how much is read from ``fp`` at a time. The other
+    keyword arguments are the same as for :func:`loads`.
+
+    """
+    chunk_size = kw.pop('chunk_size', READ_CHUNK_SIZE)
+    return _make_decoder(kw).iterparse(fp, chunk_size)
+
+
+def iter_array(fp, **kw):
+    """Generate the elements of the JSON array in ``fp`` (a
+    ``.read()``-supporting file-like object, or a ``str``, ``unicode`` or
+    ``bytes`` instance) as soon as each of them has been read and parsed,
+    instead of building the whole list. See :meth:`JSONDecoder.iter_array`.
+
+    *chunk_size* is how much is read from ``fp`` at a time. The other
+    keyword arguments are the same as for :func:`loads`.
+
+    """
+    chunk_size = kw.pop('chunk_size', READ_CHUNK_SIZE)
+    return _make_decoder(kw).iter_array(fp, chunk_size)
+
+
+def iter_lines(fp, **kw):
+    """Generate the Python representation of each JSON document in the
+    JSON lines (newline-delimited JSON) input ``fp``, a
+    ``.read()``-supporting file-like object or a ``str``, ``unicode`` or
+    ``bytes`` instance. Blank lines are skipped. See
+    :meth:`JSONDecoder.iter_lines`.
+
+    *chunk_size* is how much is read from ``fp`` at a time. The other
+    keyword arguments are the same as for :func:`loads`.
+
+    """
+    chunk_size = kw.pop('chunk_size', READ_CHUNK_SIZE)
+    return _make_decoder(kw).iter_lines(fp, chunk_size)
+
+
+def validate(s, **kw):
+    """Check that ``s`` (a ``str``, ``unicode`` or ``bytes`` instance) is
+    a valid JSON document, and raise the same :exc:`JSONDecodeError` as
+    :func:`loads` if it is not. See :meth:`JSONDecoder.validate`.
+
+    With the C extension no Python object is built for the document, which
+    makes this much faster than :func:`loads`, and documents of 4096
+    characters or bytes or more are checked without holding the GIL. The
+    keyword arguments are the same as for :func:`loads`.
+
+    """
+    return _make_decoder(kw).validate(s)
+
+
+def loads_many(docs, workers=None, return_exceptions=False, **kw):
+    """Deserialize each JSON document of the iterable ``docs`` (``str``,
+    ``bytes`` or ``bytearray`` instances) and return the Python objects as
+    a list, in the same order.
+
+    The options are parsed and the decoder is created once for the whole
+    batch. If *workers* is greater than 1 and the interpreter is running
+    without the GIL (a free-threaded build), the documents are split
+    between that many threads, otherwise they are decoded one after the
+    other. If *return_exceptions* is true, an :exc:`Exception` raised for
+    a document (usually :exc:`JSONDecodeError`) is put in its place in
+    the list instead of being raised. The other keyword arguments are the
+    same as for :func:`loads`.
+
+    """
+    return _run_batches(_make_decoder(kw).decode_many, docs, workers,
+                        return_exceptions)
 
 
 def _toggle_speedups(enabled):
@@ -551,17 +802,22 @@ def _toggle_speedups(enabled):
         enc.encode_basestring = (enc.c_encode_basestring or
             enc.py_encode_basestring)
         scan.make_scanner = scan.c_make_scanner or scan.py_make_scanner
+        scan.make_key_cache = scan.c_make_key_cache or scan.PyKeyCache
     else:
         dec.scanstring = dec.py_scanstring
         enc.c_make_encoder = None
         enc.encode_basestring_ascii = enc.py_encode_basestring_ascii
         enc.encode_basestring = enc.py_encode_basestring
         scan.make_scanner = scan.py_make_scanner
+        scan.make_key_cache = scan.PyKeyCache
     dec.make_scanner = scan.make_scanner
+    dec.make_key_cache = scan.make_key_cache
     global _default_decoder
     _default_decoder = JSONDecoder()
     global _default_encoder
     _default_encoder = JSONEncoder()
+    _encoder_cache.clear()
+    _decoder_cache.clear()
 
 def simple_first(kv):
     """Helper function to pass to item_sort_key to sort simple
@@ -1,6 +1,7 @@
 /* -*- mode: C; c-file-style: "python"; c-basic-offset: 4 -*- */
 #include "Python.h"
 #include "structmember.h"
+#include "datetime.h"
 #include <limits.h>  /* CHAR_BIT */
 
 #if PY_MAJOR_VERSION >= 3
@@ -12,6 +13,7 @@
 #define JSON_InternFromString PyUnicode_InternFromString
 #define PyString_GET_SIZE PyUnicode_GET_LENGTH
 #define JSON_StringCheck PyUnicode_Check
+#define JSON_RecursionError PyExc_RecursionError
 #define PY2_UNUSED
 #if PY_VERSION_HEX >= 0x030C0000
 /* PyUnicode_READY was deprecated in 3.10 and is a no-op since 3.12
@@ -23,6 +25,7 @@
 #else /* PY_MAJOR_VERSION >= 3 */
 #define PY2_UNUSED UNUSED
 #define JSON_StringCheck(obj) (PyString_Check(obj) || PyUnicode_Check(obj))
+#define JSON_RecursionError PyExc_RuntimeError
 #define PyBytes_Check PyString_Check
 #define PyUnicode_READY(obj) 0
 #define PyUnicode_KIND(obj) (sizeof(Py_UNICODE))
@@ -33,6 +36,11 @@
 #define JSON_InternFromString PyString_InternFromString
 #endif /* PY_MAJOR_VERSION < 3 */
 
+#if !defined(_PyDateTime_HAS_TZINFO)
+/* Only in datetime.h since Python 3.10 */
+#define _PyDateTime_HAS_TZINFO(o) (((_PyDateTime_BaseTZInfo *)(o))->hastzinfo)
+#endif
+
 #if PY_VERSION_HEX < 0x03090000
 #if !defined(PyObject_CallNoArgs)
 #define PyObject_CallNoArgs(callable) PyObject_CallFunctionObjArgs(callable, NULL)
@@ -89,6 +97,12 @@ json_PyOS_string_to_double(const char *s, char **endptr, PyObject *overflow_exce
 #if !defined(Py_T_OBJECT_EX)
 #  define Py_T_OBJECT_EX T_OBJECT_EX
 #endif
+#if !defined(Py_T_PYSSIZET)
+#  define Py_T_PYSSIZET T_PYSSIZET
+#endif
+#if PY_MAJOR_VERSION < 3
+typedef size_t Py_uhash_t;
+#endif
 
 /* Py_BEGIN_CRITICAL_SECTION was added in Python 3.13.
    On older versions, define as no-ops. */
@@ -109,6 +123,11 @@ json_PyOS_string_to_double(const char *s, char **endptr, PyObject *overflow_exce
 typedef struct {
     PyObject *PyScannerType;
     PyObject *PyEncoderType;
+    PyObject *PyEncoderIterType;
+    PyObject *PyKeyCacheType;
+#if PY_MAJOR_VERSION >= 3
+    PyObject *PyStructuralIndexType;
+#endif
     PyObject *JSON_Infinity;
     PyObject *JSON_NegInfinity;
     PyObject *JSON_NaN;
@@ -129,6 +148,7 @@ typedef struct {
     PyObject *JSON_newline;     /* "\n", prepended before each indent */
     PyObject *JSON_sortargs;
     PyObject *JSON_itemgetter0;
+    PyObject *JSON_event_names; /* names for scanner_events, see EVENT_* */
     /* Interned attribute-name strings used in hot paths. Caching them
      * here lets the scanner/encoder use PyObject_GetAttr (which takes
      * a PyObject *) instead of PyObject_GetAttrString (which interns
@@ -138,7 +158,12 @@ typedef struct {
     PyObject *JSON_attr_sort;         /* "sort" */
     PyObject *JSON_attr_encoded_json; /* "encoded_json" */
     PyObject *JSON_attr_add_note;     /* "add_note" (PEP 678, 3.11+) */
+    PyObject *JSON_attr_isoformat;    /* "isoformat" */
+    PyObject *JSON_attr_int;          /* "int" */
+    PyObject *JSON_attr_value;        /* "value" */
     PyObject *RawJSONType;
+    PyObject *LazyContainerType;      /* simplejson.lazy._LazyContainer */
+    PyObject *LazyEncodable;          /* _LazyContainer._encodable */
     PyObject *JSONDecodeError;
 } _speedups_state;
 
@@ -193,6 +218,10 @@ get_speedups_state(PyObject *module)
 #define JSON_ALLOW_NAN 1
 #define JSON_IGNORE_NAN 2
 
+/* PyEncoderObject.fast_encode: encoder is one of our C functions */
+#define JSON_FAST_ENCODE_ASCII 1    /* py_encode_basestring_ascii */
+#define JSON_FAST_ENCODE_UNICODE 2  /* py_encode_basestring */
+
 #if PY_VERSION_HEX >= 0x030E0000
 /* Python 3.14+: JSON_Accu is backed by a PyUnicodeWriter, building the
  * entire output in one contiguous buffer.  The FinishAsList wrapper
@@ -200,11 +229,15 @@ get_speedups_state(PyObject *module)
  * is effectively a no-op. */
 typedef struct {
     PyUnicodeWriter *writer;
+    PyObject *utf8;           /* UTF-8 output buffer, see JSON_Accu_InitUTF8 */
+    Py_ssize_t length;        /* Number of characters accumulated so far */
 } JSON_Accu;
 #else
 typedef struct {
     PyObject *large_strings;  /* A list of previously accumulated large strings */
     PyObject *small_strings;  /* Pending small strings */
+    PyObject *utf8;           /* UTF-8 output buffer, see JSON_Accu_InitUTF8 */
+    Py_ssize_t length;        /* Number of characters accumulated so far */
 } JSON_Accu;
 #endif
 
@@ -214,8 +247,18 @@ static int
 JSON_Accu_Accumulate(_speedups_state *state, JSON_Accu *acc, PyObject *unicode);
 static PyObject *
 JSON_Accu_FinishAsList(_speedups_state *state, JSON_Accu *acc);
+static PyObject *
+JSON_Accu_FinishAsString(_speedups_state *state, JSON_Accu *acc);
 static void
 JSON_Accu_Destroy(JSON_Accu *acc);
+#if PY_MAJOR_VERSION >= 3
+static int
+JSON_Accu_InitUTF8(JSON_Accu *acc);
+static int
+JSON_Accu_WriteUTF8(JSON_Accu *acc, PyObject *pystr, int escape);
+static PyObject *
+JSON_Accu_FinishAsBytes(JSON_Accu *acc);
+#endif
 
 #define ERR_EXPECTING_VALUE "Expecting value"
 #define ERR_ARRAY_DELIMITER "Expecting ',' delimiter or ']'"
@@ -230,6 +273,32 @@ JSON_Accu_Destroy(JSON_Accu *acc);
 #define ERR_STRING_ESC4 "Invalid \\uXXXX escape sequence"
 #define ERR_TRAILING_COMMA_OBJECT "Illegal trailing comma before end of object"
 #define ERR_TRAILING_COMMA_ARRAY "Illegal trailing comma before end of array"
+#define ERR_OBJECT_UNTERMINATED "Unterminated object starting at"
+#define ERR_ARRAY_UNTERMINATED "Unterminated array starting at"
+
+/* The parser states of simplejson.decoder._FeedParser, which it passes
+ * to and gets back from scanner_events */
+#define FEED_VALUE 0
+#define FEED_VALUE_OR_CLOSE 1
+#define FEED_KEY_OR_CLOSE 2
+#define FEED_KEY 3
+#define FEED_COLON 4
+#define FEED_COMMA_OR_CLOSE 5
+#define FEED_DONE 6
+
+/* Indexes of _speedups_state.JSON_event_names */
+#define EVENT_START_MAP 0
+#define EVENT_MAP_KEY 1
+#define EVENT_END_MAP 2
+#define EVENT_START_ARRAY 3
+#define EVENT_END_ARRAY 4
+#define EVENT_STRING 5
+#define EVENT_NUMBER 6
+#define EVENT_BOOLEAN 7
+#define EVENT_NULL 8
+#define EVENT_ITEM 9
+#define EVENT_DOT 10
+#define EVENT_NAME(state, i) PyTuple_GET_ITEM((state)->JSON_event_names, (i))
 
 
 typedef struct _PyScannerObject {
@@ -244,7 +313,10 @@ typedef struct _PyScannerObject {
     PyObject *parse_float;
     PyObject *parse_int;
     PyObject *parse_constant;
-    PyObject *memo;
+    PyObject *key_cache;  /* KeyCache or NULL */
+    PyObject *make_numeric_array;  /* for numeric_arrays, or NULL */
+    PyObject *raw_keys;  /* for raw_keys, or NULL */
+    Py_ssize_t raw_depth;  /* for raw_depth, or -1 */
 } PyScannerObject;
 
 /* X-macro listing every PyObject* field in PyScannerObject that must
@@ -263,7 +335,9 @@ typedef struct _PyScannerObject {
     X(parse_float)                    \
     X(parse_int)                      \
     X(parse_constant)                 \
-    X(memo)
+    X(key_cache)                      \
+    X(make_numeric_array)             \
+    X(raw_keys)
 
 static PyMemberDef scanner_members[] = {
     {"encoding", Py_T_OBJECT_EX, offsetof(PyScannerObject, encoding), READONLY, "encoding"},
@@ -288,10 +362,17 @@ typedef struct _PyEncoderObject {
     PyObject *item_separator;
     PyObject *sort_keys;
     PyObject *key_memo;
+    PyObject *shape_memo;
+    PyObject *type_encoders;
+    PyObject *type_memo;
+    PyObject *UUID;
+    PyObject *Enum;
+    PyObject *dataclass_fields;
     PyObject *encoding;
     PyObject *Decimal;
     PyObject *skipkeys_bool;
     int skipkeys;
+    /* 0, JSON_FAST_ENCODE_ASCII, JSON_FAST_ENCODE_UNICODE */
     int fast_encode;
     /* 0, JSON_ALLOW_NAN, JSON_IGNORE_NAN */
     int allow_or_ignore_nan;
@@ -299,13 +380,26 @@ typedef struct _PyEncoderObject {
     int namedtuple_as_object;
     int tuple_as_array;
     int iterable_as_array;
+    int buffer_as_array;
     PyObject *max_long_size;
     PyObject *min_long_size;
     PyObject *item_sort_key;
     PyObject *item_sort_kw;
     int for_json;
+    int datetime_as_iso;
+    int bytes_as_base64;
+    /* Any of datetime_as_iso, UUID, Enum or bytes_as_base64 is set */
+    int extra_types;
 } PyEncoderObject;
 
+/* Whether bytes are left to bytes_as instead of being decoded with the
+ * encoding. On Python 2 bytes is str, which is always text. */
+#if PY_MAJOR_VERSION >= 3
+#define JSON_BYTES_AS_BINARY(s) ((s)->bytes_as_base64)
+#else
+#define JSON_BYTES_AS_BINARY(s) 0
+#endif
+
 /* X-macro listing every PyObject* field in PyEncoderObject that must
  * be visited by tp_traverse and released by tp_clear. See the comment
  * on JSON_SCANNER_OBJECT_FIELDS above. Int flag fields (skipkeys,
@@ -321,6 +415,12 @@ typedef struct _PyEncoderObject {
     X(key_separator)                  \
     X(item_separator)                 \
     X(key_memo)                       \
+    X(shape_memo)                     \
+    X(type_encoders)                  \
+    X(type_memo)                      \
+    X(UUID)                           \
+    X(Enum)                           \
+    X(dataclass_fields)               \
     X(skipkeys_bool)                  \
     X(sort_keys)                      \
     X(item_sort_kw)                   \
@@ -341,6 +441,9 @@ static PyMemberDef encoder_members[] = {
     /* Python 2.5 does not support T_BOOl */
     {"skipkeys", Py_T_OBJECT_EX, offsetof(PyEncoderObject, skipkeys_bool), READONLY, "skipkeys"},
     {"key_memo", Py_T_OBJECT_EX, offsetof(PyEncoderObject, key_memo), READONLY, "key_memo"},
+    {"shape_memo", Py_T_OBJECT_EX, offsetof(PyEncoderObject, shape_memo), READONLY, "shape_memo"},
+    {"type_encoders", Py_T_OBJECT_EX, offsetof(PyEncoderObject, type_encoders), READONLY, "type_encoders"},
+    {"type_memo", Py_T_OBJECT_EX, offsetof(PyEncoderObject, type_memo), READONLY, "type_memo"},
     {"item_sort_key", Py_T_OBJECT_EX, offsetof(PyEncoderObject, item_sort_key), READONLY, "item_sort_key"},
     {"max_long_size", Py_T_OBJECT_EX, offsetof(PyEncoderObject, max_long_size), READONLY, "max_long_size"},
     {"min_long_size", Py_T_OBJECT_EX, offsetof(PyEncoderObject, min_long_size), READONLY, "min_long_size"},
@@ -355,10 +458,8 @@ static PyObject *
 JSON_ParseEncoding(PyObject *encoding);
 static PyObject *
 maybe_quote_bigint(PyEncoderObject* s, PyObject *encoded, PyObject *obj);
-#if PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3
 static Py_ssize_t
 ascii_char_size(JSON_UNICHR c);
-#endif
 static Py_ssize_t
 ascii_escape_char(JSON_UNICHR c, char *output, Py_ssize_t chars);
 static PyObject *
@@ -373,18 +474,39 @@ py_encode_basestring(PyObject* self UNUSED, PyObject *pystr);
 static PyObject *
 join_list_string(_speedups_state *state, PyObject *lst);
 static PyObject *
-scan_once_str(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx, Py_ssize_t *next_idx_ptr);
+scan_once_str(PyScannerObject *s, PyObject *memo, PyObject *pystr, Py_ssize_t idx,
+              Py_ssize_t depth, Py_ssize_t *next_idx_ptr);
 static PyObject *
 scanstring_str(_speedups_state *state, PyObject *pystr, Py_ssize_t end,
                const char *encoding, int strict, Py_ssize_t *next_end_ptr);
 static PyObject *
-_parse_object_str(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx, Py_ssize_t *next_idx_ptr);
+_parse_object_str(PyScannerObject *s, PyObject *memo, PyObject *pystr, Py_ssize_t idx,
+                  Py_ssize_t depth, Py_ssize_t *next_idx_ptr);
+static PyObject *
+_scan_raw_str(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx,
+              Py_ssize_t *next_idx_ptr);
 #endif
 static PyObject *
 scanstring_unicode(_speedups_state *state, PyObject *pystr, Py_ssize_t end,
                    int strict, Py_ssize_t *next_end_ptr);
 static PyObject *
-scan_once_unicode(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx, Py_ssize_t *next_idx_ptr);
+scan_once_unicode(PyScannerObject *s, PyObject *memo, PyObject *pystr, Py_ssize_t idx,
+                  Py_ssize_t depth, Py_ssize_t *next_idx_ptr);
+static PyObject *
+_scan_raw_unicode(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx,
+                  Py_ssize_t *next_idx_ptr);
+#if PY_MAJOR_VERSION >= 3
+static PyObject *
+scanstring_utf8(_speedups_state *state, PyObject *pystr,
+                const unsigned char *buf, Py_ssize_t len, Py_ssize_t end,
+                int strict, Py_ssize_t *next_end_ptr);
+static PyObject *
+scan_once_utf8(PyScannerObject *s, PyObject *memo, PyObject *pystr, Py_ssize_t idx,
+               Py_ssize_t depth, Py_ssize_t *next_idx_ptr);
+static PyObject *
+_scan_raw_utf8(PyScannerObject *s, PyObject *pystr, Py_ssize_t idx,
+               Py_ssize_t *next_idx_ptr);
+#endif
 static PyObject *
 _build_rval_index_tuple(PyObject *rval, Py_ssize_t idx)
 {
@@ -417,6 +539,8 @@ static int
 encoder_listencode_obj(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj, Py_ssize_t indent_level);
 static int
 encoder_listencode_dict(PyEncoderObject *s, JSON_Accu *rval, PyObject *dct, Py_ssize_t indent_level);
+static int
+encoder_listencode_fields(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj, PyObject *fields, Py_ssize_t indent_level);
 static PyObject *
 _encoded_const(_speedups_state *state, PyObject *obj);
 static void
@@ -487,6 +611,400 @@ json_PyDict_GetItemRef(PyObject *dict, PyObject *key, PyObject **result)
 #endif
 }
 
+/* KeyCache: an intern table for object keys that is kept across
+ * documents, unlike the memo dict of a single scan_once call. It holds at
+ * most maxsize keys and evicts with the CLOCK algorithm: every slot has a
+ * referenced bit that is set by a hit, and the hand clears the bits of the
+ * slots it passes until it finds one that has not been referenced since
+ * its last turn.
+ *
+ * The keys are found through an open addressing index of slot numbers,
+ * hashed with FNV-1a over the code points of the key. On Python 3 the
+ * scanners use the same hash to look up plain ASCII keys straight from
+ * the document (see key_cache_find_ascii), so a hit does not create a
+ * string at all. A cache may be shared by the scanners of several
+ * decoders and threads, so every lookup is a critical section. */
+typedef struct {
+    PyObject_HEAD
+    PyObject **keys;          /* slots, NULL if empty */
+    Py_uhash_t *hashes;       /* hash of the key in each slot */
+    unsigned char *referenced;
+    Py_ssize_t *index;        /* slot numbers, -1 if empty */
+    size_t mask;              /* size of index - 1 */
+    Py_ssize_t maxsize;
+    Py_ssize_t size;          /* number of keys */
+    Py_ssize_t filled;        /* slots [0, filled) have been used */
+    Py_ssize_t hand;
+    Py_ssize_t hits;
+    Py_ssize_t misses;
+} PyKeyCacheObject;
+
+#define KEY_CACHE_HASH_INIT ((Py_uhash_t)2166136261u)
+#define KEY_CACHE_HASH_STEP(h, c) (((h) ^ (Py_uhash_t)(c)) * 16777619u)
+
+static int
+key_cache_hash(PyObject *key, Py_uhash_t *hash_ptr)
+{
+    /* Hash key (a str) the way the scanners hash ASCII keys in place */
+#if PY_MAJOR_VERSION >= 3
+    int kind = PyUnicode_KIND(key);
+    const void *data = PyUnicode_DATA(key);
+    Py_ssize_t len = PyUnicode_GET_LENGTH(key);
+    Py_uhash_t h = KEY_CACHE_HASH_INIT;
+    Py_ssize_t i;
+    for (i = 0; i < len; i++)
+        h = KEY_CACHE_HASH_STEP(h, PyUnicode_READ(kind, data, i));
+    *hash_ptr = h;
+    return 0;
+#else
+    /* Python 2 has no in place lookups, and str and unicode keys must
+     * hash alike */
+    long h = PyObject_Hash(key);
+    if (h == -1)
+        return -1;
+    *hash_ptr = (Py_uhash_t)h;
+    return 0;
+#endif
+}
+
+static int
+key_cache_equal(PyObject *a, PyObject *b)
+{
+#if PY_MAJOR_VERSION >= 3
+    Py_ssize_t len = PyUnicode_GET_LENGTH(a);
+    int kind = PyUnicode_KIND(a);
+    return (len == PyUnicode_GET_LENGTH(b) && kind == PyUnicode_KIND(b) &&
+            memcmp(PyUnicode_DATA(a), PyUnicode_DATA(b), len * kind) == 0);
+#else
+    return PyObject_RichCompareBool(a, b, Py_EQ);
+#endif
+}
+
+static void
+key_cache_unlink(PyKeyCacheObject *c, Py_ssize_t slot)
+{
+    /* Remove slot from the index, moving the entries after it back so
+     * that no probe sequence is broken */
+    size_t mask = c->mask;
+    size_t i = c->hashes[slot] & mask;
+    size_t j;
+    while (c->index[i] != slot)
+        i = (i + 1) & mask;
+    j = i;
+    for (;;) {
+        size_t home;
+        j = (j + 1) & mask;
+        if (c->index[j] == -1)
+            break;
+        home = c->hashes[c->index[j]] & mask;
+        /* The entry at j may fill the hole at i unless its home lies
+         * cyclically in (i, j] */
+        if (i <= j ? (i < home && home <= j) : (i < home || home <= j))
+            continue;
+        c->index[i] = c->index[j];
+        i = j;
+    }
+    c->index[i] = -1;
+}
+
+static int
+key_cache_intern(PyKeyCacheObject *c, PyObject **key_ptr)
+{
+    /* Like json_memo_intern_key, for a KeyCache */
+    PyObject *key = *key_ptr;
+    Py_uhash_t hash;
+    size_t i;
+    Py_ssize_t slot;
+    int rv = 0;
+    if (key_cache_hash(key, &hash) < 0)
+        return -1;
+    Py_BEGIN_CRITICAL_SECTION(c);
+    for (i = hash & c->mask; (slot = c->index[i]) != -1; i = (i + 1) & c->mask) {
+        if (c->hashes[slot] == hash) {
+            rv = key_cache_equal(c->keys[slot], key);
+            if (rv != 0)
+                break;
+        }
+    }
+    if (rv > 0) {
+        c->referenced[slot] = 1;
+        c->hits++;
+        Py_INCREF(c->keys[slot]);
+        Py_DECREF(key);
+        *key_ptr = c->keys[slot];
+        rv = 0;
+    }
+    else if (rv == 0) {
+        c->misses++;
+        if (c->filled < c->maxsize) {
+            slot = c->filled++;
+        }
+        else {
+            while (c->referenced[c->hand]) {
+                c->referenced[c->hand] = 0;
+                c->hand = (c->hand + 1) % c->maxsize;
+            }
+            slot = c->hand;
+            c->hand = (slot + 1) % c->maxsize;
+            if (c->keys[slot] != NULL) {
+                key_cache_unlink(c, slot);
+                Py_CLEAR(c->keys[slot]);
+                c->size--;
+            }
+        }
+        /* The evicted key's entry was the only one removed, so the probe
+         * above is still the place for the new one */
+        for (i = hash & c->mask; c->index[i] != -1; i = (i + 1) & c->mask)
+            ;
+        c->index[i] = slot;
+        Py_INCREF(key);
+        c->keys[slot] = key;
+        c->hashes[slot] = hash;
+        c->referenced[slot] = 0;
+        c->size++;
+    }
+    Py_END_CRITICAL_SECTION();
+    return rv;
+}
+
+static void
+key_cache_clear_slots(PyKeyCacheObject *c)
+{
+    Py_ssize_t i;
+    for (i = 0; i < c->filled; i++) {
+        Py_CLEAR(c->keys[i]);
+        c->referenced[i] = 0;
+    }
+    for (i = 0; (size_t)i <= c->mask; i++)
+        c->index[i] = -1;
+    c->size = 0;
+    c->filled = 0;
+    c->hand = 0;
+}
+
+static PyObject *
+key_cache_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"maxsize", NULL};
+    Py_ssize_t maxsize;
+    size_t index_size = 8;
+    PyKeyCacheObject *c;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "n:KeyCache", kwlist,
+                                     &maxsize))
+        return NULL;
+    if (maxsize <= 0) {
+        PyErr_SetString(PyExc_ValueError, "maxsize must be greater than 0");
+        return NULL;
+    }
+    /* Keep the index at most half full */
+    while (index_size < (size_t)maxsize * 2) {
+        if (index_size > PY_SSIZE_T_MAX / sizeof(Py_ssize_t) / 2)
+            return PyErr_NoMemory();
+        index_size *= 2;
+    }
+    c = (PyKeyCacheObject *)type->tp_alloc(type, 0);
+    if (c == NULL)
+        return NULL;
+    c->maxsize = maxsize;
+    c->mask = index_size - 1;
+    c->keys = PyMem_New(PyObject *, maxsize);
+    c->hashes = PyMem_New(Py_uhash_t, maxsize);
+    c->referenced = PyMem_New(unsigned char, maxsize);
+    c->index = PyMem_New(Py_ssize_t, index_size);
+    if (c->keys == NULL || c->hashes == NULL || c->referenced == NULL ||
+            c->index == NULL) {
+        Py_DECREF(c);
+        return PyErr_NoMemory();
+    }
+    key_cache_clear_slots(c);
+    return (PyObject *)c;
+}
+
+static void
+key_cache_dealloc(PyObject *self)
+{
+    PyKeyCacheObject *c = (PyKeyCacheObject *)self;
+#if PY_VERSION_HEX >= 0x030D0000
+    PyTypeObject *tp = Py_TYPE(self);
+#endif
+    if (c->keys != NULL) {
+        Py_ssize_t i;
+        for (i = 0; i < c->filled; i++)
+            Py_XDECREF(c->keys[i]);
+    }
+    PyMem_Free(c->keys);
+    PyMem_Free(c->hashes);
+    PyMem_Free(c->referenced);
+    PyMem_Free(c->index);
+    Py_TYPE(self)->tp_free(self);
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_DECREF(tp);
+#endif
+}
+
+static PyObject *
+key_cache_info(PyObject *self, PyObject *args UNUSED)
+{
+    PyKeyCacheObject *c = (PyKeyCacheObject *)self;
+    PyObject *rval;
+    Py_BEGIN_CRITICAL_SECTION(c);
+    rval = Py_BuildValue("(nnnn)", c->hits, c->misses, c->maxsize, c->size);
+    Py_END_CRITICAL_SECTION();
+    return rval;
+}
+
+static PyObject *
+key_cache_clear(PyObject *self, PyObject *args UNUSED)
+{
+    PyKeyCacheObject *c = (PyKeyCacheObject *)self;
+    Py_BEGIN_CRITICAL_SECTION(c);
+    key_cache_clear_slots(c);
+    c->hits = 0;
+    c->misses = 0;
+    Py_END_CRITICAL_SECTION();
+    Py_RETURN_NONE;
+}
+
+static Py_ssize_t
+key_cache_len(PyObject *self)
+{
+    PyKeyCacheObject *c = (PyKeyCacheObject *)self;
+    Py_ssize_t size;
+    Py_BEGIN_CRITICAL_SECTION(c);
+    size = c->size;
+    Py_END_CRITICAL_SECTION();
+    return size;
+}
+
+#if PY_MAJOR_VERSION >= 3
+static PyObject *
+key_cache_find_ascii(PyKeyCacheObject *c, const unsigned char *p,
+                     Py_ssize_t avail, Py_ssize_t *len_ptr)
+{
+    /* Look up the key that starts at p, just after its opening quote,
+     * without creating it. Only keys made of printable ASCII without
+     * escapes are looked up. Returns a new reference to the cached key
+     * and sets *len_ptr to its length, or returns NULL (with no
+     * exception set) if the key must be scanned and interned the usual
+     * way. avail is the number of bytes readable at p. */
+    Py_uhash_t hash = KEY_CACHE_HASH_INIT;
+    PyObject *rval = NULL;
+    Py_ssize_t len;
+    size_t i;
+    Py_ssize_t slot;
+    for (len = 0; len < avail; len++) {
+        unsigned char ch = p[len];
+        if (ch == '"' || ch == '\\' || ch < 0x20 || ch >= 0x7f)
+            break;
+        hash = KEY_CACHE_HASH_STEP(hash, ch);
+    }
+    if (len == avail || p[len] != '"')
+        return NULL;
+    Py_BEGIN_CRITICAL_SECTION(c);
+    for (i = hash & c->mask; (slot = c->index[i]) != -1; i = (i + 1) & c->mask) {
+        PyObject *key = c->keys[slot];
+        if (c->hashes[slot] == hash && PyUnicode_IS_ASCII(key) &&
+                PyUnicode_GET_LENGTH(key) == len &&
+                memcmp(PyUnicode_1BYTE_DATA(key), p, len) == 0) {
+            c->referenced[slot] = 1;
+            c->hits++;
+            Py_INCREF(key);
+            rval = key;
+            break;
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+    *len_ptr = len;
+    return rval;
+}
+#endif
+
+static PyMethodDef key_cache_methods[] = {
+    {"info", key_cache_info, METH_NOARGS,
+        PyDoc_STR("info() -> (hits, misses, maxsize, currsize)")},
+    {"clear", key_cache_clear, METH_NOARGS,
+        PyDoc_STR("clear() -> None, remove every key and reset the counters")},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyMemberDef key_cache_members[] = {
+    {"maxsize", Py_T_PYSSIZET, offsetof(PyKeyCacheObject, maxsize), READONLY, "maxsize"},
+    {NULL}
+};
+
+PyDoc_STRVAR(key_cache_doc,
+"KeyCache(maxsize)\n"
+"\n"
+"Intern table for the object keys decoded by the scanners that use it,\n"
+"kept across documents and bounded to maxsize keys with CLOCK eviction.");
+
+#if PY_VERSION_HEX >= 0x030D0000
+static PyType_Slot PyKeyCacheType_slots[] = {
+    {Py_tp_doc, (void *)key_cache_doc},
+    {Py_tp_dealloc, key_cache_dealloc},
+    {Py_tp_methods, key_cache_methods},
+    {Py_tp_members, key_cache_members},
+    {Py_mp_length, key_cache_len},
+    {Py_tp_new, key_cache_new},
+    {0, NULL}
+};
+
+static PyType_Spec PyKeyCacheType_spec = {
+    .name = "simplejson._speedups.KeyCache",
+    .basicsize = sizeof(PyKeyCacheObject),
+    .flags = Py_TPFLAGS_DEFAULT,
+    .slots = PyKeyCacheType_slots,
+};
+#else
+static PyMappingMethods key_cache_as_mapping = {
+    key_cache_len,        /* mp_length */
+    0,                    /* mp_subscript */
+    0,                    /* mp_ass_subscript */
+};
+
+static PyTypeObject PyKeyCacheType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "simplejson._speedups.KeyCache", /* tp_name */
+    sizeof(PyKeyCacheObject), /* tp_basicsize */
+    0,                    /* tp_itemsize */
+    key_cache_dealloc,    /* tp_dealloc */
+    0,                    /* tp_print */
+    0,                    /* tp_getattr */
+    0,                    /* tp_setattr */
+    0,                    /* tp_compare */
+    0,                    /* tp_repr */
+    0,                    /* tp_as_number */
+    0,                    /* tp_as_sequence */
+    &key_cache_as_mapping, /* tp_as_mapping */
+    0,                    /* tp_hash */
+    0,                    /* tp_call */
+    0,                    /* tp_str */
+    0,                    /* tp_getattro */
+    0,                    /* tp_setattro */
+    0,                    /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,   /* tp_flags */
+    key_cache_doc,        /* tp_doc */
+    0,                    /* tp_traverse */
+    0,                    /* tp_clear */
+    0,                    /* tp_richcompare */
+    0,                    /* tp_weaklistoffset */
+    0,                    /* tp_iter */
+    0,                    /* tp_iternext */
+    key_cache_methods,    /* tp_methods */
+    key_cache_members,    /* tp_members */
+    0,                    /* tp_getset */
+    0,                    /* tp_base */
+    0,                    /* tp_dict */
+    0,                    /* tp_descr_get */
+    0,                    /* tp_descr_set */
+    0,                    /* tp_dictoffset */
+    0,                    /* tp_init */
+    0,                    /* tp_alloc */
+    key_cache_new,        /* tp_new */
+    0,                    /* tp_free */
+};
+#endif
+
 static inline int
 json_memo_intern_key(PyObject *memo, PyObject **key_ptr)
 {
@@ -494,8 +1012,11 @@ json_memo_intern_key(PyObject *memo, PyObject **key_ptr)
      * *key_ptr with a strong reference to the canonical entry (the
      * existing one if already present, or *key_ptr itself if it was
      * freshly inserted). The original reference in *key_ptr is always
-     * dropped on success. Returns 0 on success, -1 on error. */
+     * dropped on success. Returns 0 on success, -1 on error. memo is the
+     * dict of one scan_once call or the scanner's KeyCache. */
     PyObject *old = *key_ptr;
+    if (!PyDict_CheckExact(memo))
+        return key_cache_intern((PyKeyCacheObject *)memo, key_ptr);
 #if PY_VERSION_HEX >= 0x030D0000
     PyObject *canonical = NULL;
     if (PyDict_SetDefaultRef(memo, old, old, &canonical) < 0)
@@ -552,6 +1073,8 @@ is_raw_json(_speedups_state *state, PyObject *obj)
 static int
 JSON_Accu_Init(JSON_Accu *acc)
 {
+    acc->length = 0;
+    acc->utf8 = NULL;
     acc->writer = PyUnicodeWriter_Create(0);
     if (acc->writer == NULL)
         return -1;
@@ -563,6 +1086,9 @@ JSON_Accu_Accumulate(_speedups_state *state, JSON_Accu *acc, PyObject *unicode)
 {
     (void)state;
     assert(PyUnicode_Check(unicode));
+    if (acc->utf8 != NULL)
+        return JSON_Accu_WriteUTF8(acc, unicode, 0);
+    acc->length += PyUnicode_GET_LENGTH(unicode);
     return PyUnicodeWriter_WriteStr(acc->writer, unicode);
 }
 
@@ -585,6 +1111,16 @@ JSON_Accu_FinishAsList(_speedups_state *state, JSON_Accu *acc)
     return list;
 }
 
+static PyObject *
+JSON_Accu_FinishAsString(_speedups_state *state, JSON_Accu *acc)
+{
+    PyObject *str;
+    (void)state;
+    str = PyUnicodeWriter_Finish(acc->writer);
+    acc->writer = NULL;  /* Finish consumed the writer */
+    return str;
+}
+
 static void
 JSON_Accu_Destroy(JSON_Accu *acc)
 {
@@ -592,6 +1128,7 @@ JSON_Accu_Destroy(JSON_Accu *acc)
         PyUnicodeWriter_Discard(acc->writer);
         acc->writer = NULL;
     }
+    Py_CLEAR(acc->utf8);
 }
 
 #else /* PY_VERSION_HEX < 0x030E0000 */
@@ -602,6 +1139,8 @@ JSON_Accu_Init(JSON_Accu *acc)
 {
     /* Lazily allocated */
     acc->large_strings = NULL;
+    acc->utf8 = NULL;
+    acc->length = 0;
     acc->small_strings = PyList_New(0);
     if (acc->small_strings == NULL)
         return -1;
@@ -644,12 +1183,20 @@ JSON_Accu_Accumulate(_speedups_state *state, JSON_Accu *acc, PyObject *unicode)
     Py_ssize_t nsmall;
 #if PY_MAJOR_VERSION >= 3
     assert(PyUnicode_Check(unicode));
+    if (acc->utf8 != NULL)
+        return JSON_Accu_WriteUTF8(acc, unicode, 0);
 #else /* PY_MAJOR_VERSION >= 3 */
     assert(PyString_Check(unicode) || PyUnicode_Check(unicode));
 #endif /* PY_MAJOR_VERSION < 3 */
 
     if (PyList_Append(acc->small_strings, unicode))
         return -1;
+#if PY_MAJOR_VERSION >= 3
+    acc->length += PyUnicode_GET_LENGTH(unicode);
+#else
+    acc->length += PyString_Check(unicode) ? PyString_GET_SIZE(unicode)
+                                           : PyUnicode_GET_SIZE(unicode);
+#endif
     nsmall = PyList_GET_SIZE(acc->small_strings);
     /* Each item in a list of unicode objects has an overhead (in 64-bit
      * builds) of:
@@ -682,6 +1229,33 @@ JSON_Accu_FinishAsList(_speedups_state *state, JSON_Accu *acc)
     return res;
 }
 
+/* Like JSON_Accu_FinishAsList, but join the pieces into a single
+ * string. Used by the chunked encoder iterator, which hands each chunk
+ * to the caller as one str object. */
+static PyObject *
+JSON_Accu_FinishAsString(_speedups_state *state, JSON_Accu *acc)
+{
+    PyObject *lst;
+    PyObject *res;
+
+    lst = JSON_Accu_FinishAsList(state, acc);
+    if (lst == NULL)
+        return NULL;
+    if (PyList_GET_SIZE(lst) == 1) {
+        res = PyList_GET_ITEM(lst, 0);
+        Py_INCREF(res);
+    }
+    else {
+#if PY_MAJOR_VERSION >= 3
+        res = join_list_unicode(state, lst);
+#else
+        res = join_list_string(state, lst);
+#endif
+    }
+    Py_DECREF(lst);
+    return res;
+}
+
 static void
 JSON_Accu_Destroy(JSON_Accu *acc)
 {
@@ -691,55 +1265,209 @@ JSON_Accu_Destroy(JSON_Accu *acc)
      * case, so repeat calls are no-ops. */
     Py_CLEAR(acc->small_strings);
     Py_CLEAR(acc->large_strings);
+    Py_CLEAR(acc->utf8);
 }
 #endif /* PY_VERSION_HEX >= 0x030E0000 */
 
+#if PY_MAJOR_VERSION >= 3
+/* ---- UTF-8 output mode (Encoder.encode_bytes) ----
+ *
+ * A JSON_Accu set up with JSON_Accu_InitUTF8 writes everything it is
+ * given straight into a bytes object as UTF-8 instead of collecting str
+ * pieces, and JSON_Accu_FinishAsBytes hands that object back after
+ * trimming it to size. `length` counts bytes in this mode. This saves
+ * building the document as a str only to copy it again with
+ * str.encode('utf-8').
+ */
+
 static int
-IS_DIGIT(JSON_UNICHR c)
+JSON_Accu_InitUTF8(JSON_Accu *acc)
 {
-    return c >= '0' && c <= '9';
+#if PY_VERSION_HEX >= 0x030E0000
+    acc->writer = NULL;
+#else
+    acc->large_strings = NULL;
+    acc->small_strings = NULL;
+#endif
+    acc->length = 0;
+    acc->utf8 = PyBytes_FromStringAndSize(NULL, 256);
+    if (acc->utf8 == NULL)
+        return -1;
+    return 0;
 }
 
-static PyObject *
-maybe_quote_bigint(PyEncoderObject* s, PyObject *encoded, PyObject *obj)
+/* Make room for n more bytes and return where to write them */
+static char *
+JSON_Accu_ReserveUTF8(JSON_Accu *acc, Py_ssize_t n)
 {
-    int ge, le;
-    PyObject *quoted;
-
-    /* int_as_string_bitcount is not set: fast path, return as-is. */
-    if (s->max_long_size == Py_None || s->min_long_size == Py_None)
-        return encoded;
-
-    ge = PyObject_RichCompareBool(obj, s->max_long_size, Py_GE);
-    if (ge < 0) {
-        Py_DECREF(encoded);
-        return NULL;
-    }
-    le = PyObject_RichCompareBool(obj, s->min_long_size, Py_LE);
-    if (le < 0) {
-        Py_DECREF(encoded);
-        return NULL;
+    Py_ssize_t allocated = PyBytes_GET_SIZE(acc->utf8);
+    if (n > allocated - acc->length) {
+        if (n > PY_SSIZE_T_MAX - acc->length) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        if (allocated > PY_SSIZE_T_MAX / 2 ||
+            allocated * 2 < acc->length + n)
+            allocated = acc->length + n;
+        else
+            allocated *= 2;
+        if (_PyBytes_Resize(&acc->utf8, allocated))
+            return NULL;
     }
-    if (!(ge || le))
-        return encoded;
-
-#if PY_MAJOR_VERSION >= 3
-    quoted = PyUnicode_FromFormat("\"%U\"", encoded);
-#else
-    quoted = PyString_FromFormat("\"%s\"", PyString_AsString(encoded));
-#endif
-    Py_DECREF(encoded);
-    return quoted;
+    return PyBytes_AS_STRING(acc->utf8) + acc->length;
 }
 
-/* Stringify an int/long to its JSON decimal form. For int/long subclasses
- * we first normalize through PyLong_Type so custom __str__ / __repr__
- * overrides don't inject garbage into the JSON output (see #118). */
-static PyObject *
-encoder_long_to_str(PyObject *obj)
+/* Append pystr to a UTF-8 mode accumulator. If escape is 0 it is copied
+ * as is; JSON_FAST_ENCODE_ASCII or JSON_FAST_ENCODE_UNICODE write it as
+ * a quoted JSON string, exactly as py_encode_basestring_ascii or
+ * py_encode_basestring would, without creating the escaped str first.
+ * Sized in a first pass like ascii_escape_unicode. Lone surrogates can
+ * not be written as UTF-8 and raise the same UnicodeEncodeError as
+ * str.encode('utf-8'). */
+static int
+JSON_Accu_WriteUTF8(JSON_Accu *acc, PyObject *pystr, int escape)
 {
-    PyObject *encoded;
-    PyObject *tmp;
+    Py_ssize_t i;
+    Py_ssize_t input_chars = PyUnicode_GET_LENGTH(pystr);
+    int kind = PyUnicode_KIND(pystr);
+    const void *data = PyUnicode_DATA(pystr);
+    Py_ssize_t output_size = escape ? 2 : 0;
+    Py_ssize_t chars;
+    char *output;
+
+    if (!escape && PyUnicode_IS_ASCII(pystr)) {
+        output = JSON_Accu_ReserveUTF8(acc, input_chars);
+        if (output == NULL)
+            return -1;
+        memcpy(output, PyUnicode_1BYTE_DATA(pystr), input_chars);
+        acc->length += input_chars;
+        return 0;
+    }
+    for (i = 0; i < input_chars; i++) {
+        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
+        Py_ssize_t charsize;
+        if (escape == JSON_FAST_ENCODE_ASCII ||
+            (escape && NEEDS_ESCAPE(c)))
+            charsize = ascii_char_size(c);
+        else if (c < 0x80)
+            charsize = 1;
+        else if (c < 0x800)
+            charsize = 2;
+        else if (c < 0x10000) {
+            if (Py_UNICODE_IS_SURROGATE(c)) {
+                /* Let the codec raise the UnicodeEncodeError */
+                PyObject *encoded = PyUnicode_AsUTF8String(pystr);
+                assert(encoded == NULL);
+                Py_XDECREF(encoded);
+                return -1;
+            }
+            charsize = 3;
+        }
+        else
+            charsize = 4;
+        if (output_size > PY_SSIZE_T_MAX - charsize) {
+            PyErr_SetString(PyExc_OverflowError, "string is too long to escape");
+            return -1;
+        }
+        output_size += charsize;
+    }
+    output = JSON_Accu_ReserveUTF8(acc, output_size);
+    if (output == NULL)
+        return -1;
+    chars = 0;
+    if (escape)
+        output[chars++] = '"';
+    for (i = 0; i < input_chars; i++) {
+        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
+        if (escape == JSON_FAST_ENCODE_ASCII ||
+            (escape && NEEDS_ESCAPE(c))) {
+            /* The escapes of ensure_ascii=False are a subset of these */
+            chars = ascii_escape_char(c, output, chars);
+        }
+        else if (c < 0x80) {
+            output[chars++] = (char)c;
+        }
+        else if (c < 0x800) {
+            output[chars++] = (char)(0xc0 | (c >> 6));
+            output[chars++] = (char)(0x80 | (c & 0x3f));
+        }
+        else if (c < 0x10000) {
+            output[chars++] = (char)(0xe0 | (c >> 12));
+            output[chars++] = (char)(0x80 | ((c >> 6) & 0x3f));
+            output[chars++] = (char)(0x80 | (c & 0x3f));
+        }
+        else {
+            output[chars++] = (char)(0xf0 | (c >> 18));
+            output[chars++] = (char)(0x80 | ((c >> 12) & 0x3f));
+            output[chars++] = (char)(0x80 | ((c >> 6) & 0x3f));
+            output[chars++] = (char)(0x80 | (c & 0x3f));
+        }
+    }
+    if (escape)
+        output[chars++] = '"';
+    assert(chars == output_size);
+    acc->length += output_size;
+    return 0;
+}
+
+static PyObject *
+JSON_Accu_FinishAsBytes(JSON_Accu *acc)
+{
+    PyObject *res;
+    if (_PyBytes_Resize(&acc->utf8, acc->length))
+        return NULL;
+    res = acc->utf8;
+    acc->utf8 = NULL;
+    return res;
+}
+#endif /* PY_MAJOR_VERSION >= 3 */
+
+static int
+IS_DIGIT(JSON_UNICHR c)
+{
+    return c >= '0' && c <= '9';
+}
+
+static PyObject *
+maybe_quote_bigint(PyEncoderObject* s, PyObject *encoded, PyObject *obj)
+{
+    int ge, le;
+    PyObject *quoted;
+
+    /* int_as_string_bitcount is not set: fast path, return as-is. */
+    if (s->max_long_size == Py_None || s->min_long_size == Py_None)
+        return encoded;
+
+    ge = PyObject_RichCompareBool(obj, s->max_long_size, Py_GE);
+    if (ge < 0) {
+        Py_DECREF(encoded);
+        return NULL;
+    }
+    le = PyObject_RichCompareBool(obj, s->min_long_size, Py_LE);
+    if (le < 0) {
+        Py_DECREF(encoded);
+        return NULL;
+    }
+    if (!(ge || le))
+        return encoded;
+
+#if PY_MAJOR_VERSION >= 3
+    quoted = PyUnicode_FromFormat("\"%U\"", encoded);
+#else
+    quoted = PyString_FromFormat("\"%s\"", PyString_AsString(encoded));
+#endif
+    Py_DECREF(encoded);
+    return quoted;
+}
+
+/* Stringify an int/long to its JSON decimal form. For int/long subclasses
+ * we first normalize through PyLong_Type so custom __str__ / __repr__
+ * overrides don't inject garbage into the JSON output (see #118). */
+static PyObject *
+encoder_long_to_str(PyObject *obj)
+{
+    PyObject *encoded;
+    PyObject *tmp;
     if (PyInt_CheckExact(obj) || PyLong_CheckExact(obj))
         return PyObject_Str(obj);
     tmp = PyObject_CallOneArg((PyObject *)&PyLong_Type, obj);
@@ -828,10 +1556,9 @@ ascii_escape_char(JSON_UNICHR c, char *output, Py_ssize_t chars)
     return chars;
 }
 
-#if PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3
-/* Only needed by the two-pass ascii_escape_unicode (pre-3.14) and
- * ascii_escape_str (Python 2). The PyUnicodeWriter path on 3.14+
- * computes sizes implicitly, so this would be unused there. */
+/* Used by the two-pass ascii_escape_unicode (pre-3.14), ascii_escape_str
+ * (Python 2) and JSON_Accu_WriteUTF8. The PyUnicodeWriter path of
+ * ascii_escape_unicode on 3.14+ computes sizes implicitly. */
 static Py_ssize_t
 ascii_char_size(JSON_UNICHR c)
 {
@@ -856,7 +1583,6 @@ ascii_char_size(JSON_UNICHR c)
         return MIN_EXPANSION;
     }
 }
-#endif /* PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3 */
 
 #if PY_VERSION_HEX >= 0x030E0000
 static PyObject *
@@ -1107,6 +1833,120 @@ is_json_string_key(PyObject *key)
     return PyUnicode_Check(key);
 }
 
+/* The most entries kept in shape_memo, and the most keys a dict may have
+ * for its shape to be kept. Like key_memo, shape_memo lives as long as the
+ * JSONEncoder and is cleared when it is full. */
+#define SHAPE_MEMO_MAXSIZE 256
+#define SHAPE_MEMO_MAXKEYS 256
+
+static int
+encoder_sort_items_by_shape(PyEncoderObject *s, PyObject *items)
+{
+    /* Sort items, the items list of an exact dict, like
+     * encoder_sort_items_inplace with the default sort_keys order. The
+     * order is kept in shape_memo under the tuple of the keys as they
+     * are in the dict, so the items of the next dict with the same keys
+     * are only permuted, without comparing them. Only dicts whose keys
+     * are all exact strings are memoized, the order of other keys may
+     * depend on more than their equality. Returns 0 on success, -1 on
+     * error. */
+    Py_ssize_t n = PyList_GET_SIZE(items);
+    Py_ssize_t i;
+    PyObject *keys;
+    PyObject *perm = NULL;
+    PyObject *index = NULL;
+    PyObject *small[16];
+    PyObject **tmp;
+    Py_ssize_t *order;
+    int found;
+    if (n > SHAPE_MEMO_MAXKEYS)
+        return encoder_sort_items_inplace(s, items);
+    keys = PyTuple_New(n);
+    if (keys == NULL)
+        return -1;
+    for (i = 0; i < n; i++) {
+        PyObject *key = PyTuple_GET_ITEM(PyList_GET_ITEM(items, i), 0);
+        if (!PyUnicode_CheckExact(key)
+#if PY_MAJOR_VERSION < 3
+            && !PyString_CheckExact(key)
+#endif
+            ) {
+            Py_DECREF(keys);
+            return encoder_sort_items_inplace(s, items);
+        }
+        Py_INCREF(key);
+        PyTuple_SET_ITEM(keys, i, key);
+    }
+    found = json_PyDict_GetItemRef(s->shape_memo, keys, &perm);
+    if (found < 0)
+        goto bail;
+    if (found == 0) {
+        /* Sort the items, then record where each of them came from */
+        if (encoder_sort_items_inplace(s, items) < 0)
+            goto bail;
+        index = PyDict_New();
+        if (index == NULL)
+            goto bail;
+        for (i = 0; i < n; i++) {
+            PyObject *pos = PyInt_FromSsize_t(i);
+            if (pos == NULL)
+                goto bail;
+            if (PyDict_SetItem(index, PyTuple_GET_ITEM(keys, i), pos) < 0) {
+                Py_DECREF(pos);
+                goto bail;
+            }
+            Py_DECREF(pos);
+        }
+        perm = PyBytes_FromStringAndSize(NULL, n * sizeof(Py_ssize_t));
+        if (perm == NULL)
+            goto bail;
+        order = (Py_ssize_t *)PyBytes_AS_STRING(perm);
+        for (i = 0; i < n; i++) {
+            PyObject *key = PyTuple_GET_ITEM(PyList_GET_ITEM(items, i), 0);
+            PyObject *pos;
+            if (json_PyDict_GetItemRef(index, key, &pos) <= 0) {
+                if (!PyErr_Occurred())
+                    PyErr_SetObject(PyExc_KeyError, key);
+                goto bail;
+            }
+            order[i] = PyInt_AsSsize_t(pos);
+            Py_DECREF(pos);
+        }
+        Py_CLEAR(index);
+        if (PyDict_Size(s->shape_memo) >= SHAPE_MEMO_MAXSIZE)
+            PyDict_Clear(s->shape_memo);
+        if (PyDict_SetItem(s->shape_memo, keys, perm) < 0)
+            goto bail;
+    }
+    else {
+        order = (Py_ssize_t *)PyBytes_AS_STRING(perm);
+        if (n <= (Py_ssize_t)(sizeof(small) / sizeof(small[0])))
+            tmp = small;
+        else {
+            tmp = PyMem_New(PyObject *, n);
+            if (tmp == NULL) {
+                PyErr_NoMemory();
+                goto bail;
+            }
+        }
+        for (i = 0; i < n; i++)
+            tmp[i] = PyList_GET_ITEM(items, i);
+        for (i = 0; i < n; i++)
+            PyList_SET_ITEM(items, i, tmp[order[i]]);
+        if (tmp != small)
+            PyMem_Free(tmp);
+    }
+    Py_DECREF(perm);
+    Py_DECREF(keys);
+    return 0;
+
+bail:
+    Py_XDECREF(index);
+    Py_XDECREF(perm);
+    Py_DECREF(keys);
+    return -1;
+}
+
 static PyObject *
 encoder_dict_iteritems(PyEncoderObject *s, PyObject *dct)
 {
@@ -1152,7 +1992,14 @@ encoder_dict_iteritems(PyEncoderObject *s, PyObject *dct)
             break;
     }
     if (i == size) {
-        if (encoder_sort_items_inplace(s, items) < 0) {
+        int rv;
+        if (s->shape_memo != Py_None && PyDict_CheckExact(dct) &&
+                s->item_sort_key ==
+                    get_speedups_state(s->module_ref)->JSON_itemgetter0)
+            rv = encoder_sort_items_by_shape(s, items);
+        else
+            rv = encoder_sort_items_inplace(s, items);
+        if (rv < 0) {
             Py_DECREF(items);
             return NULL;
         }
@@ -1234,6 +2081,29 @@ raise_errmsg(_speedups_state *state, const char *msg, PyObject *s, Py_ssize_t en
     }
 }
 
+static PyObject *
+json_catch_exception(void)
+{
+    /* For the *_many(..., return_exceptions=True) methods: if the pending
+     * exception is an Exception, clear it and return it (a new reference)
+     * with its traceback attached. Anything else, such as
+     * KeyboardInterrupt, is left pending and NULL is returned. */
+    PyObject *exc_type;
+    PyObject *exc_value;
+    PyObject *exc_tb;
+    if (!PyErr_ExceptionMatches(PyExc_Exception))
+        return NULL;
+    PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+    PyErr_NormalizeException(&exc_type, &exc_value, &exc_tb);
+#if PY_MAJOR_VERSION >= 3
+    if (exc_tb != NULL)
+        PyException_SetTraceback(exc_value, exc_tb);
+#endif
+    Py_XDECREF(exc_type);
+    Py_XDECREF(exc_tb);
+    return exc_value;
+}
+
 #if PY_VERSION_HEX < 0x030E0000
 static PyObject *
 join_list_unicode(_speedups_state *state, PyObject *lst)
@@ -1858,762 +2728,2903 @@ bail:
 }
 #endif /* PY_VERSION_HEX >= 0x030E0000 */
 
-PyDoc_STRVAR(pydoc_scanstring,
-    "scanstring(basestring, end, encoding, strict=True) -> (str, end)\n"
-    "\n"
-    "Scan the string s for a JSON string. End is the index of the\n"
-    "character in s after the quote that started the JSON string.\n"
-    "Unescapes all valid JSON string escape sequences and raises ValueError\n"
-    "on attempt to decode an invalid string. If strict is False then literal\n"
-    "control characters are allowed in the string.\n"
-    "\n"
-    "Returns a tuple of the decoded string and the index of the character in s\n"
-    "after the end quote."
-);
-
-static PyObject *
-py_scanstring(PyObject* self UNUSED, PyObject *args)
+#if PY_MAJOR_VERSION >= 3
+static void
+json_utf8_document_error(const char *data, Py_ssize_t len)
 {
-    PyObject *pystr;
-    PyObject *rval;
-    Py_ssize_t end;
-    Py_ssize_t next_end = -1;
-    char *encoding = NULL;
-    int strict = 1;
-    if (!PyArg_ParseTuple(args, "On|zi:scanstring", &pystr, &end, &encoding, &strict)) {
-        return NULL;
-    }
-    if (encoding == NULL) {
-        encoding = DEFAULT_ENCODING;
-    }
-    if (PyUnicode_Check(pystr)) {
-        if (PyUnicode_READY(pystr))
-            return NULL;
-        rval = scanstring_unicode(get_speedups_state(self), pystr, end,
-                                  strict, &next_end);
-    }
-#if PY_MAJOR_VERSION < 3
-    /* Using a bytes input is unsupported for scanning in Python 3.
-       It is coerced to str in the decoder before it gets here. */
-    else if (PyString_Check(pystr)) {
-        rval = scanstring_str(get_speedups_state(self), pystr, end,
-                              encoding, strict, &next_end);
-    }
-#endif
-    else {
-        PyErr_Format(PyExc_TypeError,
-                     "first argument must be a string, not %.80s",
-                     Py_TYPE(pystr)->tp_name);
-        return NULL;
+    /* Replace the UnicodeDecodeError raised for a run of the len bytes of
+     * data with the one that decoding all of them raises, as
+     * str(data, 'utf-8') would, which has the whole document as its
+     * object and offsets into it. Any other exception is left as it is. */
+    PyObject *decoded;
+    if (!PyErr_ExceptionMatches(PyExc_UnicodeDecodeError))
+        return;
+    PyErr_Clear();
+    decoded = PyUnicode_DecodeUTF8(data, len, NULL);
+    if (decoded != NULL) {
+        Py_DECREF(decoded);
+        PyErr_SetString(PyExc_ValueError, "invalid UTF-8");
     }
-    return _build_rval_index_tuple(rval, next_end);
 }
 
-PyDoc_STRVAR(pydoc_encode_basestring_ascii,
-    "encode_basestring_ascii(basestring) -> str\n"
-    "\n"
-    "Return an ASCII-only JSON representation of a Python string"
-);
-
-PyDoc_STRVAR(pydoc_encode_basestring,
-    "encode_basestring(basestring) -> str\n"
-    "\n"
-    "Return a JSON representation of a Python string"
-);
-
 static PyObject *
-py_encode_basestring_ascii(PyObject* self UNUSED, PyObject *pystr)
+json_decode_utf8_run(const char *data, Py_ssize_t len, Py_ssize_t start,
+                     Py_ssize_t end)
 {
-    /* Return an ASCII-only JSON representation of a Python string */
-    /* METH_O */
-    if (PyBytes_Check(pystr)) {
-        return ascii_escape_str(pystr);
-    }
-    else if (PyUnicode_Check(pystr)) {
-        if (PyUnicode_READY(pystr))
-            return NULL;
-        return ascii_escape_unicode(pystr);
-    }
-    else {
-        PyErr_Format(PyExc_TypeError,
-                     "first argument must be a string, not %.80s",
-                     Py_TYPE(pystr)->tp_name);
-        return NULL;
-    }
+    /* Decode the bytes of data from start to end, the part of a document
+     * of len bytes, raising the UnicodeDecodeError of the document if
+     * they are malformed */
+    PyObject *rval = PyUnicode_DecodeUTF8(data + start, end - start, NULL);
+    if (rval == NULL)
+        json_utf8_document_error(data, len);
+    return rval;
 }
 
-/* encode_basestring: escape only control chars, backslash, and quote.
- * Non-ASCII characters pass through unchanged (ensure_ascii=False). */
-
-#if PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3
-/* Only needed by the two-pass escape_unicode_noascii (pre-3.14 and
- * Python 2). The PyUnicodeWriter path on 3.14+ writes escapes inline. */
-static Py_ssize_t
-escape_char_noascii(JSON_UNICHR c, JSON_UNICHR *output, Py_ssize_t chars)
+/* Parse the 4 hex digits of a \uXXXX escape at p into *c.
+   Returns 0 on success, -1 if p does not start with 4 hex digits. */
+static int
+json_parse_hex4(const unsigned char *p, JSON_UNICHR *c)
 {
-    if (!NEEDS_ESCAPE(c)) {
-        output[chars++] = c;
-    }
-    else {
-        output[chars++] = '\\';
-        switch (c) {
-            case '\\': output[chars++] = '\\'; break;
-            case '"':  output[chars++] = '"'; break;
-            case '\b': output[chars++] = 'b'; break;
-            case '\f': output[chars++] = 'f'; break;
-            case '\n': output[chars++] = 'n'; break;
-            case '\r': output[chars++] = 'r'; break;
-            case '\t': output[chars++] = 't'; break;
-            default:
-                /* Control character: \u00XX */
-                output[chars++] = 'u';
-                output[chars++] = '0';
-                output[chars++] = '0';
-                output[chars++] = "0123456789abcdef"[(c >> 4) & 0xf];
-                output[chars++] = "0123456789abcdef"[(c     ) & 0xf];
-        }
+    Py_ssize_t i;
+    JSON_UNICHR v = 0;
+    for (i = 0; i < 4; i++) {
+        unsigned char hex_digit = p[i];
+        v <<= 4;
+        if (hex_digit >= '0' && hex_digit <= '9')
+            v |= (hex_digit - '0');
+        else if (hex_digit >= 'a' && hex_digit <= 'f')
+            v |= (hex_digit - 'a' + 10);
+        else if (hex_digit >= 'A' && hex_digit <= 'F')
+            v |= (hex_digit - 'A' + 10);
+        else
+            return -1;
     }
-    return chars;
+    *c = v;
+    return 0;
 }
 
-static Py_ssize_t
-escape_char_noascii_size(JSON_UNICHR c)
+static PyObject *
+scanstring_utf8(_speedups_state *state, PyObject *pystr,
+                const unsigned char *buf, Py_ssize_t len, Py_ssize_t end,
+                int strict, Py_ssize_t *next_end_ptr)
 {
-    if (!NEEDS_ESCAPE(c))
-        return 1;
-    switch (c) {
-        case '\\': case '"': case '\b': case '\f':
-        case '\n': case '\r': case '\t':
-            return 2;
-        default:
-            return 6;  /* \u00XX */
-    }
-}
-#endif /* PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3 */
+    /* Read the JSON string from the UTF-8 encoded buf of len bytes, the
+    data of the bytes or memoryview pystr (only used for error messages).
+    end is the index of the first byte after the quote.
+    if strict is zero then literal control characters are allowed
+    *next_end_ptr is a return-by-reference index of the byte
+        after the end quote
+
+    Runs of literal bytes are decoded with the strict UTF-8 codec, so
+    malformed UTF-8 raises the same UnicodeDecodeError as str(s, 'utf-8').
 
+    Return value is a new PyUnicode
+    */
+    PyObject *rval;
+    Py_ssize_t begin = end - 1;
+    Py_ssize_t next = begin;
 #if PY_VERSION_HEX >= 0x030E0000
-static PyObject *
-escape_unicode_noascii(PyObject *pystr)
-{
-    /* Single-pass using PyUnicodeWriter (Python 3.14+). */
-    Py_ssize_t i;
-    Py_ssize_t input_chars = PyUnicode_GET_LENGTH(pystr);
-    int kind = PyUnicode_KIND(pystr);
-    void *data = PyUnicode_DATA(pystr);
-    Py_ssize_t run_start = 0;
-    PyUnicodeWriter *writer = PyUnicodeWriter_Create(input_chars + 2);
-    if (writer == NULL)
-        return NULL;
-    if (PyUnicodeWriter_WriteChar(writer, '"') < 0)
+    PyUnicodeWriter *writer = NULL;
+#else
+    PyObject *chunks = NULL;
+#endif
+    PyObject *chunk = NULL;
+
+    if (len == end) {
+        raise_errmsg(state, ERR_STRING_UNTERMINATED, pystr, begin);
         goto bail;
-    for (i = 0; i < input_chars; i++) {
-        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
-        if (!NEEDS_ESCAPE(c))
-            continue;
-        /* Flush run of safe characters */
-        if (i > run_start) {
-            if (PyUnicodeWriter_WriteSubstring(writer, pystr, run_start, i) < 0)
+    }
+    else if (end < 0 || len < end) {
+        raise_errmsg(state, ERR_STRING_UNTERMINATED, pystr, begin);
+        goto bail;
+    }
+    while (1) {
+        /* Find the end of the string or the next escape */
+        JSON_UNICHR c = 0;
+        for (next = end; next < len; next++) {
+            c = buf[next];
+            if (c == '"' || c == '\\') {
+                break;
+            }
+            else if (strict && c <= 0x1f) {
+                raise_errmsg(state, ERR_STRING_CONTROL, pystr, next);
                 goto bail;
+            }
         }
-        {
-            char buf[6]; /* longest escape: \u00XX */
-            Py_ssize_t len = 0;
-            buf[len++] = '\\';
+        if (!(c == '"' || c == '\\')) {
+            raise_errmsg(state, ERR_STRING_UNTERMINATED, pystr, begin);
+            goto bail;
+        }
+        /* Pick up this chunk if it's not zero length */
+        if (next != end) {
+#if PY_VERSION_HEX >= 0x030E0000
+            if (c == '"' && writer == NULL) {
+                /* No escapes at all: decode straight to the result */
+                chunk = json_decode_utf8_run((const char *)buf, len, end,
+                                             next);
+                if (chunk == NULL)
+                    goto bail;
+            }
+            else {
+                if (writer == NULL) {
+                    writer = PyUnicodeWriter_Create(next - begin);
+                    if (writer == NULL)
+                        goto bail;
+                }
+                if (PyUnicodeWriter_WriteUTF8(writer, (const char *)&buf[end],
+                                              next - end) < 0) {
+                    json_utf8_document_error((const char *)buf, len);
+                    goto bail;
+                }
+            }
+#else
+            APPEND_OLD_CHUNK
+            chunk = json_decode_utf8_run((const char *)buf, len, end, next);
+            if (chunk == NULL) {
+                goto bail;
+            }
+#endif
+        }
+        next++;
+        if (c == '"') {
+            end = next;
+            break;
+        }
+        if (next == len) {
+            raise_errmsg(state, ERR_STRING_UNTERMINATED, pystr, begin);
+            goto bail;
+        }
+        c = buf[next];
+        if (c != 'u') {
+            /* Non-unicode backslash escapes */
+            end = next + 1;
             switch (c) {
-                case '\\': buf[len++] = '\\'; break;
-                case '"':  buf[len++] = '"'; break;
-                case '\b': buf[len++] = 'b'; break;
-                case '\f': buf[len++] = 'f'; break;
-                case '\n': buf[len++] = 'n'; break;
-                case '\r': buf[len++] = 'r'; break;
-                case '\t': buf[len++] = 't'; break;
-                default:
-                    buf[len++] = 'u';
-                    buf[len++] = '0';
-                    buf[len++] = '0';
-                    buf[len++] = "0123456789abcdef"[(c >> 4) & 0xf];
-                    buf[len++] = "0123456789abcdef"[(c     ) & 0xf];
+                case '"': break;
+                case '\\': break;
+                case '/': break;
+                case 'b': c = '\b'; break;
+                case 'f': c = '\f'; break;
+                case 'n': c = '\n'; break;
+                case 'r': c = '\r'; break;
+                case 't': c = '\t'; break;
+                default: c = 0;
             }
-            if (PyUnicodeWriter_WriteUTF8(writer, buf, len) < 0)
+            if (c == 0) {
+                raise_errmsg(state, ERR_STRING_ESC1, pystr, end - 2);
                 goto bail;
+            }
         }
-        run_start = i + 1;
-    }
-    if (i > run_start) {
-        if (PyUnicodeWriter_WriteSubstring(writer, pystr, run_start, i) < 0)
+        else {
+            next++;
+            end = next + 4;
+            if (end > len) {
+                raise_errmsg(state, ERR_STRING_ESC4, pystr, next - 2);
+                goto bail;
+            }
+            if (json_parse_hex4(&buf[next], &c)) {
+                raise_errmsg(state, ERR_STRING_ESC4, pystr, end - 6);
+                goto bail;
+            }
+            next = end;
+            /* Surrogate pair */
+            if ((c & 0xfc00) == 0xd800 && end + 6 <= len &&
+                buf[next] == '\\' && buf[next + 1] == 'u') {
+                JSON_UNICHR c2;
+                if (json_parse_hex4(&buf[next + 2], &c2)) {
+                    raise_errmsg(state, ERR_STRING_ESC4, pystr, end);
+                    goto bail;
+                }
+                if ((c2 & 0xfc00) == 0xdc00) {
+                    c = 0x10000 + (((c - 0xd800) << 10) | (c2 - 0xdc00));
+                    end += 6;
+                }
+                /* else: not a low surrogate, leave it for the next round */
+            }
+        }
+#if PY_VERSION_HEX >= 0x030E0000
+        if (writer == NULL) {
+            writer = PyUnicodeWriter_Create(len - begin);
+            if (writer == NULL)
+                goto bail;
+        }
+        if (PyUnicodeWriter_WriteChar(writer, c) < 0)
+            goto bail;
+#else
+        APPEND_OLD_CHUNK
+        chunk = PyUnicode_FromOrdinal(c);
+        if (chunk == NULL) {
             goto bail;
-    }
-    if (PyUnicodeWriter_WriteChar(writer, '"') < 0)
-        goto bail;
-    return PyUnicodeWriter_Finish(writer);
-bail:
-    PyUnicodeWriter_Discard(writer);
-    return NULL;
-}
-#else /* PY_VERSION_HEX < 0x030E0000 */
-static PyObject *
-escape_unicode_noascii(PyObject *pystr)
-{
-    /* Two-pass: compute size, then fill. */
-    Py_ssize_t i;
-    Py_ssize_t input_chars = PyUnicode_GET_LENGTH(pystr);
-    PY2_UNUSED int kind = PyUnicode_KIND(pystr);
-    void *data = PyUnicode_DATA(pystr);
-    Py_ssize_t output_size = 2; /* opening and closing quotes */
-    PyObject *rval;
-
-    for (i = 0; i < input_chars; i++) {
-        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
-        Py_ssize_t charsize = escape_char_noascii_size(c);
-        if (output_size > PY_SSIZE_T_MAX - charsize) {
-            PyErr_SetString(PyExc_OverflowError,
-                            "string is too long to escape");
-            return NULL;
         }
-        output_size += charsize;
+#endif
     }
 
-#if PY_MAJOR_VERSION >= 3
-    {
-        /* Escapes are all ASCII, so maxchar doesn't increase */
-        Py_UCS4 maxchar = PyUnicode_MAX_CHAR_VALUE(pystr);
-        if (maxchar < 127)
-            maxchar = 127;
-        rval = PyUnicode_New(output_size, maxchar);
+#if PY_VERSION_HEX >= 0x030E0000
+    if (writer != NULL) {
+        rval = PyUnicodeWriter_Finish(writer);
+        writer = NULL;  /* Finish consumed the writer */
         if (rval == NULL)
-            return NULL;
-    }
-    {
-        int out_kind = PyUnicode_KIND(rval);
-        void *out_data = PyUnicode_DATA(rval);
-        Py_ssize_t chars = 0;
-        PyUnicode_WRITE(out_kind, out_data, chars++, '"');
-        for (i = 0; i < input_chars; i++) {
-            JSON_UNICHR c = PyUnicode_READ(kind, data, i);
-            if (!NEEDS_ESCAPE(c)) {
-                PyUnicode_WRITE(out_kind, out_data, chars++, c);
-            }
-            else {
-                JSON_UNICHR buf[6];
-                Py_ssize_t j, n = escape_char_noascii(c, buf, 0);
-                for (j = 0; j < n; j++)
-                    PyUnicode_WRITE(out_kind, out_data, chars++, buf[j]);
-            }
-        }
-        PyUnicode_WRITE(out_kind, out_data, chars++, '"');
-        assert(chars == output_size);
+            goto bail;
     }
 #else
-    /* Python 2: return a unicode object */
-    rval = PyUnicode_FromUnicode(NULL, output_size);
-    if (rval == NULL)
-        return NULL;
-    {
-        Py_UNICODE *output = PyUnicode_AS_UNICODE(rval);
-        Py_ssize_t chars = 0;
-        output[chars++] = '"';
-        for (i = 0; i < input_chars; i++) {
-            chars = escape_char_noascii(
-                PyUnicode_READ(kind, data, i), output, chars);
+    if (chunks != NULL) {
+        APPEND_OLD_CHUNK
+        rval = join_list_unicode(state, chunks);
+        if (rval == NULL) {
+            goto bail;
         }
-        output[chars++] = '"';
-        assert(chars == output_size);
+        Py_CLEAR(chunks);
     }
 #endif
+    else if (chunk != NULL) {
+        rval = chunk;
+    }
+    else {
+        rval = state->JSON_EmptyUnicode;
+        Py_INCREF(rval);
+    }
+    *next_end_ptr = end;
     return rval;
+bail:
+    *next_end_ptr = -1;
+    Py_XDECREF(chunk);
+#if PY_VERSION_HEX >= 0x030E0000
+    if (writer != NULL)
+        PyUnicodeWriter_Discard(writer);
+#else
+    Py_XDECREF(chunks);
+#endif
+    return NULL;
 }
-#endif /* PY_VERSION_HEX >= 0x030E0000 */
+#endif /* PY_MAJOR_VERSION >= 3 */
+
+PyDoc_STRVAR(pydoc_scanstring,
+    "scanstring(basestring, end, encoding, strict=True) -> (str, end)\n"
+    "\n"
+    "Scan the string s for a JSON string. End is the index of the\n"
+    "character in s after the quote that started the JSON string.\n"
+    "Unescapes all valid JSON string escape sequences and raises ValueError\n"
+    "on attempt to decode an invalid string. If strict is False then literal\n"
+    "control characters are allowed in the string.\n"
+    "\n"
+    "Returns a tuple of the decoded string and the index of the character in s\n"
+    "after the end quote."
+);
 
 static PyObject *
-py_encode_basestring(PyObject* self UNUSED, PyObject *pystr)
+py_scanstring(PyObject* self UNUSED, PyObject *args)
 {
-    /* Return a JSON representation of a Python string (ensure_ascii=False) */
-    /* METH_O */
-    if (PyBytes_Check(pystr)) {
-        PyObject *uni;
-        PyObject *rval;
-        uni = PyUnicode_DecodeUTF8(
-            PyBytes_AS_STRING(pystr), PyBytes_GET_SIZE(pystr), NULL);
-        if (uni == NULL)
-            return NULL;
-        rval = escape_unicode_noascii(uni);
-        Py_DECREF(uni);
-        return rval;
+    PyObject *pystr;
+    PyObject *rval;
+    Py_ssize_t end;
+    Py_ssize_t next_end = -1;
+    char *encoding = NULL;
+    int strict = 1;
+    if (!PyArg_ParseTuple(args, "On|zi:scanstring", &pystr, &end, &encoding, &strict)) {
+        return NULL;
     }
-    else if (PyUnicode_Check(pystr)) {
+    if (encoding == NULL) {
+        encoding = DEFAULT_ENCODING;
+    }
+    if (PyUnicode_Check(pystr)) {
         if (PyUnicode_READY(pystr))
             return NULL;
-        return escape_unicode_noascii(pystr);
+        rval = scanstring_unicode(get_speedups_state(self), pystr, end,
+                                  strict, &next_end);
+    }
+#if PY_MAJOR_VERSION < 3
+    /* Using a bytes input is unsupported for scanning in Python 3.
+       It is coerced to str in the decoder before it gets here. */
+    else if (PyString_Check(pystr)) {
+        rval = scanstring_str(get_speedups_state(self), pystr, end,
+                              encoding, strict, &next_end);
     }
+#endif
     else {
         PyErr_Format(PyExc_TypeError,
                      "first argument must be a string, not %.80s",
                      Py_TYPE(pystr)->tp_name);
         return NULL;
     }
+    return _build_rval_index_tuple(rval, next_end);
 }
 
-static void
-scanner_dealloc(PyObject *self)
-{
-    /* bpo-31095: UnTrack is needed before calling any callbacks */
-#if PY_VERSION_HEX >= 0x030D0000
-    PyTypeObject *tp = Py_TYPE(self);
-#endif
-    PyObject_GC_UnTrack(self);
-    scanner_clear(self);
-    Py_TYPE(self)->tp_free(self);
-#if PY_VERSION_HEX >= 0x030D0000
-    Py_DECREF(tp);
-#endif
-}
-
-static int
-scanner_traverse(PyObject *self, visitproc visit, void *arg)
-{
-    PyScannerObject *s = (PyScannerObject *)self;
-#if PY_VERSION_HEX >= 0x030D0000
-    /* Heap types must visit their type for GC. */
-    Py_VISIT(Py_TYPE(self));
-#else
-    assert(PyScanner_Check(self));
-#endif
-#define JSON_VISIT_FIELD(f) Py_VISIT(s->f);
-    JSON_SCANNER_OBJECT_FIELDS(JSON_VISIT_FIELD)
-#undef JSON_VISIT_FIELD
-    return 0;
-}
+PyDoc_STRVAR(pydoc_encode_basestring_ascii,
+    "encode_basestring_ascii(basestring) -> str\n"
+    "\n"
+    "Return an ASCII-only JSON representation of a Python string"
+);
 
-static int
-scanner_clear(PyObject *self)
-{
-    PyScannerObject *s = (PyScannerObject *)self;
-#if PY_VERSION_HEX < 0x030D0000
-    assert(PyScanner_Check(self));
-#endif
-#define JSON_CLEAR_FIELD(f) Py_CLEAR(s->f);
-    JSON_SCANNER_OBJECT_FIELDS(JSON_CLEAR_FIELD)
-#undef JSON_CLEAR_FIELD
-    return 0;
-}
+PyDoc_STRVAR(pydoc_encode_basestring,
+    "encode_basestring(basestring) -> str\n"
+    "\n"
+    "Return a JSON representation of a Python string"
+);
 
 static PyObject *
-_parse_constant(PyScannerObject *s, PyObject *pystr, PyObject *constant,
-                Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+py_encode_basestring_ascii(PyObject* self UNUSED, PyObject *pystr)
 {
-    /* Read a JSON constant from pystr. `constant` is the Python string
-       that was found ("NaN", "Infinity", "-Infinity"). Returns the
-       result of s->parse_constant(constant). */
-    PyObject *rval;
-    if (s->parse_constant == Py_None) {
-        raise_errmsg(get_speedups_state(s->module_ref),
-                     ERR_EXPECTING_VALUE, pystr, idx);
+    /* Return an ASCII-only JSON representation of a Python string */
+    /* METH_O */
+    if (PyBytes_Check(pystr)) {
+        return ascii_escape_str(pystr);
+    }
+    else if (PyUnicode_Check(pystr)) {
+        if (PyUnicode_READY(pystr))
+            return NULL;
+        return ascii_escape_unicode(pystr);
+    }
+    else {
+        PyErr_Format(PyExc_TypeError,
+                     "first argument must be a string, not %.80s",
+                     Py_TYPE(pystr)->tp_name);
         return NULL;
     }
-
-    rval = PyObject_CallOneArg(s->parse_constant, constant);
-    idx += PyString_GET_SIZE(constant);
-    *next_idx_ptr = idx;
-    return rval;
-}
-
-/* -- Helper functions for _match_number fast paths (used by the
-   _speedups_scan.h template). Factored out so the template can stay
-   agnostic about PyFloat / PyInt vs PyObject_CallOneArg details. */
-
-static inline PyObject *
-_match_number_float_fast_unicode(PyObject *numstr)
-{
-#if PY_MAJOR_VERSION >= 3
-    return PyFloat_FromString(numstr);
-#else
-    return PyFloat_FromString(numstr, NULL);
-#endif
 }
 
-static inline PyObject *
-_match_number_int_fast_unicode(PyScannerObject *s, PyObject *numstr)
-{
-    /* No fast path for unicode -> int; always call parse_int. */
-    return PyObject_CallOneArg(s->parse_int, numstr);
-}
+/* encode_basestring: escape only control chars, backslash, and quote.
+ * Non-ASCII characters pass through unchanged (ensure_ascii=False). */
 
-#if PY_MAJOR_VERSION < 3
-static inline PyObject *
-_match_number_float_fast_str(PyObject *numstr)
+#if PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3
+/* Only needed by the two-pass escape_unicode_noascii (pre-3.14 and
+ * Python 2). The PyUnicodeWriter path on 3.14+ writes escapes inline. */
+static Py_ssize_t
+escape_char_noascii(JSON_UNICHR c, JSON_UNICHR *output, Py_ssize_t chars)
 {
-    double d = PyOS_string_to_double(PyString_AS_STRING(numstr), NULL, NULL);
-    if (d == -1.0 && PyErr_Occurred())
-        return NULL;
-    return PyFloat_FromDouble(d);
+    if (!NEEDS_ESCAPE(c)) {
+        output[chars++] = c;
+    }
+    else {
+        output[chars++] = '\\';
+        switch (c) {
+            case '\\': output[chars++] = '\\'; break;
+            case '"':  output[chars++] = '"'; break;
+            case '\b': output[chars++] = 'b'; break;
+            case '\f': output[chars++] = 'f'; break;
+            case '\n': output[chars++] = 'n'; break;
+            case '\r': output[chars++] = 'r'; break;
+            case '\t': output[chars++] = 't'; break;
+            default:
+                /* Control character: \u00XX */
+                output[chars++] = 'u';
+                output[chars++] = '0';
+                output[chars++] = '0';
+                output[chars++] = "0123456789abcdef"[(c >> 4) & 0xf];
+                output[chars++] = "0123456789abcdef"[(c     ) & 0xf];
+        }
+    }
+    return chars;
 }
 
-static inline PyObject *
-_match_number_int_fast_str(PyScannerObject *s, PyObject *numstr)
+static Py_ssize_t
+escape_char_noascii_size(JSON_UNICHR c)
 {
-    if (s->parse_int != (PyObject *)&PyInt_Type) {
-        return PyObject_CallOneArg(s->parse_int, numstr);
+    if (!NEEDS_ESCAPE(c))
+        return 1;
+    switch (c) {
+        case '\\': case '"': case '\b': case '\f':
+        case '\n': case '\r': case '\t':
+            return 2;
+        default:
+            return 6;  /* \u00XX */
     }
-    return PyInt_FromString(PyString_AS_STRING(numstr), NULL, 10);
 }
-#endif
-
-/* -- Generate scan_once_unicode, _parse_object_unicode, _parse_array_unicode,
-   _match_number_unicode from the shared template. -- */
-#define JSON_SCAN_SUFFIX _unicode
-#define JSON_SCAN_DATA_INIT(p) \
-    PY2_UNUSED int kind = PyUnicode_KIND(p); \
-    void *str = PyUnicode_DATA(p); \
-    Py_ssize_t end_idx = PyUnicode_GET_LENGTH(p) - 1
-#define JSON_SCAN_READ(i) PyUnicode_READ(kind, str, (i))
-#define JSON_SCAN_SCANSTRING_CALL(pos, nextp) \
-    scanstring_unicode(state, pystr, (pos), s->strict, (nextp))
-#if PY_MAJOR_VERSION >= 3
-#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
-    PyUnicode_Substring(pystr, (sidx), (eidx))
-#else
-#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
-    PyUnicode_FromUnicode(&((Py_UNICODE *)str)[(sidx)], (eidx) - (sidx))
-#endif
-#define JSON_SCAN_PARSE_FLOAT_FAST(ns) _match_number_float_fast_unicode(ns)
-#define JSON_SCAN_PARSE_INT_FAST(ns)   _match_number_int_fast_unicode(s, ns)
-#define JSON_SPEEDUPS_SCAN_INCLUDING 1
-#include "_speedups_scan.h"
-#undef JSON_SPEEDUPS_SCAN_INCLUDING
-
-/* -- Generate the corresponding _str variants on Python 2. -- */
-#if PY_MAJOR_VERSION < 3
-#define JSON_SCAN_SUFFIX _str
-#define JSON_SCAN_DATA_INIT(p) \
-    char *str = PyString_AS_STRING(p); \
-    Py_ssize_t end_idx = PyString_GET_SIZE(p) - 1
-#define JSON_SCAN_READ(i) ((unsigned char)str[(i)])
-#define JSON_SCAN_SCANSTRING_CALL(pos, nextp) \
-    scanstring_str(state, pystr, (pos), \
-                   PyString_AS_STRING(s->encoding), s->strict, (nextp))
-#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
-    PyString_FromStringAndSize(&str[(sidx)], (eidx) - (sidx))
-#define JSON_SCAN_PARSE_FLOAT_FAST(ns) _match_number_float_fast_str(ns)
-#define JSON_SCAN_PARSE_INT_FAST(ns)   _match_number_int_fast_str(s, ns)
-#define JSON_SPEEDUPS_SCAN_INCLUDING 1
-#include "_speedups_scan.h"
-#undef JSON_SPEEDUPS_SCAN_INCLUDING
-#endif /* PY_MAJOR_VERSION < 3 */
-
+#endif /* PY_VERSION_HEX < 0x030E0000 || PY_MAJOR_VERSION < 3 */
 
+#if PY_VERSION_HEX >= 0x030E0000
 static PyObject *
-scanner_call(PyObject *self, PyObject *args, PyObject *kwds)
+escape_unicode_noascii(PyObject *pystr)
 {
-    /* Python callable interface to scan_once_{str,unicode} */
-    PyObject *pystr;
-    PyObject *rval = NULL;
-    Py_ssize_t idx;
-    Py_ssize_t next_idx = -1;
-    static char *kwlist[] = {"string", "idx", NULL};
-    PyScannerObject *s;
-#if PY_VERSION_HEX < 0x030D0000
-    assert(PyScanner_Check(self));
-#endif
-    s = (PyScannerObject *)self;
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:scan_once", kwlist, &pystr, &idx))
-        return NULL;
-
-    if (PyUnicode_Check(pystr)) {
-        if (PyUnicode_READY(pystr))
-            return NULL;
-    }
-#if PY_MAJOR_VERSION < 3
-    else if (!PyString_Check(pystr)) {
-#else
-    else {
-#endif
-        PyErr_Format(PyExc_TypeError,
-                 "first argument must be a string, not %.80s",
-                 Py_TYPE(pystr)->tp_name);
+    /* Single-pass using PyUnicodeWriter (Python 3.14+). */
+    Py_ssize_t i;
+    Py_ssize_t input_chars = PyUnicode_GET_LENGTH(pystr);
+    int kind = PyUnicode_KIND(pystr);
+    void *data = PyUnicode_DATA(pystr);
+    Py_ssize_t run_start = 0;
+    PyUnicodeWriter *writer = PyUnicodeWriter_Create(input_chars + 2);
+    if (writer == NULL)
         return NULL;
+    if (PyUnicodeWriter_WriteChar(writer, '"') < 0)
+        goto bail;
+    for (i = 0; i < input_chars; i++) {
+        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
+        if (!NEEDS_ESCAPE(c))
+            continue;
+        /* Flush run of safe characters */
+        if (i > run_start) {
+            if (PyUnicodeWriter_WriteSubstring(writer, pystr, run_start, i) < 0)
+                goto bail;
+        }
+        {
+            char buf[6]; /* longest escape: \u00XX */
+            Py_ssize_t len = 0;
+            buf[len++] = '\\';
+            switch (c) {
+                case '\\': buf[len++] = '\\'; break;
+                case '"':  buf[len++] = '"'; break;
+                case '\b': buf[len++] = 'b'; break;
+                case '\f': buf[len++] = 'f'; break;
+                case '\n': buf[len++] = 'n'; break;
+                case '\r': buf[len++] = 'r'; break;
+                case '\t': buf[len++] = 't'; break;
+                default:
+                    buf[len++] = 'u';
+                    buf[len++] = '0';
+                    buf[len++] = '0';
+                    buf[len++] = "0123456789abcdef"[(c >> 4) & 0xf];
+                    buf[len++] = "0123456789abcdef"[(c     ) & 0xf];
+            }
+            if (PyUnicodeWriter_WriteUTF8(writer, buf, len) < 0)
+                goto bail;
+        }
+        run_start = i + 1;
     }
-
-    Py_BEGIN_CRITICAL_SECTION(self);
-
-    if (PyUnicode_Check(pystr)) {
-        rval = scan_once_unicode(s, pystr, idx, &next_idx);
-    }
-#if PY_MAJOR_VERSION < 3
-    else {
-        rval = scan_once_str(s, pystr, idx, &next_idx);
+    if (i > run_start) {
+        if (PyUnicodeWriter_WriteSubstring(writer, pystr, run_start, i) < 0)
+            goto bail;
     }
-#endif /* PY_MAJOR_VERSION < 3 */
-    PyDict_Clear(s->memo);
-
-    Py_END_CRITICAL_SECTION();
-    return _build_rval_index_tuple(rval, next_idx);
+    if (PyUnicodeWriter_WriteChar(writer, '"') < 0)
+        goto bail;
+    return PyUnicodeWriter_Finish(writer);
+bail:
+    PyUnicodeWriter_Discard(writer);
+    return NULL;
 }
-
+#else /* PY_VERSION_HEX < 0x030E0000 */
 static PyObject *
-JSON_ParseEncoding(PyObject *encoding)
+escape_unicode_noascii(PyObject *pystr)
 {
-    if (encoding == Py_None)
-        return JSON_InternFromString(DEFAULT_ENCODING);
+    /* Two-pass: compute size, then fill. */
+    Py_ssize_t i;
+    Py_ssize_t input_chars = PyUnicode_GET_LENGTH(pystr);
+    PY2_UNUSED int kind = PyUnicode_KIND(pystr);
+    void *data = PyUnicode_DATA(pystr);
+    Py_ssize_t output_size = 2; /* opening and closing quotes */
+    PyObject *rval;
+
+    for (i = 0; i < input_chars; i++) {
+        JSON_UNICHR c = PyUnicode_READ(kind, data, i);
+        Py_ssize_t charsize = escape_char_noascii_size(c);
+        if (output_size > PY_SSIZE_T_MAX - charsize) {
+            PyErr_SetString(PyExc_OverflowError,
+                            "string is too long to escape");
+            return NULL;
+        }
+        output_size += charsize;
+    }
+
 #if PY_MAJOR_VERSION >= 3
-    if (PyUnicode_Check(encoding)) {
-        if (PyUnicode_AsUTF8(encoding) == NULL) {
+    {
+        /* Escapes are all ASCII, so maxchar doesn't increase */
+        Py_UCS4 maxchar = PyUnicode_MAX_CHAR_VALUE(pystr);
+        if (maxchar < 127)
+            maxchar = 127;
+        rval = PyUnicode_New(output_size, maxchar);
+        if (rval == NULL)
             return NULL;
+    }
+    {
+        int out_kind = PyUnicode_KIND(rval);
+        void *out_data = PyUnicode_DATA(rval);
+        Py_ssize_t chars = 0;
+        PyUnicode_WRITE(out_kind, out_data, chars++, '"');
+        for (i = 0; i < input_chars; i++) {
+            JSON_UNICHR c = PyUnicode_READ(kind, data, i);
+            if (!NEEDS_ESCAPE(c)) {
+                PyUnicode_WRITE(out_kind, out_data, chars++, c);
+            }
+            else {
+                JSON_UNICHR buf[6];
+                Py_ssize_t j, n = escape_char_noascii(c, buf, 0);
+                for (j = 0; j < n; j++)
+                    PyUnicode_WRITE(out_kind, out_data, chars++, buf[j]);
+            }
         }
-        Py_INCREF(encoding);
-        return encoding;
+        PyUnicode_WRITE(out_kind, out_data, chars++, '"');
+        assert(chars == output_size);
     }
-#else /* PY_MAJOR_VERSION >= 3 */
-    if (PyString_Check(encoding)) {
-        Py_INCREF(encoding);
-        return encoding;
+#else
+    /* Python 2: return a unicode object */
+    rval = PyUnicode_FromUnicode(NULL, output_size);
+    if (rval == NULL)
+        return NULL;
+    {
+        Py_UNICODE *output = PyUnicode_AS_UNICODE(rval);
+        Py_ssize_t chars = 0;
+        output[chars++] = '"';
+        for (i = 0; i < input_chars; i++) {
+            chars = escape_char_noascii(
+                PyUnicode_READ(kind, data, i), output, chars);
+        }
+        output[chars++] = '"';
+        assert(chars == output_size);
     }
-    if (PyUnicode_Check(encoding))
-        return PyUnicode_AsEncodedString(encoding, NULL, NULL);
-#endif /* PY_MAJOR_VERSION >= 3 */
-    PyErr_SetString(PyExc_TypeError, "encoding must be a string");
-    return NULL;
+#endif
+    return rval;
 }
+#endif /* PY_VERSION_HEX >= 0x030E0000 */
 
 static PyObject *
-scanner_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+py_encode_basestring(PyObject* self UNUSED, PyObject *pystr)
 {
-    /* Initialize Scanner object */
-    PyObject *ctx;
-    static char *kwlist[] = {"context", NULL};
-    PyScannerObject *s;
-    PyObject *encoding;
-
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:make_scanner", kwlist, &ctx))
+    /* Return a JSON representation of a Python string (ensure_ascii=False) */
+    /* METH_O */
+    if (PyBytes_Check(pystr)) {
+        PyObject *uni;
+        PyObject *rval;
+        uni = PyUnicode_DecodeUTF8(
+            PyBytes_AS_STRING(pystr), PyBytes_GET_SIZE(pystr), NULL);
+        if (uni == NULL)
+            return NULL;
+        rval = escape_unicode_noascii(uni);
+        Py_DECREF(uni);
+        return rval;
+    }
+    else if (PyUnicode_Check(pystr)) {
+        if (PyUnicode_READY(pystr))
+            return NULL;
+        return escape_unicode_noascii(pystr);
+    }
+    else {
+        PyErr_Format(PyExc_TypeError,
+                     "first argument must be a string, not %.80s",
+                     Py_TYPE(pystr)->tp_name);
         return NULL;
+    }
+}
 
-    s = (PyScannerObject *)type->tp_alloc(type, 0);
-    if (s == NULL)
-        return NULL;
+static void
+scanner_dealloc(PyObject *self)
+{
+    /* bpo-31095: UnTrack is needed before calling any callbacks */
+#if PY_VERSION_HEX >= 0x030D0000
+    PyTypeObject *tp = Py_TYPE(self);
+#endif
+    PyObject_GC_UnTrack(self);
+    scanner_clear(self);
+    Py_TYPE(self)->tp_free(self);
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_DECREF(tp);
+#endif
+}
 
+static int
+scanner_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    PyScannerObject *s = (PyScannerObject *)self;
 #if PY_VERSION_HEX >= 0x030D0000
-    s->module_ref = PyType_GetModuleByDef(type, &moduledef);
-    if (s->module_ref == NULL)
-        goto bail;
+    /* Heap types must visit their type for GC. */
+    Py_VISIT(Py_TYPE(self));
 #else
-    s->module_ref = _speedups_module;  /* borrowed */
+    assert(PyScanner_Check(self));
 #endif
-    Py_INCREF(s->module_ref);
+#define JSON_VISIT_FIELD(f) Py_VISIT(s->f);
+    JSON_SCANNER_OBJECT_FIELDS(JSON_VISIT_FIELD)
+#undef JSON_VISIT_FIELD
+    return 0;
+}
 
-    if (s->memo == NULL) {
-        s->memo = PyDict_New();
-        if (s->memo == NULL)
-            goto bail;
-    }
+static int
+scanner_clear(PyObject *self)
+{
+    PyScannerObject *s = (PyScannerObject *)self;
+#if PY_VERSION_HEX < 0x030D0000
+    assert(PyScanner_Check(self));
+#endif
+#define JSON_CLEAR_FIELD(f) Py_CLEAR(s->f);
+    JSON_SCANNER_OBJECT_FIELDS(JSON_CLEAR_FIELD)
+#undef JSON_CLEAR_FIELD
+    return 0;
+}
 
-    /* Load required attributes from the Python-side JSONDecoder context.
-     * Each getattr failure is a hard error; goto bail lets scanner_dealloc
-     * release whatever we managed to set on s. */
-#define LOAD_ATTR(field, name)                              \
-    do {                                                    \
-        s->field = PyObject_GetAttrString(ctx, name);       \
-        if (s->field == NULL)                               \
-            goto bail;                                      \
-    } while (0)
+static PyObject *
+_parse_constant(PyScannerObject *s, PyObject *pystr, PyObject *constant,
+                Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+{
+    /* Read a JSON constant from pystr. `constant` is the Python string
+       that was found ("NaN", "Infinity", "-Infinity"). Returns the
+       result of s->parse_constant(constant). */
+    PyObject *rval;
+    if (s->parse_constant == Py_None) {
+        raise_errmsg(get_speedups_state(s->module_ref),
+                     ERR_EXPECTING_VALUE, pystr, idx);
+        return NULL;
+    }
 
-    encoding = PyObject_GetAttrString(ctx, "encoding");
-    if (encoding == NULL)
-        goto bail;
-    s->encoding = JSON_ParseEncoding(encoding);
-    Py_XDECREF(encoding);
-    if (s->encoding == NULL)
-        goto bail;
+    rval = PyObject_CallOneArg(s->parse_constant, constant);
+    idx += PyString_GET_SIZE(constant);
+    *next_idx_ptr = idx;
+    return rval;
+}
 
-    LOAD_ATTR(strict_bool, "strict");
-    s->strict = PyObject_IsTrue(s->strict_bool);
-    if (s->strict < 0)
-        goto bail;
-    LOAD_ATTR(object_hook, "object_hook");
-    LOAD_ATTR(pairs_hook, "object_pairs_hook");
-    LOAD_ATTR(array_hook, "array_hook");
-    LOAD_ATTR(parse_float, "parse_float");
-    LOAD_ATTR(parse_int, "parse_int");
-    LOAD_ATTR(parse_constant, "parse_constant");
+/* The numbers of an array read by _parse_numeric_array (in the
+ * _speedups_scan.h template) for numeric_arrays. They are kept as 64-bit
+ * integers until the first float, and as doubles from then on. An integer
+ * that a double can't hold exactly sets inexact, and the array is then
+ * decoded as a list instead. Arrays of up to JSON_NUMERIC_SMALL numbers
+ * need no allocation. */
+#define JSON_NUMERIC_SMALL 32
 
-#undef LOAD_ATTR
+typedef union {
+    long long q;
+    double d;
+} JSON_Number;
 
-    return (PyObject *)s;
+typedef struct {
+    JSON_Number *items;
+    Py_ssize_t size;
+    Py_ssize_t allocated;
+    int is_float;
+    int inexact;
+    JSON_Number small[JSON_NUMERIC_SMALL];
+} JSON_NumericArray;
 
-bail:
-    Py_DECREF(s);
-    return NULL;
+static void
+json_numeric_init(JSON_NumericArray *arr)
+{
+    arr->items = arr->small;
+    arr->size = 0;
+    arr->allocated = JSON_NUMERIC_SMALL;
+    arr->is_float = 0;
+    arr->inexact = 0;
 }
 
-PyDoc_STRVAR(scanner_doc, "JSON scanner object");
+static void
+json_numeric_clear(JSON_NumericArray *arr)
+{
+    if (arr->items != arr->small)
+        PyMem_Free(arr->items);
+    arr->items = arr->small;
+}
 
-#if PY_VERSION_HEX >= 0x030D0000
-/* Heap type slots and spec for Python 3.13+ */
-static PyType_Slot PyScannerType_slots[] = {
-    {Py_tp_doc, (void *)scanner_doc},
-    {Py_tp_dealloc, scanner_dealloc},
-    {Py_tp_call, scanner_call},
-    {Py_tp_traverse, scanner_traverse},
-    {Py_tp_clear, scanner_clear},
-    {Py_tp_members, scanner_members},
-    {Py_tp_new, scanner_new},
-    {0, NULL}
-};
+static JSON_Number *
+json_numeric_push(JSON_NumericArray *arr)
+{
+    /* Return the slot for the next number, or NULL on error */
+    if (arr->size == arr->allocated) {
+        JSON_Number *items;
+        Py_ssize_t allocated = arr->allocated * 2;
+        if (allocated > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(JSON_Number)) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        if (arr->items == arr->small) {
+            items = (JSON_Number *)PyMem_Malloc(allocated * sizeof(JSON_Number));
+            if (items != NULL)
+                memcpy(items, arr->small, sizeof(arr->small));
+        }
+        else {
+            items = (JSON_Number *)PyMem_Realloc(
+                arr->items, allocated * sizeof(JSON_Number));
+        }
+        if (items == NULL) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        arr->items = items;
+        arr->allocated = allocated;
+    }
+    return &arr->items[arr->size++];
+}
 
-static PyType_Spec PyScannerType_spec = {
-    .name = "simplejson._speedups.Scanner",
-    .basicsize = sizeof(PyScannerObject),
-    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
-    .slots = PyScannerType_slots,
-};
-#else
-static PyTypeObject PyScannerType = {
-    PyVarObject_HEAD_INIT(NULL, 0)
-    "simplejson._speedups.Scanner",       /* tp_name */
-    sizeof(PyScannerObject), /* tp_basicsize */
-    0,                    /* tp_itemsize */
-    scanner_dealloc, /* tp_dealloc */
-    0,                    /* tp_print */
-    0,                    /* tp_getattr */
-    0,                    /* tp_setattr */
-    0,                    /* tp_compare */
-    0,                    /* tp_repr */
-    0,                    /* tp_as_number */
-    0,                    /* tp_as_sequence */
-    0,                    /* tp_as_mapping */
-    0,                    /* tp_hash */
-    scanner_call,         /* tp_call */
-    0,                    /* tp_str */
-    0,/* PyObject_GenericGetAttr, */                    /* tp_getattro */
-    0,/* PyObject_GenericSetAttr, */                    /* tp_setattro */
-    0,                    /* tp_as_buffer */
-    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,   /* tp_flags */
-    scanner_doc,          /* tp_doc */
-    scanner_traverse,                    /* tp_traverse */
-    scanner_clear,                    /* tp_clear */
-    0,                    /* tp_richcompare */
-    0,                    /* tp_weaklistoffset */
-    0,                    /* tp_iter */
-    0,                    /* tp_iternext */
-    0,                    /* tp_methods */
-    scanner_members,                    /* tp_members */
-    0,                    /* tp_getset */
-    0,                    /* tp_base */
-    0,                    /* tp_dict */
-    0,                    /* tp_descr_get */
-    0,                    /* tp_descr_set */
-    0,                    /* tp_dictoffset */
-    0,                    /* tp_init */
-    0,/* PyType_GenericAlloc, */        /* tp_alloc */
-    scanner_new,          /* tp_new */
-    0,/* PyObject_GC_Del, */              /* tp_free */
-};
-#endif
+static int
+json_numeric_exact(long long value)
+{
+    /* Whether (double)value is exactly value. 2**63 is out of range of a
+     * long long, so it is compared before converting back. */
+    double d = (double)value;
+    return d < 9223372036854775808.0 && (long long)d == value;
+}
+
+static int
+json_numeric_append_int(JSON_NumericArray *arr, long long value)
+{
+    JSON_Number *item = json_numeric_push(arr);
+    if (item == NULL)
+        return -1;
+    if (arr->is_float) {
+        if (!json_numeric_exact(value))
+            arr->inexact = 1;
+        item->d = (double)value;
+    }
+    else {
+        item->q = value;
+    }
+    return 0;
+}
+
+static int
+json_numeric_append_float(JSON_NumericArray *arr, double value)
+{
+    JSON_Number *item;
+    if (!arr->is_float) {
+        Py_ssize_t i;
+        for (i = 0; i < arr->size; i++) {
+            if (!json_numeric_exact(arr->items[i].q))
+                arr->inexact = 1;
+            arr->items[i].d = (double)arr->items[i].q;
+        }
+        arr->is_float = 1;
+    }
+    item = json_numeric_push(arr);
+    if (item == NULL)
+        return -1;
+    item->d = value;
+    return 0;
+}
 
 static PyObject *
-encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+json_numeric_finish(PyScannerObject *s, JSON_NumericArray *arr)
 {
-    static char *kwlist[] = {
-        "markers",
-        "default",
-        "encoder",
-        "indent",
-        "key_separator",
-        "item_separator",
-        "sort_keys",
-        "skipkeys",
-        "allow_nan",
-        "key_memo",
-        "use_decimal",
-        "namedtuple_as_object",
-        "tuple_as_array",
-        "int_as_string_bitcount",
-        "item_sort_key",
-        "encoding",
-        "for_json",
-        "ignore_nan",
-        "Decimal",
-        "iterable_as_array",
-        NULL};
+    /* Return make_numeric_array(typecode, data), where data is a bytearray
+     * of the numbers as 'q' (int64) or 'd' (double) */
+    PyObject *data = PyByteArray_FromStringAndSize(
+        (const char *)arr->items, arr->size * (Py_ssize_t)sizeof(JSON_Number));
+    if (data == NULL)
+        return NULL;
+    return PyObject_CallFunction(s->make_numeric_array, "sN",
+                                 arr->is_float ? "d" : "q", data);
+}
 
-    PyEncoderObject *s;
-    PyObject *markers, *defaultfn, *encoder, *indent, *key_separator;
-    PyObject *item_separator, *sort_keys, *skipkeys, *allow_nan, *key_memo;
-    PyObject *use_decimal, *namedtuple_as_object, *tuple_as_array, *iterable_as_array;
-    PyObject *int_as_string_bitcount, *item_sort_key, *encoding, *for_json;
-    PyObject *ignore_nan, *Decimal;
-    int is_true;
+#include "_speedups_float.h"
 
-    /* Build the format string from per-argument pieces so that each "O"
-     * has a comment and adding/removing an argument only touches one
-     * line instead of counting letters in a 20-char string literal. The
-     * order here must match kwlist[] above and the &var argument list
-     * to PyArg_ParseTupleAndKeywords below. */
-    static const char *const fmt =
-        "O"  /* markers */
-        "O"  /* default */
-        "O"  /* encoder */
-        "O"  /* indent */
-        "O"  /* key_separator */
-        "O"  /* item_separator */
-        "O"  /* sort_keys */
-        "O"  /* skipkeys */
-        "O"  /* allow_nan */
-        "O"  /* key_memo */
-        "O"  /* use_decimal */
-        "O"  /* namedtuple_as_object */
-        "O"  /* tuple_as_array */
-        "O"  /* int_as_string_bitcount */
-        "O"  /* item_sort_key */
-        "O"  /* encoding */
-        "O"  /* for_json */
-        "O"  /* ignore_nan */
-        "O"  /* Decimal */
-        "O"  /* iterable_as_array */
-        ":make_encoder";
+/* The first error found by _validate (in the _speedups_scan.h template),
+ * which runs without the GIL and so can't raise it: an ERR_* message
+ * and its index, or (with a NULL msg) a run of string bytes that is not
+ * valid UTF-8, which json_validate_raise decodes again for the same
+ * UnicodeDecodeError as the scanner. */
+typedef struct {
+    const char *msg;
+    Py_ssize_t pos;
+    Py_ssize_t run_start;
+    Py_ssize_t run_end;
+} JSON_ValidateError;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, fmt, kwlist,
-        &markers, &defaultfn, &encoder, &indent, &key_separator, &item_separator,
-        &sort_keys, &skipkeys, &allow_nan, &key_memo, &use_decimal,
-        &namedtuple_as_object, &tuple_as_array,
-        &int_as_string_bitcount, &item_sort_key, &encoding, &for_json,
-        &ignore_nan, &Decimal, &iterable_as_array))
-        return NULL;
+/* Depth of the arrays and objects that _validate tracks without
+ * allocating, and the size of the documents it checks without the GIL */
+#define JSON_VALIDATE_SMALL 64
+#define JSON_VALIDATE_NOGIL_SIZE 4096
 
-    s = (PyEncoderObject *)type->tp_alloc(type, 0);
-    if (s == NULL)
-        return NULL;
+static void
+json_validate_raise(_speedups_state *state, PyObject *pystr,
+                    JSON_ValidateError *err);
 
-#if PY_VERSION_HEX >= 0x030D0000
-    s->module_ref = PyType_GetModuleByDef(type, &moduledef);
-    if (s->module_ref == NULL)
-        goto bail;
-#else
-    s->module_ref = _speedups_module;  /* borrowed */
+#if PY_VERSION_HEX < 0x03040000
+#define PyMem_RawRealloc realloc
+#define PyMem_RawFree free
 #endif
-    Py_INCREF(s->module_ref);
 
-    Py_INCREF(markers);
-    s->markers = markers;
-    Py_INCREF(defaultfn);
-    s->defaultfn = defaultfn;
-    Py_INCREF(encoder);
-    s->encoder = encoder;
-#if PY_MAJOR_VERSION >= 3
-    if (encoding == Py_None) {
-        /* Py3: encoding=None means "don't decode bytes keys/values".
-         * Store Py_None rather than NULL so Py_T_OBJECT_EX exposes the
-         * attribute as None (not AttributeError) and so tp_traverse /
-         * tp_clear handle the slot uniformly. The bytes-path sentinel
-         * checks in encoder_stringify_key and encoder_listencode_obj
-         * compare against Py_None. */
-        Py_INCREF(Py_None);
-        s->encoding = Py_None;
+static int
+json_validate_push(char **stack, Py_ssize_t *allocated, char *small,
+                   Py_ssize_t depth, char open)
+{
+    /* Push the bracket of an array or object that _validate has entered,
+       without the GIL. Returns 0, or -1 if out of memory. */
+    if (depth == *allocated) {
+        Py_ssize_t n = *allocated * 2;
+        char *grown = (char *)PyMem_RawRealloc(
+            *stack == small ? NULL : *stack, (size_t)n);
+        if (grown == NULL)
+            return -1;
+        if (*stack == small)
+            memcpy(grown, small, (size_t)depth);
+        *stack = grown;
+        *allocated = n;
     }
-    else
-#endif /* PY_MAJOR_VERSION >= 3 */
-    {
-        s->encoding = JSON_ParseEncoding(encoding);
-        if (s->encoding == NULL)
-            goto bail;
+    (*stack)[depth] = open;
+    return 0;
+}
+
+static int
+json_utf8_valid(const unsigned char *p, Py_ssize_t n)
+{
+    /* Return whether the n bytes at p are valid UTF-8 as the strict codec
+       decodes it: no overlong forms or code points above U+10FFFF, and no
+       surrogates except on Python 2, where the codec lets them through. */
+    const unsigned char *end = p + n;
+    while (p < end) {
+        unsigned char c = *p;
+        if (c < 0x80) {
+            p++;
+        }
+        else if (c >= 0xc2 && c <= 0xdf) {
+            if (end - p < 2 || (p[1] & 0xc0) != 0x80)
+                return 0;
+            p += 2;
+        }
+        else if (c >= 0xe0 && c <= 0xef) {
+            if (end - p < 3 || (p[1] & 0xc0) != 0x80 ||
+                (p[2] & 0xc0) != 0x80 ||
+                (c == 0xe0 && p[1] < 0xa0))
+                return 0;
+#if PY_MAJOR_VERSION >= 3
+            if (c == 0xed && p[1] > 0x9f)
+                return 0;
+#endif
+            p += 3;
+        }
+        else if (c >= 0xf0 && c <= 0xf4) {
+            if (end - p < 4 || (p[1] & 0xc0) != 0x80 ||
+                (p[2] & 0xc0) != 0x80 || (p[3] & 0xc0) != 0x80 ||
+                (c == 0xf0 && p[1] < 0x90) || (c == 0xf4 && p[1] > 0x8f))
+                return 0;
+            p += 4;
+        }
+        else {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+/* -- Helper functions for _match_number fast paths (used by the
+   _speedups_scan.h template). Factored out so the template can stay
+   agnostic about PyFloat / PyInt vs PyObject_CallOneArg details. */
+
+static inline PyObject *
+_match_number_float_fast_unicode(PyObject *numstr)
+{
+#if PY_MAJOR_VERSION >= 3
+    return PyFloat_FromString(numstr);
+#else
+    return PyFloat_FromString(numstr, NULL);
+#endif
+}
+
+static inline PyObject *
+_match_number_int_fast_unicode(PyScannerObject *s, PyObject *numstr)
+{
+    /* No fast path for unicode -> int; always call parse_int. */
+    return PyObject_CallOneArg(s->parse_int, numstr);
+}
+
+#if PY_MAJOR_VERSION < 3
+static inline PyObject *
+_match_number_float_fast_str(PyObject *numstr)
+{
+    double d = PyOS_string_to_double(PyString_AS_STRING(numstr), NULL, NULL);
+    if (d == -1.0 && PyErr_Occurred())
+        return NULL;
+    return PyFloat_FromDouble(d);
+}
+
+static inline PyObject *
+_match_number_int_fast_str(PyScannerObject *s, PyObject *numstr)
+{
+    if (s->parse_int != (PyObject *)&PyInt_Type) {
+        return PyObject_CallOneArg(s->parse_int, numstr);
+    }
+    return PyInt_FromString(PyString_AS_STRING(numstr), NULL, 10);
+}
+#endif
+
+/* -- Helpers for _events (in the _speedups_scan.h template), which keep
+   the stack of open containers of simplejson.decoder._FeedParser. Each
+   frame of it is a list [kind, items, key, prefix], where kind is dict or
+   list, key is the last key read in an object, and prefix is the path of
+   the container. */
+
+static int
+feed_top(PyObject *stack, PyObject **frame_ptr)
+{
+    /* Set *frame_ptr to the innermost open container (borrowed), or NULL
+       if there is none. Returns 0, or -1 with an exception set. */
+    Py_ssize_t n = PyList_GET_SIZE(stack);
+    PyObject *frame;
+    *frame_ptr = NULL;
+    if (n == 0)
+        return 0;
+    frame = PyList_GET_ITEM(stack, n - 1);
+    if (!PyList_CheckExact(frame) || PyList_GET_SIZE(frame) != 4) {
+        PyErr_SetString(PyExc_TypeError,
+                        "stack frames must be lists of 4 items");
+        return -1;
+    }
+    *frame_ptr = frame;
+    return 0;
+}
+
+static int
+feed_event(PyObject *events, PyObject *name, PyObject *value,
+           PyObject *prefix)
+{
+    /* Append the event tuple (name, value, prefix) to events */
+    PyObject *event = PyTuple_Pack(3, name, value, prefix);
+    int rv;
+    if (event == NULL)
+        return -1;
+    rv = PyList_Append(events, event);
+    Py_DECREF(event);
+    return rv;
+}
+
+static PyObject *
+feed_prefix(_speedups_state *state, PyObject *frame, PyObject **child_ptr)
+{
+    /* Return the path prefix of the next value in frame (borrowed), like
+       _FeedParser.prefix, kept in *child_ptr until the key changes. */
+    PyObject *prefix;
+    PyObject *key;
+    PyObject *tmp;
+    int nonempty;
+    if (*child_ptr != NULL)
+        return *child_ptr;
+    prefix = PyList_GET_ITEM(frame, 3);
+    if (PyList_GET_ITEM(frame, 0) == (PyObject *)&PyList_Type)
+        key = EVENT_NAME(state, EVENT_ITEM);
+    else
+        key = PyList_GET_ITEM(frame, 2);
+    nonempty = PyObject_IsTrue(prefix);
+    if (nonempty < 0)
+        return NULL;
+    if (!nonempty) {
+        Py_INCREF(key);
+        *child_ptr = key;
+        return key;
+    }
+    tmp = PyNumber_Add(prefix, EVENT_NAME(state, EVENT_DOT));
+    if (tmp == NULL)
+        return NULL;
+    *child_ptr = PyNumber_Add(tmp, key);
+    Py_DECREF(tmp);
+    return *child_ptr;
+}
+
+static int
+feed_push(_speedups_state *state, PyObject *stack, PyObject *events,
+          int is_dict, PyObject **frame_ptr, PyObject **child_ptr)
+{
+    /* Open an object or array as the next value in *frame_ptr, and set
+       *frame_ptr to it. Returns 0, or -1 with an exception set. */
+    PyObject *prefix;
+    PyObject *frame;
+    int rv;
+    prefix = feed_prefix(state, *frame_ptr, child_ptr);
+    if (prefix == NULL)
+        return -1;
+    if (feed_event(events, EVENT_NAME(state, is_dict ? EVENT_START_MAP :
+                                      EVENT_START_ARRAY),
+                   Py_None, prefix) < 0)
+        return -1;
+    frame = Py_BuildValue("[OOOO]", is_dict ? (PyObject *)&PyDict_Type :
+                          (PyObject *)&PyList_Type, Py_None, Py_None,
+                          prefix);
+    if (frame == NULL)
+        return -1;
+    rv = PyList_Append(stack, frame);
+    Py_DECREF(frame);
+    if (rv < 0)
+        return -1;
+    *frame_ptr = frame;
+    Py_CLEAR(*child_ptr);
+    return 0;
+}
+
+static int
+feed_close(_speedups_state *state, PyObject *stack, PyObject *events,
+           PyObject **frame_ptr, PyObject **child_ptr)
+{
+    /* Close the innermost container *frame_ptr, setting *frame_ptr to
+       the one that encloses it. Returns 0, or -1 with an exception set. */
+    PyObject *frame = *frame_ptr;
+    Py_ssize_t n = PyList_GET_SIZE(stack);
+    if (feed_event(events, EVENT_NAME(state,
+                       PyList_GET_ITEM(frame, 0) == (PyObject *)&PyDict_Type ?
+                       EVENT_END_MAP : EVENT_END_ARRAY),
+                   Py_None, PyList_GET_ITEM(frame, 3)) < 0)
+        return -1;
+    if (PyList_SetSlice(stack, n - 1, n, NULL) < 0)
+        return -1;
+    Py_CLEAR(*child_ptr);
+    return feed_top(stack, frame_ptr);
+}
+
+/* -- Generate scan_once_unicode, _parse_object_unicode, _parse_array_unicode,
+   _match_number_unicode from the shared template. -- */
+#define JSON_SCAN_SUFFIX _unicode
+#define JSON_SCAN_DATA_INIT(p) \
+    PY2_UNUSED int kind = PyUnicode_KIND(p); \
+    void *str = PyUnicode_DATA(p); \
+    Py_ssize_t end_idx = PyUnicode_GET_LENGTH(p) - 1
+#define JSON_SCAN_READ(i) PyUnicode_READ(kind, str, (i))
+#define JSON_SCAN_SCANSTRING_CALL(pos, nextp) \
+    scanstring_unicode(state, pystr, (pos), s->strict, (nextp))
+#if PY_MAJOR_VERSION >= 3
+#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
+    PyUnicode_Substring(pystr, (sidx), (eidx))
+#define JSON_SCAN_RAW_CREATE(sidx, eidx) JSON_SCAN_NUMSTR_CREATE(sidx, eidx)
+#else
+#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
+    PyUnicode_FromUnicode(&((Py_UNICODE *)str)[(sidx)], (eidx) - (sidx))
+#define JSON_SCAN_RAW_CREATE(sidx, eidx) \
+    PyUnicode_FromUnicode(PyUnicode_AS_UNICODE(pystr) + (sidx), \
+                          (eidx) - (sidx))
+#endif
+#define JSON_SCAN_PARSE_FLOAT_FAST(ns) _match_number_float_fast_unicode(ns)
+#define JSON_SCAN_PARSE_INT_FAST(ns)   _match_number_int_fast_unicode(s, ns)
+#if PY_MAJOR_VERSION >= 3
+#define JSON_SCAN_ASCII_DATA(i) \
+    (kind == PyUnicode_1BYTE_KIND ? (const unsigned char *)str + (i) : NULL)
+#endif
+#define JSON_SPEEDUPS_SCAN_INCLUDING 1
+#include "_speedups_scan.h"
+#undef JSON_SPEEDUPS_SCAN_INCLUDING
+
+/* -- Generate the corresponding _str variants on Python 2. -- */
+#if PY_MAJOR_VERSION < 3
+#define JSON_SCAN_SUFFIX _str
+#define JSON_SCAN_DATA_INIT(p) \
+    char *str = PyString_AS_STRING(p); \
+    Py_ssize_t end_idx = PyString_GET_SIZE(p) - 1
+#define JSON_SCAN_READ(i) ((unsigned char)str[(i)])
+#define JSON_SCAN_SCANSTRING_CALL(pos, nextp) \
+    scanstring_str(state, pystr, (pos), \
+                   PyString_AS_STRING(s->encoding), s->strict, (nextp))
+#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
+    PyString_FromStringAndSize(&str[(sidx)], (eidx) - (sidx))
+#define JSON_SCAN_RAW_CREATE(sidx, eidx) \
+    PyUnicode_Decode(PyString_AS_STRING(pystr) + (sidx), (eidx) - (sidx), \
+                     PyString_AS_STRING(s->encoding), NULL)
+#define JSON_SCAN_PARSE_FLOAT_FAST(ns) _match_number_float_fast_str(ns)
+#define JSON_SCAN_PARSE_INT_FAST(ns)   _match_number_int_fast_str(s, ns)
+#define JSON_SCAN_UTF8 1
+#define JSON_SPEEDUPS_SCAN_INCLUDING 1
+#include "_speedups_scan.h"
+#undef JSON_SPEEDUPS_SCAN_INCLUDING
+#endif /* PY_MAJOR_VERSION < 3 */
+
+/* -- Generate the _utf8 variants on Python 3, which scan UTF-8 encoded
+   bytes (or a contiguous memoryview, see scanner_call) without decoding
+   the whole document first. Only string values are decoded; numbers are
+   ASCII and become str via PyUnicode_FromStringAndSize. -- */
+#if PY_MAJOR_VERSION >= 3
+static inline const unsigned char *
+json_utf8_data(PyObject *pystr)
+{
+    if (PyBytes_Check(pystr))
+        return (const unsigned char *)PyBytes_AS_STRING(pystr);
+    return (const unsigned char *)PyMemoryView_GET_BUFFER(pystr)->buf;
+}
+
+static inline Py_ssize_t
+json_utf8_size(PyObject *pystr)
+{
+    if (PyBytes_Check(pystr))
+        return PyBytes_GET_SIZE(pystr);
+    return PyMemoryView_GET_BUFFER(pystr)->len;
+}
+
+#define JSON_SCAN_SUFFIX _utf8
+#define JSON_SCAN_DATA_INIT(p) \
+    const unsigned char *str = json_utf8_data(p); \
+    Py_ssize_t end_idx = json_utf8_size(p) - 1
+#define JSON_SCAN_READ(i) ((JSON_UNICHR)str[(i)])
+#define JSON_SCAN_SCANSTRING_CALL(pos, nextp) \
+    scanstring_utf8(state, pystr, str, end_idx + 1, (pos), s->strict, (nextp))
+#define JSON_SCAN_NUMSTR_CREATE(sidx, eidx) \
+    PyUnicode_FromStringAndSize((const char *)&str[(sidx)], (eidx) - (sidx))
+#define JSON_SCAN_RAW_CREATE(sidx, eidx) \
+    json_decode_utf8_run((const char *)json_utf8_data(pystr), \
+                         json_utf8_size(pystr), (sidx), (eidx))
+#define JSON_SCAN_PARSE_FLOAT_FAST(ns) _match_number_float_fast_unicode(ns)
+#define JSON_SCAN_PARSE_INT_FAST(ns)   _match_number_int_fast_unicode(s, ns)
+#define JSON_SCAN_ASCII_DATA(i) (str + (i))
+#define JSON_SCAN_UTF8 1
+#define JSON_SPEEDUPS_SCAN_INCLUDING 1
+#include "_speedups_scan.h"
+#undef JSON_SPEEDUPS_SCAN_INCLUDING
+#endif /* PY_MAJOR_VERSION >= 3 */
+
+
+static PyObject *
+scanner_new_memo(PyScannerObject *s)
+{
+    /* The key memo for a call: the KeyCache, or a new dict */
+    if (s->key_cache != NULL) {
+        Py_INCREF(s->key_cache);
+        return s->key_cache;
+    }
+    return PyDict_New();
+}
+
+static PyObject *
+scanner_check_string(PyObject *pystr, PyObject **view)
+{
+    /* Return the object to scan for the string argument pystr (borrowed),
+     * which is pystr itself, or a memoryview of it stored in *view. */
+    *view = NULL;
+    if (PyUnicode_Check(pystr)) {
+        if (PyUnicode_READY(pystr))
+            return NULL;
+    }
+#if PY_MAJOR_VERSION < 3
+    else if (!PyString_Check(pystr)) {
+#else
+    else if (PyBytes_Check(pystr)) {
+        /* Scanned as UTF-8 */
+    }
+    else if (PyObject_CheckBuffer(pystr)) {
+        /* bytearray, memoryview, ...: scan them through a memoryview of
+         * our own, which keeps the buffer exported (so a bytearray can't
+         * be resized under us by a hook) while we read from it. */
+        *view = PyMemoryView_FromObject(pystr);
+        if (*view == NULL)
+            return NULL;
+        if (!PyBuffer_IsContiguous(PyMemoryView_GET_BUFFER(*view), 'C')) {
+            PyErr_SetString(PyExc_TypeError,
+                            "first argument must be a contiguous buffer");
+            Py_CLEAR(*view);
+            return NULL;
+        }
+        pystr = *view;
+    }
+    else {
+#endif
+        PyErr_Format(PyExc_TypeError,
+                 "first argument must be a string, not %.80s",
+                 Py_TYPE(pystr)->tp_name);
+        return NULL;
+    }
+    return pystr;
+}
+
+static PyObject *
+scanner_call(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Python callable interface to scan_once_{str,unicode,utf8} */
+    PyObject *pystr;
+    PyObject *view;
+    PyObject *memo;
+    PyObject *rval = NULL;
+    Py_ssize_t idx;
+    Py_ssize_t next_idx = -1;
+    static char *kwlist[] = {"string", "idx", NULL};
+    PyScannerObject *s;
+#if PY_VERSION_HEX < 0x030D0000
+    assert(PyScanner_Check(self));
+#endif
+    s = (PyScannerObject *)self;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:scan_once", kwlist, &pystr, &idx))
+        return NULL;
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+
+    /* The scanner holds no mutable state, so a scanner shared between
+     * threads (as the default decoder's is) needs no lock. The key memo
+     * is private to each call, unless there is a KeyCache (which locks
+     * itself). */
+    memo = scanner_new_memo(s);
+    if (memo == NULL) {
+        Py_XDECREF(view);
+        return NULL;
+    }
+    if (PyUnicode_Check(pystr)) {
+        rval = scan_once_unicode(s, memo, pystr, idx, 0, &next_idx);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rval = scan_once_str(s, memo, pystr, idx, 0, &next_idx);
+#else
+        rval = scan_once_utf8(s, memo, pystr, idx, 0, &next_idx);
+#endif
+    }
+    Py_DECREF(memo);
+    Py_XDECREF(view);
+    return _build_rval_index_tuple(rval, next_idx);
+}
+
+static PyObject *
+scanner_select(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Scan the JSON term at idx of string, building only the values that
+     * tree selects, and return a tuple of a dict of them by label and
+     * the index after the term. */
+    static char *kwlist[] = {"string", "idx", "tree", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *pystr;
+    PyObject *view;
+    PyObject *tree;
+    PyObject *memo;
+    PyObject *rval;
+    Py_ssize_t idx;
+    Py_ssize_t next_idx = -1;
+    int rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OnO!:select", kwlist,
+        &pystr, &idx, &PyDict_Type, &tree))
+        return NULL;
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+    rval = PyDict_New();
+    memo = rval == NULL ? NULL : scanner_new_memo(s);
+    if (memo == NULL) {
+        Py_XDECREF(rval);
+        Py_XDECREF(view);
+        return NULL;
+    }
+    if (PyUnicode_Check(pystr)) {
+        rv = _select_unicode(s, memo, pystr, idx, tree, rval, &next_idx);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rv = _select_str(s, memo, pystr, idx, tree, rval, &next_idx);
+#else
+        rv = _select_utf8(s, memo, pystr, idx, tree, rval, &next_idx);
+#endif
+    }
+    Py_DECREF(memo);
+    Py_XDECREF(view);
+    if (rv < 0) {
+        Py_DECREF(rval);
+        rval = NULL;
+    }
+    return _build_rval_index_tuple(rval, next_idx);
+}
+
+static PyObject *
+scanner_spans(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Read the array or object at idx of string without building its
+     * values, and return a tuple of the list of their spans and the index
+     * after it, or (None, idx) if there is no array or object at idx. */
+    static char *kwlist[] = {"string", "idx", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *pystr;
+    PyObject *view;
+    PyObject *memo;
+    PyObject *rval;
+    Py_ssize_t idx;
+    Py_ssize_t next_idx;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:spans", kwlist,
+        &pystr, &idx))
+        return NULL;
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+    memo = scanner_new_memo(s);
+    if (memo == NULL) {
+        Py_XDECREF(view);
+        return NULL;
+    }
+    next_idx = idx;
+    if (PyUnicode_Check(pystr)) {
+        rval = _spans_unicode(s, memo, pystr, idx, &next_idx);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rval = _spans_str(s, memo, pystr, idx, &next_idx);
+#else
+        rval = _spans_utf8(s, memo, pystr, idx, &next_idx);
+#endif
+    }
+    Py_DECREF(memo);
+    Py_XDECREF(view);
+    return _build_rval_index_tuple(rval, next_idx);
+}
+
+static PyObject *
+scanner_lines(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Scan the JSON lines of string from idx up to stop for
+     * JSONDecoder.iter_lines, and return a tuple of the list of their
+     * documents, the index where it stopped and the number of lines. */
+    static char *kwlist[] = {"string", "idx", "stop", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *pystr;
+    PyObject *view;
+    PyObject *memo;
+    PyObject *rval;
+    Py_ssize_t idx;
+    Py_ssize_t stop;
+    Py_ssize_t next_idx;
+    Py_ssize_t count;
+    int rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Onn:lines", kwlist,
+        &pystr, &idx, &stop))
+        return NULL;
+    if (idx < 0) {
+        PyErr_SetString(PyExc_ValueError, "idx cannot be negative");
+        return NULL;
+    }
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+    rval = PyList_New(0);
+    memo = rval == NULL ? NULL : scanner_new_memo(s);
+    if (memo == NULL) {
+        Py_XDECREF(rval);
+        Py_XDECREF(view);
+        return NULL;
+    }
+    if (PyUnicode_Check(pystr)) {
+        rv = _lines_unicode(s, memo, pystr, idx, stop, rval, &next_idx,
+                            &count);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rv = _lines_str(s, memo, pystr, idx, stop, rval, &next_idx,
+                        &count);
+#else
+        rv = _lines_utf8(s, memo, pystr, idx, stop, rval, &next_idx,
+                         &count);
+#endif
+    }
+    Py_DECREF(memo);
+    Py_XDECREF(view);
+    if (rv < 0) {
+        Py_DECREF(rval);
+        return NULL;
+    }
+    return Py_BuildValue("(Nnn)", rval, next_idx, count);
+}
+
+static PyObject *
+scanner_events(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Tokenize string from idx for JSONDecoder.iterparse, appending the
+     * events to the list events and updating the parser state and stack
+     * of simplejson.decoder._FeedParser, and return a tuple of the new
+     * state and the index where it stopped. */
+    static char *kwlist[] = {"string", "idx", "state", "stack", "events",
+                             "memo", "closed", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *pystr;
+    PyObject *view;
+    PyObject *stack;
+    PyObject *events;
+    PyObject *memo;
+    Py_ssize_t idx;
+    Py_ssize_t next_idx;
+    int feed_state;
+    int closed;
+    int rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OniO!O!O!i:events", kwlist,
+        &pystr, &idx, &feed_state, &PyList_Type, &stack, &PyList_Type,
+        &events, &PyDict_Type, &memo, &closed))
+        return NULL;
+    if (!PyDict_CheckExact(memo)) {
+        PyErr_SetString(PyExc_TypeError, "memo must be a dict");
+        return NULL;
+    }
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+    if (PyUnicode_Check(pystr)) {
+        rv = _events_unicode(s, memo, pystr, idx, closed, &feed_state,
+                             stack, events, &next_idx);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rv = _events_str(s, memo, pystr, idx, closed, &feed_state,
+                         stack, events, &next_idx);
+#else
+        rv = _events_utf8(s, memo, pystr, idx, closed, &feed_state,
+                          stack, events, &next_idx);
+#endif
+    }
+    Py_XDECREF(view);
+    if (rv < 0)
+        return NULL;
+    return Py_BuildValue("(in)", feed_state, next_idx);
+}
+
+static PyObject *
+scanner_decode_doc(PyScannerObject *s, PyObject *memo, PyObject *pystr)
+{
+    /* Decode the whole document pystr (text, or bytes that
+     * scanner_decode_many has checked may be scanned) like
+     * JSONDecoder.decode: skip a BOM and whitespace, scan one value and
+     * allow only whitespace after it. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    Py_ssize_t idx = 0;
+    Py_ssize_t next_idx = -1;
+    Py_ssize_t length;
+    PyObject *rval;
+    PyObject *exc;
+    if (PyUnicode_Check(pystr)) {
+        PY2_UNUSED int kind;
+        void *str;
+        if (PyUnicode_READY(pystr))
+            return NULL;
+        kind = PyUnicode_KIND(pystr);
+        str = PyUnicode_DATA(pystr);
+        length = PyUnicode_GET_LENGTH(pystr);
+        if (length > 0 && PyUnicode_READ(kind, str, 0) == 0xfeff)
+            idx = 1;
+#if PY_MAJOR_VERSION >= 3
+        else if (length >= 3 && PyUnicode_READ(kind, str, 0) == 0xef &&
+                 PyUnicode_READ(kind, str, 1) == 0xbb &&
+                 PyUnicode_READ(kind, str, 2) == 0xbf)
+            idx = 3;
+#endif
+        while (idx < length && IS_WHITESPACE(PyUnicode_READ(kind, str, idx)))
+            idx++;
+        rval = scan_once_unicode(s, memo, pystr, idx, 0, &next_idx);
+        if (rval == NULL)
+            return NULL;
+        while (next_idx < length &&
+               IS_WHITESPACE(PyUnicode_READ(kind, str, next_idx)))
+            next_idx++;
+    }
+    else {
+        const char *str = PyBytes_AS_STRING(pystr);
+        length = PyBytes_GET_SIZE(pystr);
+        if (length >= 3 && memcmp(str, "\xef\xbb\xbf", 3) == 0)
+            idx = 3;
+        while (idx < length && IS_WHITESPACE(str[idx]))
+            idx++;
+#if PY_MAJOR_VERSION < 3
+        rval = scan_once_str(s, memo, pystr, idx, 0, &next_idx);
+#else
+        rval = scan_once_utf8(s, memo, pystr, idx, 0, &next_idx);
+#endif
+        if (rval == NULL)
+            return NULL;
+        while (next_idx < length && IS_WHITESPACE(str[next_idx]))
+            next_idx++;
+    }
+    if (next_idx == length)
+        return rval;
+    Py_DECREF(rval);
+    exc = PyObject_CallFunction(state->JSONDecodeError, "(zOnn)",
+                                "Extra data", pystr, next_idx, length);
+    if (exc != NULL) {
+        PyErr_SetObject(state->JSONDecodeError, exc);
+        Py_DECREF(exc);
+    }
+    return NULL;
+}
+
+static PyObject *
+scanner_decode_many(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Decode each document of a sequence into a list, in a single loop */
+    static char *kwlist[] = {"docs", "utf8", "decode", "return_exceptions",
+                             NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *docs;
+    PyObject *decode;
+    int utf8;
+    int return_exceptions = 0;
+    PyObject *seq;
+    PyObject *memo = NULL;
+    PyObject *rval = NULL;
+    Py_ssize_t i;
+    Py_ssize_t n;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OiO|i:decode_many", kwlist,
+        &docs, &utf8, &decode, &return_exceptions))
+        return NULL;
+    seq = PySequence_Fast(docs, "docs must be a sequence");
+    if (seq == NULL)
+        return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+    rval = PyList_New(n);
+    if (rval == NULL)
+        goto bail;
+    /* Keys are interned across the whole batch */
+    memo = scanner_new_memo(s);
+    if (memo == NULL)
+        goto bail;
+    for (i = 0; i < n; i++) {
+        PyObject *doc = PySequence_Fast_GET_ITEM(seq, i);
+        PyObject *obj;
+#if PY_MAJOR_VERSION >= 3
+        if (PyUnicode_Check(doc) || (utf8 && PyBytes_Check(doc)))
+#else
+        if (PyUnicode_Check(doc) || PyString_Check(doc))
+#endif
+            obj = scanner_decode_doc(s, memo, doc);
+        else
+            /* Let JSONDecoder.decode handle anything else */
+            obj = PyObject_CallOneArg(decode, doc);
+        if (obj == NULL) {
+            if (!return_exceptions)
+                goto bail;
+            obj = json_catch_exception();
+            if (obj == NULL)
+                goto bail;
+        }
+        PyList_SET_ITEM(rval, i, obj);
+    }
+    Py_DECREF(memo);
+    Py_DECREF(seq);
+    return rval;
+
+bail:
+    Py_XDECREF(memo);
+    Py_XDECREF(rval);
+    Py_DECREF(seq);
+    return NULL;
+}
+
+PyDoc_STRVAR(scanner_decode_many_doc,
+"decode_many(docs, utf8, decode, return_exceptions=False) -> list\n"
+"\n"
+"Decode each JSON document of docs. Text documents, and bytes if utf8 is\n"
+"true, are scanned directly, decode(doc) is called for anything else.\n"
+"If return_exceptions is true, an Exception raised for a document takes\n"
+"its place in the list instead of being raised.");
+
+static void
+json_validate_raise(_speedups_state *state, PyObject *pystr,
+                    JSON_ValidateError *err)
+{
+    /* Raise the error that _validate found in pystr */
+    if (err->msg != NULL) {
+        raise_errmsg(state, err->msg, pystr, err->pos);
+    }
+    else if (err->run_start < 0) {
+        PyErr_NoMemory();
+    }
+    else {
+        /* The same UnicodeDecodeError as the scanner raises */
+#if PY_MAJOR_VERSION < 3
+        const char *data = PyString_AS_STRING(pystr);
+        PyObject *decoded = PyUnicode_DecodeUTF8(
+            data + err->run_start, err->run_end - err->run_start, NULL);
+#else
+        PyObject *decoded = json_decode_utf8_run(
+            (const char *)json_utf8_data(pystr), json_utf8_size(pystr),
+            err->run_start, err->run_end);
+#endif
+        Py_XDECREF(decoded);
+        if (decoded != NULL)
+            PyErr_SetString(PyExc_ValueError, "invalid UTF-8");
+    }
+}
+
+static PyObject *
+scanner_validate(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Check the JSON term at idx of string without building it, and
+     * return the index after it. Large documents are checked without
+     * the GIL. */
+    static char *kwlist[] = {"string", "idx", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyObject *pystr;
+    PyObject *view;
+    PyThreadState *save = NULL;
+    JSON_ValidateError err;
+    Py_ssize_t idx;
+    Py_ssize_t next_idx = -1;
+    Py_ssize_t length;
+    int allow_constants = (s->parse_constant != Py_None);
+    int rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:validate", kwlist,
+        &pystr, &idx))
+        return NULL;
+    pystr = scanner_check_string(pystr, &view);
+    if (pystr == NULL)
+        return NULL;
+    if (PyUnicode_Check(pystr))
+        length = PyUnicode_GET_LENGTH(pystr);
+    else
+#if PY_MAJOR_VERSION < 3
+        length = PyString_GET_SIZE(pystr);
+#else
+        length = json_utf8_size(pystr);
+#endif
+    if (length >= JSON_VALIDATE_NOGIL_SIZE)
+        save = PyEval_SaveThread();
+    if (PyUnicode_Check(pystr)) {
+        rv = _validate_unicode(pystr, idx, s->strict, allow_constants, &err,
+                               &next_idx);
+    }
+    else {
+#if PY_MAJOR_VERSION < 3
+        rv = _validate_str(pystr, idx, s->strict, allow_constants, &err,
+                           &next_idx);
+#else
+        rv = _validate_utf8(pystr, idx, s->strict, allow_constants, &err,
+                            &next_idx);
+#endif
+    }
+    if (save != NULL)
+        PyEval_RestoreThread(save);
+    if (rv < 0) {
+        json_validate_raise(get_speedups_state(s->module_ref), pystr, &err);
+        Py_XDECREF(view);
+        return NULL;
+    }
+    Py_XDECREF(view);
+    return PyInt_FromSsize_t(next_idx);
+}
+
+PyDoc_STRVAR(scanner_validate_doc,
+"validate(string, idx) -> end\n"
+"\n"
+"Check the JSON term at idx of string like calling the scanner does,\n"
+"raising the same errors, but without building it or calling any hook,\n"
+"and return the index after it. Documents of 4096 or more characters or\n"
+"bytes are checked without holding the GIL.");
+
+#if PY_MAJOR_VERSION >= 3
+/* StructuralIndex: a two stage decoder for large UTF-8 documents, in the
+ * manner of simdjson but in portable C, for JSONDecoder.index.
+ *
+ * Stage 1 (json_index_scan) reads the document 64 bytes at a time and
+ * finds the quotes, backslashes and { } [ ] : , in each block with
+ * word-at-a-time comparisons of 8 bytes (SWAR), as 64-bit masks. The
+ * escaped quotes are removed, a prefix XOR of the remaining quotes marks
+ * the bytes that are in strings, and the offsets of the structural
+ * characters outside of strings and of the opening quote of every string
+ * are recorded in order, followed by the matching closing bracket of
+ * every opening one. It runs without the GIL for large documents.
+ *
+ * Stage 2 (index_build) builds the value at an offset from the index,
+ * and index_lookup finds the member or element of an object or array
+ * without reading the values before it, as an object or array is
+ * skipped by jumping to its closing bracket. Strings and numbers are
+ * read by the usual scanner functions, and any other error is reported
+ * by _validate_utf8, so that it is the one the decoder raises. */
+typedef PY_UINT32_T JSON_IndexPos;
+typedef unsigned long long JSON_IndexMask;
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *scanner;      /* the PyScannerObject that decodes values */
+    PyObject *doc;          /* the bytes of the document */
+    JSON_IndexPos *pos;     /* offsets of the structural characters */
+    JSON_IndexPos *match;   /* for an opening bracket at pos[k], the k of
+                               its closing bracket */
+    Py_ssize_t count;       /* length of pos */
+} PyStructuralIndexObject;
+
+#define JSON_INDEX_MAX_SIZE ((Py_ssize_t)0xffffffffUL)
+#define JSON_INDEX_ONES ((JSON_IndexMask)0x0101010101010101ULL)
+#define JSON_INDEX_HIGHS ((JSON_IndexMask)0x8080808080808080ULL)
+
+static inline JSON_IndexMask
+json_index_word(const unsigned char *p)
+{
+    /* The 8 bytes at p with the first one in the low byte, whatever the
+     * byte order of the platform */
+    return ((JSON_IndexMask)p[0] | ((JSON_IndexMask)p[1] << 8) |
+            ((JSON_IndexMask)p[2] << 16) | ((JSON_IndexMask)p[3] << 24) |
+            ((JSON_IndexMask)p[4] << 32) | ((JSON_IndexMask)p[5] << 40) |
+            ((JSON_IndexMask)p[6] << 48) | ((JSON_IndexMask)p[7] << 56));
+}
+
+static inline JSON_IndexMask
+json_index_eq(JSON_IndexMask w, unsigned char c)
+{
+    /* The high bit of each byte of w that is c */
+    JSON_IndexMask x = w ^ (JSON_INDEX_ONES * c);
+    return ~(((x & ~JSON_INDEX_HIGHS) + ~JSON_INDEX_HIGHS) | x) &
+           JSON_INDEX_HIGHS;
+}
+
+static inline JSON_IndexMask
+json_index_gather(JSON_IndexMask highs)
+{
+    /* The high bits of the bytes of highs as its 8 low bits */
+    return ((highs >> 7) * (JSON_IndexMask)0x0102040810204080ULL) >> 56;
+}
+
+static inline JSON_IndexMask
+json_index_prefix_xor(JSON_IndexMask m)
+{
+    /* Each bit of the result is the XOR of the bits of m up to it */
+    m ^= m << 1;
+    m ^= m << 2;
+    m ^= m << 4;
+    m ^= m << 8;
+    m ^= m << 16;
+    m ^= m << 32;
+    return m;
+}
+
+static inline int
+json_index_ctz(JSON_IndexMask m)
+{
+    /* The index of the lowest set bit of m, which is not 0 */
+#if defined(__GNUC__) || defined(__clang__)
+    return __builtin_ctzll(m);
+#else
+    static const unsigned char debruijn[64] = {
+        0, 1, 48, 2, 57, 49, 28, 3, 61, 58, 50, 42, 38, 29, 17, 4,
+        62, 55, 59, 36, 53, 51, 43, 22, 45, 39, 33, 30, 24, 18, 12, 5,
+        63, 47, 56, 27, 60, 41, 37, 16, 54, 35, 52, 21, 44, 32, 23, 11,
+        46, 26, 40, 15, 34, 20, 31, 10, 25, 14, 19, 9, 13, 8, 7, 6};
+    return debruijn[((m & (0 - m)) * (JSON_IndexMask)0x03f79d71b4cb0a89ULL)
+                    >> 58];
+#endif
+}
+
+static int
+json_index_scan(const unsigned char *buf, Py_ssize_t len,
+                JSON_IndexPos **pos_ptr, JSON_IndexPos **match_ptr,
+                Py_ssize_t *count_ptr)
+{
+    /* Stage 1: store the offsets of the structural characters of buf in
+     * *pos_ptr and their matching brackets in *match_ptr. Returns 0, 1 if
+     * a string or bracket is not closed or the brackets don't match, or
+     * -1 if out of memory. It may run without the GIL, so it only uses
+     * the raw allocator. */
+    unsigned char tail[64];
+    JSON_IndexPos *pos = NULL;
+    JSON_IndexPos *match = NULL;
+    JSON_IndexPos *stack = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t allocated = len / 8 + 64;
+    Py_ssize_t depth = 0;
+    Py_ssize_t base;
+    Py_ssize_t k;
+    JSON_IndexMask escape_carry = 0;
+    JSON_IndexMask string_carry = 0;
+    int rv = -1;
+
+    pos = (JSON_IndexPos *)PyMem_RawMalloc(allocated * sizeof(JSON_IndexPos));
+    if (pos == NULL)
+        goto done;
+    for (base = 0; base < len; base += 64) {
+        const unsigned char *p = buf + base;
+        JSON_IndexMask quotes = 0;
+        JSON_IndexMask backslashes = 0;
+        JSON_IndexMask ops = 0;
+        JSON_IndexMask escaped;
+        JSON_IndexMask in_string;
+        JSON_IndexMask bits;
+        int i;
+        if (len - base < 64) {
+            memset(tail, ' ', sizeof(tail));
+            memcpy(tail, p, len - base);
+            p = tail;
+        }
+        for (i = 0; i < 8; i++) {
+            JSON_IndexMask w = json_index_word(p + 8 * i);
+            /* [ and ] are { and } without the 0x20 bit */
+            JSON_IndexMask w20 = w | (JSON_INDEX_ONES * 0x20);
+            quotes |= json_index_gather(json_index_eq(w, '"')) << (8 * i);
+            backslashes |= json_index_gather(json_index_eq(w, '\\'))
+                           << (8 * i);
+            ops |= json_index_gather(
+                json_index_eq(w20, '{') | json_index_eq(w20, '}') |
+                json_index_eq(w, ':') | json_index_eq(w, ',')) << (8 * i);
+        }
+        /* A backslash escapes the next byte unless it is escaped itself.
+         * Backslashes are rare enough to be taken one at a time. */
+        escaped = escape_carry;
+        escape_carry = 0;
+        for (bits = backslashes; bits != 0; bits &= bits - 1) {
+            JSON_IndexMask bit = bits & (0 - bits);
+            if (escaped & bit)
+                continue;
+            if (bit >> 63)
+                escape_carry = 1;
+            else
+                escaped |= bit << 1;
+        }
+        quotes &= ~escaped;
+        /* The bytes from each opening quote up to its closing quote */
+        in_string = json_index_prefix_xor(quotes) ^ string_carry;
+        string_carry = 0 - (in_string >> 63);
+        bits = (ops & ~in_string) | (quotes & in_string);
+        if (count + 64 > allocated) {
+            JSON_IndexPos *grown;
+            allocated *= 2;
+            grown = (JSON_IndexPos *)PyMem_RawRealloc(
+                pos, allocated * sizeof(JSON_IndexPos));
+            if (grown == NULL)
+                goto done;
+            pos = grown;
+        }
+        for (; bits != 0; bits &= bits - 1)
+            pos[count++] = (JSON_IndexPos)(base + json_index_ctz(bits));
+    }
+    rv = 1;
+    if (string_carry)
+        goto done;
+
+    /* Match the brackets */
+    match = (JSON_IndexPos *)PyMem_RawMalloc(
+        (count + 1) * sizeof(JSON_IndexPos));
+    stack = (JSON_IndexPos *)PyMem_RawMalloc(
+        (count + 1) * sizeof(JSON_IndexPos));
+    if (match == NULL || stack == NULL) {
+        rv = -1;
+        goto done;
+    }
+    for (k = 0; k < count; k++) {
+        unsigned char c = buf[pos[k]];
+        if (c == '{' || c == '[') {
+            stack[depth++] = (JSON_IndexPos)k;
+        }
+        else if (c == '}' || c == ']') {
+            /* } and ] are 2 after { and [ */
+            if (depth == 0 || buf[pos[stack[depth - 1]]] != c - 2)
+                goto done;
+            match[stack[--depth]] = (JSON_IndexPos)k;
+        }
+    }
+    if (depth == 0)
+        rv = 0;
+
+done:
+    PyMem_RawFree(stack);
+    if (rv != 0) {
+        PyMem_RawFree(pos);
+        PyMem_RawFree(match);
+        return rv;
+    }
+    *pos_ptr = pos;
+    *match_ptr = match;
+    *count_ptr = count;
+    return 0;
+}
+
+static inline Py_ssize_t
+index_skip_whitespace(const unsigned char *buf, Py_ssize_t idx,
+                      Py_ssize_t len)
+{
+    while (idx < len && IS_WHITESPACE(buf[idx]))
+        idx++;
+    return idx;
+}
+
+static Py_ssize_t
+index_find(PyStructuralIndexObject *x, Py_ssize_t idx)
+{
+    /* The first k where pos[k] is idx or after it */
+    Py_ssize_t lo = 0;
+    Py_ssize_t hi = x->count;
+    while (lo < hi) {
+        Py_ssize_t mid = lo + (hi - lo) / 2;
+        if ((Py_ssize_t)x->pos[mid] < idx)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    return lo;
+}
+
+static Py_ssize_t
+index_skip_value(PyStructuralIndexObject *x, Py_ssize_t k, Py_ssize_t idx)
+{
+    /* The k after the value at offset idx, where pos[k] is the first
+     * structural character at idx or after it, or -1 if there is no
+     * value at idx */
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    if ((Py_ssize_t)x->pos[k] != idx)
+        return k;
+    if (buf[idx] == '{' || buf[idx] == '[')
+        return x->match[k] + 1;
+    if (buf[idx] == '"')
+        return k + 1;
+    return -1;
+}
+
+static void
+index_raise(PyStructuralIndexObject *x, Py_ssize_t idx)
+{
+    /* Replace the JSONDecodeError, or the lack of any exception, of a
+     * failed build or lookup of the value at idx with the error that the
+     * decoder raises for that value */
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_ValidateError err;
+    Py_ssize_t next_idx;
+    PyObject *exc_type = NULL;
+    PyObject *exc_value = NULL;
+    PyObject *exc_tb = NULL;
+    if (PyErr_Occurred()) {
+        if (!PyErr_ExceptionMatches(state->JSONDecodeError))
+            return;
+        PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+    }
+    if (_validate_utf8(x->doc, idx, s->strict, s->parse_constant != Py_None,
+                       &err, &next_idx) < 0) {
+        Py_XDECREF(exc_type);
+        Py_XDECREF(exc_value);
+        Py_XDECREF(exc_tb);
+        json_validate_raise(state, x->doc, &err);
+    }
+    else if (exc_type != NULL) {
+        PyErr_Restore(exc_type, exc_value, exc_tb);
+    }
+    else {
+        raise_errmsg(state, ERR_EXPECTING_VALUE, x->doc, idx);
+    }
+}
+
+static PyObject *
+index_build(PyStructuralIndexObject *x, PyObject *memo, Py_ssize_t idx,
+            Py_ssize_t *k_ptr, Py_ssize_t *next_idx_ptr);
+
+static PyObject *
+index_build_object(PyStructuralIndexObject *x, PyObject *memo,
+                   Py_ssize_t idx, Py_ssize_t *k_ptr,
+                   Py_ssize_t *next_idx_ptr)
+{
+    /* Build the object at idx, where pos[*k_ptr] is its { */
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t len = PyBytes_GET_SIZE(x->doc);
+    const JSON_IndexPos *pos = x->pos;
+    Py_ssize_t k = *k_ptr;
+    Py_ssize_t close = x->match[k];
+    PyObject *rval = NULL;
+    PyObject *pairs = NULL;
+    PyObject *key = NULL;
+    PyObject *val = NULL;
+    PyObject *item;
+
+    if (s->pairs_hook != Py_None)
+        rval = pairs = PyList_New(0);
+    else
+        rval = PyDict_New();
+    if (rval == NULL)
+        return NULL;
+    idx = index_skip_whitespace(buf, idx + 1, len);
+    k++;
+    while (k != close || (Py_ssize_t)pos[k] != idx) {
+        if ((Py_ssize_t)pos[k] != idx || buf[idx] != '"')
+            goto bail;
+        key = scanstring_utf8(state, x->doc, buf, len, idx + 1, s->strict,
+                              &idx);
+        if (key == NULL || json_memo_intern_key(memo, &key) < 0)
+            goto bail;
+        idx = index_skip_whitespace(buf, idx, len);
+        if (k + 1 == close || (Py_ssize_t)pos[k + 1] != idx ||
+                buf[idx] != ':')
+            goto bail;
+        k += 2;
+        idx = index_skip_whitespace(buf, idx + 1, len);
+        val = index_build(x, memo, idx, &k, &idx);
+        if (val == NULL)
+            goto bail;
+        if (pairs != NULL) {
+            item = PyTuple_Pack(2, key, val);
+            if (item == NULL)
+                goto bail;
+            if (PyList_Append(pairs, item) < 0) {
+                Py_DECREF(item);
+                goto bail;
+            }
+            Py_DECREF(item);
+        }
+        else if (PyDict_SetItem(rval, key, val) < 0) {
+            goto bail;
+        }
+        Py_CLEAR(key);
+        Py_CLEAR(val);
+        idx = index_skip_whitespace(buf, idx, len);
+        if ((Py_ssize_t)pos[k] != idx)
+            goto bail;
+        if (k == close)
+            break;
+        if (buf[idx] != ',')
+            goto bail;
+        k++;
+        idx = index_skip_whitespace(buf, idx + 1, len);
+        if (k == close && (Py_ssize_t)pos[k] == idx)
+            goto bail;
+    }
+    *k_ptr = close + 1;
+    *next_idx_ptr = (Py_ssize_t)pos[close] + 1;
+    if (pairs != NULL) {
+        val = PyObject_CallOneArg(s->pairs_hook, pairs);
+        Py_DECREF(pairs);
+        return val;
+    }
+    if (s->object_hook != Py_None) {
+        val = PyObject_CallOneArg(s->object_hook, rval);
+        Py_DECREF(rval);
+        return val;
+    }
+    return rval;
+bail:
+    Py_XDECREF(key);
+    Py_XDECREF(val);
+    Py_DECREF(rval);
+    return NULL;
+}
+
+static PyObject *
+index_build_array(PyStructuralIndexObject *x, PyObject *memo,
+                  Py_ssize_t idx, Py_ssize_t *k_ptr,
+                  Py_ssize_t *next_idx_ptr)
+{
+    /* Build the array at idx, where pos[*k_ptr] is its [ */
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t len = PyBytes_GET_SIZE(x->doc);
+    const JSON_IndexPos *pos = x->pos;
+    Py_ssize_t k = *k_ptr;
+    Py_ssize_t close = x->match[k];
+    PyObject *rval;
+    PyObject *val;
+
+    rval = PyList_New(0);
+    if (rval == NULL)
+        return NULL;
+    idx = index_skip_whitespace(buf, idx + 1, len);
+    k++;
+    while (k != close || (Py_ssize_t)pos[k] != idx) {
+        val = index_build(x, memo, idx, &k, &idx);
+        if (val == NULL)
+            goto bail;
+        if (PyList_Append(rval, val) < 0) {
+            Py_DECREF(val);
+            goto bail;
+        }
+        Py_DECREF(val);
+        idx = index_skip_whitespace(buf, idx, len);
+        if ((Py_ssize_t)pos[k] != idx)
+            goto bail;
+        if (k == close)
+            break;
+        if (buf[idx] != ',')
+            goto bail;
+        k++;
+        idx = index_skip_whitespace(buf, idx + 1, len);
+        if (k == close && (Py_ssize_t)pos[k] == idx)
+            goto bail;
+    }
+    *k_ptr = close + 1;
+    *next_idx_ptr = (Py_ssize_t)pos[close] + 1;
+    if (s->array_hook != Py_None) {
+        val = PyObject_CallOneArg(s->array_hook, rval);
+        Py_DECREF(rval);
+        return val;
+    }
+    return rval;
+bail:
+    Py_DECREF(rval);
+    return NULL;
+}
+
+static PyObject *
+index_build(PyStructuralIndexObject *x, PyObject *memo, Py_ssize_t idx,
+            Py_ssize_t *k_ptr, Py_ssize_t *next_idx_ptr)
+{
+    /* Stage 2: build the value at offset idx, where pos[*k_ptr] is the
+     * first structural character at idx or after it, and set *k_ptr and
+     * *next_idx_ptr to those after the value. Returns NULL with no
+     * exception set if the document is not as the index expects there,
+     * for the caller to report with index_raise. */
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t len = PyBytes_GET_SIZE(x->doc);
+    Py_ssize_t k = *k_ptr;
+    PyObject *rval;
+    if (k < x->count && (Py_ssize_t)x->pos[k] == idx) {
+        switch (buf[idx]) {
+            case '{':
+                if (Py_EnterRecursiveCall(" while decoding a JSON object "
+                                          "from a string"))
+                    return NULL;
+                rval = index_build_object(x, memo, idx, k_ptr, next_idx_ptr);
+                Py_LeaveRecursiveCall();
+                return rval;
+            case '[':
+                if (Py_EnterRecursiveCall(" while decoding a JSON array "
+                                          "from a string"))
+                    return NULL;
+                rval = index_build_array(x, memo, idx, k_ptr, next_idx_ptr);
+                Py_LeaveRecursiveCall();
+                return rval;
+            case '"':
+                *k_ptr = k + 1;
+                return scanstring_utf8(get_speedups_state(s->module_ref),
+                                       x->doc, buf, len, idx + 1, s->strict,
+                                       next_idx_ptr);
+            default:
+                /* A : , } or ] where a value should be */
+                return NULL;
+        }
+    }
+    /* A number or a constant */
+    return scan_once_utf8(s, memo, x->doc, idx, 0, next_idx_ptr);
+}
+
+static PyObject *
+structural_index_decode(PyObject *self, PyObject *args)
+{
+    /* Python interface to index_build */
+    PyStructuralIndexObject *x = (PyStructuralIndexObject *)self;
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    PyObject *memo;
+    PyObject *rval;
+    Py_ssize_t idx;
+    Py_ssize_t k;
+    Py_ssize_t next_idx = -1;
+    if (!PyArg_ParseTuple(args, "n:decode", &idx))
+        return NULL;
+    if (idx < 0 || idx > PyBytes_GET_SIZE(x->doc)) {
+        PyErr_SetString(PyExc_IndexError, "index out of range");
+        return NULL;
+    }
+    memo = scanner_new_memo(s);
+    if (memo == NULL)
+        return NULL;
+    if (s->make_numeric_array != NULL || s->raw_keys != NULL) {
+        /* Options that only the scanner implements */
+        rval = scan_once_utf8(s, memo, x->doc, idx, 0, &next_idx);
+    }
+    else {
+        k = index_find(x, idx);
+        rval = index_build(x, memo, idx, &k, &next_idx);
+        if (rval == NULL)
+            index_raise(x, idx);
+    }
+    Py_DECREF(memo);
+    return _build_rval_index_tuple(rval, next_idx);
+}
+
+static Py_ssize_t
+index_lookup_member(PyStructuralIndexObject *x, Py_ssize_t k, PyObject *key)
+{
+    /* The offset of the value of key in the object at pos[k], -1 if it
+     * has no such member, or -2 if the object is not as the index
+     * expects, or -3 with an exception set. As in a decoded object, the
+     * last member of that name is the one found. */
+    PyScannerObject *s = (PyScannerObject *)x->scanner;
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t len = PyBytes_GET_SIZE(x->doc);
+    const JSON_IndexPos *pos = x->pos;
+    Py_ssize_t close = x->match[k];
+    const char *key_data;
+    Py_ssize_t key_len;
+    Py_ssize_t j;
+    Py_ssize_t rval = -1;
+
+    if (!PyUnicode_Check(key))
+        return -1;
+    key_data = PyUnicode_AsUTF8AndSize(key, &key_len);
+    if (key_data == NULL)
+        return -3;
+    for (j = k + 1; j != close; j++) {
+        Py_ssize_t quote = pos[j];
+        Py_ssize_t end;
+        Py_ssize_t idx;
+        int found;
+        if (buf[quote] != '"' || j + 1 == close || buf[pos[j + 1]] != ':')
+            return -2;
+        /* The closing quote is the last byte before the : that is not
+         * whitespace */
+        end = pos[j + 1];
+        while (end > quote + 1 && IS_WHITESPACE(buf[end - 1]))
+            end--;
+        end--;
+        if (end <= quote || buf[end] != '"')
+            return -2;
+        if (memchr(buf + quote + 1, '\\', end - quote - 1) == NULL) {
+            found = (end - quote - 1 == key_len &&
+                     memcmp(buf + quote + 1, key_data, key_len) == 0);
+        }
+        else {
+            PyObject *name = scanstring_utf8(
+                get_speedups_state(s->module_ref), x->doc, buf, len,
+                quote + 1, s->strict, &idx);
+            if (name == NULL)
+                return -3;
+            found = PyUnicode_Compare(name, key) == 0;
+            Py_DECREF(name);
+        }
+        idx = index_skip_whitespace(buf, pos[j + 1] + 1, len);
+        if (found)
+            rval = idx;
+        j = index_skip_value(x, j + 2, idx);
+        if (j < 0)
+            return -2;
+        if (j == close)
+            break;
+        if (buf[pos[j]] != ',')
+            return -2;
+    }
+    return rval;
+}
+
+static Py_ssize_t
+index_lookup_element(PyStructuralIndexObject *x, Py_ssize_t k,
+                     Py_ssize_t n)
+{
+    /* The offset of the element n of the array at pos[k], -1 if it has
+     * no such element, or -2 if the array is not as the index expects */
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t len = PyBytes_GET_SIZE(x->doc);
+    Py_ssize_t close = x->match[k];
+    Py_ssize_t idx = index_skip_whitespace(buf, x->pos[k] + 1, len);
+    Py_ssize_t i;
+    Py_ssize_t j = k + 1;
+    if (j == close && (Py_ssize_t)x->pos[j] == idx)
+        return -1;
+    for (i = 0; ; i++) {
+        Py_ssize_t next = index_skip_value(x, j, idx);
+        if (next < 0)
+            return -2;
+        if (i == n)
+            return idx;
+        j = next;
+        if (j == close)
+            return -1;
+        if (buf[x->pos[j]] != ',')
+            return -2;
+        idx = index_skip_whitespace(buf, x->pos[j] + 1, len);
+        j++;
+    }
+}
+
+static PyObject *
+structural_index_lookup(PyObject *self, PyObject *args)
+{
+    /* The offset of the value of the member key of the object at idx, or
+     * of the element key of the array at idx, or -1 if there is none */
+    PyStructuralIndexObject *x = (PyStructuralIndexObject *)self;
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    PyObject *key;
+    Py_ssize_t idx;
+    Py_ssize_t k;
+    Py_ssize_t rval = -1;
+    if (!PyArg_ParseTuple(args, "nO:lookup", &idx, &key))
+        return NULL;
+    k = index_find(x, idx);
+    if (k == x->count || (Py_ssize_t)x->pos[k] != idx)
+        return PyInt_FromSsize_t(-1);
+    if (buf[idx] == '{') {
+        rval = index_lookup_member(x, k, key);
+    }
+    else if (buf[idx] == '[' && PyLong_Check(key) && !PyBool_Check(key)) {
+        Py_ssize_t n = PyLong_AsSsize_t(key);
+        if (n == -1 && PyErr_Occurred()) {
+            if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+                return NULL;
+            /* No array is that long */
+            PyErr_Clear();
+        }
+        else if (n >= 0) {
+            rval = index_lookup_element(x, k, n);
+        }
+    }
+    if (rval == -3)
+        return NULL;
+    if (rval == -2) {
+        index_raise(x, idx);
+        return NULL;
+    }
+    return PyInt_FromSsize_t(rval);
+}
+
+static PyObject *
+structural_index_skip(PyObject *self, PyObject *args)
+{
+    /* The offset after the object or array at idx, or -1 if there is
+     * none */
+    PyStructuralIndexObject *x = (PyStructuralIndexObject *)self;
+    const unsigned char *buf = (const unsigned char *)PyBytes_AS_STRING(x->doc);
+    Py_ssize_t idx;
+    Py_ssize_t k;
+    if (!PyArg_ParseTuple(args, "n:skip", &idx))
+        return NULL;
+    k = index_find(x, idx);
+    if (k == x->count || (Py_ssize_t)x->pos[k] != idx ||
+            (buf[idx] != '{' && buf[idx] != '['))
+        return PyInt_FromSsize_t(-1);
+    return PyInt_FromSsize_t((Py_ssize_t)x->pos[x->match[k]] + 1);
+}
+
+static Py_ssize_t
+structural_index_len(PyObject *self)
+{
+    return ((PyStructuralIndexObject *)self)->count;
+}
+
+static void
+structural_index_dealloc(PyObject *self)
+{
+    PyStructuralIndexObject *x = (PyStructuralIndexObject *)self;
+#if PY_VERSION_HEX >= 0x030D0000
+    PyTypeObject *tp = Py_TYPE(self);
+#endif
+    PyObject_GC_UnTrack(self);
+    Py_CLEAR(x->scanner);
+    Py_CLEAR(x->doc);
+    PyMem_RawFree(x->pos);
+    PyMem_RawFree(x->match);
+    Py_TYPE(self)->tp_free(self);
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_DECREF(tp);
+#endif
+}
+
+static int
+structural_index_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    PyStructuralIndexObject *x = (PyStructuralIndexObject *)self;
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_VISIT(Py_TYPE(self));
+#endif
+    Py_VISIT(x->scanner);
+    return 0;
+}
+
+static int
+structural_index_clear(PyObject *self)
+{
+    Py_CLEAR(((PyStructuralIndexObject *)self)->scanner);
+    return 0;
+}
+
+static PyMethodDef structural_index_methods[] = {
+    {"decode", structural_index_decode, METH_VARARGS,
+        PyDoc_STR("decode(idx) -> (value, end)\n\n"
+                  "Build the value at the byte offset idx from the index")},
+    {"lookup", structural_index_lookup, METH_VARARGS,
+        PyDoc_STR("lookup(idx, key) -> offset\n\n"
+                  "Find the value of the member key (a str) of the object "
+                  "at idx,\nor of the element key (an int) of the array at "
+                  "idx, or -1")},
+    {"skip", structural_index_skip, METH_VARARGS,
+        PyDoc_STR("skip(idx) -> offset\n\n"
+                  "Find the end of the object or array at idx, or -1")},
+    {NULL, NULL, 0, NULL}
+};
+
+PyDoc_STRVAR(structural_index_doc,
+"The offsets of the structural characters of a UTF-8 JSON document,\n"
+"made by the index method of the scanner.");
+
+#if PY_VERSION_HEX >= 0x030D0000
+static PyType_Slot PyStructuralIndexType_slots[] = {
+    {Py_tp_doc, (void *)structural_index_doc},
+    {Py_tp_dealloc, structural_index_dealloc},
+    {Py_tp_traverse, structural_index_traverse},
+    {Py_tp_clear, structural_index_clear},
+    {Py_tp_methods, structural_index_methods},
+    {Py_mp_length, structural_index_len},
+    {0, NULL}
+};
+
+static PyType_Spec PyStructuralIndexType_spec = {
+    .name = "simplejson._speedups.StructuralIndex",
+    .basicsize = sizeof(PyStructuralIndexObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC |
+             Py_TPFLAGS_DISALLOW_INSTANTIATION,
+    .slots = PyStructuralIndexType_slots,
+};
+#else
+static PyMappingMethods structural_index_as_mapping = {
+    structural_index_len, /* mp_length */
+    0,                    /* mp_subscript */
+    0,                    /* mp_ass_subscript */
+};
+
+static PyTypeObject PyStructuralIndexType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "simplejson._speedups.StructuralIndex", /* tp_name */
+    sizeof(PyStructuralIndexObject), /* tp_basicsize */
+    0,                    /* tp_itemsize */
+    structural_index_dealloc, /* tp_dealloc */
+    0,                    /* tp_print */
+    0,                    /* tp_getattr */
+    0,                    /* tp_setattr */
+    0,                    /* tp_compare */
+    0,                    /* tp_repr */
+    0,                    /* tp_as_number */
+    0,                    /* tp_as_sequence */
+    &structural_index_as_mapping, /* tp_as_mapping */
+    0,                    /* tp_hash */
+    0,                    /* tp_call */
+    0,                    /* tp_str */
+    0,                    /* tp_getattro */
+    0,                    /* tp_setattro */
+    0,                    /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,   /* tp_flags */
+    structural_index_doc, /* tp_doc */
+    structural_index_traverse, /* tp_traverse */
+    structural_index_clear, /* tp_clear */
+    0,                    /* tp_richcompare */
+    0,                    /* tp_weaklistoffset */
+    0,                    /* tp_iter */
+    0,                    /* tp_iternext */
+    structural_index_methods, /* tp_methods */
+};
+#endif
+
+static PyObject *
+scanner_index(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Build the StructuralIndex of a bytes string (stage 1), or return
+     * None if a string or bracket in it is not closed */
+    static char *kwlist[] = {"string", NULL};
+    PyScannerObject *s = (PyScannerObject *)self;
+    PyTypeObject *index_type =
+        (PyTypeObject *)get_speedups_state(s->module_ref)->PyStructuralIndexType;
+    PyStructuralIndexObject *x;
+    PyObject *pystr;
+    PyThreadState *save = NULL;
+    JSON_IndexPos *pos;
+    JSON_IndexPos *match;
+    Py_ssize_t count;
+    Py_ssize_t length;
+    int rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!:index", kwlist,
+        &PyBytes_Type, &pystr))
+        return NULL;
+    length = PyBytes_GET_SIZE(pystr);
+    if (length > JSON_INDEX_MAX_SIZE) {
+        PyErr_SetString(PyExc_ValueError, "document too large to index");
+        return NULL;
+    }
+    if (length >= JSON_VALIDATE_NOGIL_SIZE)
+        save = PyEval_SaveThread();
+    rv = json_index_scan((const unsigned char *)PyBytes_AS_STRING(pystr),
+                         length, &pos, &match, &count);
+    if (save != NULL)
+        PyEval_RestoreThread(save);
+    if (rv < 0)
+        return PyErr_NoMemory();
+    if (rv > 0)
+        Py_RETURN_NONE;
+    x = (PyStructuralIndexObject *)index_type->tp_alloc(index_type, 0);
+    if (x == NULL) {
+        PyMem_RawFree(pos);
+        PyMem_RawFree(match);
+        return NULL;
+    }
+    Py_INCREF(self);
+    x->scanner = self;
+    Py_INCREF(pystr);
+    x->doc = pystr;
+    x->pos = pos;
+    x->match = match;
+    x->count = count;
+    return (PyObject *)x;
+}
+
+PyDoc_STRVAR(scanner_index_doc,
+"index(string) -> StructuralIndex or None\n"
+"\n"
+"Find the structural characters of the UTF-8 bytes string and return\n"
+"their index, whose values are decoded by this scanner, or None if a\n"
+"string or bracket in it is not closed. Documents of 4096 or more bytes\n"
+"are indexed without holding the GIL.");
+#endif /* PY_MAJOR_VERSION >= 3 */
+
+PyDoc_STRVAR(scanner_events_doc,
+"events(string, idx, state, stack, events, memo, closed) -> (state, end)\n"
+"\n"
+"Tokenize string from idx for JSONDecoder.iterparse, appending the\n"
+"(event, value, prefix) tuple of each token to the list events while\n"
+"updating the parser state and the stack of open containers. Stops at\n"
+"the end of string, before a token that is invalid or that may be cut\n"
+"off by the end of string unless closed is true, and before a top-level\n"
+"value. Returns the new state and the index where it stopped.");
+
+PyDoc_STRVAR(scanner_lines_doc,
+"lines(string, idx, stop) -> (list, end, count)\n"
+"\n"
+"Scan the JSON lines of string from idx, the start of a line, up to stop\n"
+"and return the list of the documents of the lines that are not blank,\n"
+"the index where it stopped and the number of lines read. Stops at the\n"
+"start of a line whose document is invalid, spans lines or is followed\n"
+"by other data.");
+
+PyDoc_STRVAR(scanner_select_doc,
+"select(string, idx, tree) -> (dict, end)\n"
+"\n"
+"Scan the JSON term at idx of string like calling the scanner does, but\n"
+"only build the values that tree selects and skip everything else.\n"
+"tree maps the object keys (str) and array indexes (int) to select to\n"
+"the tree below them, or to the label of the value in the dict that is\n"
+"returned.");
+
+PyDoc_STRVAR(scanner_spans_doc,
+"spans(string, idx) -> (list, end)\n"
+"\n"
+"Read the array or object at idx of string without building its values,\n"
+"and return the (start, end) indexes of each element of the array, or the\n"
+"(key, start, end) of each member of the object. The values are skipped\n"
+"without being validated. Returns (None, idx) if there is no array or\n"
+"object at idx.");
+
+static PyMethodDef scanner_methods[] = {
+    {"decode_many", (PyCFunction)(void(*)(void))scanner_decode_many,
+        METH_VARARGS | METH_KEYWORDS, scanner_decode_many_doc},
+    {"events", (PyCFunction)(void(*)(void))scanner_events,
+        METH_VARARGS | METH_KEYWORDS, scanner_events_doc},
+#if PY_MAJOR_VERSION >= 3
+    {"index", (PyCFunction)(void(*)(void))scanner_index,
+        METH_VARARGS | METH_KEYWORDS, scanner_index_doc},
+#endif
+    {"lines", (PyCFunction)(void(*)(void))scanner_lines,
+        METH_VARARGS | METH_KEYWORDS, scanner_lines_doc},
+    {"select", (PyCFunction)(void(*)(void))scanner_select,
+        METH_VARARGS | METH_KEYWORDS, scanner_select_doc},
+    {"spans", (PyCFunction)(void(*)(void))scanner_spans,
+        METH_VARARGS | METH_KEYWORDS, scanner_spans_doc},
+    {"validate", (PyCFunction)(void(*)(void))scanner_validate,
+        METH_VARARGS | METH_KEYWORDS, scanner_validate_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject *
+JSON_ParseEncoding(PyObject *encoding)
+{
+    if (encoding == Py_None)
+        return JSON_InternFromString(DEFAULT_ENCODING);
+#if PY_MAJOR_VERSION >= 3
+    if (PyUnicode_Check(encoding)) {
+        if (PyUnicode_AsUTF8(encoding) == NULL) {
+            return NULL;
+        }
+        Py_INCREF(encoding);
+        return encoding;
+    }
+#else /* PY_MAJOR_VERSION >= 3 */
+    if (PyString_Check(encoding)) {
+        Py_INCREF(encoding);
+        return encoding;
+    }
+    if (PyUnicode_Check(encoding))
+        return PyUnicode_AsEncodedString(encoding, NULL, NULL);
+#endif /* PY_MAJOR_VERSION >= 3 */
+    PyErr_SetString(PyExc_TypeError, "encoding must be a string");
+    return NULL;
+}
+
+static PyObject *
+scanner_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    /* Initialize Scanner object */
+    PyObject *ctx;
+    static char *kwlist[] = {"context", NULL};
+    PyScannerObject *s;
+    PyObject *encoding;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:make_scanner", kwlist, &ctx))
+        return NULL;
+
+    s = (PyScannerObject *)type->tp_alloc(type, 0);
+    if (s == NULL)
+        return NULL;
+
+#if PY_VERSION_HEX >= 0x030D0000
+    s->module_ref = PyType_GetModuleByDef(type, &moduledef);
+    if (s->module_ref == NULL)
+        goto bail;
+#else
+    s->module_ref = _speedups_module;  /* borrowed */
+#endif
+    Py_INCREF(s->module_ref);
+
+    /* Load required attributes from the Python-side JSONDecoder context.
+     * Each getattr failure is a hard error; goto bail lets scanner_dealloc
+     * release whatever we managed to set on s. */
+#define LOAD_ATTR(field, name)                              \
+    do {                                                    \
+        s->field = PyObject_GetAttrString(ctx, name);       \
+        if (s->field == NULL)                               \
+            goto bail;                                      \
+    } while (0)
+
+    encoding = PyObject_GetAttrString(ctx, "encoding");
+    if (encoding == NULL)
+        goto bail;
+    s->encoding = JSON_ParseEncoding(encoding);
+    Py_XDECREF(encoding);
+    if (s->encoding == NULL)
+        goto bail;
+
+    LOAD_ATTR(strict_bool, "strict");
+    s->strict = PyObject_IsTrue(s->strict_bool);
+    if (s->strict < 0)
+        goto bail;
+    LOAD_ATTR(object_hook, "object_hook");
+    LOAD_ATTR(pairs_hook, "object_pairs_hook");
+    LOAD_ATTR(array_hook, "array_hook");
+    LOAD_ATTR(parse_float, "parse_float");
+    LOAD_ATTR(parse_int, "parse_int");
+    LOAD_ATTR(parse_constant, "parse_constant");
+
+#undef LOAD_ATTR
+
+    /* The key_cache attribute is optional */
+    s->key_cache = PyObject_GetAttrString(ctx, "key_cache");
+    if (s->key_cache == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            goto bail;
+        PyErr_Clear();
+    }
+    else if (s->key_cache == Py_None) {
+        Py_CLEAR(s->key_cache);
+    }
+    else if (!PyObject_TypeCheck(s->key_cache,
+                                 (PyTypeObject *)get_speedups_state(
+                                     s->module_ref)->PyKeyCacheType)) {
+        PyErr_Format(PyExc_TypeError,
+                     "key_cache must be a KeyCache, not %.80s",
+                     Py_TYPE(s->key_cache)->tp_name);
+        goto bail;
+    }
+
+    /* So is make_numeric_array, see JSONDecoder(numeric_arrays=...) */
+    s->make_numeric_array = PyObject_GetAttrString(ctx, "make_numeric_array");
+    if (s->make_numeric_array == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            goto bail;
+        PyErr_Clear();
+    }
+    else if (s->make_numeric_array == Py_None) {
+        Py_CLEAR(s->make_numeric_array);
+    }
+
+    /* And raw_keys and raw_depth, see JSONDecoder(raw_keys=...) */
+    s->raw_keys = PyObject_GetAttrString(ctx, "raw_keys");
+    if (s->raw_keys == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            goto bail;
+        PyErr_Clear();
+    }
+    else if (s->raw_keys == Py_None) {
+        Py_CLEAR(s->raw_keys);
+    }
+    s->raw_depth = -1;
+    encoding = PyObject_GetAttrString(ctx, "raw_depth");
+    if (encoding == NULL) {
+        if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+            goto bail;
+        PyErr_Clear();
+    }
+    else {
+        if (encoding != Py_None)
+            s->raw_depth = PyInt_AsSsize_t(encoding);
+        Py_DECREF(encoding);
+        if (s->raw_depth == -1 && PyErr_Occurred())
+            goto bail;
+    }
+
+    return (PyObject *)s;
+
+bail:
+    Py_DECREF(s);
+    return NULL;
+}
+
+PyDoc_STRVAR(scanner_doc, "JSON scanner object");
+
+#if PY_VERSION_HEX >= 0x030D0000
+/* Heap type slots and spec for Python 3.13+ */
+static PyType_Slot PyScannerType_slots[] = {
+    {Py_tp_doc, (void *)scanner_doc},
+    {Py_tp_dealloc, scanner_dealloc},
+    {Py_tp_call, scanner_call},
+    {Py_tp_traverse, scanner_traverse},
+    {Py_tp_clear, scanner_clear},
+    {Py_tp_methods, scanner_methods},
+    {Py_tp_members, scanner_members},
+    {Py_tp_new, scanner_new},
+    {0, NULL}
+};
+
+static PyType_Spec PyScannerType_spec = {
+    .name = "simplejson._speedups.Scanner",
+    .basicsize = sizeof(PyScannerObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+    .slots = PyScannerType_slots,
+};
+#else
+static PyTypeObject PyScannerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "simplejson._speedups.Scanner",       /* tp_name */
+    sizeof(PyScannerObject), /* tp_basicsize */
+    0,                    /* tp_itemsize */
+    scanner_dealloc, /* tp_dealloc */
+    0,                    /* tp_print */
+    0,                    /* tp_getattr */
+    0,                    /* tp_setattr */
+    0,                    /* tp_compare */
+    0,                    /* tp_repr */
+    0,                    /* tp_as_number */
+    0,                    /* tp_as_sequence */
+    0,                    /* tp_as_mapping */
+    0,                    /* tp_hash */
+    scanner_call,         /* tp_call */
+    0,                    /* tp_str */
+    0,/* PyObject_GenericGetAttr, */                    /* tp_getattro */
+    0,/* PyObject_GenericSetAttr, */                    /* tp_setattro */
+    0,                    /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,   /* tp_flags */
+    scanner_doc,          /* tp_doc */
+    scanner_traverse,                    /* tp_traverse */
+    scanner_clear,                    /* tp_clear */
+    0,                    /* tp_richcompare */
+    0,                    /* tp_weaklistoffset */
+    0,                    /* tp_iter */
+    0,                    /* tp_iternext */
+    scanner_methods,                    /* tp_methods */
+    scanner_members,                    /* tp_members */
+    0,                    /* tp_getset */
+    0,                    /* tp_base */
+    0,                    /* tp_dict */
+    0,                    /* tp_descr_get */
+    0,                    /* tp_descr_set */
+    0,                    /* tp_dictoffset */
+    0,                    /* tp_init */
+    0,/* PyType_GenericAlloc, */        /* tp_alloc */
+    scanner_new,          /* tp_new */
+    0,/* PyObject_GC_Del, */              /* tp_free */
+};
+#endif
+
+static int
+encoder_option_check(PyObject *value, const char *name, const char *expected)
+{
+    /* Raise ValueError unless value is the string expected */
+    PyObject *str = JSON_InternFromString(expected);
+    int r;
+    if (str == NULL)
+        return -1;
+    r = PyObject_RichCompareBool(value, str, Py_EQ);
+    Py_DECREF(str);
+    if (r < 0)
+        return -1;
+    if (!r) {
+        PyErr_Format(PyExc_ValueError, "%s must be None or '%s'",
+                     name, expected);
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject *
+encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {
+        "markers",
+        "default",
+        "encoder",
+        "indent",
+        "key_separator",
+        "item_separator",
+        "sort_keys",
+        "skipkeys",
+        "allow_nan",
+        "key_memo",
+        "use_decimal",
+        "namedtuple_as_object",
+        "tuple_as_array",
+        "int_as_string_bitcount",
+        "item_sort_key",
+        "encoding",
+        "for_json",
+        "ignore_nan",
+        "Decimal",
+        "iterable_as_array",
+        "shape_memo",
+        "type_encoders",
+        "type_memo",
+        "datetime_format",
+        "UUID",
+        "Enum",
+        "bytes_as",
+        "dataclass_fields",
+        "buffer_as_array",
+        NULL};
+
+    PyEncoderObject *s;
+    PyObject *markers, *defaultfn, *encoder, *indent, *key_separator;
+    PyObject *item_separator, *sort_keys, *skipkeys, *allow_nan, *key_memo;
+    PyObject *use_decimal, *namedtuple_as_object, *tuple_as_array, *iterable_as_array;
+    PyObject *int_as_string_bitcount, *item_sort_key, *encoding, *for_json;
+    PyObject *ignore_nan, *Decimal;
+    PyObject *shape_memo = Py_None;
+    PyObject *type_encoders = Py_None;
+    PyObject *type_memo = Py_None;
+    PyObject *datetime_format = Py_None;
+    PyObject *UUID = Py_None;
+    PyObject *Enum = Py_None;
+    PyObject *bytes_as = Py_None;
+    PyObject *dataclass_fields = Py_None;
+    PyObject *buffer_as_array = Py_False;
+    int is_true;
+
+    /* Build the format string from per-argument pieces so that each "O"
+     * has a comment and adding/removing an argument only touches one
+     * line instead of counting letters in a 20-char string literal. The
+     * order here must match kwlist[] above and the &var argument list
+     * to PyArg_ParseTupleAndKeywords below. */
+    static const char *const fmt =
+        "O"  /* markers */
+        "O"  /* default */
+        "O"  /* encoder */
+        "O"  /* indent */
+        "O"  /* key_separator */
+        "O"  /* item_separator */
+        "O"  /* sort_keys */
+        "O"  /* skipkeys */
+        "O"  /* allow_nan */
+        "O"  /* key_memo */
+        "O"  /* use_decimal */
+        "O"  /* namedtuple_as_object */
+        "O"  /* tuple_as_array */
+        "O"  /* int_as_string_bitcount */
+        "O"  /* item_sort_key */
+        "O"  /* encoding */
+        "O"  /* for_json */
+        "O"  /* ignore_nan */
+        "O"  /* Decimal */
+        "O"  /* iterable_as_array */
+        "|O" /* shape_memo */
+        "O"  /* type_encoders */
+        "O"  /* type_memo */
+        "O"  /* datetime_format */
+        "O"  /* UUID */
+        "O"  /* Enum */
+        "O"  /* bytes_as */
+        "O"  /* dataclass_fields */
+        "O"  /* buffer_as_array */
+        ":make_encoder";
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, fmt, kwlist,
+        &markers, &defaultfn, &encoder, &indent, &key_separator, &item_separator,
+        &sort_keys, &skipkeys, &allow_nan, &key_memo, &use_decimal,
+        &namedtuple_as_object, &tuple_as_array,
+        &int_as_string_bitcount, &item_sort_key, &encoding, &for_json,
+        &ignore_nan, &Decimal, &iterable_as_array, &shape_memo,
+        &type_encoders, &type_memo, &datetime_format, &UUID, &Enum,
+        &bytes_as, &dataclass_fields, &buffer_as_array))
+        return NULL;
+    if (shape_memo != Py_None && !PyDict_Check(shape_memo)) {
+        PyErr_SetString(PyExc_TypeError, "shape_memo must be None or a dict");
+        return NULL;
+    }
+    if (type_encoders != Py_None && !PyDict_Check(type_encoders)) {
+        PyErr_SetString(PyExc_TypeError, "type_encoders must be None or a dict");
+        return NULL;
+    }
+    if (type_memo != Py_None && !PyDict_Check(type_memo)) {
+        PyErr_SetString(PyExc_TypeError, "type_memo must be None or a dict");
+        return NULL;
+    }
+    if (dataclass_fields != Py_None && !PyCallable_Check(dataclass_fields)) {
+        PyErr_SetString(PyExc_TypeError, "dataclass_fields must be None or callable");
+        return NULL;
+    }
+    if ((UUID != Py_None && !PyType_Check(UUID)) ||
+        (Enum != Py_None && !PyType_Check(Enum))) {
+        PyErr_SetString(PyExc_TypeError, "UUID and Enum must be None or a type");
+        return NULL;
+    }
+
+    s = (PyEncoderObject *)type->tp_alloc(type, 0);
+    if (s == NULL)
+        return NULL;
+
+#if PY_VERSION_HEX >= 0x030D0000
+    s->module_ref = PyType_GetModuleByDef(type, &moduledef);
+    if (s->module_ref == NULL)
+        goto bail;
+#else
+    s->module_ref = _speedups_module;  /* borrowed */
+#endif
+    Py_INCREF(s->module_ref);
+
+    Py_INCREF(markers);
+    s->markers = markers;
+    Py_INCREF(defaultfn);
+    s->defaultfn = defaultfn;
+    Py_INCREF(encoder);
+    s->encoder = encoder;
+#if PY_MAJOR_VERSION >= 3
+    if (encoding == Py_None) {
+        /* Py3: encoding=None means "don't decode bytes keys/values".
+         * Store Py_None rather than NULL so Py_T_OBJECT_EX exposes the
+         * attribute as None (not AttributeError) and so tp_traverse /
+         * tp_clear handle the slot uniformly. The bytes-path sentinel
+         * checks in encoder_stringify_key and encoder_listencode_obj
+         * compare against Py_None. */
+        Py_INCREF(Py_None);
+        s->encoding = Py_None;
+    }
+    else
+#endif /* PY_MAJOR_VERSION >= 3 */
+    {
+        s->encoding = JSON_ParseEncoding(encoding);
+        if (s->encoding == NULL)
+            goto bail;
     }
     Py_INCREF(indent);
     s->indent = indent;
@@ -2626,961 +5637,3111 @@ encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
     s->skipkeys = PyObject_IsTrue(skipkeys);
     if (s->skipkeys < 0)
         goto bail;
-    Py_INCREF(key_memo);
-    s->key_memo = key_memo;
-    s->fast_encode = (PyCFunction_Check(s->encoder) && PyCFunction_GetFunction(s->encoder) == (PyCFunction)py_encode_basestring_ascii);
-    is_true = PyObject_IsTrue(ignore_nan);
-    if (is_true < 0)
+    Py_INCREF(key_memo);
+    s->key_memo = key_memo;
+    Py_INCREF(shape_memo);
+    s->shape_memo = shape_memo;
+    Py_INCREF(type_encoders);
+    s->type_encoders = type_encoders;
+    if (type_memo == Py_None) {
+        /* Without a memo from the JSONEncoder, keep one for this call */
+        s->type_memo = PyDict_New();
+        if (s->type_memo == NULL)
+            goto bail;
+    }
+    else {
+        Py_INCREF(type_memo);
+        s->type_memo = type_memo;
+    }
+    if (datetime_format != Py_None) {
+        if (encoder_option_check(datetime_format, "datetime_format", "iso"))
+            goto bail;
+        if (PyDateTimeAPI == NULL) {
+            PyDateTime_IMPORT;
+            if (PyDateTimeAPI == NULL)
+                goto bail;
+        }
+        s->datetime_as_iso = 1;
+    }
+    if (bytes_as != Py_None) {
+        if (encoder_option_check(bytes_as, "bytes_as", "base64"))
+            goto bail;
+        s->bytes_as_base64 = 1;
+    }
+    Py_INCREF(UUID);
+    s->UUID = UUID;
+    Py_INCREF(Enum);
+    s->Enum = Enum;
+    Py_INCREF(dataclass_fields);
+    s->dataclass_fields = dataclass_fields;
+    s->extra_types = (s->datetime_as_iso || s->bytes_as_base64 ||
+                      UUID != Py_None || Enum != Py_None);
+    s->fast_encode = 0;
+    if (PyCFunction_Check(s->encoder)) {
+        if (PyCFunction_GetFunction(s->encoder) == (PyCFunction)py_encode_basestring_ascii)
+            s->fast_encode = JSON_FAST_ENCODE_ASCII;
+        else if (PyCFunction_GetFunction(s->encoder) == (PyCFunction)py_encode_basestring)
+            s->fast_encode = JSON_FAST_ENCODE_UNICODE;
+    }
+    is_true = PyObject_IsTrue(ignore_nan);
+    if (is_true < 0)
+        goto bail;
+    s->allow_or_ignore_nan = is_true ? JSON_IGNORE_NAN : 0;
+    is_true = PyObject_IsTrue(allow_nan);
+    if (is_true < 0)
+        goto bail;
+    s->allow_or_ignore_nan |= is_true ? JSON_ALLOW_NAN : 0;
+    s->use_decimal = PyObject_IsTrue(use_decimal);
+    if (s->use_decimal < 0)
+        goto bail;
+    s->namedtuple_as_object = PyObject_IsTrue(namedtuple_as_object);
+    if (s->namedtuple_as_object < 0)
+        goto bail;
+    s->tuple_as_array = PyObject_IsTrue(tuple_as_array);
+    if (s->tuple_as_array < 0)
+        goto bail;
+    s->iterable_as_array = PyObject_IsTrue(iterable_as_array);
+    if (s->iterable_as_array < 0)
+        goto bail;
+    s->buffer_as_array = PyObject_IsTrue(buffer_as_array);
+    if (s->buffer_as_array < 0)
+        goto bail;
+    if (PyInt_Check(int_as_string_bitcount) || PyLong_Check(int_as_string_bitcount)) {
+        static const unsigned long long_long_bitsize = sizeof(long long) * CHAR_BIT;
+        long int_as_string_bitcount_val = PyLong_AsLong(int_as_string_bitcount);
+        if (int_as_string_bitcount_val == -1 && PyErr_Occurred())
+            goto bail;
+        if (int_as_string_bitcount_val > 0 && int_as_string_bitcount_val < (long)long_long_bitsize) {
+            int n = (int)int_as_string_bitcount_val;
+            /* Compute 2^n as unsigned (well-defined for n < 64) and
+             * -(2^n) as signed without UB. Naive "-1LL << n" is a
+             * shift of a negative value, which is undefined, and
+             * "-(1LL << n)" overflows when n == 63. The expression
+             * below avoids both: (1ULL << n) - 1 is always >= 0, so
+             * negating it and subtracting 1 stays in range and
+             * produces LLONG_MIN at n == 63. */
+            s->max_long_size = PyLong_FromUnsignedLongLong(1ULL << n);
+            s->min_long_size = PyLong_FromLongLong(
+                -(long long)((1ULL << n) - 1ULL) - 1LL);
+            if (s->min_long_size == NULL || s->max_long_size == NULL) {
+                goto bail;
+            }
+        }
+        else {
+            PyErr_Format(PyExc_TypeError,
+                         "int_as_string_bitcount (%ld) must be greater than 0 and less than the number of bits of a `long long` type (%lu bits)",
+                         int_as_string_bitcount_val, long_long_bitsize);
+            goto bail;
+        }
+    }
+    else if (int_as_string_bitcount == Py_None) {
+        Py_INCREF(Py_None);
+        s->max_long_size = Py_None;
+        Py_INCREF(Py_None);
+        s->min_long_size = Py_None;
+    }
+    else {
+        PyErr_SetString(PyExc_TypeError, "int_as_string_bitcount must be None or an integer");
+        goto bail;
+    }
+    if (item_sort_key != Py_None) {
+        if (!PyCallable_Check(item_sort_key)) {
+            PyErr_SetString(PyExc_TypeError, "item_sort_key must be None or callable");
+            goto bail;
+        }
+    }
+    else {
+        is_true = PyObject_IsTrue(sort_keys);
+        if (is_true < 0)
+            goto bail;
+        if (is_true) {
+            _speedups_state *state = get_speedups_state(s->module_ref);
+            item_sort_key = state->JSON_itemgetter0;
+            if (!item_sort_key)
+                goto bail;
+        }
+    }
+    if (item_sort_key == Py_None) {
+        Py_INCREF(Py_None);
+        s->item_sort_kw = Py_None;
+    }
+    else {
+        s->item_sort_kw = PyDict_New();
+        if (s->item_sort_kw == NULL)
+            goto bail;
+        if (PyDict_SetItemString(s->item_sort_kw, "key", item_sort_key))
+            goto bail;
+    }
+    Py_INCREF(sort_keys);
+    s->sort_keys = sort_keys;
+    Py_INCREF(item_sort_key);
+    s->item_sort_key = item_sort_key;
+    Py_INCREF(Decimal);
+    s->Decimal = Decimal;
+    s->for_json = PyObject_IsTrue(for_json);
+    if (s->for_json < 0)
+        goto bail;
+
+    return (PyObject *)s;
+
+bail:
+    Py_DECREF(s);
+    return NULL;
+}
+
+static PyObject *
+encoder_call(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Python callable interface to encode_listencode_obj */
+    static char *kwlist[] = {"obj", "_current_indent_level", NULL};
+    PyObject *obj;
+    Py_ssize_t indent_level;
+    PyEncoderObject *s;
+    JSON_Accu rval;
+    _speedups_state *state;
+    int encode_rv;
+#if PY_VERSION_HEX < 0x030D0000
+    assert(PyEncoder_Check(self));
+#endif
+    s = (PyEncoderObject *)self;
+    state = get_speedups_state(s->module_ref);
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:_iterencode", kwlist,
+        &obj, &indent_level))
+        return NULL;
+    if (JSON_Accu_Init(&rval))
+        return NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    encode_rv = encoder_listencode_obj(s, &rval, obj, indent_level);
+    Py_END_CRITICAL_SECTION();
+    if (encode_rv) {
+        JSON_Accu_Destroy(&rval);
+        return NULL;
+    }
+    return JSON_Accu_FinishAsList(state, &rval);
+}
+
+#if PY_MAJOR_VERSION >= 3
+static PyObject *
+encoder_encode_bytes(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Like encoder_call, but return the document as UTF-8 encoded bytes */
+    static char *kwlist[] = {"obj", "_current_indent_level", NULL};
+    PyObject *obj;
+    Py_ssize_t indent_level;
+    PyEncoderObject *s = (PyEncoderObject *)self;
+    JSON_Accu rval;
+    int encode_rv;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:encode_bytes", kwlist,
+        &obj, &indent_level))
+        return NULL;
+    if (JSON_Accu_InitUTF8(&rval))
+        return NULL;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    encode_rv = encoder_listencode_obj(s, &rval, obj, indent_level);
+    Py_END_CRITICAL_SECTION();
+    if (encode_rv) {
+        JSON_Accu_Destroy(&rval);
+        return NULL;
+    }
+    return JSON_Accu_FinishAsBytes(&rval);
+}
+#endif /* PY_MAJOR_VERSION >= 3 */
+
+static PyObject *
+_encoded_const(_speedups_state *state, PyObject *obj)
+{
+    /* Return the JSON string representation of None, True, False */
+    if (obj == Py_None) {
+        Py_INCREF(state->JSON_s_null);
+        return state->JSON_s_null;
+    }
+    else if (obj == Py_True) {
+        Py_INCREF(state->JSON_s_true);
+        return state->JSON_s_true;
+    }
+    else if (obj == Py_False) {
+        Py_INCREF(state->JSON_s_false);
+        return state->JSON_s_false;
+    }
+    else {
+        PyErr_SetString(PyExc_ValueError, "not a const");
+        return NULL;
+    }
+}
+
+static PyObject *
+encoder_encode_float(PyEncoderObject *s, PyObject *obj)
+{
+    /* Return the JSON representation of a PyFloat */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    double i = PyFloat_AS_DOUBLE(obj);
+    if (!Py_IS_FINITE(i)) {
+        if (!s->allow_or_ignore_nan) {
+            PyErr_SetString(PyExc_ValueError, "Out of range float values are not JSON compliant");
+            return NULL;
+        }
+        if (s->allow_or_ignore_nan & JSON_IGNORE_NAN) {
+            return _encoded_const(state, Py_None);
+        }
+        /* JSON_ALLOW_NAN is set */
+        else if (i > 0) {
+            Py_INCREF(state->JSON_Infinity);
+            return state->JSON_Infinity;
+        }
+        else if (i < 0) {
+            Py_INCREF(state->JSON_NegInfinity);
+            return state->JSON_NegInfinity;
+        }
+        else {
+            Py_INCREF(state->JSON_NaN);
+            return state->JSON_NaN;
+        }
+    }
+    /* Use a better float format here? */
+    if (PyFloat_CheckExact(obj)) {
+        return PyObject_Repr(obj);
+    }
+    else {
+        /* See #118, do not trust custom str/repr */
+        PyObject *res;
+        PyObject *tmp = PyObject_CallOneArg((PyObject *)&PyFloat_Type, obj);
+        if (tmp == NULL) {
+            return NULL;
+        }
+        res = PyObject_Repr(tmp);
+        Py_DECREF(tmp);
+        return res;
+    }
+}
+
+static PyObject *
+encoder_encode_string(PyEncoderObject *s, PyObject *obj)
+{
+    /* Return the JSON representation of a string */
+    PyObject *encoded;
+
+    if (s->fast_encode == JSON_FAST_ENCODE_ASCII) {
+        return py_encode_basestring_ascii(NULL, obj);
+    }
+    if (s->fast_encode == JSON_FAST_ENCODE_UNICODE) {
+        return py_encode_basestring(NULL, obj);
+    }
+    encoded = PyObject_CallOneArg(s->encoder, obj);
+    if (encoded != NULL &&
+#if PY_MAJOR_VERSION < 3
+        !PyString_Check(encoded) &&
+#endif /* PY_MAJOR_VERSION < 3 */
+        !PyUnicode_Check(encoded))
+    {
+        PyErr_Format(PyExc_TypeError,
+                     "encoder() must return a string, not %.80s",
+                     Py_TYPE(encoded)->tp_name);
+        Py_DECREF(encoded);
+        return NULL;
+    }
+    return encoded;
+}
+
+static int
+_steal_accumulate(_speedups_state *state, JSON_Accu *accu, PyObject *stolen)
+{
+    /* Append stolen and then decrement its reference count */
+    int rval = JSON_Accu_Accumulate(state, accu, stolen);
+    Py_DECREF(stolen);
+    return rval;
+}
+
+static int
+JSON_Accu_WriteASCII(_speedups_state *state, JSON_Accu *acc,
+                     const char *buf, Py_ssize_t n)
+{
+    /* Append the n ASCII characters at buf, copying them straight into
+     * the output where the accumulator has one */
+#if PY_MAJOR_VERSION >= 3
+    if (acc->utf8 != NULL) {
+        char *output = JSON_Accu_ReserveUTF8(acc, n);
+        if (output == NULL)
+            return -1;
+        memcpy(output, buf, n);
+        acc->length += n;
+        return 0;
+    }
+#endif
+#if PY_VERSION_HEX >= 0x030E0000
+    (void)state;
+    acc->length += n;
+    return PyUnicodeWriter_WriteUTF8(acc->writer, buf, n);
+#else
+    {
+#if PY_MAJOR_VERSION >= 3
+        PyObject *str = PyUnicode_DecodeASCII(buf, n, NULL);
+#else
+        PyObject *str = PyString_FromStringAndSize(buf, n);
+#endif
+        if (str == NULL)
+            return -1;
+        return _steal_accumulate(state, acc, str);
+    }
+#endif
+}
+
+/* Push a reference to `obj` into the encoder's circular-reference marker
+ * dict, keyed by the object's address. Allocates a fresh PyLong ident and
+ * stores it in *ident_ptr (caller owns the reference, and must pass it to
+ * encoder_markers_pop to remove the entry). If markers tracking is off
+ * (s->markers == Py_None), stores NULL in *ident_ptr and returns 0 with
+ * no side effects — that NULL is the sentinel markers_pop understands.
+ * On circular reference sets the ValueError; on any other failure sets
+ * the corresponding exception. Returns 0 on success, -1 on error. */
+static int
+encoder_markers_push(PyEncoderObject *s, PyObject *obj, PyObject **ident_ptr)
+{
+    PyObject *ident;
+    int has_key;
+    *ident_ptr = NULL;
+    if (s->markers == Py_None)
+        return 0;
+    ident = PyLong_FromVoidPtr(obj);
+    if (ident == NULL)
+        return -1;
+    has_key = PyDict_Contains(s->markers, ident);
+    if (has_key) {
+        if (has_key != -1)
+            PyErr_SetString(PyExc_ValueError, "Circular reference detected");
+        Py_DECREF(ident);
+        return -1;
+    }
+    if (PyDict_SetItem(s->markers, ident, obj) < 0) {
+        Py_DECREF(ident);
+        return -1;
+    }
+    *ident_ptr = ident;
+    return 0;
+}
+
+/* Counterpart to encoder_markers_push. Removes the ident entry from
+ * s->markers and drops the caller's reference. Passing NULL is a no-op
+ * so callers can invoke it unconditionally on the happy path (when
+ * markers tracking was off, push wrote NULL into their local). Returns
+ * 0 on success, -1 if PyDict_DelItem failed (the reference is still
+ * released in that case). */
+static int
+encoder_markers_pop(PyEncoderObject *s, PyObject *ident)
+{
+    int rv;
+    if (ident == NULL)
+        return 0;
+    rv = PyDict_DelItem(s->markers, ident);
+    Py_DECREF(ident);
+    return rv;
+}
+
+/* Helper for the for_json / _asdict paths in encoder_listencode_obj.
+ * Steals the reference to `newobj` (returned by _call_json_method),
+ * handles recursion-depth tracking, and dispatches to the right
+ * sub-encoder:
+ *   - if as_dict is 0, encodes newobj as a generic JSON value via
+ *     encoder_listencode_obj (for_json contract: return any JSON-
+ *     compatible value);
+ *   - if as_dict is 1, encodes newobj as a dict via
+ *     encoder_listencode_dict after a TypeError-on-mismatch check
+ *     (_asdict contract: must return a dict).
+ * Cleans up on every exit path. */
+static int
+encoder_steal_encode(PyEncoderObject *s, JSON_Accu *rval,
+                     PyObject *newobj, Py_ssize_t indent_level,
+                     int as_dict)
+{
+    int rv;
+    if (newobj == NULL)
+        return -1;
+    if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
+        Py_DECREF(newobj);
+        return -1;
+    }
+    if (as_dict) {
+        if (JSON_AnyDict_Check(newobj)) {
+            rv = encoder_listencode_dict(s, rval, newobj, indent_level);
+        } else {
+            PyErr_Format(PyExc_TypeError,
+                         "_asdict() must return a dict, not %.80s",
+                         Py_TYPE(newobj)->tp_name);
+            rv = -1;
+        }
+    } else {
+        rv = encoder_listencode_obj(s, rval, newobj, indent_level);
+    }
+    Py_DECREF(newobj);
+    Py_LeaveRecursiveCall();
+    return rv;
+}
+
+/* The most types kept in type_memo, which like key_memo lives as long as
+ * the JSONEncoder (for the same tuple_as_array, use_decimal,
+ * type_encoders and dataclass_fields) and is cleared when it is full.
+ * Each entry is either the callable from type_encoders for the type, the
+ * tuple of the field names of a dataclass from dataclass_fields, or an
+ * int of the TYPE_MAY_HAVE_* flags telling which of the for_json and
+ * _asdict methods must still be looked up on its instances. */
+#define TYPE_MEMO_MAXSIZE 256
+#define TYPE_MAY_HAVE_FOR_JSON 1
+#define TYPE_MAY_HAVE_ASDICT 2
+
+static int
+encoder_type_may_have(PyTypeObject *type, PyObject *name)
+{
+    /* Whether instances of type may have the attribute name. This is
+     * only known not to be so for a static type (whose attributes cannot
+     * change) with the generic getattr and no instance dict that does not
+     * itself have the attribute, such as list, tuple and dict. */
+    if ((type->tp_flags & Py_TPFLAGS_HEAPTYPE) ||
+        type->tp_getattro != PyObject_GenericGetAttr ||
+        type->tp_dictoffset != 0)
+        return 1;
+    return PyObject_HasAttr((PyObject *)type, name);
+}
+
+static int
+encoder_is_native_type(PyEncoderObject *s, PyObject *base)
+{
+    /* Whether base is a class whose instances the encoder handles itself,
+     * which ends the search of type_encoders along an MRO */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    return (base == (PyObject *)&PyList_Type ||
+            base == (PyObject *)&PyDict_Type ||
+            base == (PyObject *)&PyUnicode_Type ||
+            base == (PyObject *)&PyLong_Type ||
+            base == (PyObject *)&PyFloat_Type ||
+#if PY_MAJOR_VERSION < 3
+            base == (PyObject *)&PyString_Type ||
+            base == (PyObject *)&PyInt_Type ||
+#endif
+#if PY_VERSION_HEX >= 0x030F0000
+            base == (PyObject *)&PyFrozenDict_Type ||
+#endif
+            base == state->RawJSONType ||
+            base == state->LazyContainerType ||
+            (s->tuple_as_array && base == (PyObject *)&PyTuple_Type) ||
+            (s->use_decimal && base == s->Decimal));
+}
+
+static PyObject *
+encoder_type_entry(PyEncoderObject *s, PyTypeObject *type)
+{
+    /* Return a new reference to the type_memo entry of type, making it
+     * from type_encoders and the class attributes of type on a miss */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *entry = NULL;
+    Py_ssize_t flags = 0;
+    int found;
+
+    found = json_PyDict_GetItemRef(s->type_memo, (PyObject *)type, &entry);
+    if (found)
+        return found < 0 ? NULL : entry;
+    if (s->type_encoders != Py_None && type->tp_mro != NULL) {
+        Py_ssize_t i;
+        for (i = 0; i < PyTuple_GET_SIZE(type->tp_mro); i++) {
+            PyObject *base = PyTuple_GET_ITEM(type->tp_mro, i);
+            if (encoder_is_native_type(s, base))
+                break;
+            found = json_PyDict_GetItemRef(s->type_encoders, base, &entry);
+            if (found < 0)
+                return NULL;
+            if (found)
+                break;
+        }
+    }
+    if (entry == NULL && s->dataclass_fields != Py_None) {
+        entry = PyObject_CallOneArg(s->dataclass_fields, (PyObject *)type);
+        if (entry == NULL)
+            return NULL;
+        if (entry == Py_None) {
+            Py_CLEAR(entry);
+        }
+        else if (!PyTuple_CheckExact(entry)) {
+            PyErr_Format(PyExc_TypeError,
+                         "dataclass_fields() must return a tuple or None, not %.80s",
+                         Py_TYPE(entry)->tp_name);
+            Py_DECREF(entry);
+            return NULL;
+        }
+    }
+    if (entry == NULL) {
+        if (encoder_type_may_have(type, state->JSON_attr_for_json))
+            flags |= TYPE_MAY_HAVE_FOR_JSON;
+        if (encoder_type_may_have(type, state->JSON_attr_asdict))
+            flags |= TYPE_MAY_HAVE_ASDICT;
+        entry = PyInt_FromSsize_t(flags);
+        if (entry == NULL)
+            return NULL;
+    }
+    if (PyDict_Size(s->type_memo) >= TYPE_MEMO_MAXSIZE)
+        PyDict_Clear(s->type_memo);
+    if (PyDict_SetItem(s->type_memo, (PyObject *)type, entry) < 0) {
+        Py_DECREF(entry);
+        return NULL;
+    }
+    return entry;
+}
+
+static int
+encoder_type_lookup(PyEncoderObject *s, PyObject *obj, PyObject **fn)
+{
+    /* Look up the type of obj in type_memo. Sets *fn to a new reference
+     * to its type encoder or tuple of dataclass fields, or NULL if it has
+     * neither, and returns the TYPE_MAY_HAVE_* flags of the type, or -1
+     * on error. */
+    PyObject *entry = encoder_type_entry(s, Py_TYPE(obj));
+    Py_ssize_t flags;
+    *fn = NULL;
+    if (entry == NULL)
+        return -1;
+    if (PyInt_Check(entry) || PyLong_Check(entry)) {
+        flags = PyInt_AsSsize_t(entry);
+        Py_DECREF(entry);
+        return (int)flags;
+    }
+    *fn = entry;
+    return 0;
+}
+
+static int
+encoder_subclass_type_encoder(PyEncoderObject *s, PyObject *obj,
+                              PyObject **fn)
+{
+    /* Set *fn to a new reference to the type encoder of obj if it is an
+     * instance of a subclass of str, int or float that has one in
+     * type_encoders, which is used before obj would be encoded as that
+     * type. Returns 1 if so, 0 if not, or -1 on error. */
+    PyObject *entry;
+    *fn = NULL;
+    if (!(JSON_StringCheck(obj) || PyInt_Check(obj) || PyLong_Check(obj) ||
+          PyFloat_Check(obj)) ||
+        PyUnicode_CheckExact(obj) || PyInt_CheckExact(obj) ||
+        PyLong_CheckExact(obj) || PyFloat_CheckExact(obj) ||
+        PyBool_Check(obj))
+        return 0;
+#if PY_MAJOR_VERSION < 3
+    if (PyString_CheckExact(obj))
+        return 0;
+#endif
+    entry = encoder_type_entry(s, Py_TYPE(obj));
+    if (entry == NULL)
+        return -1;
+    if (PyInt_Check(entry) || PyLong_Check(entry) || PyTuple_CheckExact(entry)) {
+        Py_DECREF(entry);
+        return 0;
+    }
+    *fn = entry;
+    return 1;
+}
+
+/* Encode fn(obj) in place of obj, where fn is the default hook or a
+ * type encoder, with circular-reference tracking via markers.
+ * Returns 0 on success, -1 on error. */
+static int
+encoder_listencode_converted(PyEncoderObject *s, JSON_Accu *rval,
+                             PyObject *obj, PyObject *fn,
+                             Py_ssize_t indent_level)
+{
+#if PY_VERSION_HEX >= 0x030B0000
+    _speedups_state *state = get_speedups_state(s->module_ref);
+#endif
+    PyObject *ident = NULL;
+    PyObject *newobj;
+    int rv;
+
+    if (encoder_markers_push(s, obj, &ident))
+        return -1;
+    if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
+        Py_XDECREF(ident);
+        return -1;
+    }
+    newobj = PyObject_CallOneArg(fn, obj);
+    if (newobj == NULL) {
+#if PY_VERSION_HEX >= 0x030B0000
+        /* Annotate before unwinding; the "when serializing X object"
+         * note uses the original obj's type name, matching the Python
+         * encoder which binds type(o).__name__ before `o = default(o)`
+         * runs. */
+        encoder_annotate_exception(state,
+            "when serializing %s object", Py_TYPE(obj)->tp_name);
+#endif
+        Py_LeaveRecursiveCall();
+        Py_XDECREF(ident);
+        return -1;
+    }
+    rv = encoder_listencode_obj(s, rval, newobj, indent_level);
+    Py_LeaveRecursiveCall();
+    if (rv) {
+#if PY_VERSION_HEX >= 0x030B0000
+        /* fn() succeeded but encoding its return value failed; in
+         * the Python encoder `o` has been rebound to newobj at this
+         * point, so the note reflects that type. */
+        encoder_annotate_exception(state,
+            "when serializing %s object", Py_TYPE(newobj)->tp_name);
+#endif
+    }
+    Py_DECREF(newobj);
+    if (rv == 0) {
+        if (encoder_markers_pop(s, ident) < 0)
+            rv = -1;
+    } else {
+        Py_XDECREF(ident);
+    }
+    return rv;
+}
+
+/* Fallback encoder path used when obj is not one of the directly-
+ * supported JSON types (const, string, int, float, list, dict,
+ * Decimal, etc.) and is not a _asdict / for_json candidate. Handles
+ * four sub-cases in order:
+ *   1. RawJSON — emit the already-encoded string verbatim.
+ *   2. LazyObject / LazyArray — encode what their _encodable() returns.
+ *   3. iterable_as_array — treat any iterable object as a JSON array.
+ *   4. default(obj) — call the user-supplied default hook and recurse
+ *      on its result, with circular-reference tracking via markers.
+ * Returns 0 on success, -1 on error. */
+static int
+encoder_listencode_default(PyEncoderObject *s, JSON_Accu *rval,
+                           PyObject *obj, Py_ssize_t indent_level)
+{
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *newobj;
+    int raw;
+    int rv;
+
+    raw = is_raw_json(state, obj);
+    if (raw < 0)
+        return -1;
+    if (raw) {
+        PyObject *encoded = PyObject_GetAttr(obj, state->JSON_attr_encoded_json);
+        if (encoded == NULL)
+            return -1;
+        return _steal_accumulate(state, rval, encoded);
+    }
+    raw = PyObject_IsInstance(obj, state->LazyContainerType);
+    if (raw < 0)
+        return -1;
+    if (raw) {
+        return encoder_listencode_converted(s, rval, obj,
+                                            state->LazyEncodable,
+                                            indent_level);
+    }
+
+    if (s->iterable_as_array) {
+        newobj = PyObject_GetIter(obj);
+        if (newobj == NULL) {
+            if (!PyErr_ExceptionMatches(PyExc_TypeError))
+                return -1;
+            PyErr_Clear();
+        } else {
+            rv = encoder_listencode_list(s, rval, newobj, indent_level);
+            Py_DECREF(newobj);
+            return rv;
+        }
+    }
+
+    return encoder_listencode_converted(s, rval, obj, s->defaultfn,
+                                        indent_level);
+}
+
+static char *
+json_write_digits(char *p, int value, int width)
+{
+    /* Write value as width decimal digits, padded with zeros */
+    int i;
+    for (i = width - 1; i >= 0; i--) {
+        p[i] = (char)('0' + value % 10);
+        value /= 10;
+    }
+    return p + width;
+}
+
+static char *
+json_write_time(char *p, int hour, int minute, int second, int microsecond)
+{
+    /* Write HH:MM:SS[.ffffff] as time.isoformat() does */
+    p = json_write_digits(p, hour, 2);
+    *p++ = ':';
+    p = json_write_digits(p, minute, 2);
+    *p++ = ':';
+    p = json_write_digits(p, second, 2);
+    if (microsecond) {
+        *p++ = '.';
+        p = json_write_digits(p, microsecond, 6);
+    }
+    return p;
+}
+
+static int
+encoder_listencode_isoformat(PyEncoderObject *s, JSON_Accu *rval,
+                             PyObject *obj)
+{
+    /* Encode a date, datetime or time as a string of its isoformat().
+     * Naive instances of the exact types are formatted here, the others
+     * by calling their isoformat() method. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    char buf[32];  /* "YYYY-MM-DDTHH:MM:SS.ffffff" */
+    char *p = buf;
+
+    *p++ = '"';
+    if (PyDate_CheckExact(obj) ||
+        (PyDateTime_CheckExact(obj) && !_PyDateTime_HAS_TZINFO(obj))) {
+        p = json_write_digits(p, PyDateTime_GET_YEAR(obj), 4);
+        *p++ = '-';
+        p = json_write_digits(p, PyDateTime_GET_MONTH(obj), 2);
+        *p++ = '-';
+        p = json_write_digits(p, PyDateTime_GET_DAY(obj), 2);
+        if (PyDateTime_CheckExact(obj)) {
+            *p++ = 'T';
+            p = json_write_time(p, PyDateTime_DATE_GET_HOUR(obj),
+                                PyDateTime_DATE_GET_MINUTE(obj),
+                                PyDateTime_DATE_GET_SECOND(obj),
+                                PyDateTime_DATE_GET_MICROSECOND(obj));
+        }
+    }
+    else if (PyTime_CheckExact(obj) && !_PyDateTime_HAS_TZINFO(obj)) {
+        p = json_write_time(p, PyDateTime_TIME_GET_HOUR(obj),
+                            PyDateTime_TIME_GET_MINUTE(obj),
+                            PyDateTime_TIME_GET_SECOND(obj),
+                            PyDateTime_TIME_GET_MICROSECOND(obj));
+    }
+    else {
+        PyObject *encoded;
+        PyObject *iso = PyObject_CallMethodObjArgs(
+            obj, state->JSON_attr_isoformat, NULL);
+        if (iso == NULL)
+            return -1;
+        encoded = encoder_encode_string(s, iso);
+        Py_DECREF(iso);
+        if (encoded == NULL)
+            return -1;
+        return _steal_accumulate(state, rval, encoded);
+    }
+    *p++ = '"';
+    return JSON_Accu_WriteASCII(state, rval, buf, p - buf);
+}
+
+static int
+json_uuid_bytes(PyObject *value, unsigned char *bytes)
+{
+    /* Write the int value of a UUID to bytes as 16 big-endian bytes.
+     * Returns 0 on success, 1 if it does not fit or -1 on error. */
+    if (!PyLong_Check(value))
+        return 1;
+#if PY_VERSION_HEX >= 0x030D0000
+    {
+        Py_ssize_t n = PyLong_AsNativeBytes(
+            value, bytes, 16,
+            Py_ASNATIVEBYTES_BIG_ENDIAN | Py_ASNATIVEBYTES_UNSIGNED_BUFFER |
+            Py_ASNATIVEBYTES_REJECT_NEGATIVE);
+        if (n < 0)
+            return -1;
+        return n > 16;
+    }
+#else
+    if (_PyLong_AsByteArray((PyLongObject *)value, bytes, 16, 0, 0) < 0)
+        return -1;
+    return 0;
+#endif
+}
+
+static int
+encoder_listencode_uuid(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj)
+{
+    /* Encode a UUID as a string of str(obj). The 8-4-4-4-12 hex digits
+     * of an exact UUID are written here from its int attribute. */
+    static const char hexdigits[] = "0123456789abcdef";
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    unsigned char bytes[16];
+    char buf[38];
+    char *p = buf;
+    PyObject *value;
+    int i;
+    int r = 1;
+
+    if (Py_TYPE(obj) == (PyTypeObject *)s->UUID) {
+        value = PyObject_GetAttr(obj, state->JSON_attr_int);
+        if (value == NULL)
+            return -1;
+        r = json_uuid_bytes(value, bytes);
+        Py_DECREF(value);
+        if (r < 0)
+            return -1;
+    }
+    if (r) {
+        PyObject *encoded;
+        value = PyObject_Str(obj);
+        if (value == NULL)
+            return -1;
+        encoded = encoder_encode_string(s, value);
+        Py_DECREF(value);
+        if (encoded == NULL)
+            return -1;
+        return _steal_accumulate(state, rval, encoded);
+    }
+    *p++ = '"';
+    for (i = 0; i < 16; i++) {
+        if (i == 4 || i == 6 || i == 8 || i == 10)
+            *p++ = '-';
+        *p++ = hexdigits[bytes[i] >> 4];
+        *p++ = hexdigits[bytes[i] & 0xf];
+    }
+    *p++ = '"';
+    return JSON_Accu_WriteASCII(state, rval, buf, p - buf);
+}
+
+static int
+encoder_listencode_base64(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj)
+{
+    /* Encode bytes or a bytearray as a string of its standard base64 */
+    static const char b64digits[] =
+        "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    const unsigned char *data;
+    Py_ssize_t i, n, size;
+    char *buf = NULL;
+    char *p;
+    int rv = -1;
+
+    Py_BEGIN_CRITICAL_SECTION(obj);
+    if (PyByteArray_Check(obj)) {
+        data = (const unsigned char *)PyByteArray_AS_STRING(obj);
+        n = PyByteArray_GET_SIZE(obj);
+    }
+    else {
+        data = (const unsigned char *)PyBytes_AS_STRING(obj);
+        n = PyBytes_GET_SIZE(obj);
+    }
+    if (n > (PY_SSIZE_T_MAX - 2) / 4 * 3 - 3) {
+        PyErr_SetString(PyExc_OverflowError, "bytes are too long to encode");
+    }
+    else {
+        size = (n + 2) / 3 * 4 + 2;
+        buf = (char *)PyMem_Malloc(size);
+        if (buf == NULL)
+            PyErr_NoMemory();
+    }
+    if (buf != NULL) {
+        p = buf;
+        *p++ = '"';
+        for (i = 0; i + 2 < n; i += 3) {
+            unsigned long v = ((unsigned long)data[i] << 16) |
+                              ((unsigned long)data[i + 1] << 8) | data[i + 2];
+            *p++ = b64digits[v >> 18];
+            *p++ = b64digits[(v >> 12) & 0x3f];
+            *p++ = b64digits[(v >> 6) & 0x3f];
+            *p++ = b64digits[v & 0x3f];
+        }
+        if (i < n) {
+            unsigned long v = (unsigned long)data[i] << 16;
+            if (i + 1 < n)
+                v |= (unsigned long)data[i + 1] << 8;
+            *p++ = b64digits[v >> 18];
+            *p++ = b64digits[(v >> 12) & 0x3f];
+            *p++ = i + 1 < n ? b64digits[(v >> 6) & 0x3f] : '=';
+            *p++ = '=';
+        }
+        *p++ = '"';
+        rv = JSON_Accu_WriteASCII(state, rval, buf, p - buf);
+        PyMem_Free(buf);
+    }
+    Py_END_CRITICAL_SECTION();
+    return rv;
+}
+
+static int
+encoder_listencode_extra(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj,
+                         Py_ssize_t indent_level)
+{
+    /* Encode obj if it is of one of the types enabled by the
+     * datetime_format, uuid_as_str, enum_as_value and bytes_as options.
+     * Returns 1 if it was encoded, 0 if it is not of those types, or -1
+     * on error. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *value;
+    int rv;
+
+    if (s->datetime_as_iso && (PyDate_Check(obj) || PyTime_Check(obj)))
+        rv = encoder_listencode_isoformat(s, rval, obj);
+    else if (s->UUID != Py_None &&
+             PyObject_TypeCheck(obj, (PyTypeObject *)s->UUID))
+        rv = encoder_listencode_uuid(s, rval, obj);
+    else if (s->Enum != Py_None &&
+             PyObject_TypeCheck(obj, (PyTypeObject *)s->Enum)) {
+        value = PyObject_GetAttr(obj, state->JSON_attr_value);
+        if (value == NULL)
+            return -1;
+        if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
+            Py_DECREF(value);
+            return -1;
+        }
+        rv = encoder_listencode_obj(s, rval, value, indent_level);
+        Py_LeaveRecursiveCall();
+        Py_DECREF(value);
+    }
+    else if (s->bytes_as_base64 &&
+             (PyBytes_Check(obj) || PyByteArray_Check(obj)))
+        rv = encoder_listencode_base64(s, rval, obj);
+    else
+        return 0;
+    return rv ? -1 : 1;
+}
+
+static int
+encoder_buffer_format(const char *format, Py_ssize_t itemsize,
+                      char *code, int *swap)
+{
+    /* Parse the struct format of the items of a buffer. Returns 1 and sets
+     * *code to its format character and *swap to whether the bytes of each
+     * item are in the other byte order, or 0 if the items are not single
+     * numbers that fit in 8 bytes. */
+    const int one = 1;
+    int host_little = *(const char *)&one;
+    int native = 1;
+    int little = host_little;
+    Py_ssize_t size;
+
+    if (format == NULL)
+        format = "B";
+    if (*format == '@') {
+        format++;
+    }
+    else if (*format == '=' || *format == '<' || *format == '>' ||
+             *format == '!') {
+        native = 0;
+        if (*format != '=')
+            little = (*format == '<');
+        format++;
+    }
+    if (format[0] == '\0' || format[1] != '\0')
+        return 0;
+    switch (format[0]) {
+    case 'b': case 'B': case '?':
+        size = 1;
+        break;
+    case 'h': case 'H':
+        size = 2;
+        break;
+    case 'i': case 'I':
+        size = native ? (Py_ssize_t)sizeof(int) : 4;
+        break;
+    case 'l': case 'L':
+        size = native ? (Py_ssize_t)sizeof(long) : 4;
+        break;
+    case 'q': case 'Q':
+        size = 8;
+        break;
+    case 'n': case 'N':
+        if (!native)
+            return 0;
+        size = sizeof(Py_ssize_t);
+        break;
+    case 'f':
+        size = sizeof(float);
+        break;
+    case 'd':
+        size = sizeof(double);
+        break;
+    default:
+        return 0;
+    }
+    if (size != itemsize || size > 8)
+        return 0;
+    *code = format[0];
+    *swap = (little != host_little);
+    return 1;
+}
+
+/* The most dimensions of a buffer encoded by buffer_as_array, as for
+ * memoryview */
+#define BUFFER_MAX_NDIM 64
+/* The size of the buffer in which the output of encoder_listencode_buffer
+ * is collected */
+#define BUFFER_OUT_SIZE 4096
+
+/* The output of encoder_listencode_buffer, collected in buf and written
+ * to rval in large pieces rather than as one string per number */
+typedef struct {
+    PyEncoderObject *s;
+    _speedups_state *state;
+    JSON_Accu *rval;
+    const char *separator;    /* item_separator if it is ASCII, else NULL */
+    Py_ssize_t separator_len;
+    const char *indent;       /* indent if it is ASCII, else NULL */
+    Py_ssize_t indent_len;
+    Py_ssize_t len;
+    char buf[BUFFER_OUT_SIZE];
+} JSON_BufferOut;
+
+static const char *
+json_ascii_chars(PyObject *obj, Py_ssize_t *n)
+{
+    /* Return the characters of obj if it is an ASCII string, else NULL */
+#if PY_MAJOR_VERSION >= 3
+    if (PyUnicode_Check(obj) && PyUnicode_IS_ASCII(obj))
+        return PyUnicode_AsUTF8AndSize(obj, n);
+#else
+    if (PyString_Check(obj)) {
+        const char *p = PyString_AS_STRING(obj);
+        Py_ssize_t i;
+        *n = PyString_GET_SIZE(obj);
+        for (i = 0; i < *n; i++) {
+            if ((unsigned char)p[i] >= 0x80)
+                return NULL;
+        }
+        return p;
+    }
+#endif
+    return NULL;
+}
+
+static int
+json_out_flush(JSON_BufferOut *out)
+{
+    int rv = 0;
+    if (out->len) {
+        rv = JSON_Accu_WriteASCII(out->state, out->rval, out->buf, out->len);
+        out->len = 0;
+    }
+    return rv;
+}
+
+static int
+json_out_write(JSON_BufferOut *out, const char *p, Py_ssize_t n)
+{
+    if (out->len + n > BUFFER_OUT_SIZE) {
+        if (json_out_flush(out))
+            return -1;
+        if (n > BUFFER_OUT_SIZE)
+            return JSON_Accu_WriteASCII(out->state, out->rval, p, n);
+    }
+    memcpy(out->buf + out->len, p, n);
+    out->len += n;
+    return 0;
+}
+
+static int
+json_out_steal(JSON_BufferOut *out, PyObject *stolen)
+{
+    /* Write the string stolen after what has been collected so far */
+    if (stolen == NULL)
+        return -1;
+    if (json_out_flush(out)) {
+        Py_DECREF(stolen);
+        return -1;
+    }
+    return _steal_accumulate(out->state, out->rval, stolen);
+}
+
+static int
+json_out_newline_indent(JSON_BufferOut *out, Py_ssize_t indent_level)
+{
+    Py_ssize_t i;
+    if (out->indent == NULL) {
+        if (json_out_flush(out))
+            return -1;
+        return encoder_accumulate_newline_indent(out->s, out->state,
+                                                 out->rval, indent_level);
+    }
+    if (json_out_write(out, "\n", 1))
+        return -1;
+    for (i = 0; i < indent_level; i++) {
+        if (json_out_write(out, out->indent, out->indent_len))
+            return -1;
+    }
+    return 0;
+}
+
+static int
+json_out_separator(JSON_BufferOut *out, Py_ssize_t indent_level)
+{
+    /* Write the item separator, and the newline indent when indented */
+    if (out->separator != NULL) {
+        if (json_out_write(out, out->separator, out->separator_len))
+            return -1;
+    }
+    else {
+        Py_INCREF(out->s->item_separator);
+        if (json_out_steal(out, out->s->item_separator))
+            return -1;
+    }
+    if (out->s->indent != Py_None)
+        return json_out_newline_indent(out, indent_level);
+    return 0;
+}
+
+static int
+json_out_integer(JSON_BufferOut *out, unsigned long long u, int negative)
+{
+    /* Write the decimal digits of u, after a minus sign if negative */
+    char buf[24];
+    char *p = buf + sizeof(buf);
+    do {
+        *--p = (char)('0' + (int)(u % 10));
+        u /= 10;
+    } while (u);
+    if (negative)
+        *--p = '-';
+    return json_out_write(out, p, buf + sizeof(buf) - p);
+}
+
+static int
+encoder_listencode_buffer_item(JSON_BufferOut *out, const char *ptr,
+                               Py_ssize_t itemsize, char code, int swap)
+{
+    /* Encode the number of format code at ptr */
+    PyEncoderObject *s = out->s;
+    unsigned char b[8];
+    Py_ssize_t i;
+    PyObject *value;
+    PyObject *encoded;
+
+    if (swap) {
+        for (i = 0; i < itemsize; i++)
+            b[i] = (unsigned char)ptr[itemsize - 1 - i];
+    }
+    else {
+        memcpy(b, ptr, itemsize);
+    }
+    if (code == '?') {
+        if (b[0])
+            return json_out_write(out, "true", 4);
+        return json_out_write(out, "false", 5);
+    }
+    if (code == 'f' || code == 'd') {
+        double d;
+        if (code == 'f') {
+            float f;
+            memcpy(&f, b, sizeof(f));
+            d = f;
+        }
+        else {
+            memcpy(&d, b, sizeof(d));
+        }
+        if (Py_IS_FINITE(d)) {
+            char *repr = PyOS_double_to_string(d, 'r', 0, Py_DTSF_ADD_DOT_0,
+                                               NULL);
+            int rv;
+            if (repr == NULL)
+                return -1;
+            rv = json_out_write(out, repr, strlen(repr));
+            PyMem_Free(repr);
+            return rv;
+        }
+        value = PyFloat_FromDouble(d);
+        if (value == NULL)
+            return -1;
+        encoded = encoder_encode_float(s, value);
+        Py_DECREF(value);
+        return json_out_steal(out, encoded);
+    }
+    if (code == 'B' || code == 'H' || code == 'I' || code == 'L' ||
+        code == 'Q' || code == 'N') {
+        unsigned long long u;
+        if (itemsize == 1) {
+            u = b[0];
+        }
+        else if (itemsize == (Py_ssize_t)sizeof(unsigned short)) {
+            unsigned short v;
+            memcpy(&v, b, sizeof(v));
+            u = v;
+        }
+        else if (itemsize == (Py_ssize_t)sizeof(unsigned int)) {
+            unsigned int v;
+            memcpy(&v, b, sizeof(v));
+            u = v;
+        }
+        else {
+            memcpy(&u, b, sizeof(u));
+        }
+        if (s->max_long_size == Py_None)
+            return json_out_integer(out, u, 0);
+        value = PyLong_FromUnsignedLongLong(u);
+    }
+    else {
+        long long v;
+        if (itemsize == 1) {
+            v = (signed char)b[0];
+        }
+        else if (itemsize == (Py_ssize_t)sizeof(short)) {
+            short h;
+            memcpy(&h, b, sizeof(h));
+            v = h;
+        }
+        else if (itemsize == (Py_ssize_t)sizeof(int)) {
+            int n;
+            memcpy(&n, b, sizeof(n));
+            v = n;
+        }
+        else {
+            memcpy(&v, b, sizeof(v));
+        }
+        if (s->max_long_size == Py_None) {
+            if (v < 0)
+                return json_out_integer(out, 0ULL - (unsigned long long)v, 1);
+            return json_out_integer(out, (unsigned long long)v, 0);
+        }
+        value = PyLong_FromLongLong(v);
+    }
+    /* int_as_string_bitcount is set */
+    if (value == NULL)
+        return -1;
+    encoded = encoder_long_to_str(value);
+    if (encoded != NULL)
+        encoded = maybe_quote_bigint(s, encoded, value);
+    Py_DECREF(value);
+    return json_out_steal(out, encoded);
+}
+
+static int
+encoder_listencode_buffer_dim(JSON_BufferOut *out, Py_buffer *view,
+                              const Py_ssize_t *shape,
+                              const Py_ssize_t *strides,
+                              const char *ptr, int dim, char code, int swap,
+                              Py_ssize_t indent_level)
+{
+    /* Encode dimension dim of view, starting at ptr, as a JSON array */
+    int indented = (out->s->indent != Py_None);
+    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
+    Py_ssize_t n = shape[dim];
+    Py_ssize_t stride = strides[dim];
+    Py_ssize_t i;
+
+    if (n == 0)
+        return json_out_write(out, "[]", 2);
+    if (json_out_write(out, "[", 1))
+        return -1;
+    if (indented && json_out_newline_indent(out, inner_indent_level))
+        return -1;
+    for (i = 0; i < n; i++, ptr += stride) {
+        int rv;
+        if (i && json_out_separator(out, inner_indent_level))
+            return -1;
+        if (dim + 1 < view->ndim)
+            rv = encoder_listencode_buffer_dim(out, view, shape, strides,
+                                               ptr, dim + 1, code, swap,
+                                               inner_indent_level);
+        else
+            rv = encoder_listencode_buffer_item(out, ptr, view->itemsize,
+                                                code, swap);
+        if (rv)
+            return -1;
+    }
+    if (indented && json_out_newline_indent(out, indent_level))
+        return -1;
+    return json_out_write(out, "]", 1);
+}
+
+static int
+encoder_listencode_buffer(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj,
+                          Py_ssize_t indent_level)
+{
+    /* Encode obj for the buffer_as_array option: the numbers of a buffer
+     * such as an array.array, memoryview or NumPy array are formatted
+     * straight from its memory as (nested) JSON arrays, or as a single
+     * number for a zero-dimensional buffer such as a NumPy scalar.
+     * Returns 1 if it was encoded, 0 if obj does not export a buffer of
+     * plain numbers, or -1 on error. */
+    JSON_BufferOut out;
+    Py_buffer view;
+    Py_ssize_t shape[BUFFER_MAX_NDIM];
+    Py_ssize_t strides[BUFFER_MAX_NDIM];
+    char code;
+    int swap;
+    int rv;
+    int i;
+
+    if (!PyObject_CheckBuffer(obj) || PyBytes_Check(obj) ||
+        PyByteArray_Check(obj) || PyUnicode_Check(obj))
+        return 0;
+    if (PyObject_GetBuffer(obj, &view, PyBUF_STRIDES | PyBUF_FORMAT) < 0) {
+        if (!PyErr_ExceptionMatches(PyExc_BufferError))
+            return -1;
+        PyErr_Clear();
+        return 0;
+    }
+    if (view.ndim > BUFFER_MAX_NDIM ||
+        !encoder_buffer_format(view.format, view.itemsize, &code, &swap)) {
+        PyBuffer_Release(&view);
+        return 0;
+    }
+    /* Some exporters, such as ctypes, leave out the shape of a
+     * one-dimensional buffer or the strides of a contiguous one */
+    for (i = view.ndim - 1; i >= 0; i--) {
+        if (view.shape != NULL)
+            shape[i] = view.shape[i];
+        else
+            shape[i] = view.len / view.itemsize;
+        if (view.strides != NULL)
+            strides[i] = view.strides[i];
+        else if (i == view.ndim - 1)
+            strides[i] = view.itemsize;
+        else
+            strides[i] = strides[i + 1] * shape[i + 1];
+    }
+    out.s = s;
+    out.state = get_speedups_state(s->module_ref);
+    out.rval = rval;
+    out.separator = json_ascii_chars(s->item_separator, &out.separator_len);
+    out.indent = NULL;
+    if (s->indent != Py_None)
+        out.indent = json_ascii_chars(s->indent, &out.indent_len);
+    out.len = 0;
+    if (view.ndim == 0)
+        rv = encoder_listencode_buffer_item(&out, (char *)view.buf,
+                                            view.itemsize, code, swap);
+    else
+        rv = encoder_listencode_buffer_dim(&out, &view, shape, strides,
+                                           (char *)view.buf, 0, code, swap,
+                                           indent_level);
+    if (rv == 0)
+        rv = json_out_flush(&out);
+    PyBuffer_Release(&view);
+    return rv ? -1 : 1;
+}
+
+static int
+encoder_listencode_obj(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj, Py_ssize_t indent_level)
+{
+    /* Encode Python object obj to a JSON term, rval is a PyList */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *newobj;
+    int flags;
+    int extra;
+    int buffered;
+    int rv = -1;
+    if (s->type_encoders != Py_None &&
+        (rv = encoder_subclass_type_encoder(s, obj, &newobj)) != 0) {
+        if (rv > 0) {
+            rv = encoder_listencode_converted(s, rval, obj, newobj,
+                                              indent_level);
+            Py_DECREF(newobj);
+        }
+        return rv;
+    }
+    /* Check strings first — they are the most common JSON value type. */
+#if PY_MAJOR_VERSION >= 3
+    if (rval->utf8 != NULL && s->fast_encode && PyUnicode_Check(obj)) {
+        /* encode_bytes: escape straight into the output buffer */
+        rv = JSON_Accu_WriteUTF8(rval, obj, s->fast_encode);
+    }
+    else
+#endif
+    if ((PyBytes_Check(obj) && s->encoding != Py_None &&
+         !JSON_BYTES_AS_BINARY(s)) ||
+        PyUnicode_Check(obj))
+    {
+        PyObject *encoded = encoder_encode_string(s, obj);
+        if (encoded != NULL)
+            rv = _steal_accumulate(state, rval, encoded);
+    }
+    else if (obj == Py_None || obj == Py_True || obj == Py_False) {
+        PyObject *cstr = _encoded_const(state, obj);
+        if (cstr != NULL)
+            rv = _steal_accumulate(state, rval, cstr);
+    }
+    else if (PyInt_Check(obj) || PyLong_Check(obj)) {
+        PyObject *encoded = encoder_long_to_str(obj);
+        if (encoded != NULL) {
+            encoded = maybe_quote_bigint(s, encoded, obj);
+            if (encoded != NULL)
+                rv = _steal_accumulate(state, rval, encoded);
+        }
+    }
+    else if (PyFloat_Check(obj)) {
+        PyObject *encoded = encoder_encode_float(s, obj);
+        if (encoded != NULL)
+            rv = _steal_accumulate(state, rval, encoded);
+    }
+    else if (s->extra_types &&
+             (extra = encoder_listencode_extra(s, rval, obj, indent_level))) {
+        if (extra > 0)
+            rv = 0;
+    }
+    else if ((flags = encoder_type_lookup(s, obj, &newobj)) < 0) {
+        /* error */
+    }
+    else if (newobj != NULL && PyTuple_CheckExact(newobj)) {
+        if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
+            Py_DECREF(newobj);
+            return rv;
+        }
+        rv = encoder_listencode_fields(s, rval, obj, newobj, indent_level);
+        Py_LeaveRecursiveCall();
+        Py_DECREF(newobj);
+    }
+    else if (newobj != NULL) {
+        rv = encoder_listencode_converted(s, rval, obj, newobj, indent_level);
+        Py_DECREF(newobj);
+    }
+    else if (s->for_json && (flags & TYPE_MAY_HAVE_FOR_JSON) &&
+             _call_json_method(obj, state->JSON_attr_for_json, &newobj)) {
+        rv = encoder_steal_encode(s, rval, newobj, indent_level, /*as_dict=*/0);
+    }
+    else if (s->namedtuple_as_object && (flags & TYPE_MAY_HAVE_ASDICT) &&
+             _call_json_method(obj, state->JSON_attr_asdict, &newobj)) {
+        rv = encoder_steal_encode(s, rval, newobj, indent_level, /*as_dict=*/1);
+    }
+    else if (PyList_Check(obj) || (s->tuple_as_array && PyTuple_Check(obj))) {
+        if (Py_EnterRecursiveCall(" while encoding a JSON object"))
+            return rv;
+        rv = encoder_listencode_list(s, rval, obj, indent_level);
+        Py_LeaveRecursiveCall();
+    }
+    else if (JSON_AnyDict_Check(obj)) {
+        if (Py_EnterRecursiveCall(" while encoding a JSON object"))
+            return rv;
+        rv = encoder_listencode_dict(s, rval, obj, indent_level);
+        Py_LeaveRecursiveCall();
+    }
+    else if (s->use_decimal && PyObject_TypeCheck(obj, (PyTypeObject *)s->Decimal)) {
+        PyObject *encoded = PyObject_Str(obj);
+        if (encoded != NULL)
+            rv = _steal_accumulate(state, rval, encoded);
+    }
+    else if (s->buffer_as_array &&
+             (buffered = encoder_listencode_buffer(s, rval, obj, indent_level))) {
+        if (buffered > 0)
+            rv = 0;
+    }
+    else {
+        rv = encoder_listencode_default(s, rval, obj, indent_level);
+    }
+    return rv;
+}
+
+/* The most keys kept in key_memo, which lives as long as the JSONEncoder.
+ * When it is full it is cleared, so a stream of distinct keys cannot grow
+ * it without limit. */
+#define KEY_MEMO_MAXSIZE 1024
+
+static PyObject *
+encoder_encode_key_item(PyEncoderObject *s, PyObject *kstr)
+{
+    /* Return the encoded key kstr followed by the key separator */
+    PyObject *encoded = encoder_encode_string(s, kstr);
+    PyObject *rval;
+    if (encoded == NULL)
+        return NULL;
+    rval = PyNumber_Add(encoded, s->key_separator);
+    Py_DECREF(encoded);
+    return rval;
+}
+
+/* Stringify and encode a dict key to its JSON representation followed by
+ * the key separator, using the key_memo cache for string keys.  Returns a
+ * new reference to the encoded string on success, Py_None (borrowed, no
+ * new reference) for skipkeys, or NULL on error. */
+static PyObject *
+encoder_encode_dict_key(PyEncoderObject *s, PyObject *key)
+{
+    PyObject *kstr;
+    PyObject *encoded;
+
+    kstr = encoder_stringify_key(s, key);
+    if (kstr == NULL)
+        return NULL;
+    if (kstr == Py_None) {
+        Py_DECREF(kstr);
+        return Py_None;  /* skipkeys */
+    }
+
+    /* For string keys (PyUnicode on Py3, PyString on Py2),
+     * encoder_stringify_key returns Py_INCREF(key) — i.e. kstr IS key.
+     * For non-string keys it returns a freshly created string, so
+     * kstr != key.  Use this identity test to decide whether the
+     * key_memo cache applies: caching under a non-string original key
+     * would be write-only (the lookup uses kstr, not key). */
+    if (kstr == key) {
+        int cached = json_PyDict_GetItemRef(s->key_memo, kstr, &encoded);
+        if (cached < 0) {
+            Py_DECREF(kstr);
+            return NULL;
+        }
+        if (cached == 0) {
+            encoded = encoder_encode_key_item(s, kstr);
+            if (encoded == NULL) {
+                Py_DECREF(kstr);
+                return NULL;
+            }
+            if (PyDict_Size(s->key_memo) >= KEY_MEMO_MAXSIZE)
+                PyDict_Clear(s->key_memo);
+            if (PyDict_SetItem(s->key_memo, key, encoded)) {
+                Py_DECREF(kstr);
+                Py_DECREF(encoded);
+                return NULL;
+            }
+        }
+        Py_DECREF(kstr);
+    } else {
+        encoded = encoder_encode_key_item(s, kstr);
+        Py_DECREF(kstr);
+        if (encoded == NULL)
+            return NULL;
+    }
+    return encoded;  /* new reference */
+}
+
+/* Write '\n' followed by indent_level copies of s->indent directly to
+ * the accumulator, without materializing the combined string as an
+ * intermediate PyObject. This is the newline-plus-indent prefix
+ * emitted before each item of an indented array or object and before
+ * the matching closing bracket.
+ *
+ * Writing pieces rather than building a concatenated string saves a
+ * PyUnicode_FromStringAndSize + PySequence_Repeat + PyNumber_Add per
+ * container (versus the previous encoder_build_indent_string helper),
+ * which matters most for deeply nested structures and on 3.14+ where
+ * JSON_Accu is a PyUnicodeWriter that appends in-place at near-zero
+ * per-write cost. On older Python the cost is one PyList_Append per
+ * piece; the extra list entries are cheap compared to the allocation
+ * traffic and the PySequence_Repeat's proportional memcpy work.
+ *
+ * Returns 0 on success, -1 on allocation failure. Only called when
+ * s->indent is not Py_None. */
+static int
+encoder_accumulate_newline_indent(PyEncoderObject *s, _speedups_state *state,
+                                  JSON_Accu *rval, Py_ssize_t indent_level)
+{
+    Py_ssize_t i;
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_newline))
+        return -1;
+    for (i = 0; i < indent_level; i++) {
+        if (JSON_Accu_Accumulate(state, rval, s->indent))
+            return -1;
+    }
+    return 0;
+}
+
+#if PY_VERSION_HEX >= 0x030B0000
+/* Attach a PEP 678 note formatted via PyUnicode_FromFormatV to the in-
+ * flight exception. Mirrors the pure-Python encoder's
+ * `except BaseException as exc: exc.add_note(...); raise` wrappers
+ * around each recursive encode step.
+ *
+ * Crucially, PyErr_Fetch runs BEFORE the note is built: the `%R`
+ * formatter walks into PyObject_Repr, which on debug builds
+ * (cpython-3.14-debug and cpython-3.14t+debug) asserts that no
+ * exception is currently set. Building the note while our caller's
+ * exception is still live would core-dump those jobs, as the CI
+ * failure on job 72447820967 / 72447820982 demonstrated. Fetch first,
+ * format second, Restore last.
+ *
+ * Failures on the note path — a repr() that raises, PyUnicode_FromFormatV
+ * returning NULL, a BaseException subclass whose add_note override
+ * raises — are swallowed so the in-flight exception survives intact.
+ *
+ * Only compiled on Python 3.11+, where PEP 678 exists. */
+static void
+encoder_annotate_exception(_speedups_state *state, const char *format, ...)
+{
+    PyObject *exc_type;
+    PyObject *exc_value;
+    PyObject *exc_tb;
+    PyObject *note;
+    PyObject *result;
+    va_list args;
+
+    PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+    if (exc_value == NULL) {
+        /* No live exception to annotate — callsites always have one,
+         * so this is a defensive no-op. */
+        PyErr_Restore(exc_type, exc_value, exc_tb);
+        return;
+    }
+    PyErr_NormalizeException(&exc_type, &exc_value, &exc_tb);
+
+    va_start(args, format);
+    note = PyUnicode_FromFormatV(format, args);
+    va_end(args);
+
+    if (note != NULL) {
+        result = PyObject_CallMethodObjArgs(exc_value, state->JSON_attr_add_note,
+                                            note, NULL);
+        Py_DECREF(note);
+        if (result == NULL)
+            PyErr_Clear();
+        else
+            Py_DECREF(result);
+    }
+    else {
+        PyErr_Clear();
+    }
+
+    PyErr_Restore(exc_type, exc_value, exc_tb);
+}
+#endif
+
+static int
+encoder_listencode_shaped_dict(PyEncoderObject *s, JSON_Accu *rval,
+                               PyObject *dct, Py_ssize_t inner_indent_level)
+{
+    /* Encode the items of the exact dict dct in sorted key order, if the
+     * order of its keys is in shape_memo (see
+     * encoder_sort_items_by_shape), without building and sorting a list
+     * of items. Returns 1 if the items were encoded, 0 if the shape is
+     * not known and nothing was written, or -1 on error. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    int indented = (s->indent != Py_None);
+    PyObject *keys;
+    PyObject *values;
+    PyObject *perm = NULL;
+    const Py_ssize_t *order;
+    Py_ssize_t n, i;
+    int rv = 0;
+
+    n = PyDict_Size(dct);
+    if (n > SHAPE_MEMO_MAXKEYS)
+        return 0;
+    keys = PyTuple_New(n);
+    if (keys == NULL)
+        return -1;
+    values = PyTuple_New(n);
+    if (values == NULL) {
+        Py_DECREF(keys);
+        return -1;
+    }
+    i = 0;
+    Py_BEGIN_CRITICAL_SECTION(dct);
+    {
+        Py_ssize_t pos = 0;
+        PyObject *key, *value;
+        while (PyDict_Next(dct, &pos, &key, &value)) {
+            if (i == n || !(PyUnicode_CheckExact(key)
+#if PY_MAJOR_VERSION < 3
+                            || PyString_CheckExact(key)
+#endif
+                            )) {
+                i = -1;
+                break;
+            }
+            Py_INCREF(key);
+            PyTuple_SET_ITEM(keys, i, key);
+            Py_INCREF(value);
+            PyTuple_SET_ITEM(values, i, value);
+            i++;
+        }
+    }
+    Py_END_CRITICAL_SECTION();
+    if (i != n)
+        goto done;
+    rv = json_PyDict_GetItemRef(s->shape_memo, keys, &perm);
+    if (rv <= 0)
+        goto done;
+    order = (const Py_ssize_t *)PyBytes_AS_STRING(perm);
+    for (i = 0; i < n; i++) {
+        PyObject *key = PyTuple_GET_ITEM(keys, order[i]);
+        PyObject *encoded = encoder_encode_dict_key(s, key);
+        if (encoded == NULL)
+            goto bail;
+        if (i) {
+            if (JSON_Accu_Accumulate(state, rval, s->item_separator) ||
+                (indented && encoder_accumulate_newline_indent(
+                                 s, state, rval, inner_indent_level))) {
+                Py_DECREF(encoded);
+                goto bail;
+            }
+        }
+        if (_steal_accumulate(state, rval, encoded))
+            goto bail;
+        if (encoder_listencode_obj(s, rval, PyTuple_GET_ITEM(values, order[i]),
+                                   inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+            encoder_annotate_exception(state,
+                "when serializing %s item %R",
+                Py_TYPE(dct)->tp_name, key);
+#endif
+            goto bail;
+        }
+    }
+    rv = 1;
+done:
+    Py_XDECREF(perm);
+    Py_DECREF(keys);
+    Py_DECREF(values);
+    return rv;
+bail:
+    rv = -1;
+    goto done;
+}
+
+static int
+encoder_listencode_dict(PyEncoderObject *s, JSON_Accu *rval, PyObject *dct, Py_ssize_t indent_level)
+{
+    /* Encode Python dict dct a JSON term */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *ident = NULL;
+    PyObject *encoded = NULL;
+    PyObject *iter = NULL;
+    PyObject *item = NULL;
+    /* When s->indent is not Py_None, each inter-item boundary is emitted
+     * as s->item_separator + '\n' + (s->indent * inner_indent_level) via
+     * multiple JSON_Accu_Accumulate calls; no combined PyObject is
+     * materialized. */
+    int indented = (s->indent != Py_None);
+    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
+    Py_ssize_t idx;
+
+    {
+        Py_ssize_t dct_size = PyDict_Check(dct) ? PyDict_Size(dct)
+                                                : PyObject_Length(dct);
+        if (dct_size == 0)
+            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_dict);
+        if (dct_size < 0)
+            return -1;
+    }
+
+    if (encoder_markers_push(s, dct, &ident))
+        goto bail;
+
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_dict))
         goto bail;
-    s->allow_or_ignore_nan = is_true ? JSON_IGNORE_NAN : 0;
-    is_true = PyObject_IsTrue(allow_nan);
-    if (is_true < 0)
+
+    if (indented) {
+        if (encoder_accumulate_newline_indent(s, state, rval, inner_indent_level))
+            goto bail;
+    }
+
+    /* Fast path: when sort_keys is off and dct is an exact dict,
+     * iterate with PyDict_Next to avoid allocating an items list.
+     * Py_BEGIN_CRITICAL_SECTION prevents concurrent dict mutation
+     * on free-threaded builds; on default builds it is a no-op. */
+    if (s->item_sort_kw == Py_None && PyDict_CheckExact(dct)) {
+        Py_ssize_t pos = 0;
+        PyObject *key, *value;
+        int err = 0;
+
+        idx = 0;
+        Py_BEGIN_CRITICAL_SECTION(dct);
+        while (PyDict_Next(dct, &pos, &key, &value)) {
+            Py_INCREF(key);
+            Py_INCREF(value);
+
+            encoded = encoder_encode_dict_key(s, key);
+            Py_DECREF(key);
+            if (encoded == NULL) {
+                Py_DECREF(value); err = 1; break;
+            }
+            if (encoded == Py_None) {
+                /* skipkeys */
+                encoded = NULL;
+                Py_DECREF(value);
+                continue;
+            }
+            if (idx) {
+                if (JSON_Accu_Accumulate(state, rval, s->item_separator)) {
+                    Py_DECREF(value); err = 1; break;
+                }
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, inner_indent_level)) {
+                    Py_DECREF(value); err = 1; break;
+                }
+            }
+            if (JSON_Accu_Accumulate(state, rval, encoded)) {
+                Py_DECREF(value); err = 1; break;
+            }
+            Py_CLEAR(encoded);
+            if (encoder_listencode_obj(s, rval, value, inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+                encoder_annotate_exception(state,
+                    "when serializing %s item %R",
+                    Py_TYPE(dct)->tp_name, key);
+#endif
+                Py_DECREF(value); err = 1; break;
+            }
+            Py_DECREF(value);
+            idx++;
+        }
+        Py_END_CRITICAL_SECTION();
+
+        if (err || PyErr_Occurred())
+            goto bail;
+    }
+    else {
+        /* Sorted iteration of an exact dict with a known shape */
+        if (s->shape_memo != Py_None && PyDict_CheckExact(dct) &&
+                s->item_sort_key == state->JSON_itemgetter0) {
+            int rv = encoder_listencode_shaped_dict(s, rval, dct,
+                                                    inner_indent_level);
+            if (rv < 0)
+                goto bail;
+            if (rv > 0)
+                goto done;
+        }
+        /* Slow path: sorted iteration, dict subclasses, or non-dict
+         * mappings.  Build an items list via encoder_dict_iteritems. */
+        iter = encoder_dict_iteritems(s, dct);
+        if (iter == NULL)
+            goto bail;
+
+        idx = 0;
+        while ((item = PyIter_Next(iter))) {
+            PyObject *key, *value;
+            if (!PyTuple_Check(item) || Py_SIZE(item) != 2) {
+                PyErr_SetString(PyExc_ValueError, "items must return 2-tuples");
+                goto bail;
+            }
+            key = PyTuple_GET_ITEM(item, 0);
+            value = PyTuple_GET_ITEM(item, 1);
+
+            encoded = encoder_encode_dict_key(s, key);
+            if (encoded == NULL)
+                goto bail;
+            if (encoded == Py_None) {
+                /* skipkeys */
+                encoded = NULL;
+                Py_CLEAR(item);
+                continue;
+            }
+            if (idx) {
+                if (JSON_Accu_Accumulate(state, rval, s->item_separator))
+                    goto bail;
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, inner_indent_level))
+                    goto bail;
+            }
+            if (JSON_Accu_Accumulate(state, rval, encoded))
+                goto bail;
+            Py_CLEAR(encoded);
+            if (encoder_listencode_obj(s, rval, value, inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+                encoder_annotate_exception(state,
+                    "when serializing %s item %R",
+                    Py_TYPE(dct)->tp_name, key);
+#endif
+                goto bail;
+            }
+            Py_CLEAR(item);
+            idx++;
+        }
+        Py_CLEAR(iter);
+        if (PyErr_Occurred())
+            goto bail;
+    }
+
+done:
+    if (encoder_markers_pop(s, ident))
         goto bail;
-    s->allow_or_ignore_nan |= is_true ? JSON_ALLOW_NAN : 0;
-    s->use_decimal = PyObject_IsTrue(use_decimal);
-    if (s->use_decimal < 0)
+    ident = NULL;
+    if (indented) {
+        if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
+            goto bail;
+    }
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_close_dict))
         goto bail;
-    s->namedtuple_as_object = PyObject_IsTrue(namedtuple_as_object);
-    if (s->namedtuple_as_object < 0)
+    return 0;
+
+bail:
+    Py_XDECREF(encoded);
+    Py_XDECREF(item);
+    Py_XDECREF(iter);
+    Py_XDECREF(ident);
+    return -1;
+}
+
+
+/* Return a new list of the (name, value) items of the dataclass fields of
+ * obj, sorted by item_sort_kw when it is set, or NULL on error. */
+static PyObject *
+encoder_fields_items(PyEncoderObject *s, PyObject *obj, PyObject *fields)
+{
+    Py_ssize_t i;
+    Py_ssize_t n = PyTuple_GET_SIZE(fields);
+    PyObject *items = PyList_New(n);
+    if (items == NULL)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        PyObject *name = PyTuple_GET_ITEM(fields, i);
+        PyObject *value = PyObject_GetAttr(obj, name);
+        PyObject *item;
+        if (value == NULL)
+            goto bail;
+        item = PyTuple_Pack(2, name, value);
+        Py_DECREF(value);
+        if (item == NULL)
+            goto bail;
+        PyList_SET_ITEM(items, i, item);
+    }
+    if (s->item_sort_kw != Py_None && encoder_sort_items_inplace(s, items))
         goto bail;
-    s->tuple_as_array = PyObject_IsTrue(tuple_as_array);
-    if (s->tuple_as_array < 0)
+    return items;
+
+bail:
+    Py_DECREF(items);
+    return NULL;
+}
+
+static int
+encoder_listencode_fields(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj,
+                          PyObject *fields, Py_ssize_t indent_level)
+{
+    /* Encode the dataclass fields of obj as a JSON object. The attributes
+     * are read in field order straight into the output unless the items
+     * have to be sorted first. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *ident = NULL;
+    PyObject *items = NULL;
+    PyObject *encoded = NULL;
+    PyObject *value = NULL;
+    int indented = (s->indent != Py_None);
+    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
+    Py_ssize_t i, n;
+    Py_ssize_t idx = 0;
+
+    n = PyTuple_GET_SIZE(fields);
+    if (n == 0)
+        return JSON_Accu_Accumulate(state, rval, state->JSON_empty_dict);
+    if (encoder_markers_push(s, obj, &ident))
         goto bail;
-    s->iterable_as_array = PyObject_IsTrue(iterable_as_array);
-    if (s->iterable_as_array < 0)
+    if (s->item_sort_kw != Py_None) {
+        items = encoder_fields_items(s, obj, fields);
+        if (items == NULL)
+            goto bail;
+    }
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_dict))
         goto bail;
-    if (PyInt_Check(int_as_string_bitcount) || PyLong_Check(int_as_string_bitcount)) {
-        static const unsigned long long_long_bitsize = sizeof(long long) * CHAR_BIT;
-        long int_as_string_bitcount_val = PyLong_AsLong(int_as_string_bitcount);
-        if (int_as_string_bitcount_val == -1 && PyErr_Occurred())
+    if (indented) {
+        if (encoder_accumulate_newline_indent(s, state, rval, inner_indent_level))
             goto bail;
-        if (int_as_string_bitcount_val > 0 && int_as_string_bitcount_val < (long)long_long_bitsize) {
-            int n = (int)int_as_string_bitcount_val;
-            /* Compute 2^n as unsigned (well-defined for n < 64) and
-             * -(2^n) as signed without UB. Naive "-1LL << n" is a
-             * shift of a negative value, which is undefined, and
-             * "-(1LL << n)" overflows when n == 63. The expression
-             * below avoids both: (1ULL << n) - 1 is always >= 0, so
-             * negating it and subtracting 1 stays in range and
-             * produces LLONG_MIN at n == 63. */
-            s->max_long_size = PyLong_FromUnsignedLongLong(1ULL << n);
-            s->min_long_size = PyLong_FromLongLong(
-                -(long long)((1ULL << n) - 1ULL) - 1LL);
-            if (s->min_long_size == NULL || s->max_long_size == NULL) {
-                goto bail;
-            }
+    }
+    for (i = 0; i < n; i++) {
+        PyObject *name;
+        if (items != NULL) {
+            PyObject *item = PyList_GET_ITEM(items, i);
+            name = PyTuple_GET_ITEM(item, 0);
+            value = PyTuple_GET_ITEM(item, 1);
+            Py_INCREF(value);
         }
         else {
-            PyErr_Format(PyExc_TypeError,
-                         "int_as_string_bitcount (%ld) must be greater than 0 and less than the number of bits of a `long long` type (%lu bits)",
-                         int_as_string_bitcount_val, long_long_bitsize);
+            name = PyTuple_GET_ITEM(fields, i);
+            value = PyObject_GetAttr(obj, name);
+            if (value == NULL)
+                goto bail;
+        }
+        encoded = encoder_encode_dict_key(s, name);
+        if (encoded == NULL)
+            goto bail;
+        if (encoded == Py_None) {
+            /* skipkeys */
+            encoded = NULL;
+            Py_CLEAR(value);
+            continue;
+        }
+        if (idx) {
+            if (JSON_Accu_Accumulate(state, rval, s->item_separator))
+                goto bail;
+            if (indented && encoder_accumulate_newline_indent(
+                                s, state, rval, inner_indent_level))
+                goto bail;
+        }
+        if (JSON_Accu_Accumulate(state, rval, encoded))
+            goto bail;
+        Py_CLEAR(encoded);
+        if (encoder_listencode_obj(s, rval, value, inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+            encoder_annotate_exception(state,
+                "when serializing %s item %R",
+                Py_TYPE(obj)->tp_name, name);
+#endif
             goto bail;
         }
+        Py_CLEAR(value);
+        idx++;
     }
-    else if (int_as_string_bitcount == Py_None) {
-        Py_INCREF(Py_None);
-        s->max_long_size = Py_None;
-        Py_INCREF(Py_None);
-        s->min_long_size = Py_None;
+    Py_CLEAR(items);
+    if (encoder_markers_pop(s, ident))
+        goto bail;
+    ident = NULL;
+    if (indented) {
+        if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
+            goto bail;
     }
-    else {
-        PyErr_SetString(PyExc_TypeError, "int_as_string_bitcount must be None or an integer");
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_close_dict))
         goto bail;
+    return 0;
+
+bail:
+    Py_XDECREF(encoded);
+    Py_XDECREF(value);
+    Py_XDECREF(items);
+    Py_XDECREF(ident);
+    return -1;
+}
+
+static int
+encoder_listencode_list(PyEncoderObject *s, JSON_Accu *rval, PyObject *seq, Py_ssize_t indent_level)
+{
+    /* Encode Python list seq to a JSON term */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *ident = NULL;
+    PyObject *iter = NULL;
+    PyObject *obj = NULL;
+    /* See encoder_listencode_dict: inter-item indent prefixes are
+     * written piece-by-piece via encoder_accumulate_newline_indent,
+     * no intermediate PyObject is materialized. */
+    int indented = (s->indent != Py_None);
+    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
+    Py_ssize_t i = 0;
+    int is_exact_fast;
+
+    /* Emptiness check: use direct size for exact types to skip the
+     * __bool__/__len__ method dispatch of PyObject_IsTrue. */
+    if (PyList_CheckExact(seq)) {
+        if (PyList_GET_SIZE(seq) == 0)
+            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_array);
+        is_exact_fast = 1;
     }
-    if (item_sort_key != Py_None) {
-        if (!PyCallable_Check(item_sort_key)) {
-            PyErr_SetString(PyExc_TypeError, "item_sort_key must be None or callable");
-            goto bail;
-        }
+    else if (PyTuple_CheckExact(seq)) {
+        if (PyTuple_GET_SIZE(seq) == 0)
+            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_array);
+        is_exact_fast = 1;
     }
     else {
-        is_true = PyObject_IsTrue(sort_keys);
-        if (is_true < 0)
+        /* For non-exact types (list/tuple subclasses or other iterables)
+         * we cannot short-circuit on emptiness without consuming the
+         * iterator. iterable_as_array in particular reaches us with a
+         * bare iterator whose PyObject_IsTrue always returns 1, so the
+         * emptiness is only discovered on the first PyIter_Next call
+         * inside the slow path below. */
+        is_exact_fast = 0;
+    }
+
+    if (encoder_markers_push(s, seq, &ident))
+        goto bail;
+
+    if (is_exact_fast) {
+        /* Fast path: exact list or exact tuple — iterate by index to
+         * avoid allocating an iterator object.  Known non-empty from
+         * the size check above, so the opening bracket and the first
+         * newline_indent can be emitted unconditionally.
+         * Py_BEGIN_CRITICAL_SECTION prevents concurrent list mutation
+         * on free-threaded builds (tuples are immutable so the lock is
+         * uncontested).
+         *
+         * Uses a local `item` variable (not the outer `obj`) so that
+         * the bail handler's Py_XDECREF(obj) stays a no-op for this
+         * path. */
+        PyObject *item;
+        Py_ssize_t size;
+        int is_list = PyList_CheckExact(seq);
+        int err = 0;
+
+        if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array))
             goto bail;
-        if (is_true) {
-            _speedups_state *state = get_speedups_state(s->module_ref);
-            item_sort_key = state->JSON_itemgetter0;
-            if (!item_sort_key)
+
+        if (indented) {
+            if (encoder_accumulate_newline_indent(s, state, rval, inner_indent_level))
                 goto bail;
         }
-    }
-    if (item_sort_key == Py_None) {
-        Py_INCREF(Py_None);
-        s->item_sort_kw = Py_None;
+
+        Py_BEGIN_CRITICAL_SECTION(seq);
+        size = is_list ? PyList_GET_SIZE(seq) : PyTuple_GET_SIZE(seq);
+        for (i = 0; i < size; i++) {
+            item = is_list ? PyList_GET_ITEM(seq, i)
+                           : PyTuple_GET_ITEM(seq, i);
+            Py_INCREF(item);
+            if (i) {
+                if (JSON_Accu_Accumulate(state, rval, s->item_separator)) {
+                    Py_DECREF(item); err = 1; break;
+                }
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, inner_indent_level)) {
+                    Py_DECREF(item); err = 1; break;
+                }
+            }
+            if (encoder_listencode_obj(s, rval, item, inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+                encoder_annotate_exception(state,
+                    "when serializing %s item %zd",
+                    Py_TYPE(seq)->tp_name, i);
+#endif
+                Py_DECREF(item); err = 1; break;
+            }
+            Py_DECREF(item);
+        }
+        Py_END_CRITICAL_SECTION();
+
+        if (err)
+            goto bail;
+
+        if (indented) {
+            if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
+                goto bail;
+        }
+        if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
+            goto bail;
     }
     else {
-        s->item_sort_kw = PyDict_New();
-        if (s->item_sort_kw == NULL)
+        /* Slow path: list/tuple subclasses or arbitrary iterables.
+         * The opening '[' and newline_indent are deferred until we
+         * know there is at least one item, so an empty iterable still
+         * emits a compact "[]" under an indent= setting. */
+        int emitted_open = 0;
+
+        iter = PyObject_GetIter(seq);
+        if (iter == NULL)
             goto bail;
-        if (PyDict_SetItemString(s->item_sort_kw, "key", item_sort_key))
+        while ((obj = PyIter_Next(iter))) {
+            if (!emitted_open) {
+                if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array))
+                    goto bail;
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, inner_indent_level))
+                    goto bail;
+                emitted_open = 1;
+            }
+            else {
+                if (JSON_Accu_Accumulate(state, rval, s->item_separator))
+                    goto bail;
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, inner_indent_level))
+                    goto bail;
+            }
+            if (encoder_listencode_obj(s, rval, obj, inner_indent_level)) {
+#if PY_VERSION_HEX >= 0x030B0000
+                encoder_annotate_exception(state,
+                    "when serializing %s item %zd",
+                    Py_TYPE(seq)->tp_name, i);
+#endif
+                goto bail;
+            }
+            i++;
+            Py_CLEAR(obj);
+        }
+        Py_CLEAR(iter);
+        if (PyErr_Occurred())
             goto bail;
+
+        if (!emitted_open) {
+            if (JSON_Accu_Accumulate(state, rval, state->JSON_empty_array))
+                goto bail;
+        }
+        else {
+            if (indented) {
+                if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
+                    goto bail;
+            }
+            if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
+                goto bail;
+        }
     }
-    Py_INCREF(sort_keys);
-    s->sort_keys = sort_keys;
-    Py_INCREF(item_sort_key);
-    s->item_sort_key = item_sort_key;
-    Py_INCREF(Decimal);
-    s->Decimal = Decimal;
-    s->for_json = PyObject_IsTrue(for_json);
-    if (s->for_json < 0)
-        goto bail;
 
-    return (PyObject *)s;
+    if (encoder_markers_pop(s, ident))
+        goto bail;
+    ident = NULL;
+    return 0;
 
 bail:
-    Py_DECREF(s);
-    return NULL;
+    Py_XDECREF(obj);
+    Py_XDECREF(iter);
+    Py_XDECREF(ident);
+    return -1;
 }
 
-static PyObject *
-encoder_call(PyObject *self, PyObject *args, PyObject *kwds)
-{
-    /* Python callable interface to encode_listencode_obj */
-    static char *kwlist[] = {"obj", "_current_indent_level", NULL};
-    PyObject *obj;
+/* ---- Chunked encoding: Encoder.iterencode(obj, level, chunk_size) ----
+ *
+ * encoder_call builds the complete document before returning, so even
+ * a caller that writes the result out piece by piece holds the whole
+ * serialized output in memory at once. The iterator below walks the
+ * same object graph, but keeps the containers it is in the middle of
+ * on an explicit stack instead of the C call stack. That lets
+ * __next__ stop as soon as roughly chunk_size characters have been
+ * accumulated, return them, and pick up where it left off on the next
+ * call. Scalars are still written by encoder_listencode_obj and the
+ * containers follow encoder_listencode_list/_dict step for step, so
+ * the concatenated chunks are identical to the encoder_call output.
+ */
+
+#define JSON_FRAME_SEQ 0      /* exact list or tuple, walked by index */
+#define JSON_FRAME_ITER 1     /* any other iterable encoded as an array */
+#define JSON_FRAME_DICT 2     /* items iterator from encoder_dict_iteritems */
+#define JSON_FRAME_DEFAULT 3  /* result of default(), owns a marker */
+#define JSON_FRAME_LINES 4    /* iterator of documents, one per line */
+
+typedef struct {
+    int kind;
+    /* Non-zero while an item handed out by this frame is being encoded;
+     * only those frames annotate an exception on the way out, the same
+     * way the recursive encoder only adds a note around the recursive
+     * call for an item. */
+    int active;
+    PyObject *container;  /* list/tuple/iterable/dict, or default()'s result */
+    PyObject *iter;       /* JSON_FRAME_ITER and JSON_FRAME_DICT only */
+    PyObject *ident;      /* markers key, or NULL */
+    PyObject *key;        /* JSON_FRAME_DICT: key of the current item */
+    Py_ssize_t index;     /* number of items handed out so far */
     Py_ssize_t indent_level;
-    PyEncoderObject *s;
-    JSON_Accu rval;
-    _speedups_state *state;
-    int encode_rv;
-#if PY_VERSION_HEX < 0x030D0000
-    assert(PyEncoder_Check(self));
-#endif
-    s = (PyEncoderObject *)self;
-    state = get_speedups_state(s->module_ref);
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On:_iterencode", kwlist,
-        &obj, &indent_level))
-        return NULL;
-    if (JSON_Accu_Init(&rval))
-        return NULL;
-    Py_BEGIN_CRITICAL_SECTION(self);
-    encode_rv = encoder_listencode_obj(s, &rval, obj, indent_level);
-    Py_END_CRITICAL_SECTION();
-    if (encode_rv) {
-        JSON_Accu_Destroy(&rval);
-        return NULL;
-    }
-    return JSON_Accu_FinishAsList(state, &rval);
-}
+} JSON_EncoderFrame;
 
-static PyObject *
-_encoded_const(_speedups_state *state, PyObject *obj)
+typedef struct {
+    PyObject_HEAD
+    PyObject *encoder;        /* the Encoder being driven */
+    PyObject *pending;        /* next value to encode, or NULL */
+    Py_ssize_t pending_level;
+    JSON_EncoderFrame *stack;
+    Py_ssize_t depth;
+    Py_ssize_t allocated;
+    Py_ssize_t chunk_size;
+    int utf8;                 /* produce UTF-8 bytes, see JSON_Accu_InitUTF8 */
+} PyEncoderIterObject;
+
+static void
+encoder_iter_pop(PyEncoderIterObject *it)
 {
-    /* Return the JSON string representation of None, True, False */
-    if (obj == Py_None) {
-        Py_INCREF(state->JSON_s_null);
-        return state->JSON_s_null;
-    }
-    else if (obj == Py_True) {
-        Py_INCREF(state->JSON_s_true);
-        return state->JSON_s_true;
-    }
-    else if (obj == Py_False) {
-        Py_INCREF(state->JSON_s_false);
-        return state->JSON_s_false;
-    }
-    else {
-        PyErr_SetString(PyExc_ValueError, "not a const");
-        return NULL;
-    }
+    JSON_EncoderFrame *frame = &it->stack[--it->depth];
+    Py_CLEAR(frame->container);
+    Py_CLEAR(frame->iter);
+    Py_CLEAR(frame->ident);
+    Py_CLEAR(frame->key);
 }
 
-static PyObject *
-encoder_encode_float(PyEncoderObject *s, PyObject *obj)
+static void
+encoder_iter_reset(PyEncoderIterObject *it)
 {
-    /* Return the JSON representation of a PyFloat */
-    _speedups_state *state = get_speedups_state(s->module_ref);
-    double i = PyFloat_AS_DOUBLE(obj);
-    if (!Py_IS_FINITE(i)) {
-        if (!s->allow_or_ignore_nan) {
-            PyErr_SetString(PyExc_ValueError, "Out of range float values are not JSON compliant");
-            return NULL;
-        }
-        if (s->allow_or_ignore_nan & JSON_IGNORE_NAN) {
-            return _encoded_const(state, Py_None);
-        }
-        /* JSON_ALLOW_NAN is set */
-        else if (i > 0) {
-            Py_INCREF(state->JSON_Infinity);
-            return state->JSON_Infinity;
-        }
-        else if (i < 0) {
-            Py_INCREF(state->JSON_NegInfinity);
-            return state->JSON_NegInfinity;
-        }
-        else {
-            Py_INCREF(state->JSON_NaN);
-            return state->JSON_NaN;
-        }
-    }
-    /* Use a better float format here? */
-    if (PyFloat_CheckExact(obj)) {
-        return PyObject_Repr(obj);
-    }
-    else {
-        /* See #118, do not trust custom str/repr */
-        PyObject *res;
-        PyObject *tmp = PyObject_CallOneArg((PyObject *)&PyFloat_Type, obj);
-        if (tmp == NULL) {
-            return NULL;
-        }
-        res = PyObject_Repr(tmp);
-        Py_DECREF(tmp);
-        return res;
-    }
+    while (it->depth > 0)
+        encoder_iter_pop(it);
+    Py_CLEAR(it->pending);
 }
 
-static PyObject *
-encoder_encode_string(PyEncoderObject *s, PyObject *obj)
+/* Push a frame for `container` (a new reference is taken). The returned
+ * pointer is only valid until the next push, which may move the stack. */
+static JSON_EncoderFrame *
+encoder_iter_push(PyEncoderIterObject *it, int kind, PyObject *container,
+                  Py_ssize_t indent_level)
 {
-    /* Return the JSON representation of a string */
-    PyObject *encoded;
-
-    if (s->fast_encode) {
-        return py_encode_basestring_ascii(NULL, obj);
-    }
-    encoded = PyObject_CallOneArg(s->encoder, obj);
-    if (encoded != NULL &&
-#if PY_MAJOR_VERSION < 3
-        !PyString_Check(encoded) &&
-#endif /* PY_MAJOR_VERSION < 3 */
-        !PyUnicode_Check(encoded))
-    {
-        PyErr_Format(PyExc_TypeError,
-                     "encoder() must return a string, not %.80s",
-                     Py_TYPE(encoded)->tp_name);
-        Py_DECREF(encoded);
+    JSON_EncoderFrame *frame;
+    if (it->depth >= Py_GetRecursionLimit()) {
+        PyErr_SetString(JSON_RecursionError,
+                        "maximum recursion depth exceeded while encoding a JSON object");
         return NULL;
     }
-    return encoded;
+    if (it->depth == it->allocated) {
+        Py_ssize_t allocated = it->allocated ? it->allocated * 2 : 16;
+        JSON_EncoderFrame *stack = (JSON_EncoderFrame *)PyMem_Realloc(
+            it->stack, allocated * sizeof(JSON_EncoderFrame));
+        if (stack == NULL) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        it->stack = stack;
+        it->allocated = allocated;
+    }
+    frame = &it->stack[it->depth++];
+    frame->kind = kind;
+    frame->active = 0;
+    Py_INCREF(container);
+    frame->container = container;
+    frame->iter = NULL;
+    frame->ident = NULL;
+    frame->key = NULL;
+    frame->index = 0;
+    frame->indent_level = indent_level;
+    return frame;
 }
 
+/* Pop the top frame and release its circular-reference marker. */
 static int
-_steal_accumulate(_speedups_state *state, JSON_Accu *accu, PyObject *stolen)
+encoder_iter_close(PyEncoderIterObject *it)
 {
-    /* Append stolen and then decrement its reference count */
-    int rval = JSON_Accu_Accumulate(state, accu, stolen);
-    Py_DECREF(stolen);
-    return rval;
+    JSON_EncoderFrame *frame = &it->stack[it->depth - 1];
+    PyObject *ident = frame->ident;
+    frame->ident = NULL;
+    encoder_iter_pop(it);
+    return encoder_markers_pop((PyEncoderObject *)it->encoder, ident);
 }
 
-/* Push a reference to `obj` into the encoder's circular-reference marker
- * dict, keyed by the object's address. Allocates a fresh PyLong ident and
- * stores it in *ident_ptr (caller owns the reference, and must pass it to
- * encoder_markers_pop to remove the entry). If markers tracking is off
- * (s->markers == Py_None), stores NULL in *ident_ptr and returns 0 with
- * no side effects — that NULL is the sentinel markers_pop understands.
- * On circular reference sets the ValueError; on any other failure sets
- * the corresponding exception. Returns 0 on success, -1 on error. */
 static int
-encoder_markers_push(PyEncoderObject *s, PyObject *obj, PyObject **ident_ptr)
+encoder_iter_push_list(PyEncoderIterObject *it, _speedups_state *state,
+                       JSON_Accu *rval, PyObject *seq, Py_ssize_t indent_level)
 {
+    /* Counterpart of encoder_listencode_list */
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
+    JSON_EncoderFrame *frame;
     PyObject *ident;
-    int has_key;
-    *ident_ptr = NULL;
-    if (s->markers == Py_None)
-        return 0;
-    ident = PyLong_FromVoidPtr(obj);
-    if (ident == NULL)
+    int is_exact_fast = PyList_CheckExact(seq) || PyTuple_CheckExact(seq);
+
+    if (is_exact_fast && Py_SIZE(seq) == 0)
+        return JSON_Accu_Accumulate(state, rval, state->JSON_empty_array);
+    if (encoder_markers_push(s, seq, &ident))
         return -1;
-    has_key = PyDict_Contains(s->markers, ident);
-    if (has_key) {
-        if (has_key != -1)
-            PyErr_SetString(PyExc_ValueError, "Circular reference detected");
-        Py_DECREF(ident);
+    frame = encoder_iter_push(it, is_exact_fast ? JSON_FRAME_SEQ : JSON_FRAME_ITER,
+                              seq, indent_level);
+    if (frame == NULL) {
+        Py_XDECREF(ident);
         return -1;
     }
-    if (PyDict_SetItem(s->markers, ident, obj) < 0) {
-        Py_DECREF(ident);
-        return -1;
+    frame->ident = ident;
+    if (!is_exact_fast) {
+        /* '[' is deferred until the first item, see encoder_iter_advance */
+        frame->iter = PyObject_GetIter(seq);
+        return frame->iter == NULL ? -1 : 0;
     }
-    *ident_ptr = ident;
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array))
+        return -1;
+    if (s->indent != Py_None)
+        return encoder_accumulate_newline_indent(s, state, rval, indent_level + 1);
     return 0;
 }
 
-/* Counterpart to encoder_markers_push. Removes the ident entry from
- * s->markers and drops the caller's reference. Passing NULL is a no-op
- * so callers can invoke it unconditionally on the happy path (when
- * markers tracking was off, push wrote NULL into their local). Returns
- * 0 on success, -1 if PyDict_DelItem failed (the reference is still
- * released in that case). */
-static int
-encoder_markers_pop(PyEncoderObject *s, PyObject *ident)
-{
-    int rv;
-    if (ident == NULL)
-        return 0;
-    rv = PyDict_DelItem(s->markers, ident);
-    Py_DECREF(ident);
-    return rv;
-}
-
-/* Helper for the for_json / _asdict paths in encoder_listencode_obj.
- * Steals the reference to `newobj` (returned by _call_json_method),
- * handles recursion-depth tracking, and dispatches to the right
- * sub-encoder:
- *   - if as_dict is 0, encodes newobj as a generic JSON value via
- *     encoder_listencode_obj (for_json contract: return any JSON-
- *     compatible value);
- *   - if as_dict is 1, encodes newobj as a dict via
- *     encoder_listencode_dict after a TypeError-on-mismatch check
- *     (_asdict contract: must return a dict).
- * Cleans up on every exit path. */
 static int
-encoder_steal_encode(PyEncoderObject *s, JSON_Accu *rval,
-                     PyObject *newobj, Py_ssize_t indent_level,
-                     int as_dict)
+encoder_iter_push_dict(PyEncoderIterObject *it, _speedups_state *state,
+                       JSON_Accu *rval, PyObject *dct, Py_ssize_t indent_level)
 {
-    int rv;
-    if (newobj == NULL)
-        return -1;
-    if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
-        Py_DECREF(newobj);
+    /* Counterpart of encoder_listencode_dict */
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
+    JSON_EncoderFrame *frame;
+    PyObject *ident;
+    Py_ssize_t dct_size = PyDict_Check(dct) ? PyDict_Size(dct)
+                                            : PyObject_Length(dct);
+    if (dct_size == 0)
+        return JSON_Accu_Accumulate(state, rval, state->JSON_empty_dict);
+    if (dct_size < 0)
         return -1;
-    }
-    if (as_dict) {
-        if (JSON_AnyDict_Check(newobj)) {
-            rv = encoder_listencode_dict(s, rval, newobj, indent_level);
-        } else {
-            PyErr_Format(PyExc_TypeError,
-                         "_asdict() must return a dict, not %.80s",
-                         Py_TYPE(newobj)->tp_name);
-            rv = -1;
-        }
-    } else {
-        rv = encoder_listencode_obj(s, rval, newobj, indent_level);
-    }
-    Py_DECREF(newobj);
-    Py_LeaveRecursiveCall();
-    return rv;
-}
-
-/* Fallback encoder path used when obj is not one of the directly-
- * supported JSON types (const, string, int, float, list, dict,
- * Decimal, etc.) and is not a _asdict / for_json candidate. Handles
- * three sub-cases in order:
- *   1. RawJSON — emit the already-encoded string verbatim.
- *   2. iterable_as_array — treat any iterable object as a JSON array.
- *   3. default(obj) — call the user-supplied default hook and recurse
- *      on its result, with circular-reference tracking via markers.
- * Returns 0 on success, -1 on error. */
-static int
-encoder_listencode_default(PyEncoderObject *s, JSON_Accu *rval,
-                           PyObject *obj, Py_ssize_t indent_level)
-{
-    _speedups_state *state = get_speedups_state(s->module_ref);
-    PyObject *ident = NULL;
-    PyObject *newobj;
-    int raw;
-    int rv;
-
-    raw = is_raw_json(state, obj);
-    if (raw < 0)
+    if (encoder_markers_push(s, dct, &ident))
+        return -1;
+    frame = encoder_iter_push(it, JSON_FRAME_DICT, dct, indent_level);
+    if (frame == NULL) {
+        Py_XDECREF(ident);
         return -1;
-    if (raw) {
-        PyObject *encoded = PyObject_GetAttr(obj, state->JSON_attr_encoded_json);
-        if (encoded == NULL)
-            return -1;
-        return _steal_accumulate(state, rval, encoded);
     }
+    frame->ident = ident;
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_dict))
+        return -1;
+    if (s->indent != Py_None &&
+        encoder_accumulate_newline_indent(s, state, rval, indent_level + 1))
+        return -1;
+    frame->iter = encoder_dict_iteritems(s, dct);
+    return frame->iter == NULL ? -1 : 0;
+}
 
-    if (s->iterable_as_array) {
-        newobj = PyObject_GetIter(obj);
-        if (newobj == NULL) {
-            if (!PyErr_ExceptionMatches(PyExc_TypeError))
-                return -1;
-            PyErr_Clear();
-        } else {
-            rv = encoder_listencode_list(s, rval, newobj, indent_level);
-            Py_DECREF(newobj);
-            return rv;
-        }
-    }
+static int
+encoder_iter_push_fields(PyEncoderIterObject *it, _speedups_state *state,
+                         JSON_Accu *rval, PyObject *obj, PyObject *fields,
+                         Py_ssize_t indent_level)
+{
+    /* Counterpart of encoder_listencode_fields */
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
+    JSON_EncoderFrame *frame;
+    PyObject *ident;
+    PyObject *items;
 
+    if (PyTuple_GET_SIZE(fields) == 0)
+        return JSON_Accu_Accumulate(state, rval, state->JSON_empty_dict);
     if (encoder_markers_push(s, obj, &ident))
         return -1;
-    if (Py_EnterRecursiveCall(" while encoding a JSON object")) {
+    frame = encoder_iter_push(it, JSON_FRAME_DICT, obj, indent_level);
+    if (frame == NULL) {
         Py_XDECREF(ident);
         return -1;
     }
-    newobj = PyObject_CallOneArg(s->defaultfn, obj);
+    frame->ident = ident;
+    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_dict))
+        return -1;
+    if (s->indent != Py_None &&
+        encoder_accumulate_newline_indent(s, state, rval, indent_level + 1))
+        return -1;
+    items = encoder_fields_items(s, obj, fields);
+    if (items == NULL)
+        return -1;
+    frame->iter = PyObject_GetIter(items);
+    Py_DECREF(items);
+    return frame->iter == NULL ? -1 : 0;
+}
+
+/* Call fn(obj), where fn is the default hook or a type encoder, and push
+ * a frame that keeps the marker of obj until the result has been encoded.
+ * Returns a new reference to the result, or NULL on error. */
+static PyObject *
+encoder_iter_convert(PyEncoderIterObject *it, _speedups_state *state,
+                     PyObject *obj, PyObject *fn, Py_ssize_t indent_level)
+{
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
+    JSON_EncoderFrame *frame;
+    PyObject *newobj;
+    PyObject *ident;
+
+    if (encoder_markers_push(s, obj, &ident))
+        return NULL;
+    newobj = PyObject_CallOneArg(fn, obj);
     if (newobj == NULL) {
 #if PY_VERSION_HEX >= 0x030B0000
-        /* Annotate before unwinding; the "when serializing X object"
-         * note uses the original obj's type name, matching the Python
-         * encoder which binds type(o).__name__ before `o = default(o)`
-         * runs. */
         encoder_annotate_exception(state,
             "when serializing %s object", Py_TYPE(obj)->tp_name);
 #endif
-        Py_LeaveRecursiveCall();
         Py_XDECREF(ident);
-        return -1;
-    }
-    rv = encoder_listencode_obj(s, rval, newobj, indent_level);
-    Py_LeaveRecursiveCall();
-    if (rv) {
-#if PY_VERSION_HEX >= 0x030B0000
-        /* default() succeeded but encoding its return value failed; in
-         * the Python encoder `o` has been rebound to newobj at this
-         * point, so the note reflects that type. */
-        encoder_annotate_exception(state,
-            "when serializing %s object", Py_TYPE(newobj)->tp_name);
-#endif
+        return NULL;
     }
-    Py_DECREF(newobj);
-    if (rv == 0) {
-        if (encoder_markers_pop(s, ident) < 0)
-            rv = -1;
-    } else {
+    frame = encoder_iter_push(it, JSON_FRAME_DEFAULT, newobj, indent_level);
+    if (frame == NULL) {
         Py_XDECREF(ident);
+        Py_DECREF(newobj);
+        return NULL;
     }
-    return rv;
+    frame->ident = ident;
+    frame->active = 1;
+    return newobj;
 }
 
+/* Encode one value. Scalars are written to rval immediately; containers
+ * get a frame pushed (with their opening bracket written) and are
+ * filled in by later encoder_iter_advance calls. The dispatch order
+ * mirrors encoder_listencode_obj and encoder_listencode_default. */
 static int
-encoder_listencode_obj(PyEncoderObject *s, JSON_Accu *rval, PyObject *obj, Py_ssize_t indent_level)
+encoder_iter_value(PyEncoderIterObject *it, _speedups_state *state,
+                   JSON_Accu *rval, PyObject *obj, Py_ssize_t indent_level)
 {
-    /* Encode Python object obj to a JSON term, rval is a PyList */
-    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
     PyObject *newobj;
+    int conversions = 0;
+    int flags;
+    int raw;
     int rv = -1;
-    /* Check strings first — they are the most common JSON value type. */
-    if ((PyBytes_Check(obj) && s->encoding != Py_None) ||
-        PyUnicode_Check(obj))
-    {
-        PyObject *encoded = encoder_encode_string(s, obj);
-        if (encoded != NULL)
-            rv = _steal_accumulate(state, rval, encoded);
-    }
-    else if (obj == Py_None || obj == Py_True || obj == Py_False) {
-        PyObject *cstr = _encoded_const(state, obj);
-        if (cstr != NULL)
-            rv = _steal_accumulate(state, rval, cstr);
-    }
-    else if (PyInt_Check(obj) || PyLong_Check(obj)) {
-        PyObject *encoded = encoder_long_to_str(obj);
-        if (encoded != NULL) {
-            encoded = maybe_quote_bigint(s, encoded, obj);
-            if (encoded != NULL)
-                rv = _steal_accumulate(state, rval, encoded);
-        }
-    }
-    else if (PyFloat_Check(obj)) {
-        PyObject *encoded = encoder_encode_float(s, obj);
-        if (encoded != NULL)
-            rv = _steal_accumulate(state, rval, encoded);
-    }
-    else if (s->for_json && _call_json_method(obj, state->JSON_attr_for_json, &newobj)) {
-        rv = encoder_steal_encode(s, rval, newobj, indent_level, /*as_dict=*/0);
-    }
-    else if (s->namedtuple_as_object && _call_json_method(obj, state->JSON_attr_asdict, &newobj)) {
-        rv = encoder_steal_encode(s, rval, newobj, indent_level, /*as_dict=*/1);
-    }
-    else if (PyList_Check(obj) || (s->tuple_as_array && PyTuple_Check(obj))) {
-        if (Py_EnterRecursiveCall(" while encoding a JSON object"))
-            return rv;
-        rv = encoder_listencode_list(s, rval, obj, indent_level);
-        Py_LeaveRecursiveCall();
-    }
-    else if (JSON_AnyDict_Check(obj)) {
-        if (Py_EnterRecursiveCall(" while encoding a JSON object"))
-            return rv;
-        rv = encoder_listencode_dict(s, rval, obj, indent_level);
-        Py_LeaveRecursiveCall();
-    }
-    else if (s->use_decimal && PyObject_TypeCheck(obj, (PyTypeObject *)s->Decimal)) {
-        PyObject *encoded = PyObject_Str(obj);
-        if (encoded != NULL)
-            rv = _steal_accumulate(state, rval, encoded);
-    }
-    else {
-        rv = encoder_listencode_default(s, rval, obj, indent_level);
-    }
-    return rv;
-}
-
-/* Stringify and encode a dict key to its JSON representation, using the
- * key_memo cache for string keys.  Returns a new reference to the encoded
- * key string on success, Py_None (borrowed, no new reference) for
- * skipkeys, or NULL on error. */
-static PyObject *
-encoder_encode_dict_key(PyEncoderObject *s, PyObject *key)
-{
-    PyObject *kstr;
-    PyObject *encoded;
-
-    kstr = encoder_stringify_key(s, key);
-    if (kstr == NULL)
-        return NULL;
-    if (kstr == Py_None) {
-        Py_DECREF(kstr);
-        return Py_None;  /* skipkeys */
-    }
 
-    /* For string keys (PyUnicode on Py3, PyString on Py2),
-     * encoder_stringify_key returns Py_INCREF(key) — i.e. kstr IS key.
-     * For non-string keys it returns a freshly created string, so
-     * kstr != key.  Use this identity test to decide whether the
-     * key_memo cache applies: caching under a non-string original key
-     * would be write-only (the lookup uses kstr, not key). */
-    if (kstr == key) {
-        int cached = json_PyDict_GetItemRef(s->key_memo, kstr, &encoded);
-        if (cached < 0) {
-            Py_DECREF(kstr);
-            return NULL;
+    Py_INCREF(obj);
+    for (;;) {
+        if ((PyBytes_Check(obj) && s->encoding != Py_None &&
+             !JSON_BYTES_AS_BINARY(s)) ||
+            PyUnicode_Check(obj) ||
+            obj == Py_None || obj == Py_True || obj == Py_False ||
+            PyInt_Check(obj) || PyLong_Check(obj) || PyFloat_Check(obj))
+        {
+            rv = encoder_listencode_obj(s, rval, obj, indent_level);
+            break;
         }
-        if (cached == 0) {
-            encoded = encoder_encode_string(s, kstr);
-            if (encoded == NULL) {
-                Py_DECREF(kstr);
-                return NULL;
-            }
-            if (PyDict_SetItem(s->key_memo, key, encoded)) {
-                Py_DECREF(kstr);
-                Py_DECREF(encoded);
-                return NULL;
+        /* for_json(), type encoder and default() results are encoded in
+         * this loop rather than recursively, so bound the chain the same
+         * way the recursive encoder's Py_EnterRecursiveCall would. */
+        if (++conversions > Py_GetRecursionLimit()) {
+            PyErr_SetString(JSON_RecursionError,
+                            "maximum recursion depth exceeded while encoding a JSON object");
+            break;
+        }
+        if (s->extra_types) {
+            int extra = encoder_listencode_extra(s, rval, obj, indent_level);
+            if (extra) {
+                if (extra > 0)
+                    rv = 0;
+                break;
             }
         }
-        Py_DECREF(kstr);
-    } else {
-        encoded = encoder_encode_string(s, kstr);
-        Py_DECREF(kstr);
-        if (encoded == NULL)
-            return NULL;
-    }
-    return encoded;  /* new reference */
-}
-
-/* Write '\n' followed by indent_level copies of s->indent directly to
- * the accumulator, without materializing the combined string as an
- * intermediate PyObject. This is the newline-plus-indent prefix
- * emitted before each item of an indented array or object and before
- * the matching closing bracket.
- *
- * Writing pieces rather than building a concatenated string saves a
- * PyUnicode_FromStringAndSize + PySequence_Repeat + PyNumber_Add per
- * container (versus the previous encoder_build_indent_string helper),
- * which matters most for deeply nested structures and on 3.14+ where
- * JSON_Accu is a PyUnicodeWriter that appends in-place at near-zero
- * per-write cost. On older Python the cost is one PyList_Append per
- * piece; the extra list entries are cheap compared to the allocation
- * traffic and the PySequence_Repeat's proportional memcpy work.
- *
- * Returns 0 on success, -1 on allocation failure. Only called when
- * s->indent is not Py_None. */
-static int
-encoder_accumulate_newline_indent(PyEncoderObject *s, _speedups_state *state,
-                                  JSON_Accu *rval, Py_ssize_t indent_level)
-{
-    Py_ssize_t i;
-    if (JSON_Accu_Accumulate(state, rval, state->JSON_newline))
-        return -1;
-    for (i = 0; i < indent_level; i++) {
-        if (JSON_Accu_Accumulate(state, rval, s->indent))
-            return -1;
-    }
-    return 0;
-}
-
-#if PY_VERSION_HEX >= 0x030B0000
-/* Attach a PEP 678 note formatted via PyUnicode_FromFormatV to the in-
- * flight exception. Mirrors the pure-Python encoder's
- * `except BaseException as exc: exc.add_note(...); raise` wrappers
- * around each recursive encode step.
- *
- * Crucially, PyErr_Fetch runs BEFORE the note is built: the `%R`
- * formatter walks into PyObject_Repr, which on debug builds
- * (cpython-3.14-debug and cpython-3.14t+debug) asserts that no
- * exception is currently set. Building the note while our caller's
- * exception is still live would core-dump those jobs, as the CI
- * failure on job 72447820967 / 72447820982 demonstrated. Fetch first,
- * format second, Restore last.
- *
- * Failures on the note path — a repr() that raises, PyUnicode_FromFormatV
- * returning NULL, a BaseException subclass whose add_note override
- * raises — are swallowed so the in-flight exception survives intact.
- *
- * Only compiled on Python 3.11+, where PEP 678 exists. */
-static void
-encoder_annotate_exception(_speedups_state *state, const char *format, ...)
-{
-    PyObject *exc_type;
-    PyObject *exc_value;
-    PyObject *exc_tb;
-    PyObject *note;
-    PyObject *result;
-    va_list args;
-
-    PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
-    if (exc_value == NULL) {
-        /* No live exception to annotate — callsites always have one,
-         * so this is a defensive no-op. */
-        PyErr_Restore(exc_type, exc_value, exc_tb);
-        return;
-    }
-    PyErr_NormalizeException(&exc_type, &exc_value, &exc_tb);
-
-    va_start(args, format);
-    note = PyUnicode_FromFormatV(format, args);
-    va_end(args);
-
-    if (note != NULL) {
-        result = PyObject_CallMethodObjArgs(exc_value, state->JSON_attr_add_note,
-                                            note, NULL);
-        Py_DECREF(note);
-        if (result == NULL)
-            PyErr_Clear();
-        else
-            Py_DECREF(result);
-    }
-    else {
-        PyErr_Clear();
+        flags = encoder_type_lookup(s, obj, &newobj);
+        if (flags < 0)
+            break;
+        if (newobj != NULL && PyTuple_CheckExact(newobj)) {
+            rv = encoder_iter_push_fields(it, state, rval, obj, newobj,
+                                          indent_level);
+            Py_DECREF(newobj);
+            break;
+        }
+        if (newobj != NULL) {
+            PyObject *fn = newobj;
+            newobj = encoder_iter_convert(it, state, obj, fn, indent_level);
+            Py_DECREF(fn);
+            if (newobj == NULL)
+                break;
+            Py_DECREF(obj);
+            obj = newobj;
+            continue;
+        }
+        if (s->for_json && (flags & TYPE_MAY_HAVE_FOR_JSON) &&
+            _call_json_method(obj, state->JSON_attr_for_json, &newobj)) {
+            if (newobj == NULL)
+                break;
+            Py_DECREF(obj);
+            obj = newobj;
+            continue;
+        }
+        if (s->namedtuple_as_object && (flags & TYPE_MAY_HAVE_ASDICT) &&
+            _call_json_method(obj, state->JSON_attr_asdict, &newobj)) {
+            if (newobj == NULL)
+                break;
+            if (!JSON_AnyDict_Check(newobj)) {
+                PyErr_Format(PyExc_TypeError,
+                             "_asdict() must return a dict, not %.80s",
+                             Py_TYPE(newobj)->tp_name);
+                Py_DECREF(newobj);
+                break;
+            }
+            rv = encoder_iter_push_dict(it, state, rval, newobj, indent_level);
+            Py_DECREF(newobj);
+            break;
+        }
+        if (PyList_Check(obj) || (s->tuple_as_array && PyTuple_Check(obj))) {
+            rv = encoder_iter_push_list(it, state, rval, obj, indent_level);
+            break;
+        }
+        if (JSON_AnyDict_Check(obj)) {
+            rv = encoder_iter_push_dict(it, state, rval, obj, indent_level);
+            break;
+        }
+        if (s->use_decimal && PyObject_TypeCheck(obj, (PyTypeObject *)s->Decimal)) {
+            rv = encoder_listencode_obj(s, rval, obj, indent_level);
+            break;
+        }
+        if (s->buffer_as_array) {
+            int buffered = encoder_listencode_buffer(s, rval, obj, indent_level);
+            if (buffered) {
+                if (buffered > 0)
+                    rv = 0;
+                break;
+            }
+        }
+        raw = is_raw_json(state, obj);
+        if (raw < 0)
+            break;
+        if (raw) {
+            PyObject *encoded = PyObject_GetAttr(obj, state->JSON_attr_encoded_json);
+            if (encoded != NULL)
+                rv = _steal_accumulate(state, rval, encoded);
+            break;
+        }
+        raw = PyObject_IsInstance(obj, state->LazyContainerType);
+        if (raw < 0)
+            break;
+        if (raw) {
+            newobj = encoder_iter_convert(it, state, obj,
+                                          state->LazyEncodable, indent_level);
+            if (newobj == NULL)
+                break;
+            Py_DECREF(obj);
+            obj = newobj;
+            continue;
+        }
+        if (s->iterable_as_array) {
+            newobj = PyObject_GetIter(obj);
+            if (newobj == NULL) {
+                if (!PyErr_ExceptionMatches(PyExc_TypeError))
+                    break;
+                PyErr_Clear();
+            }
+            else {
+                rv = encoder_iter_push_list(it, state, rval, newobj, indent_level);
+                Py_DECREF(newobj);
+                break;
+            }
+        }
+        newobj = encoder_iter_convert(it, state, obj, s->defaultfn,
+                                      indent_level);
+        if (newobj == NULL)
+            break;
+        Py_DECREF(obj);
+        obj = newobj;
     }
-
-    PyErr_Restore(exc_type, exc_value, exc_tb);
+    Py_DECREF(obj);
+    return rv;
 }
-#endif
 
+/* Make progress on the innermost container: either hand out its next
+ * item in it->pending (after writing the separators that precede it),
+ * or write its closing bracket and pop it. */
 static int
-encoder_listencode_dict(PyEncoderObject *s, JSON_Accu *rval, PyObject *dct, Py_ssize_t indent_level)
+encoder_iter_advance(PyEncoderIterObject *it, _speedups_state *state,
+                     JSON_Accu *rval)
 {
-    /* Encode Python dict dct a JSON term */
-    _speedups_state *state = get_speedups_state(s->module_ref);
-    PyObject *ident = NULL;
-    PyObject *encoded = NULL;
-    PyObject *iter = NULL;
-    PyObject *item = NULL;
-    /* When s->indent is not Py_None, each inter-item boundary is emitted
-     * as s->item_separator + '\n' + (s->indent * inner_indent_level) via
-     * multiple JSON_Accu_Accumulate calls; no combined PyObject is
-     * materialized. */
+    PyEncoderObject *s = (PyEncoderObject *)it->encoder;
+    JSON_EncoderFrame *frame = &it->stack[it->depth - 1];
     int indented = (s->indent != Py_None);
-    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
-    Py_ssize_t idx;
+    Py_ssize_t inner_indent_level = indented ? frame->indent_level + 1
+                                             : frame->indent_level;
+    PyObject *item = NULL;
 
-    {
-        Py_ssize_t dct_size = PyDict_Check(dct) ? PyDict_Size(dct)
-                                                : PyObject_Length(dct);
-        if (dct_size == 0)
-            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_dict);
-        if (dct_size < 0)
+    frame->active = 0;
+    switch (frame->kind) {
+    case JSON_FRAME_DEFAULT:
+        return encoder_iter_close(it);
+    case JSON_FRAME_LINES:
+        /* Terminate the previous document, then hand out the next one */
+        if (frame->index &&
+            JSON_Accu_Accumulate(state, rval, state->JSON_newline))
             return -1;
-    }
-
-    if (encoder_markers_push(s, dct, &ident))
-        goto bail;
-
-    if (JSON_Accu_Accumulate(state, rval, state->JSON_open_dict))
-        goto bail;
-
-    if (indented) {
-        if (encoder_accumulate_newline_indent(s, state, rval, inner_indent_level))
-            goto bail;
-    }
-
-    /* Fast path: when sort_keys is off and dct is an exact dict,
-     * iterate with PyDict_Next to avoid allocating an items list.
-     * Py_BEGIN_CRITICAL_SECTION prevents concurrent dict mutation
-     * on free-threaded builds; on default builds it is a no-op. */
-    if (s->item_sort_kw == Py_None && PyDict_CheckExact(dct)) {
-        Py_ssize_t pos = 0;
-        PyObject *key, *value;
-        int err = 0;
-
-        idx = 0;
-        Py_BEGIN_CRITICAL_SECTION(dct);
-        while (PyDict_Next(dct, &pos, &key, &value)) {
-            Py_INCREF(key);
-            Py_INCREF(value);
-
-            encoded = encoder_encode_dict_key(s, key);
-            Py_DECREF(key);
-            if (encoded == NULL) {
-                Py_DECREF(value); err = 1; break;
-            }
-            if (encoded == Py_None) {
-                /* skipkeys */
-                encoded = NULL;
-                Py_DECREF(value);
-                continue;
+        item = PyIter_Next(frame->iter);
+        if (item == NULL) {
+            if (PyErr_Occurred())
+                return -1;
+            return encoder_iter_close(it);
+        }
+        it->pending = item;
+        it->pending_level = frame->indent_level;
+        frame->index++;
+        frame->active = 1;
+        return 0;
+    case JSON_FRAME_SEQ:
+        Py_BEGIN_CRITICAL_SECTION(frame->container);
+        if (frame->index < Py_SIZE(frame->container)) {
+            item = PyList_CheckExact(frame->container)
+                ? PyList_GET_ITEM(frame->container, frame->index)
+                : PyTuple_GET_ITEM(frame->container, frame->index);
+            Py_INCREF(item);
+        }
+        Py_END_CRITICAL_SECTION();
+        if (item == NULL) {
+            if (indented && encoder_accumulate_newline_indent(
+                                s, state, rval, frame->indent_level))
+                return -1;
+            if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
+                return -1;
+            return encoder_iter_close(it);
+        }
+        break;
+    case JSON_FRAME_ITER:
+        item = PyIter_Next(frame->iter);
+        if (item == NULL) {
+            if (PyErr_Occurred())
+                return -1;
+            if (frame->index == 0) {
+                if (JSON_Accu_Accumulate(state, rval, state->JSON_empty_array))
+                    return -1;
             }
-            if (idx) {
-                if (JSON_Accu_Accumulate(state, rval, s->item_separator)) {
-                    Py_DECREF(value); err = 1; break;
-                }
+            else {
                 if (indented && encoder_accumulate_newline_indent(
-                                    s, state, rval, inner_indent_level)) {
-                    Py_DECREF(value); err = 1; break;
-                }
-            }
-            if (JSON_Accu_Accumulate(state, rval, encoded)) {
-                Py_DECREF(value); err = 1; break;
-            }
-            Py_CLEAR(encoded);
-            if (JSON_Accu_Accumulate(state, rval, s->key_separator)) {
-                Py_DECREF(value); err = 1; break;
+                                    s, state, rval, frame->indent_level))
+                    return -1;
+                if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
+                    return -1;
             }
-            if (encoder_listencode_obj(s, rval, value, inner_indent_level)) {
-#if PY_VERSION_HEX >= 0x030B0000
-                encoder_annotate_exception(state,
-                    "when serializing %s item %R",
-                    Py_TYPE(dct)->tp_name, key);
-#endif
-                Py_DECREF(value); err = 1; break;
+            return encoder_iter_close(it);
+        }
+        if (frame->index == 0) {
+            if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array) ||
+                (indented && encoder_accumulate_newline_indent(
+                                 s, state, rval, inner_indent_level)))
+            {
+                Py_DECREF(item);
+                return -1;
             }
-            Py_DECREF(value);
-            idx++;
         }
-        Py_END_CRITICAL_SECTION();
-
-        if (err || PyErr_Occurred())
-            goto bail;
-    }
-    else {
-        /* Slow path: sorted iteration, dict subclasses, or non-dict
-         * mappings.  Build an items list via encoder_dict_iteritems. */
-        iter = encoder_dict_iteritems(s, dct);
-        if (iter == NULL)
-            goto bail;
-
-        idx = 0;
-        while ((item = PyIter_Next(iter))) {
-            PyObject *key, *value;
+        break;
+    case JSON_FRAME_DICT:
+        for (;;) {
+            PyObject *key, *encoded, *tmp;
+            item = PyIter_Next(frame->iter);
+            if (item == NULL) {
+                if (PyErr_Occurred())
+                    return -1;
+                if (indented && encoder_accumulate_newline_indent(
+                                    s, state, rval, frame->indent_level))
+                    return -1;
+                if (JSON_Accu_Accumulate(state, rval, state->JSON_close_dict))
+                    return -1;
+                return encoder_iter_close(it);
+            }
             if (!PyTuple_Check(item) || Py_SIZE(item) != 2) {
                 PyErr_SetString(PyExc_ValueError, "items must return 2-tuples");
-                goto bail;
+                Py_DECREF(item);
+                return -1;
             }
             key = PyTuple_GET_ITEM(item, 0);
-            value = PyTuple_GET_ITEM(item, 1);
-
             encoded = encoder_encode_dict_key(s, key);
-            if (encoded == NULL)
-                goto bail;
+            if (encoded == NULL) {
+                Py_DECREF(item);
+                return -1;
+            }
             if (encoded == Py_None) {
                 /* skipkeys */
-                encoded = NULL;
-                Py_CLEAR(item);
+                Py_DECREF(item);
                 continue;
             }
-            if (idx) {
-                if (JSON_Accu_Accumulate(state, rval, s->item_separator))
-                    goto bail;
-                if (indented && encoder_accumulate_newline_indent(
-                                    s, state, rval, inner_indent_level))
-                    goto bail;
+            if (frame->index) {
+                if (JSON_Accu_Accumulate(state, rval, s->item_separator) ||
+                    (indented && encoder_accumulate_newline_indent(
+                                     s, state, rval, inner_indent_level)))
+                {
+                    Py_DECREF(encoded);
+                    Py_DECREF(item);
+                    return -1;
+                }
             }
-            if (JSON_Accu_Accumulate(state, rval, encoded))
-                goto bail;
-            Py_CLEAR(encoded);
-            if (JSON_Accu_Accumulate(state, rval, s->key_separator))
-                goto bail;
-            if (encoder_listencode_obj(s, rval, value, inner_indent_level)) {
-#if PY_VERSION_HEX >= 0x030B0000
-                encoder_annotate_exception(state,
-                    "when serializing %s item %R",
-                    Py_TYPE(dct)->tp_name, key);
-#endif
-                goto bail;
+            if (_steal_accumulate(state, rval, encoded)) {
+                Py_DECREF(item);
+                return -1;
             }
-            Py_CLEAR(item);
-            idx++;
+            tmp = frame->key;
+            Py_INCREF(key);
+            frame->key = key;
+            Py_XDECREF(tmp);
+            it->pending = PyTuple_GET_ITEM(item, 1);
+            Py_INCREF(it->pending);
+            Py_DECREF(item);
+            it->pending_level = inner_indent_level;
+            frame->index++;
+            frame->active = 1;
+            return 0;
         }
-        Py_CLEAR(iter);
-        if (PyErr_Occurred())
-            goto bail;
     }
 
-    if (encoder_markers_pop(s, ident))
-        goto bail;
-    ident = NULL;
-    if (indented) {
-        if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
-            goto bail;
+    /* JSON_FRAME_SEQ and JSON_FRAME_ITER: hand out `item` */
+    if (frame->index) {
+        if (JSON_Accu_Accumulate(state, rval, s->item_separator) ||
+            (indented && encoder_accumulate_newline_indent(
+                             s, state, rval, inner_indent_level)))
+        {
+            Py_DECREF(item);
+            return -1;
+        }
     }
-    if (JSON_Accu_Accumulate(state, rval, state->JSON_close_dict))
-        goto bail;
+    it->pending = item;
+    it->pending_level = inner_indent_level;
+    frame->index++;
+    frame->active = 1;
     return 0;
-
-bail:
-    Py_XDECREF(encoded);
-    Py_XDECREF(item);
-    Py_XDECREF(iter);
-    Py_XDECREF(ident);
-    return -1;
 }
 
+/* Add the notes the recursive encoder would have added while unwinding
+ * from the same failure, innermost container first. */
+static void
+encoder_iter_annotate(PyEncoderIterObject *it, _speedups_state *state)
+{
+#if PY_VERSION_HEX >= 0x030B0000
+    Py_ssize_t i;
+    for (i = it->depth - 1; i >= 0; i--) {
+        JSON_EncoderFrame *frame = &it->stack[i];
+        if (!frame->active)
+            continue;
+        if (frame->kind == JSON_FRAME_DEFAULT) {
+            encoder_annotate_exception(state,
+                "when serializing %s object",
+                Py_TYPE(frame->container)->tp_name);
+        }
+        else if (frame->kind == JSON_FRAME_DICT) {
+            encoder_annotate_exception(state,
+                "when serializing %s item %R",
+                Py_TYPE(frame->container)->tp_name, frame->key);
+        }
+        else {
+            encoder_annotate_exception(state,
+                "when serializing %s item %zd",
+                Py_TYPE(frame->container)->tp_name, frame->index - 1);
+        }
+    }
+#else
+    (void)it;
+    (void)state;
+#endif
+}
 
-static int
-encoder_listencode_list(PyEncoderObject *s, JSON_Accu *rval, PyObject *seq, Py_ssize_t indent_level)
+static PyObject *
+encoder_iter_next(PyObject *self)
 {
-    /* Encode Python list seq to a JSON term */
-    _speedups_state *state = get_speedups_state(s->module_ref);
-    PyObject *ident = NULL;
-    PyObject *iter = NULL;
-    PyObject *obj = NULL;
-    /* See encoder_listencode_dict: inter-item indent prefixes are
-     * written piece-by-piece via encoder_accumulate_newline_indent,
-     * no intermediate PyObject is materialized. */
-    int indented = (s->indent != Py_None);
-    Py_ssize_t inner_indent_level = indented ? indent_level + 1 : indent_level;
-    Py_ssize_t i = 0;
-    int is_exact_fast;
+    PyEncoderIterObject *it = (PyEncoderIterObject *)self;
+    _speedups_state *state;
+    JSON_Accu rval;
+    PyObject *chunk = NULL;
+    int err = 0;
 
-    /* Emptiness check: use direct size for exact types to skip the
-     * __bool__/__len__ method dispatch of PyObject_IsTrue. */
-    if (PyList_CheckExact(seq)) {
-        if (PyList_GET_SIZE(seq) == 0)
-            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_array);
-        is_exact_fast = 1;
+    if (it->encoder == NULL)
+        return NULL;
+    state = get_speedups_state(((PyEncoderObject *)it->encoder)->module_ref);
+#if PY_MAJOR_VERSION >= 3
+    if (it->utf8 ? JSON_Accu_InitUTF8(&rval) : JSON_Accu_Init(&rval))
+        return NULL;
+#else
+    if (JSON_Accu_Init(&rval))
+        return NULL;
+#endif
+    Py_BEGIN_CRITICAL_SECTION(self);
+    while (rval.length < it->chunk_size) {
+        if (it->pending != NULL) {
+            PyObject *obj = it->pending;
+            it->pending = NULL;
+            err = encoder_iter_value(it, state, &rval, obj, it->pending_level);
+            Py_DECREF(obj);
+        }
+        else if (it->depth > 0) {
+            err = encoder_iter_advance(it, state, &rval);
+        }
+        else {
+            break;
+        }
+        if (err)
+            break;
     }
-    else if (PyTuple_CheckExact(seq)) {
-        if (PyTuple_GET_SIZE(seq) == 0)
-            return JSON_Accu_Accumulate(state, rval, state->JSON_empty_array);
-        is_exact_fast = 1;
+    if (err) {
+        encoder_iter_annotate(it, state);
+        encoder_iter_reset(it);
+        JSON_Accu_Destroy(&rval);
+    }
+    else if (rval.length == 0) {
+        /* Nothing left to encode: signal StopIteration */
+        JSON_Accu_Destroy(&rval);
     }
     else {
-        /* For non-exact types (list/tuple subclasses or other iterables)
-         * we cannot short-circuit on emptiness without consuming the
-         * iterator. iterable_as_array in particular reaches us with a
-         * bare iterator whose PyObject_IsTrue always returns 1, so the
-         * emptiness is only discovered on the first PyIter_Next call
-         * inside the slow path below. */
-        is_exact_fast = 0;
+#if PY_MAJOR_VERSION >= 3
+        if (it->utf8)
+            chunk = JSON_Accu_FinishAsBytes(&rval);
+        else
+#endif
+            chunk = JSON_Accu_FinishAsString(state, &rval);
     }
+    Py_END_CRITICAL_SECTION();
+    return chunk;
+}
 
-    if (encoder_markers_push(s, seq, &ident))
-        goto bail;
+static void
+encoder_iter_dealloc(PyObject *self)
+{
+    PyEncoderIterObject *it = (PyEncoderIterObject *)self;
+#if PY_VERSION_HEX >= 0x030D0000
+    PyTypeObject *tp = Py_TYPE(self);
+#endif
+    PyObject_GC_UnTrack(self);
+    encoder_iter_reset(it);
+    Py_CLEAR(it->encoder);
+    PyMem_Free(it->stack);
+    Py_TYPE(self)->tp_free(self);
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_DECREF(tp);
+#endif
+}
 
-    if (is_exact_fast) {
-        /* Fast path: exact list or exact tuple — iterate by index to
-         * avoid allocating an iterator object.  Known non-empty from
-         * the size check above, so the opening bracket and the first
-         * newline_indent can be emitted unconditionally.
-         * Py_BEGIN_CRITICAL_SECTION prevents concurrent list mutation
-         * on free-threaded builds (tuples are immutable so the lock is
-         * uncontested).
-         *
-         * Uses a local `item` variable (not the outer `obj`) so that
-         * the bail handler's Py_XDECREF(obj) stays a no-op for this
-         * path. */
-        PyObject *item;
-        Py_ssize_t size;
-        int is_list = PyList_CheckExact(seq);
-        int err = 0;
+static int
+encoder_iter_traverse(PyObject *self, visitproc visit, void *arg)
+{
+    PyEncoderIterObject *it = (PyEncoderIterObject *)self;
+    Py_ssize_t i;
+#if PY_VERSION_HEX >= 0x030D0000
+    Py_VISIT(Py_TYPE(self));
+#endif
+    Py_VISIT(it->encoder);
+    Py_VISIT(it->pending);
+    for (i = 0; i < it->depth; i++) {
+        Py_VISIT(it->stack[i].container);
+        Py_VISIT(it->stack[i].iter);
+        Py_VISIT(it->stack[i].ident);
+        Py_VISIT(it->stack[i].key);
+    }
+    return 0;
+}
 
-        if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array))
-            goto bail;
+static int
+encoder_iter_clear(PyObject *self)
+{
+    PyEncoderIterObject *it = (PyEncoderIterObject *)self;
+    encoder_iter_reset(it);
+    Py_CLEAR(it->encoder);
+    return 0;
+}
 
-        if (indented) {
-            if (encoder_accumulate_newline_indent(s, state, rval, inner_indent_level))
-                goto bail;
-        }
+#if PY_VERSION_HEX >= 0x030D0000
+static PyType_Slot PyEncoderIterType_slots[] = {
+    {Py_tp_dealloc, encoder_iter_dealloc},
+    {Py_tp_traverse, encoder_iter_traverse},
+    {Py_tp_clear, encoder_iter_clear},
+    {Py_tp_iter, PyObject_SelfIter},
+    {Py_tp_iternext, encoder_iter_next},
+    {0, NULL}
+};
 
-        Py_BEGIN_CRITICAL_SECTION(seq);
-        size = is_list ? PyList_GET_SIZE(seq) : PyTuple_GET_SIZE(seq);
-        for (i = 0; i < size; i++) {
-            item = is_list ? PyList_GET_ITEM(seq, i)
-                           : PyTuple_GET_ITEM(seq, i);
-            Py_INCREF(item);
-            if (i) {
-                if (JSON_Accu_Accumulate(state, rval, s->item_separator)) {
-                    Py_DECREF(item); err = 1; break;
-                }
-                if (indented && encoder_accumulate_newline_indent(
-                                    s, state, rval, inner_indent_level)) {
-                    Py_DECREF(item); err = 1; break;
-                }
-            }
-            if (encoder_listencode_obj(s, rval, item, inner_indent_level)) {
-#if PY_VERSION_HEX >= 0x030B0000
-                encoder_annotate_exception(state,
-                    "when serializing %s item %zd",
-                    Py_TYPE(seq)->tp_name, i);
+static PyType_Spec PyEncoderIterType_spec = {
+    .name = "simplejson._speedups.EncoderIterator",
+    .basicsize = sizeof(PyEncoderIterObject),
+    .flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC |
+             Py_TPFLAGS_DISALLOW_INSTANTIATION,
+    .slots = PyEncoderIterType_slots,
+};
+#else
+static PyTypeObject PyEncoderIterType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "simplejson._speedups.EncoderIterator", /* tp_name */
+    sizeof(PyEncoderIterObject), /* tp_basicsize */
+    0,                    /* tp_itemsize */
+    encoder_iter_dealloc, /* tp_dealloc */
+    0,                    /* tp_print */
+    0,                    /* tp_getattr */
+    0,                    /* tp_setattr */
+    0,                    /* tp_compare */
+    0,                    /* tp_repr */
+    0,                    /* tp_as_number */
+    0,                    /* tp_as_sequence */
+    0,                    /* tp_as_mapping */
+    0,                    /* tp_hash */
+    0,                    /* tp_call */
+    0,                    /* tp_str */
+    0,                    /* tp_getattro */
+    0,                    /* tp_setattro */
+    0,                    /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,   /* tp_flags */
+    0,                    /* tp_doc */
+    encoder_iter_traverse, /* tp_traverse */
+    encoder_iter_clear,   /* tp_clear */
+    0,                    /* tp_richcompare */
+    0,                    /* tp_weaklistoffset */
+    PyObject_SelfIter,    /* tp_iter */
+    encoder_iter_next,    /* tp_iternext */
+};
 #endif
-                Py_DECREF(item); err = 1; break;
-            }
-            Py_DECREF(item);
-        }
-        Py_END_CRITICAL_SECTION();
 
-        if (err)
-            goto bail;
+static PyObject *
+encoder_iterencode(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"obj", "_current_indent_level", "chunk_size", NULL};
+    PyObject *obj;
+    Py_ssize_t indent_level;
+    Py_ssize_t chunk_size;
+    PyEncoderObject *s = (PyEncoderObject *)self;
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyTypeObject *iter_type = (PyTypeObject *)state->PyEncoderIterType;
+    PyEncoderIterObject *it;
 
-        if (indented) {
-            if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
-                goto bail;
-        }
-        if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
-            goto bail;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Onn:iterencode", kwlist,
+        &obj, &indent_level, &chunk_size))
+        return NULL;
+    if (chunk_size <= 0) {
+        PyErr_SetString(PyExc_ValueError, "chunk_size must be greater than 0");
+        return NULL;
     }
-    else {
-        /* Slow path: list/tuple subclasses or arbitrary iterables.
-         * The opening '[' and newline_indent are deferred until we
-         * know there is at least one item, so an empty iterable still
-         * emits a compact "[]" under an indent= setting. */
-        int emitted_open = 0;
+    it = (PyEncoderIterObject *)iter_type->tp_alloc(iter_type, 0);
+    if (it == NULL)
+        return NULL;
+    Py_INCREF(self);
+    it->encoder = self;
+    Py_INCREF(obj);
+    it->pending = obj;
+    it->pending_level = indent_level;
+    it->chunk_size = chunk_size;
+    return (PyObject *)it;
+}
 
-        iter = PyObject_GetIter(seq);
-        if (iter == NULL)
-            goto bail;
-        while ((obj = PyIter_Next(iter))) {
-            if (!emitted_open) {
-                if (JSON_Accu_Accumulate(state, rval, state->JSON_open_array))
-                    goto bail;
-                if (indented && encoder_accumulate_newline_indent(
-                                    s, state, rval, inner_indent_level))
-                    goto bail;
-                emitted_open = 1;
-            }
-            else {
-                if (JSON_Accu_Accumulate(state, rval, s->item_separator))
-                    goto bail;
-                if (indented && encoder_accumulate_newline_indent(
-                                    s, state, rval, inner_indent_level))
-                    goto bail;
-            }
-            if (encoder_listencode_obj(s, rval, obj, inner_indent_level)) {
-#if PY_VERSION_HEX >= 0x030B0000
-                encoder_annotate_exception(state,
-                    "when serializing %s item %zd",
-                    Py_TYPE(seq)->tp_name, i);
+static PyObject *
+encoder_iterencode_lines(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"iterable", "chunk_size", "as_bytes", NULL};
+    PyObject *iterable;
+    Py_ssize_t chunk_size;
+    int as_bytes = 0;
+    PyEncoderObject *s = (PyEncoderObject *)self;
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyTypeObject *iter_type = (PyTypeObject *)state->PyEncoderIterType;
+    PyEncoderIterObject *it;
+    JSON_EncoderFrame *frame;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On|i:iterencode_lines",
+        kwlist, &iterable, &chunk_size, &as_bytes))
+        return NULL;
+    if (chunk_size <= 0) {
+        PyErr_SetString(PyExc_ValueError, "chunk_size must be greater than 0");
+        return NULL;
+    }
+#if PY_MAJOR_VERSION < 3
+    if (as_bytes) {
+        PyErr_SetString(PyExc_ValueError, "as_bytes requires Python 3");
+        return NULL;
+    }
 #endif
-                goto bail;
-            }
-            i++;
-            Py_CLEAR(obj);
-        }
-        Py_CLEAR(iter);
-        if (PyErr_Occurred())
-            goto bail;
+    it = (PyEncoderIterObject *)iter_type->tp_alloc(iter_type, 0);
+    if (it == NULL)
+        return NULL;
+    Py_INCREF(self);
+    it->encoder = self;
+    it->chunk_size = chunk_size;
+    it->utf8 = as_bytes;
+    frame = encoder_iter_push(it, JSON_FRAME_LINES, iterable, 0);
+    if (frame == NULL || (frame->iter = PyObject_GetIter(iterable)) == NULL) {
+        Py_DECREF(it);
+        return NULL;
+    }
+    return (PyObject *)it;
+}
 
-        if (!emitted_open) {
-            if (JSON_Accu_Accumulate(state, rval, state->JSON_empty_array))
+static PyObject *
+encoder_encode_many(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    /* Encode each object of a sequence into a list, in a single loop */
+    static char *kwlist[] = {"objs", "return_exceptions", NULL};
+    PyEncoderObject *s = (PyEncoderObject *)self;
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    PyObject *objs;
+    int return_exceptions = 0;
+    PyObject *seq;
+    PyObject *rval = NULL;
+    Py_ssize_t i;
+    Py_ssize_t n;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|i:encode_many", kwlist,
+        &objs, &return_exceptions))
+        return NULL;
+    seq = PySequence_Fast(objs, "objs must be a sequence");
+    if (seq == NULL)
+        return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+    rval = PyList_New(n);
+    if (rval == NULL)
+        goto bail;
+    for (i = 0; i < n; i++) {
+        PyObject *obj = PySequence_Fast_GET_ITEM(seq, i);
+        PyObject *encoded = NULL;
+        JSON_Accu acc;
+        int encode_rv;
+        if (JSON_Accu_Init(&acc))
+            goto bail;
+        Py_BEGIN_CRITICAL_SECTION(self);
+        encode_rv = encoder_listencode_obj(s, &acc, obj, 0);
+        Py_END_CRITICAL_SECTION();
+        if (encode_rv)
+            JSON_Accu_Destroy(&acc);
+        else
+            encoded = JSON_Accu_FinishAsString(state, &acc);
+        if (encoded == NULL) {
+            if (!return_exceptions)
                 goto bail;
-        }
-        else {
-            if (indented) {
-                if (encoder_accumulate_newline_indent(s, state, rval, indent_level))
-                    goto bail;
-            }
-            if (JSON_Accu_Accumulate(state, rval, state->JSON_close_array))
+            encoded = json_catch_exception();
+            if (encoded == NULL)
                 goto bail;
+            /* An error leaves the containers it was raised in marked */
+            if (s->markers != Py_None)
+                PyDict_Clear(s->markers);
         }
+        PyList_SET_ITEM(rval, i, encoded);
     }
-
-    if (encoder_markers_pop(s, ident))
-        goto bail;
-    ident = NULL;
-    return 0;
+    Py_DECREF(seq);
+    return rval;
 
 bail:
-    Py_XDECREF(obj);
-    Py_XDECREF(iter);
-    Py_XDECREF(ident);
-    return -1;
+    Py_XDECREF(rval);
+    Py_DECREF(seq);
+    return NULL;
 }
 
+PyDoc_STRVAR(encoder_encode_many_doc,
+"encode_many(objs, return_exceptions=False) -> list\n"
+"\n"
+"Encode each object of objs as a JSON document. If return_exceptions is\n"
+"true, an Exception raised for an object takes its place in the list\n"
+"instead of being raised.");
+
+PyDoc_STRVAR(encoder_iterencode_doc,
+"iterencode(obj, _current_indent_level, chunk_size) -> iterator\n"
+"\n"
+"Encode obj incrementally, yielding strings of about chunk_size\n"
+"characters each.");
+
+PyDoc_STRVAR(encoder_iterencode_lines_doc,
+"iterencode_lines(iterable, chunk_size, as_bytes=False) -> iterator\n"
+"\n"
+"Encode each object of iterable followed by a newline, yielding strings\n"
+"(or UTF-8 encoded bytes) of about chunk_size characters each.");
+
+#if PY_MAJOR_VERSION >= 3
+PyDoc_STRVAR(encoder_encode_bytes_doc,
+"encode_bytes(obj, _current_indent_level) -> bytes\n"
+"\n"
+"Encode obj as a UTF-8 encoded JSON document.");
+#endif
+
+static PyMethodDef encoder_methods[] = {
+    {"iterencode", (PyCFunction)(void(*)(void))encoder_iterencode,
+        METH_VARARGS | METH_KEYWORDS, encoder_iterencode_doc},
+    {"iterencode_lines", (PyCFunction)(void(*)(void))encoder_iterencode_lines,
+        METH_VARARGS | METH_KEYWORDS, encoder_iterencode_lines_doc},
+    {"encode_many", (PyCFunction)(void(*)(void))encoder_encode_many,
+        METH_VARARGS | METH_KEYWORDS, encoder_encode_many_doc},
+#if PY_MAJOR_VERSION >= 3
+    {"encode_bytes", (PyCFunction)(void(*)(void))encoder_encode_bytes,
+        METH_VARARGS | METH_KEYWORDS, encoder_encode_bytes_doc},
+#endif
+    {NULL, NULL, 0, NULL}
+};
+
 static void
 encoder_dealloc(PyObject *self)
 {
@@ -3637,6 +8798,7 @@ static PyType_Slot PyEncoderType_slots[] = {
     {Py_tp_traverse, encoder_traverse},
     {Py_tp_clear, encoder_clear},
     {Py_tp_members, encoder_members},
+    {Py_tp_methods, encoder_methods},
     {Py_tp_new, encoder_new},
     {0, NULL}
 };
@@ -3676,7 +8838,7 @@ static PyTypeObject PyEncoderType = {
     0,                    /* tp_weaklistoffset */
     0,                    /* tp_iter */
     0,                    /* tp_iternext */
-    0,                    /* tp_methods */
+    encoder_methods,      /* tp_methods */
     encoder_members,      /* tp_members */
     0,                    /* tp_getset */
     0,                    /* tp_base */
@@ -3741,12 +8903,18 @@ reset_speedups_state_constants(_speedups_state *state)
     Py_CLEAR(state->JSON_newline);
     Py_CLEAR(state->JSON_sortargs);
     Py_CLEAR(state->JSON_itemgetter0);
+    Py_CLEAR(state->JSON_event_names);
     Py_CLEAR(state->JSON_attr_for_json);
     Py_CLEAR(state->JSON_attr_asdict);
     Py_CLEAR(state->JSON_attr_sort);
     Py_CLEAR(state->JSON_attr_encoded_json);
     Py_CLEAR(state->JSON_attr_add_note);
+    Py_CLEAR(state->JSON_attr_isoformat);
+    Py_CLEAR(state->JSON_attr_int);
+    Py_CLEAR(state->JSON_attr_value);
     Py_CLEAR(state->RawJSONType);
+    Py_CLEAR(state->LazyContainerType);
+    Py_CLEAR(state->LazyEncodable);
     Py_CLEAR(state->JSONDecodeError);
 }
 
@@ -3817,10 +8985,23 @@ init_speedups_state(_speedups_state *state, PyObject *module)
     state->JSON_sortargs = PyTuple_New(0);
     if (state->JSON_sortargs == NULL)
         return -1;
+    state->JSON_event_names = Py_BuildValue(
+        "(sssssssssss)", "start_map", "map_key", "end_map", "start_array",
+        "end_array", "string", "number", "boolean", "null", "item", ".");
+    if (state->JSON_event_names == NULL)
+        return -1;
 
     state->RawJSONType = import_dependency("simplejson.raw_json", "RawJSON");
     if (state->RawJSONType == NULL)
         return -1;
+    state->LazyContainerType = import_dependency("simplejson.lazy",
+                                                 "_LazyContainer");
+    if (state->LazyContainerType == NULL)
+        return -1;
+    state->LazyEncodable = PyObject_GetAttrString(state->LazyContainerType,
+                                                  "_encodable");
+    if (state->LazyEncodable == NULL)
+        return -1;
     state->JSONDecodeError = import_dependency("simplejson.errors", "JSONDecodeError");
     if (state->JSONDecodeError == NULL)
         return -1;
@@ -3851,6 +9032,15 @@ init_speedups_state(_speedups_state *state, PyObject *module)
     state->JSON_attr_add_note = JSON_InternFromString("add_note");
     if (state->JSON_attr_add_note == NULL)
         return -1;
+    state->JSON_attr_isoformat = JSON_InternFromString("isoformat");
+    if (state->JSON_attr_isoformat == NULL)
+        return -1;
+    state->JSON_attr_int = JSON_InternFromString("int");
+    if (state->JSON_attr_int == NULL)
+        return -1;
+    state->JSON_attr_value = JSON_InternFromString("value");
+    if (state->JSON_attr_value == NULL)
+        return -1;
 
     (void)module;
     return 0;
@@ -3875,16 +9065,38 @@ module_exec(PyObject *m)
     state->PyEncoderType = PyType_FromModuleAndSpec(m, &PyEncoderType_spec, NULL);
     if (state->PyEncoderType == NULL)
         return -1;
+    state->PyEncoderIterType = PyType_FromModuleAndSpec(m, &PyEncoderIterType_spec, NULL);
+    if (state->PyEncoderIterType == NULL)
+        return -1;
+    state->PyKeyCacheType = PyType_FromModuleAndSpec(m, &PyKeyCacheType_spec, NULL);
+    if (state->PyKeyCacheType == NULL)
+        return -1;
+    state->PyStructuralIndexType = PyType_FromModuleAndSpec(m, &PyStructuralIndexType_spec, NULL);
+    if (state->PyStructuralIndexType == NULL)
+        return -1;
 #else
     if (PyType_Ready(&PyScannerType) < 0)
         return -1;
     if (PyType_Ready(&PyEncoderType) < 0)
         return -1;
+    if (PyType_Ready(&PyEncoderIterType) < 0)
+        return -1;
+    if (PyType_Ready(&PyKeyCacheType) < 0)
+        return -1;
+#if PY_MAJOR_VERSION >= 3
+    if (PyType_Ready(&PyStructuralIndexType) < 0)
+        return -1;
+#endif
     /* Static types are eternal, so these are borrowed pointers kept
      * in the state struct for layout uniformity with the 3.13+ path.
      * There is nothing to refcount and no GC tracking here. */
     state->PyScannerType = (PyObject *)&PyScannerType;
     state->PyEncoderType = (PyObject *)&PyEncoderType;
+    state->PyEncoderIterType = (PyObject *)&PyEncoderIterType;
+    state->PyKeyCacheType = (PyObject *)&PyKeyCacheType;
+#if PY_MAJOR_VERSION >= 3
+    state->PyStructuralIndexType = (PyObject *)&PyStructuralIndexType;
+#endif
     /* Scanner/Encoder instance construction needs a borrowed reference
      * to the module to store in module_ref; capture it here, before
      * anything else that might trigger instance creation. */
@@ -3896,6 +9108,8 @@ module_exec(PyObject *m)
         return -1;
     if (PyModule_AddObjectRef(m, "make_encoder", state->PyEncoderType) < 0)
         return -1;
+    if (PyModule_AddObjectRef(m, "make_key_cache", state->PyKeyCacheType) < 0)
+        return -1;
 #else
     Py_INCREF(state->PyScannerType);
     if (PyModule_AddObject(m, "make_scanner", state->PyScannerType) < 0) {
@@ -3907,6 +9121,11 @@ module_exec(PyObject *m)
         Py_DECREF(state->PyEncoderType);
         return -1;
     }
+    Py_INCREF(state->PyKeyCacheType);
+    if (PyModule_AddObject(m, "make_key_cache", state->PyKeyCacheType) < 0) {
+        Py_DECREF(state->PyKeyCacheType);
+        return -1;
+    }
 #endif
 
     return init_speedups_state(state, m);
@@ -3919,6 +9138,9 @@ speedups_traverse(PyObject *m, visitproc visit, void *arg)
     _speedups_state *state = get_speedups_state(m);
     Py_VISIT(state->PyScannerType);
     Py_VISIT(state->PyEncoderType);
+    Py_VISIT(state->PyEncoderIterType);
+    Py_VISIT(state->PyKeyCacheType);
+    Py_VISIT(state->PyStructuralIndexType);
     Py_VISIT(state->JSON_Infinity);
     Py_VISIT(state->JSON_NegInfinity);
     Py_VISIT(state->JSON_NaN);
@@ -3934,11 +9156,18 @@ speedups_traverse(PyObject *m, visitproc visit, void *arg)
     Py_VISIT(state->JSON_empty_array);
     Py_VISIT(state->JSON_sortargs);
     Py_VISIT(state->JSON_itemgetter0);
+    Py_VISIT(state->JSON_event_names);
     Py_VISIT(state->JSON_attr_for_json);
     Py_VISIT(state->JSON_attr_asdict);
     Py_VISIT(state->JSON_attr_sort);
     Py_VISIT(state->JSON_attr_encoded_json);
+    Py_VISIT(state->JSON_attr_add_note);
+    Py_VISIT(state->JSON_attr_isoformat);
+    Py_VISIT(state->JSON_attr_int);
+    Py_VISIT(state->JSON_attr_value);
     Py_VISIT(state->RawJSONType);
+    Py_VISIT(state->LazyContainerType);
+    Py_VISIT(state->LazyEncodable);
     Py_VISIT(state->JSONDecodeError);
     return 0;
 }
@@ -3949,6 +9178,9 @@ speedups_clear(PyObject *m)
     _speedups_state *state = get_speedups_state(m);
     Py_CLEAR(state->PyScannerType);
     Py_CLEAR(state->PyEncoderType);
+    Py_CLEAR(state->PyEncoderIterType);
+    Py_CLEAR(state->PyKeyCacheType);
+    Py_CLEAR(state->PyStructuralIndexType);
     reset_speedups_state_constants(state);
     return 0;
 }
@@ -4016,8 +9248,14 @@ init_speedups(void)
         return;
     if (PyType_Ready(&PyEncoderType) < 0)
         return;
+    if (PyType_Ready(&PyEncoderIterType) < 0)
+        return;
+    if (PyType_Ready(&PyKeyCacheType) < 0)
+        return;
     state->PyScannerType = (PyObject *)&PyScannerType;
     state->PyEncoderType = (PyObject *)&PyEncoderType;
+    state->PyEncoderIterType = (PyObject *)&PyEncoderIterType;
+    state->PyKeyCacheType = (PyObject *)&PyKeyCacheType;
 
     m = Py_InitModule3("_speedups", speedups_methods, module_doc);
     if (m == NULL)
@@ -4034,6 +9272,11 @@ init_speedups(void)
         Py_DECREF(state->PyEncoderType);
         return;
     }
+    Py_INCREF(state->PyKeyCacheType);
+    if (PyModule_AddObject(m, "make_key_cache", state->PyKeyCacheType) < 0) {
+        Py_DECREF(state->PyKeyCacheType);
+        return;
+    }
     if (init_speedups_state(state, m) < 0)
         return;
 }
@@ -4,10 +4,13 @@
  * This file is NOT a traditional header and must not be used as one.
  * It contains function *definitions* and is #included multiple times
  * from _speedups.c with different macro settings to generate both
- * the Py2 bytes (_str) and the universal unicode (_unicode) variants
- * of scan_once, _parse_object, _parse_array, and _match_number
- * without code duplication. The caller must #define the following
- * macros before each #include, and must wrap the inclusion with
+ * the Py2 bytes (_str), the universal unicode (_unicode) and the Py3
+ * UTF-8 buffer (_utf8) variants of scan_once, _parse_object, _parse_array,
+ * _parse_numeric_array, _match_number, _parse_double, _skip_value,
+ * _scan_raw, _select, _spans, _validate_string and _validate without code
+ * duplication. The
+ * caller must #define the following macros before each #include, and must
+ * wrap the inclusion with
  *
  *     #define JSON_SPEEDUPS_SCAN_INCLUDING 1
  *     #include "_speedups_scan.h"
@@ -21,16 +24,26 @@
  *
  * Expected macros (must be defined before each #include):
  *
- *   JSON_SCAN_SUFFIX                - Either _str or _unicode
+ *   JSON_SCAN_SUFFIX                - One of _str, _unicode or _utf8
  *   JSON_SCAN_DATA_INIT(pystr)      - Statements to set up `str` (data
  *                                     pointer) and `end_idx` locals
  *   JSON_SCAN_READ(idx)             - Read char at idx, returns JSON_UNICHR
  *   JSON_SCAN_SCANSTRING_CALL(...)  - scanstring_* call with the right args
  *   JSON_SCAN_NUMSTR_CREATE(s, e)   - Create a PyObject holding the numeric
  *                                     substring from start..end
+ *   JSON_SCAN_RAW_CREATE(s, e)      - Create the str (unicode) of the
+ *                                     source from start..end, for RawJSON
  *   JSON_SCAN_PARSE_FLOAT_FAST(ns)  - Fast-path float parse (or fallback)
  *   JSON_SCAN_PARSE_INT_FAST(ns)    - Fast-path int parse (or fallback)
  *
+ * and may define:
+ *
+ *   JSON_SCAN_ASCII_DATA(idx)       - Pointer to the bytes at idx if they
+ *                                     are one byte per char, or NULL; lets
+ *                                     a KeyCache find keys in place
+ *   JSON_SCAN_UTF8                  - Defined if `str` points to UTF-8
+ *                                     bytes, which _validate_string checks
+ *
  * The macros are #undef'd at the bottom of the file so the caller can
  * redefine them for the next #include.
  *
@@ -69,6 +82,61 @@
             idx++; \
     } while (0)
 
+static int
+JSON_SCAN_FN(_parse_double)(PyObject *pystr, Py_ssize_t start,
+                            Py_ssize_t end, double *result)
+{
+    /* Store the value of the float pystr[start:end] that _match_number has
+       matched in *result and return 1, or return 0 if it has more than 19
+       significant digits or json_decimal_to_double can't round it, and it
+       must go through PyOS_string_to_double. */
+    JSON_SCAN_DATA_INIT(pystr);
+    Py_ssize_t idx = start;
+    unsigned long long mantissa = 0;
+    int digits = 0;
+    int negative = 0;
+    int in_fraction = 0;
+    long exp10 = 0;
+    long exponent = 0;
+    int exp_negative = 0;
+    JSON_UNICHR c;
+
+    (void)end_idx;
+    if (JSON_SCAN_READ(idx) == '-') {
+        negative = 1;
+        idx++;
+    }
+    for (; idx < end; idx++) {
+        c = JSON_SCAN_READ(idx);
+        if (c == '.') {
+            in_fraction = 1;
+            continue;
+        }
+        if (!IS_DIGIT(c))
+            break;
+        if (mantissa != 0 || c != '0') {
+            if (++digits > 19)
+                return 0;
+            mantissa = mantissa * 10 + (c - '0');
+        }
+        exp10 -= in_fraction;
+    }
+    if (idx < end) {
+        /* 'e' or 'E', then an optional sign and at least one digit */
+        c = JSON_SCAN_READ(++idx);
+        if (c == '-' || c == '+') {
+            exp_negative = (c == '-');
+            idx++;
+        }
+        for (; idx < end; idx++) {
+            if (exponent < 100000)
+                exponent = exponent * 10 + (JSON_SCAN_READ(idx) - '0');
+        }
+        exp10 += exp_negative ? -exponent : exponent;
+    }
+    return json_decimal_to_double(negative, mantissa, exp10, result);
+}
+
 static PyObject *
 JSON_SCAN_FN(_match_number)(PyScannerObject *s, PyObject *pystr,
                             Py_ssize_t start, Py_ssize_t *next_idx_ptr)
@@ -144,6 +212,13 @@ JSON_SCAN_FN(_match_number)(PyScannerObject *s, PyObject *pystr,
         }
     }
 
+    *next_idx_ptr = idx;
+    if (is_float && s->parse_float == (PyObject *)&PyFloat_Type) {
+        double d;
+        if (JSON_SCAN_FN(_parse_double)(pystr, start, idx, &d))
+            return PyFloat_FromDouble(d);
+    }
+
     /* copy the section we determined to be a number */
     numstr = JSON_SCAN_NUMSTR_CREATE(start, idx);
     if (numstr == NULL)
@@ -164,16 +239,17 @@ JSON_SCAN_FN(_match_number)(PyScannerObject *s, PyObject *pystr,
         rval = JSON_SCAN_PARSE_INT_FAST(numstr);
     }
     Py_DECREF(numstr);
-    *next_idx_ptr = idx;
     return rval;
 }
 
 static PyObject *
-JSON_SCAN_FN(_parse_object)(PyScannerObject *s, PyObject *pystr,
-                            Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+JSON_SCAN_FN(_parse_object)(PyScannerObject *s, PyObject *memo,
+                            PyObject *pystr, Py_ssize_t idx,
+                            Py_ssize_t depth, Py_ssize_t *next_idx_ptr)
 {
     /* Read a JSON object from pystr.
        idx is the index of the first character after the opening curly brace.
+       depth is how deep the object is nested, for raw_depth.
        *next_idx_ptr is a return-by-reference index to the first character
        after the closing curly brace. */
     _speedups_state *state = get_speedups_state(s->module_ref);
@@ -212,15 +288,31 @@ JSON_SCAN_FN(_parse_object)(PyScannerObject *s, PyObject *pystr,
                 raise_errmsg(state, ERR_OBJECT_PROPERTY, pystr, idx);
                 goto bail;
             }
-            key = JSON_SCAN_SCANSTRING_CALL(idx + 1, &next_idx);
-            if (key == NULL)
-                goto bail;
-            /* Intern the key through s->memo so repeated key strings
-             * share one PyObject across this decode. Using SetDefault
-             * collapses what used to be separate Get/Set lookups into
-             * a single atomic call. */
-            if (json_memo_intern_key(s->memo, &key) < 0)
-                goto bail;
+            key = NULL;
+#ifdef JSON_SCAN_ASCII_DATA
+            if (!PyDict_CheckExact(memo)) {
+                const unsigned char *key_data = JSON_SCAN_ASCII_DATA(idx + 1);
+                Py_ssize_t key_len;
+                if (key_data != NULL) {
+                    key = key_cache_find_ascii((PyKeyCacheObject *)memo,
+                                               key_data, end_idx - idx,
+                                               &key_len);
+                    if (key != NULL)
+                        next_idx = idx + key_len + 2;
+                }
+            }
+#endif
+            if (key == NULL) {
+                key = JSON_SCAN_SCANSTRING_CALL(idx + 1, &next_idx);
+                if (key == NULL)
+                    goto bail;
+                /* Intern the key through memo so repeated key strings
+                 * share one PyObject across this decode. Using SetDefault
+                 * collapses what used to be separate Get/Set lookups into
+                 * a single atomic call. */
+                if (json_memo_intern_key(memo, &key) < 0)
+                    goto bail;
+            }
             idx = next_idx;
 
             /* skip whitespace between key and : delimiter, read :, skip
@@ -233,10 +325,26 @@ JSON_SCAN_FN(_parse_object)(PyScannerObject *s, PyObject *pystr,
             idx++;
             SKIP_WHITESPACE();
 
-            /* read any JSON term */
-            val = JSON_SCAN_FN(scan_once)(s, pystr, idx, &next_idx);
-            if (val == NULL)
-                goto bail;
+            /* read any JSON term, or the source of the object or array
+               of a raw key */
+            val = NULL;
+            if (s->raw_keys != NULL && idx <= end_idx &&
+                (JSON_SCAN_READ(idx) == '{' || JSON_SCAN_READ(idx) == '[')) {
+                int raw = PySequence_Contains(s->raw_keys, key);
+                if (raw < 0)
+                    goto bail;
+                if (raw) {
+                    val = JSON_SCAN_FN(_scan_raw)(s, pystr, idx, &next_idx);
+                    if (val == NULL)
+                        goto bail;
+                }
+            }
+            if (val == NULL) {
+                val = JSON_SCAN_FN(scan_once)(s, memo, pystr, idx, depth + 1,
+                                              &next_idx);
+                if (val == NULL)
+                    goto bail;
+            }
 
             if (has_pairs_hook) {
                 item = PyTuple_Pack(2, key, val);
@@ -329,19 +437,198 @@ bail:
     return NULL;
 }
 
+static int
+JSON_SCAN_FN(_parse_numeric_array)(PyScannerObject *s, PyObject *pystr,
+                                   Py_ssize_t idx, Py_ssize_t *next_idx_ptr,
+                                   PyObject **result)
+{
+    /* Read a JSON array of numbers from pystr straight into a C buffer,
+       without an object for each number, and make it into a typed array
+       with make_numeric_array. idx is the index of the first character
+       after the opening brace. Returns 1 and sets *result and
+       *next_idx_ptr, 0 if the array is empty, is not well formed, has
+       an element that is not a number that fits in an int64 or a double,
+       or mixes floats with an integer that a double can't hold exactly
+       (it is then decoded as a list from the start), or -1 on error. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    JSON_NumericArray arr;
+    char buf[64];
+    int rv = 0;
+
+    json_numeric_init(&arr);
+    for (;;) {
+        Py_ssize_t start;
+        JSON_UNICHR c;
+        int is_float = 0;
+        SKIP_WHITESPACE();
+        if (idx > end_idx)
+            goto done;
+        start = idx;
+        c = JSON_SCAN_READ(idx);
+        if (c == 'N' || c == 'I' ||
+            (c == '-' && idx < end_idx && JSON_SCAN_READ(idx + 1) == 'I')) {
+            /* NaN, Infinity or -Infinity, if they decode to floats */
+            PyObject *constant = (c == 'N' ? state->JSON_NaN :
+                                  c == 'I' ? state->JSON_Infinity :
+                                  state->JSON_NegInfinity);
+            const char *name = (c == 'N' ? "NaN" :
+                                c == 'I' ? "Infinity" : "-Infinity");
+            Py_ssize_t i;
+            PyObject *value;
+            double d;
+            if (s->parse_constant == Py_None)
+                goto done;
+            for (i = 0; name[i] != '\0'; i++) {
+                if (idx + i > end_idx ||
+                    JSON_SCAN_READ(idx + i) != (JSON_UNICHR)name[i])
+                    goto done;
+            }
+            value = _parse_constant(s, pystr, constant, idx, &idx);
+            if (value == NULL) {
+                rv = -1;
+                goto done;
+            }
+            if (!PyFloat_CheckExact(value)) {
+                Py_DECREF(value);
+                goto done;
+            }
+            d = PyFloat_AS_DOUBLE(value);
+            Py_DECREF(value);
+            if (json_numeric_append_float(&arr, d)) {
+                rv = -1;
+                goto done;
+            }
+        }
+        else {
+            /* The same grammar as _match_number */
+            if (c == '-') {
+                if (idx >= end_idx)
+                    goto done;
+                c = JSON_SCAN_READ(++idx);
+            }
+            if (c == '0') {
+                idx++;
+            }
+            else if (IS_DIGIT(c)) {
+                idx++;
+                while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+                    idx++;
+            }
+            else {
+                goto done;
+            }
+            if (idx < end_idx &&
+                JSON_SCAN_READ(idx) == '.' &&
+                IS_DIGIT(JSON_SCAN_READ(idx + 1))) {
+                is_float = 1;
+                idx += 2;
+                while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+                    idx++;
+            }
+            if (idx < end_idx &&
+                (JSON_SCAN_READ(idx) == 'e' || JSON_SCAN_READ(idx) == 'E')) {
+                Py_ssize_t e_start = idx;
+                idx++;
+                if (idx < end_idx &&
+                    (JSON_SCAN_READ(idx) == '-' || JSON_SCAN_READ(idx) == '+'))
+                    idx++;
+                while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+                    idx++;
+                if (IS_DIGIT(JSON_SCAN_READ(idx - 1)))
+                    is_float = 1;
+                else
+                    idx = e_start;
+            }
+            if (is_float) {
+                Py_ssize_t i;
+                double d;
+                if (!JSON_SCAN_FN(_parse_double)(pystr, start, idx, &d)) {
+                    if (idx - start >= (Py_ssize_t)sizeof(buf))
+                        goto done;
+                    for (i = start; i < idx; i++)
+                        buf[i - start] = (char)JSON_SCAN_READ(i);
+                    buf[idx - start] = '\0';
+                    d = PyOS_string_to_double(buf, NULL, NULL);
+                    if (d == -1.0 && PyErr_Occurred()) {
+                        rv = -1;
+                        goto done;
+                    }
+                }
+                if (json_numeric_append_float(&arr, d)) {
+                    rv = -1;
+                    goto done;
+                }
+            }
+            else {
+                /* At most 19 digits, then in range of an int64 */
+                int negative = (JSON_SCAN_READ(start) == '-');
+                Py_ssize_t i = start + negative;
+                unsigned long long u = 0;
+                long long value;
+                if (idx - i > 19)
+                    goto done;
+                for (; i < idx; i++)
+                    u = u * 10 + (JSON_SCAN_READ(i) - '0');
+                if (u > (negative ? 9223372036854775808ULL
+                                  : 9223372036854775807ULL))
+                    goto done;
+                value = negative ? -(long long)(u - 1) - 1 : (long long)u;
+                if (json_numeric_append_int(&arr, value)) {
+                    rv = -1;
+                    goto done;
+                }
+            }
+        }
+        SKIP_WHITESPACE();
+        if (idx > end_idx)
+            goto done;
+        c = JSON_SCAN_READ(idx);
+        if (c == ']')
+            break;
+        if (c != ',')
+            goto done;
+        idx++;
+    }
+    if (arr.inexact)
+        goto done;
+    *result = json_numeric_finish(s, &arr);
+    if (*result == NULL) {
+        rv = -1;
+        goto done;
+    }
+    *next_idx_ptr = idx + 1;
+    rv = 1;
+done:
+    json_numeric_clear(&arr);
+    return rv;
+}
+
 static PyObject *
-JSON_SCAN_FN(_parse_array)(PyScannerObject *s, PyObject *pystr,
-                           Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+JSON_SCAN_FN(_parse_array)(PyScannerObject *s, PyObject *memo,
+                           PyObject *pystr, Py_ssize_t idx,
+                           Py_ssize_t depth, Py_ssize_t *next_idx_ptr)
 {
     /* Read a JSON array from pystr.
        idx is the index of the first character after the opening brace.
+       depth is how deep the array is nested, for raw_depth.
        *next_idx_ptr is a return-by-reference index to the first character
        after the closing brace. */
     _speedups_state *state = get_speedups_state(s->module_ref);
     JSON_SCAN_DATA_INIT(pystr);
     PyObject *val = NULL;
-    PyObject *rval = PyList_New(0);
+    PyObject *rval;
     Py_ssize_t next_idx;
+
+    if (s->make_numeric_array != NULL) {
+        int found = JSON_SCAN_FN(_parse_numeric_array)(s, pystr, idx,
+                                                       next_idx_ptr, &rval);
+        if (found < 0)
+            return NULL;
+        if (found)
+            goto hook;
+    }
+    rval = PyList_New(0);
     if (rval == NULL)
         return NULL;
 
@@ -354,7 +641,8 @@ JSON_SCAN_FN(_parse_array)(PyScannerObject *s, PyObject *pystr,
         while (idx <= end_idx) {
             trailing_delimiter = 0;
             /* read any JSON term and de-tuplefy the (rval, idx) */
-            val = JSON_SCAN_FN(scan_once)(s, pystr, idx, &next_idx);
+            val = JSON_SCAN_FN(scan_once)(s, memo, pystr, idx, depth + 1,
+                                          &next_idx);
             if (val == NULL) {
                 goto bail;
             }
@@ -405,6 +693,8 @@ JSON_SCAN_FN(_parse_array)(PyScannerObject *s, PyObject *pystr,
         }
         goto bail;
     }
+    *next_idx_ptr = idx + 1;
+hook:
     /* apply array_hook if set */
     if (s->array_hook != Py_None) {
         val = PyObject_CallOneArg(s->array_hook, rval);
@@ -414,7 +704,6 @@ JSON_SCAN_FN(_parse_array)(PyScannerObject *s, PyObject *pystr,
         rval = val;
         val = NULL;
     }
-    *next_idx_ptr = idx + 1;
     return rval;
 bail:
     Py_XDECREF(val);
@@ -423,11 +712,14 @@ bail:
 }
 
 static PyObject *
-JSON_SCAN_FN(scan_once)(PyScannerObject *s, PyObject *pystr,
-                        Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+JSON_SCAN_FN(scan_once)(PyScannerObject *s, PyObject *memo,
+                        PyObject *pystr, Py_ssize_t idx,
+                        Py_ssize_t depth, Py_ssize_t *next_idx_ptr)
 {
     /* Read one JSON term (of any kind) from pystr.
        idx is the index of the first character of the term.
+       depth is how deep the term is nested, 0 at the top level. An object
+       or array at raw_depth or deeper is read as a RawJSON of its source.
        *next_idx_ptr is a return-by-reference index to the first character
        after the term. */
     _speedups_state *state = get_speedups_state(s->module_ref);
@@ -446,18 +738,28 @@ JSON_SCAN_FN(scan_once)(PyScannerObject *s, PyObject *pystr,
             break;
         case '{':
             /* object */
+            if (s->raw_depth >= 0 && depth >= s->raw_depth) {
+                rval = JSON_SCAN_FN(_scan_raw)(s, pystr, idx, next_idx_ptr);
+                break;
+            }
             if (Py_EnterRecursiveCall(" while decoding a JSON object "
                                       "from a string"))
                 return NULL;
-            rval = JSON_SCAN_FN(_parse_object)(s, pystr, idx + 1, next_idx_ptr);
+            rval = JSON_SCAN_FN(_parse_object)(s, memo, pystr, idx + 1,
+                                               depth, next_idx_ptr);
             Py_LeaveRecursiveCall();
             break;
         case '[':
             /* array */
+            if (s->raw_depth >= 0 && depth >= s->raw_depth) {
+                rval = JSON_SCAN_FN(_scan_raw)(s, pystr, idx, next_idx_ptr);
+                break;
+            }
             if (Py_EnterRecursiveCall(" while decoding a JSON array "
                                       "from a string"))
                 return NULL;
-            rval = JSON_SCAN_FN(_parse_array)(s, pystr, idx + 1, next_idx_ptr);
+            rval = JSON_SCAN_FN(_parse_array)(s, memo, pystr, idx + 1,
+                                              depth, next_idx_ptr);
             Py_LeaveRecursiveCall();
             break;
         case 'n':
@@ -551,6 +853,835 @@ JSON_SCAN_FN(scan_once)(PyScannerObject *s, PyObject *pystr,
     return rval;
 }
 
+static int
+JSON_SCAN_FN(_skip_value)(PyScannerObject *s, PyObject *pystr,
+                          Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+{
+    /* Find the end of the JSON term at idx without building it, for
+       select and _spans. Strings are skipped to their closing quote and arrays and
+       objects to their matching bracket, without validating what is in
+       between. *next_idx_ptr is set to the index of the first character
+       after the term. Returns 0, or -1 with an exception set. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    Py_ssize_t start = idx;
+    Py_ssize_t string_start;
+    Py_ssize_t depth = 0;
+    JSON_UNICHR c;
+
+    if (idx < 0 || idx > end_idx) {
+        raise_errmsg(state, ERR_EXPECTING_VALUE, pystr, idx);
+        return -1;
+    }
+    c = JSON_SCAN_READ(idx);
+    if (c != '"' && c != '{' && c != '[') {
+        /* A number, a literal or a named constant */
+        while (idx <= end_idx) {
+            c = JSON_SCAN_READ(idx);
+            if (c == ',' || c == ']' || c == '}' || IS_WHITESPACE(c))
+                break;
+            idx++;
+        }
+        if (idx == start) {
+            raise_errmsg(state, ERR_EXPECTING_VALUE, pystr, start);
+            return -1;
+        }
+        *next_idx_ptr = idx;
+        return 0;
+    }
+    do {
+        c = JSON_SCAN_READ(idx);
+        if (c == '"') {
+            string_start = idx;
+            for (idx++; ; idx++) {
+                if (idx > end_idx) {
+                    raise_errmsg(state, ERR_STRING_UNTERMINATED, pystr,
+                                 string_start);
+                    return -1;
+                }
+                c = JSON_SCAN_READ(idx);
+                if (c == '"')
+                    break;
+                if (c == '\\')
+                    idx++;
+            }
+        }
+        else if (c == '{' || c == '[') {
+            depth++;
+        }
+        else if (c == '}' || c == ']') {
+            depth--;
+        }
+        idx++;
+    } while (depth > 0 && idx <= end_idx);
+    if (depth > 0) {
+        raise_errmsg(state, JSON_SCAN_READ(start) == '{' ?
+                     ERR_OBJECT_UNTERMINATED : ERR_ARRAY_UNTERMINATED,
+                     pystr, start);
+        return -1;
+    }
+    *next_idx_ptr = idx;
+    return 0;
+}
+
+static int
+JSON_SCAN_FN(_select)(PyScannerObject *s, PyObject *memo, PyObject *pystr,
+                      Py_ssize_t idx, PyObject *node, PyObject *rval,
+                      Py_ssize_t *next_idx_ptr)
+{
+    /* Read the JSON term at idx like scan_once, but only build the values
+       that node selects and store them in rval, see scanner_select. node
+       maps the object keys (str) and array indexes (int) to select to
+       either the node of the keys to select below them, or the label of
+       the value in rval. Everything else is skipped with _skip_value.
+       Returns 0, or -1 with an exception set. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    JSON_UNICHR open;
+    JSON_UNICHR close;
+    PyObject *key;
+    PyObject *child;
+    PyObject *value;
+    Py_ssize_t max_index = -1;
+    Py_ssize_t i;
+    Py_ssize_t next_idx;
+    int found;
+    int rv;
+
+    open = (idx >= 0 && idx <= end_idx) ? JSON_SCAN_READ(idx) : 0;
+    if (open == '{') {
+        close = '}';
+    }
+    else if (open == '[') {
+        Py_ssize_t pos = 0;
+        close = ']';
+        /* The elements after the last selected index are only skipped */
+        while (PyDict_Next(node, &pos, &key, &child)) {
+            if (PyLong_Check(key) || PyInt_Check(key)) {
+                Py_ssize_t index = PyInt_AsSsize_t(key);
+                if (index == -1 && PyErr_Occurred())
+                    return -1;
+                if (index > max_index)
+                    max_index = index;
+            }
+        }
+    }
+    else {
+        return JSON_SCAN_FN(_skip_value)(s, pystr, idx, next_idx_ptr);
+    }
+    idx++;
+    SKIP_WHITESPACE();
+    if (idx <= end_idx && JSON_SCAN_READ(idx) == close) {
+        *next_idx_ptr = idx + 1;
+        return 0;
+    }
+    for (i = 0; ; i++) {
+        /* read the key, or count the index */
+        if (open == '{') {
+            if (idx > end_idx || JSON_SCAN_READ(idx) != '"') {
+                raise_errmsg(state, i ? ERR_OBJECT_PROPERTY :
+                             ERR_OBJECT_PROPERTY_FIRST, pystr, idx);
+                return -1;
+            }
+            key = JSON_SCAN_SCANSTRING_CALL(idx + 1, &next_idx);
+            if (key == NULL)
+                return -1;
+            idx = next_idx;
+            SKIP_WHITESPACE();
+            if (idx > end_idx || JSON_SCAN_READ(idx) != ':') {
+                Py_DECREF(key);
+                raise_errmsg(state, ERR_OBJECT_PROPERTY_DELIMITER, pystr, idx);
+                return -1;
+            }
+            idx++;
+            SKIP_WHITESPACE();
+        }
+        else if (i <= max_index) {
+            key = PyInt_FromSsize_t(i);
+            if (key == NULL)
+                return -1;
+        }
+        else {
+            key = NULL;
+        }
+
+        /* build, descend into or skip the value */
+        child = NULL;
+        found = 0;
+        if (key != NULL) {
+            found = json_PyDict_GetItemRef(node, key, &child);
+            Py_DECREF(key);
+            if (found < 0)
+                return -1;
+        }
+        if (!found) {
+            rv = JSON_SCAN_FN(_skip_value)(s, pystr, idx, &next_idx);
+        }
+        else if (PyDict_CheckExact(child)) {
+            rv = JSON_SCAN_FN(_select)(s, memo, pystr, idx, child, rval,
+                                       &next_idx);
+        }
+        else {
+            value = JSON_SCAN_FN(scan_once)(s, memo, pystr, idx, 0, &next_idx);
+            rv = value == NULL ? -1 : PyDict_SetItem(rval, child, value);
+            Py_XDECREF(value);
+        }
+        Py_XDECREF(child);
+        if (rv < 0)
+            return -1;
+        idx = next_idx;
+
+        /* read the delimiter */
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == close)
+            break;
+        if (idx > end_idx || JSON_SCAN_READ(idx) != ',') {
+            raise_errmsg(state, open == '{' ? ERR_OBJECT_DELIMITER :
+                         ERR_ARRAY_DELIMITER, pystr, idx);
+            return -1;
+        }
+        idx++;
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == close) {
+            raise_errmsg(state, open == '{' ? ERR_TRAILING_COMMA_OBJECT :
+                         ERR_TRAILING_COMMA_ARRAY, pystr, idx);
+            return -1;
+        }
+    }
+    *next_idx_ptr = idx + 1;
+    return 0;
+}
+
+static PyObject *
+JSON_SCAN_FN(_spans)(PyScannerObject *s, PyObject *memo, PyObject *pystr,
+                     Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+{
+    /* Read the array or object at idx for the lazy containers of
+       JSONDecoder, see scanner_spans: return a list of the (start, end)
+       of each element of an array, or of the (key, start, end) of each
+       member of an object, where the values are skipped with _skip_value.
+       Returns Py_None (new reference) without setting *next_idx_ptr if
+       there is no array or object at idx, or NULL with an exception set. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    JSON_UNICHR open;
+    JSON_UNICHR close;
+    PyObject *rval;
+    PyObject *key = NULL;
+    PyObject *item;
+    Py_ssize_t start;
+    Py_ssize_t next_idx;
+
+    open = (idx >= 0 && idx <= end_idx) ? JSON_SCAN_READ(idx) : 0;
+    if (open == '{')
+        close = '}';
+    else if (open == '[')
+        close = ']';
+    else
+        Py_RETURN_NONE;
+    rval = PyList_New(0);
+    if (rval == NULL)
+        return NULL;
+    idx++;
+    SKIP_WHITESPACE();
+    if (idx <= end_idx && JSON_SCAN_READ(idx) == close) {
+        *next_idx_ptr = idx + 1;
+        return rval;
+    }
+    for (;;) {
+        /* read the key */
+        if (open == '{') {
+            if (idx > end_idx || JSON_SCAN_READ(idx) != '"') {
+                raise_errmsg(state, PyList_GET_SIZE(rval) ?
+                             ERR_OBJECT_PROPERTY : ERR_OBJECT_PROPERTY_FIRST,
+                             pystr, idx);
+                goto bail;
+            }
+            key = JSON_SCAN_SCANSTRING_CALL(idx + 1, &next_idx);
+            if (key == NULL || json_memo_intern_key(memo, &key) < 0)
+                goto bail;
+            idx = next_idx;
+            SKIP_WHITESPACE();
+            if (idx > end_idx || JSON_SCAN_READ(idx) != ':') {
+                raise_errmsg(state, ERR_OBJECT_PROPERTY_DELIMITER, pystr, idx);
+                goto bail;
+            }
+            idx++;
+            SKIP_WHITESPACE();
+        }
+
+        /* skip the value */
+        start = idx;
+        if (idx > end_idx && open == '[' && !PyList_GET_SIZE(rval)) {
+            raise_errmsg(state, ERR_ARRAY_VALUE_FIRST, pystr, idx);
+            goto bail;
+        }
+        if (JSON_SCAN_FN(_skip_value)(s, pystr, idx, &next_idx) < 0)
+            goto bail;
+        idx = next_idx;
+        if (key != NULL)
+            item = Py_BuildValue("(Nnn)", key, start, idx);
+        else
+            item = Py_BuildValue("(nn)", start, idx);
+        key = NULL;
+        if (item == NULL)
+            goto bail;
+        if (PyList_Append(rval, item) < 0) {
+            Py_DECREF(item);
+            goto bail;
+        }
+        Py_DECREF(item);
+
+        /* read the delimiter */
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == close)
+            break;
+        if (idx > end_idx || JSON_SCAN_READ(idx) != ',') {
+            raise_errmsg(state, open == '{' ? ERR_OBJECT_DELIMITER :
+                         ERR_ARRAY_DELIMITER, pystr, idx);
+            goto bail;
+        }
+        idx++;
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == close) {
+            raise_errmsg(state, open == '{' ? ERR_TRAILING_COMMA_OBJECT :
+                         ERR_TRAILING_COMMA_ARRAY, pystr, idx);
+            goto bail;
+        }
+    }
+    *next_idx_ptr = idx + 1;
+    return rval;
+bail:
+    Py_XDECREF(key);
+    Py_DECREF(rval);
+    return NULL;
+}
+
+static int
+JSON_SCAN_FN(_validate_string)(PyObject *pystr, Py_ssize_t end, int strict,
+                               JSON_ValidateError *err,
+                               Py_ssize_t *next_end_ptr)
+{
+    /* Check the JSON string of pystr whose opening quote is at end - 1
+       like scanstring does, for _validate and without the GIL.
+       *next_end_ptr is set to the index after the closing quote. Returns
+       0, or -1 with the error in err. */
+    JSON_SCAN_DATA_INIT(pystr);
+    Py_ssize_t begin = end - 1;
+    Py_ssize_t next;
+    Py_ssize_t i;
+    JSON_UNICHR c = 0;
+    JSON_UNICHR u;
+    JSON_UNICHR digit;
+
+#define VALIDATE_ERROR(m, p) \
+    do { \
+        err->msg = (m); \
+        err->pos = (p); \
+        return -1; \
+    } while (0)
+#define VALIDATE_HEX4(p, value) \
+    do { \
+        value = 0; \
+        for (i = (p); i < (p) + 4; i++) { \
+            digit = JSON_SCAN_READ(i); \
+            value <<= 4; \
+            if (IS_DIGIT(digit)) \
+                value |= digit - '0'; \
+            else if (digit >= 'a' && digit <= 'f') \
+                value |= digit - 'a' + 10; \
+            else if (digit >= 'A' && digit <= 'F') \
+                value |= digit - 'A' + 10; \
+            else \
+                VALIDATE_ERROR(ERR_STRING_ESC4, (p) - 2); \
+        } \
+    } while (0)
+
+    if (end > end_idx)
+        VALIDATE_ERROR(ERR_STRING_UNTERMINATED, begin);
+    while (1) {
+        /* Find the end of the string or the next escape */
+        for (next = end; next <= end_idx; next++) {
+            c = JSON_SCAN_READ(next);
+            if (c == '"' || c == '\\')
+                break;
+            if (strict && c <= 0x1f)
+                VALIDATE_ERROR(ERR_STRING_CONTROL, next);
+        }
+        if (next > end_idx)
+            VALIDATE_ERROR(ERR_STRING_UNTERMINATED, begin);
+#ifdef JSON_SCAN_UTF8
+        if (!json_utf8_valid((const unsigned char *)str + end, next - end)) {
+            err->msg = NULL;
+            err->run_start = end;
+            err->run_end = next;
+            return -1;
+        }
+#endif
+        next++;
+        if (c == '"')
+            break;
+        if (next > end_idx)
+            VALIDATE_ERROR(ERR_STRING_UNTERMINATED, begin);
+        c = JSON_SCAN_READ(next);
+        if (c != 'u') {
+            end = next + 1;
+            if (c != '"' && c != '\\' && c != '/' && c != 'b' && c != 'f' &&
+                c != 'n' && c != 'r' && c != 't')
+                VALIDATE_ERROR(ERR_STRING_ESC1, end - 2);
+            continue;
+        }
+        next++;
+        end = next + 4;
+        if (end > end_idx + 1)
+            VALIDATE_ERROR(ERR_STRING_ESC4, next - 2);
+        VALIDATE_HEX4(next, u);
+        if ((u & 0xfc00) == 0xd800 && end + 6 <= end_idx + 1 &&
+            JSON_SCAN_READ(end) == '\\' && JSON_SCAN_READ(end + 1) == 'u') {
+            /* The low surrogate of a pair must be valid hex as well */
+            VALIDATE_HEX4(end + 2, u);
+            if ((u & 0xfc00) == 0xdc00)
+                end += 6;
+        }
+    }
+#undef VALIDATE_HEX4
+#undef VALIDATE_ERROR
+    *next_end_ptr = next;
+    return 0;
+}
+
+static int
+JSON_SCAN_FN(_validate)(PyObject *pystr, Py_ssize_t idx, int strict,
+                        int allow_constants, JSON_ValidateError *err,
+                        Py_ssize_t *next_idx_ptr)
+{
+    /* Check the JSON term at idx of pystr like scan_once does, with the
+       same errors, but without building anything or calling anything in
+       Python, so that it can run without the GIL. *next_idx_ptr is set
+       to the index after the term. Returns 0, or -1 with the error in err
+       (and a NULL err->msg with err->run_start == -1 if out of memory).
+       Arrays and objects are tracked on a stack of their brackets rather
+       than by recursion. */
+    JSON_SCAN_DATA_INIT(pystr);
+    char small[JSON_VALIDATE_SMALL];
+    char *stack = small;
+    Py_ssize_t allocated = JSON_VALIDATE_SMALL;
+    Py_ssize_t depth = 0;
+    Py_ssize_t start;
+    int rv = -1;
+    JSON_UNICHR c;
+
+#define VALIDATE_ERROR(m, p) \
+    do { \
+        err->msg = (m); \
+        err->pos = (p); \
+        goto done; \
+    } while (0)
+
+value:
+    /* Read any JSON term */
+    if (idx < 0 || idx > end_idx)
+        VALIDATE_ERROR(ERR_EXPECTING_VALUE, idx);
+    c = JSON_SCAN_READ(idx);
+    if (c == '"') {
+        if (JSON_SCAN_FN(_validate_string)(pystr, idx + 1, strict, err,
+                                           &idx) < 0)
+            goto done;
+        goto after_value;
+    }
+    if (c == '{' || c == '[') {
+        if (json_validate_push(&stack, &allocated, small, depth,
+                               (char)c) < 0) {
+            err->msg = NULL;
+            err->run_start = -1;
+            goto done;
+        }
+        depth++;
+        idx++;
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == (c == '{' ? '}' : ']')) {
+            idx++;
+            depth--;
+            goto after_value;
+        }
+        if (c == '[') {
+            if (idx > end_idx)
+                VALIDATE_ERROR(ERR_ARRAY_VALUE_FIRST, idx);
+            goto value;
+        }
+        if (idx > end_idx)
+            VALIDATE_ERROR(ERR_OBJECT_PROPERTY_FIRST, idx);
+        goto key;
+    }
+    if (c == 'n' || c == 't' || c == 'f' || c == 'N' || c == 'I' ||
+        c == '-') {
+        /* null, true, false, or a named constant */
+        static const char *names[] = {"null", "true", "false", "NaN",
+                                      "Infinity", "-Infinity"};
+        const char *name = (c == 'n' ? names[0] : c == 't' ? names[1] :
+                            c == 'f' ? names[2] : c == 'N' ? names[3] :
+                            c == 'I' ? names[4] : names[5]);
+        Py_ssize_t n = (Py_ssize_t)strlen(name);
+        Py_ssize_t i;
+        for (i = 1; i < n; i++) {
+            if (idx + i > end_idx ||
+                JSON_SCAN_READ(idx + i) != (JSON_UNICHR)name[i])
+                break;
+        }
+        if (i == n) {
+            if (c != 'n' && c != 't' && c != 'f' && !allow_constants)
+                VALIDATE_ERROR(ERR_EXPECTING_VALUE, idx);
+            idx += n;
+            goto after_value;
+        }
+    }
+
+    /* A number, with the same grammar as _match_number */
+    start = idx;
+    if (c == '-') {
+        if (idx >= end_idx)
+            VALIDATE_ERROR(ERR_EXPECTING_VALUE, start);
+        c = JSON_SCAN_READ(++idx);
+    }
+    if (c == '0') {
+        idx++;
+    }
+    else if (IS_DIGIT(c)) {
+        idx++;
+        while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+            idx++;
+    }
+    else {
+        VALIDATE_ERROR(ERR_EXPECTING_VALUE, start);
+    }
+    if (idx < end_idx &&
+        JSON_SCAN_READ(idx) == '.' && IS_DIGIT(JSON_SCAN_READ(idx + 1))) {
+        idx += 2;
+        while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+            idx++;
+    }
+    if (idx < end_idx &&
+        (JSON_SCAN_READ(idx) == 'e' || JSON_SCAN_READ(idx) == 'E')) {
+        Py_ssize_t e_start = idx;
+        idx++;
+        if (idx < end_idx &&
+            (JSON_SCAN_READ(idx) == '-' || JSON_SCAN_READ(idx) == '+'))
+            idx++;
+        while (idx <= end_idx && IS_DIGIT(JSON_SCAN_READ(idx)))
+            idx++;
+        if (!IS_DIGIT(JSON_SCAN_READ(idx - 1)))
+            idx = e_start;
+    }
+
+after_value:
+    if (depth == 0) {
+        *next_idx_ptr = idx;
+        rv = 0;
+        goto done;
+    }
+    SKIP_WHITESPACE();
+    if (stack[depth - 1] == '[') {
+        if (idx > end_idx)
+            VALIDATE_ERROR(ERR_ARRAY_DELIMITER, idx);
+        c = JSON_SCAN_READ(idx);
+        if (c == ']') {
+            idx++;
+            depth--;
+            goto after_value;
+        }
+        if (c != ',')
+            VALIDATE_ERROR(ERR_ARRAY_DELIMITER, idx);
+        idx++;
+        SKIP_WHITESPACE();
+        if (idx <= end_idx && JSON_SCAN_READ(idx) == ']')
+            VALIDATE_ERROR(ERR_TRAILING_COMMA_ARRAY, idx);
+        goto value;
+    }
+    if (idx > end_idx)
+        VALIDATE_ERROR(ERR_OBJECT_DELIMITER, idx);
+    c = JSON_SCAN_READ(idx);
+    if (c == '}') {
+        idx++;
+        depth--;
+        goto after_value;
+    }
+    if (c != ',')
+        VALIDATE_ERROR(ERR_OBJECT_DELIMITER, idx);
+    idx++;
+    SKIP_WHITESPACE();
+    if (idx <= end_idx && JSON_SCAN_READ(idx) == '}')
+        VALIDATE_ERROR(ERR_TRAILING_COMMA_OBJECT, idx);
+    if (idx > end_idx)
+        VALIDATE_ERROR(ERR_OBJECT_PROPERTY, idx);
+
+key:
+    /* Read a key and the : delimiter, then its value */
+    if (JSON_SCAN_READ(idx) != '"')
+        VALIDATE_ERROR(ERR_OBJECT_PROPERTY, idx);
+    if (JSON_SCAN_FN(_validate_string)(pystr, idx + 1, strict, err, &idx) < 0)
+        goto done;
+    SKIP_WHITESPACE();
+    if (idx > end_idx || JSON_SCAN_READ(idx) != ':')
+        VALIDATE_ERROR(ERR_OBJECT_PROPERTY_DELIMITER, idx);
+    idx++;
+    SKIP_WHITESPACE();
+    goto value;
+
+done:
+#undef VALIDATE_ERROR
+    if (stack != small)
+        PyMem_RawFree(stack);
+    return rv;
+}
+
+static PyObject *
+JSON_SCAN_FN(_scan_raw)(PyScannerObject *s, PyObject *pystr,
+                        Py_ssize_t idx, Py_ssize_t *next_idx_ptr)
+{
+    /* Read the JSON term at idx as a RawJSON of its source, for raw_keys
+       and raw_depth. The source is checked with _validate first, so a
+       malformed term raises the same error as scan_once. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_ValidateError err;
+    PyObject *encoded;
+    PyObject *rval;
+    Py_ssize_t next_idx;
+
+    if (JSON_SCAN_FN(_validate)(pystr, idx, s->strict,
+                                s->parse_constant != Py_None, &err,
+                                &next_idx) < 0) {
+        json_validate_raise(state, pystr, &err);
+        return NULL;
+    }
+    encoded = JSON_SCAN_RAW_CREATE(idx, next_idx);
+    if (encoded == NULL)
+        return NULL;
+    rval = PyObject_CallOneArg(state->RawJSONType, encoded);
+    Py_DECREF(encoded);
+    if (rval != NULL)
+        *next_idx_ptr = next_idx;
+    return rval;
+}
+
+static int
+JSON_SCAN_FN(_events)(PyScannerObject *s, PyObject *memo, PyObject *pystr,
+                      Py_ssize_t idx, int closed, int *feed_state_ptr,
+                      PyObject *stack, PyObject *events,
+                      Py_ssize_t *next_idx_ptr)
+{
+    /* Tokenize pystr from idx for JSONDecoder.iterparse, see
+       scanner_events: append the (event, value, prefix) tuple of each
+       token in the open containers of stack to events, updating stack
+       and *feed_state_ptr the way _FeedParser.parse does. Stops at the
+       end of pystr, before a token that is invalid or that may be cut off
+       by the end of pystr unless closed, and before a top-level value,
+       which _FeedParser then deals with itself. *next_idx_ptr is set to
+       where it stopped. Returns 0, or -1 with an exception set. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    int feed_state = *feed_state_ptr;
+    int is_dict;
+    int name;
+    PyObject *frame;
+    PyObject *child = NULL;
+    PyObject *prefix;
+    PyObject *val;
+    Py_ssize_t next_idx;
+    JSON_UNICHR c;
+
+    if (feed_top(stack, &frame) < 0)
+        return -1;
+    for (;;) {
+        SKIP_WHITESPACE();
+        if (idx > end_idx || frame == NULL)
+            break;
+        c = JSON_SCAN_READ(idx);
+        is_dict = PyList_GET_ITEM(frame, 0) == (PyObject *)&PyDict_Type;
+        if (feed_state == FEED_COMMA_OR_CLOSE) {
+            if (c == ',') {
+                feed_state = is_dict ? FEED_KEY : FEED_VALUE;
+                idx++;
+                continue;
+            }
+            if (c != (is_dict ? '}' : ']'))
+                break;
+        }
+        else if (feed_state == FEED_KEY_OR_CLOSE || feed_state == FEED_KEY) {
+            if (c == '"') {
+                val = JSON_SCAN_SCANSTRING_CALL(idx + 1, &next_idx);
+                if (val == NULL)
+                    goto bail;
+                if (json_memo_intern_key(memo, &val) < 0) {
+                    Py_DECREF(val);
+                    goto bail;
+                }
+                /* frame[2] = key */
+                if (PyList_SetItem(frame, 2, val) < 0)
+                    goto bail;
+                Py_CLEAR(child);
+                if (feed_event(events, EVENT_NAME(state, EVENT_MAP_KEY), val,
+                               PyList_GET_ITEM(frame, 3)) < 0)
+                    goto bail;
+                feed_state = FEED_COLON;
+                idx = next_idx;
+                continue;
+            }
+            if (c != '}' || feed_state == FEED_KEY)
+                break;
+        }
+        else if (feed_state == FEED_COLON) {
+            if (c != ':')
+                break;
+            feed_state = FEED_VALUE;
+            idx++;
+            continue;
+        }
+        else if (feed_state == FEED_VALUE ||
+                 feed_state == FEED_VALUE_OR_CLOSE) {
+            if (c == '{' || c == '[') {
+                if (feed_push(state, stack, events, c == '{', &frame,
+                              &child) < 0)
+                    goto bail;
+                feed_state = c == '{' ? FEED_KEY_OR_CLOSE :
+                                        FEED_VALUE_OR_CLOSE;
+                idx++;
+                continue;
+            }
+            if (c == '}' || c == ']') {
+                if (c != ']' || feed_state != FEED_VALUE_OR_CLOSE)
+                    break;
+            }
+            else {
+                if (c != '"' && !closed) {
+                    /* A number or constant may continue in the next
+                       chunk if it runs to the end */
+                    next_idx = idx;
+                    while (next_idx <= end_idx) {
+                        c = JSON_SCAN_READ(next_idx);
+                        if (IS_WHITESPACE(c) || c == ',' || c == ':' ||
+                            c == '"' || c == '[' || c == ']' || c == '{' ||
+                            c == '}')
+                            break;
+                        next_idx++;
+                    }
+                    if (next_idx > end_idx)
+                        break;
+                    c = JSON_SCAN_READ(idx);
+                }
+                val = JSON_SCAN_FN(scan_once)(s, memo, pystr, idx,
+                                              PyList_GET_SIZE(stack),
+                                              &next_idx);
+                if (val == NULL)
+                    goto bail;
+                if (c == '"')
+                    name = EVENT_STRING;
+                else if (c == 't' || c == 'f')
+                    name = EVENT_BOOLEAN;
+                else if (c == 'n')
+                    name = EVENT_NULL;
+                else
+                    name = EVENT_NUMBER;
+                prefix = feed_prefix(state, frame, &child);
+                if (prefix == NULL ||
+                    feed_event(events, EVENT_NAME(state, name), val,
+                               prefix) < 0) {
+                    Py_DECREF(val);
+                    goto bail;
+                }
+                Py_DECREF(val);
+                feed_state = FEED_COMMA_OR_CLOSE;
+                idx = next_idx;
+                continue;
+            }
+        }
+        else {
+            break;
+        }
+        /* Close the innermost container */
+        if (feed_close(state, stack, events, &frame, &child) < 0)
+            goto bail;
+        feed_state = frame == NULL ? FEED_DONE : FEED_COMMA_OR_CLOSE;
+        idx++;
+    }
+    Py_XDECREF(child);
+    *feed_state_ptr = feed_state;
+    *next_idx_ptr = idx;
+    return 0;
+bail:
+    Py_XDECREF(child);
+    if (!PyErr_ExceptionMatches(state->JSONDecodeError))
+        return -1;
+    /* An invalid or cut off string or scalar, which _FeedParser tells
+       apart and reports */
+    PyErr_Clear();
+    *feed_state_ptr = feed_state;
+    *next_idx_ptr = idx;
+    return 0;
+}
+
+static int
+JSON_SCAN_FN(_lines)(PyScannerObject *s, PyObject *memo, PyObject *pystr,
+                     Py_ssize_t idx, Py_ssize_t stop, PyObject *rval,
+                     Py_ssize_t *next_idx_ptr, Py_ssize_t *count_ptr)
+{
+    /* Scan the JSON lines of pystr from idx, which is the start of a
+       line, up to stop for JSONDecoder.iter_lines, see scanner_lines:
+       append the document of each line that is not blank to rval. Stops
+       at the end of the line before stop, or at the start of a line whose
+       document is invalid, spans lines or is followed by other data,
+       which iter_lines then reports. *next_idx_ptr is set to where it
+       stopped and *count_ptr to the number of lines read. Returns 0, or
+       -1 with an exception set. */
+    _speedups_state *state = get_speedups_state(s->module_ref);
+    JSON_SCAN_DATA_INIT(pystr);
+    PyObject *val;
+    Py_ssize_t line_end;
+    Py_ssize_t next_idx;
+    Py_ssize_t i;
+    Py_ssize_t count = 0;
+    JSON_UNICHR c;
+    int rv;
+
+    if (stop > end_idx + 1)
+        stop = end_idx + 1;
+    while (idx < stop) {
+        line_end = idx;
+        while (line_end < stop && JSON_SCAN_READ(line_end) != '\n')
+            line_end++;
+        i = idx;
+        while (i < line_end && ((c = JSON_SCAN_READ(i)) == ' ' ||
+                                c == '\t' || c == '\r'))
+            i++;
+        if (i != line_end) {
+            val = JSON_SCAN_FN(scan_once)(s, memo, pystr, i, 0, &next_idx);
+            if (val == NULL) {
+                if (!PyErr_ExceptionMatches(state->JSONDecodeError))
+                    return -1;
+                PyErr_Clear();
+                break;
+            }
+            i = next_idx;
+            while (i < line_end && ((c = JSON_SCAN_READ(i)) == ' ' ||
+                                    c == '\t' || c == '\r'))
+                i++;
+            if (i != line_end) {
+                /* Spans lines or is followed by other data */
+                Py_DECREF(val);
+                break;
+            }
+            rv = PyList_Append(rval, val);
+            Py_DECREF(val);
+            if (rv < 0)
+                return -1;
+        }
+        idx = line_end + 1;
+        count++;
+    }
+    *next_idx_ptr = idx;
+    *count_ptr = count;
+    return 0;
+}
+
 #undef JSON_SCAN_FN
 #undef JSON_SCAN_CONCAT
 #undef JSON_SCAN_CONCAT_
@@ -559,6 +1690,9 @@ JSON_SCAN_FN(scan_once)(PyScannerObject *s, PyObject *pystr,
 #undef JSON_SCAN_READ
 #undef JSON_SCAN_SCANSTRING_CALL
 #undef JSON_SCAN_NUMSTR_CREATE
+#undef JSON_SCAN_RAW_CREATE
 #undef JSON_SCAN_PARSE_FLOAT_FAST
 #undef JSON_SCAN_PARSE_INT_FAST
+#undef JSON_SCAN_ASCII_DATA
+#undef JSON_SCAN_UTF8
 #undef SKIP_WHITESPACE
@@ -1,10 +1,15 @@
 """Implementation of JSONDecoder
 """
 from __future__ import absolute_import
+import codecs
 import re
+import struct
 import sys
-from .compat import PY3, unichr
-from .scanner import make_scanner, JSONDecodeError
+from collections import namedtuple
+from .compat import PY3, integer_types, string_types, text_type, unichr
+from .scanner import (make_scanner, make_key_cache, c_make_scanner,
+    py_make_index, py_scan_raw, JSONDecodeError)
+from .lazy import make_lazy
 
 
 def _import_c_scanstring():
@@ -17,7 +22,7 @@ c_scanstring = _import_c_scanstring()
 
 # NOTE (3.1.0): JSONDecodeError may still be imported from this module for
 # compatibility, but it was never in the __all__
-__all__ = ['JSONDecoder']
+__all__ = ['JSONDecoder', 'StructuralIndex']
 
 FLAGS = re.VERBOSE | re.MULTILINE | re.DOTALL
 
@@ -40,6 +45,9 @@ BACKSLASH = {
 
 DEFAULT_ENCODING = "utf-8"
 
+# How much is read from a file at a time by the incremental parsers
+READ_CHUNK_SIZE = 64 * 1024
+
 if hasattr(sys, 'get_int_max_str_digits'):
     bounded_int = int
 else:
@@ -144,9 +152,10 @@ scanstring = c_scanstring or py_scanstring
 
 WHITESPACE = re.compile(r'[ \t\n\r]*', FLAGS)
 WHITESPACE_STR = ' \t\n\r'
+WHITESPACE_BYTES = re.compile(br'[ \t\n\r]*', FLAGS)
 
 def JSONObject(state, encoding, strict, scan_once, object_hook,
-        object_pairs_hook, memo=None,
+        object_pairs_hook, memo=None, raw_keys=None, check_once=None,
         _w=WHITESPACE.match, _ws=WHITESPACE_STR):
     (s, end) = state
     # Backwards compatibility
@@ -197,7 +206,11 @@ def JSONObject(state, encoding, strict, scan_once, object_hook,
         except IndexError:
             pass
 
-        value, end = scan_once(s, end)
+        if (raw_keys is not None and key in raw_keys and
+                s[end:end + 1] in ('{', '[')):
+            value, end = py_scan_raw(s, end, encoding, check_once)
+        else:
+            value, end = scan_once(s, end)
         pairs.append((key, value))
 
         try:
@@ -243,7 +256,52 @@ def JSONObject(state, encoding, strict, scan_once, object_hook,
         pairs = object_hook(pairs)
     return pairs, end
 
-def JSONArray(state, scan_once, array_hook=None,
+def _numeric_array_maker(numeric_arrays):
+    """Return the ``make_numeric_array(typecode, data)`` function for the
+    *numeric_arrays* option, which makes a typed array of the ``'q'``
+    (int64) or ``'d'`` (double) numbers in the bytearray *data*.
+    """
+    if numeric_arrays == 'numpy':
+        import numpy
+
+        def make_numeric_array(typecode, data, _frombuffer=numpy.frombuffer):
+            return _frombuffer(data, typecode)
+        return make_numeric_array
+    import array
+    if PY3:
+        return array.array
+
+    def make_numeric_array(typecode, data, _array=array.array):
+        # The array module of Python 2 has no 64-bit integer type
+        if typecode == 'q':
+            return list(struct.unpack('=%dq' % (len(data) // 8), bytes(data)))
+        return _array(typecode, bytes(data))
+    return make_numeric_array
+
+
+def _numeric_array(values, make_numeric_array,
+                   _int_types=integer_types, float=float, type=type):
+    """Return the typed array of *values* from *make_numeric_array* if they
+    are all int64 integers or floats, otherwise *values* itself. Floats
+    make it an array of doubles, so then every integer must be one that a
+    double holds exactly.
+    """
+    typecode = 'q'
+    for value in values:
+        if type(value) is float:
+            typecode = 'd'
+        elif (type(value) not in _int_types or
+                not -0x8000000000000000 <= value <= 0x7fffffffffffffff):
+            return values
+    if typecode == 'd':
+        for value in values:
+            if type(value) is not float and float(value) != value:
+                return values
+    return make_numeric_array(typecode, bytearray(
+        struct.pack('=%d%s' % (len(values), typecode), *values)))
+
+
+def JSONArray(state, scan_once, array_hook=None, make_numeric_array=None,
               _w=WHITESPACE.match, _ws=WHITESPACE_STR):
     (s, end) = state
     values = []
@@ -285,10 +343,576 @@ def JSONArray(state, scan_once, array_hook=None,
                 "Illegal trailing comma before end of array",
                 s, end - 1)
 
+    if make_numeric_array is not None:
+        values = _numeric_array(values, make_numeric_array)
     if array_hook is not None:
         values = array_hook(values)
     return values, end
 
+# Parser states of _FeedParser, i.e. what the next token may be
+_VALUE = 0
+_VALUE_OR_CLOSE = 1
+_KEY_OR_CLOSE = 2
+_KEY = 3
+_COLON = 4
+_COMMA_OR_CLOSE = 5
+_DONE = 6
+
+_EOF_MESSAGES = {
+    _VALUE: 'Expecting value',
+    _VALUE_OR_CLOSE: "Expecting value or ']'",
+    _KEY_OR_CLOSE: "Expecting property name enclosed in double quotes or '}'",
+    _KEY: 'Expecting property name enclosed in double quotes',
+    _COLON: "Expecting ':' delimiter",
+}
+
+# The rest of a string up to its closing quote, or to the backslash that
+# ends the input in the middle of an escape, and a run of characters that
+# may still be the prefix of a number or constant
+STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', FLAGS)
+SCALAR = re.compile(r'[^ \t\n\r\[\]{},:"]*', FLAGS)
+
+_SCALAR_EVENTS = {
+    '"': 'string',
+    'n': 'null',
+    't': 'boolean',
+    'f': 'boolean',
+}
+
+def _moved_error(msg, doc, pos, end, linecol):
+    """Return a JSONDecodeError for pos and end in doc, a part of a larger
+    input. linecol maps a position in doc to the (pos, lineno, colno) that
+    are reported instead."""
+    err = JSONDecodeError(msg, doc, pos, end)
+    msg = msg.replace('%r', repr(err.doc[err.pos:err.pos + 1]))
+    pos, end = err.pos, err.end
+    err.pos, err.lineno, err.colno = linecol(pos)
+    if end is None:
+        fmt = '%s: line %d column %d (char %d)'
+        err.args = (fmt % (msg, err.lineno, err.colno, err.pos),)
+    else:
+        err.end, err.endlineno, err.endcolno = linecol(end)
+        fmt = '%s: line %d column %d - line %d column %d (char %d - %d)'
+        err.args = (fmt % (msg, err.lineno, err.colno, err.endlineno,
+                           err.endcolno, err.pos, err.end),)
+    return err
+
+def _read_chunks(s, chunk_size):
+    # Generate the chunks of a file-like object or a string
+    read = getattr(s, 'read', None)
+    if read is not None:
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for i in range(0, len(s), chunk_size):
+            yield s[i:i + chunk_size]
+
+class _FeedParser(object):
+    """State of an incremental parse driven by JSONDecoder.feed() or
+    JSONDecoder.iterparse()
+
+    Containers that are still open are kept on an explicit stack, every
+    complete value is parsed with the decoder's scan_once and only the
+    unparsed tail of the input is buffered.
+
+    If events is a list, (event, value, prefix) tuples are appended to it
+    instead of building the containers. If array_items is true, the
+    document must be an array, and its list is left to the caller to
+    consume the elements from while the parse is in progress.
+    """
+    def __init__(self, decoder, events=None, array_items=False):
+        if events is None and (decoder.raw_depth is not None or
+                               decoder.raw_keys is not None):
+            # The source of a container that is built token by token
+            # across chunks is not kept to capture
+            raise ValueError(
+                "feed and iter_array cannot be used with raw_depth or "
+                "raw_keys")
+        self.decoder = decoder
+        self.events = events
+        self.array_items = array_items
+        # The fast path scans whole values and falls back to the stack
+        # when they are incomplete, so hooks with side effects could be
+        # called twice for the same value.
+        self.fast = (events is None and
+                     decoder.object_hook is None and
+                     decoder.object_pairs_hook is None and
+                     decoder.array_hook is None)
+        # Containers nested deeper than this are not scanned whole, as
+        # the scanner ran out of stack for one of them
+        self.fast_depth = sys.maxsize
+        self.bytes_decoder = None
+        self.buf = u''
+        self.closed = False
+        self.state = _VALUE
+        self.stack = []
+        # The chunks after self.buf while it starts with a string or
+        # number that they have not completed yet, or None
+        self.pending = None
+        # Whether the input ended in the middle of an escape of that string
+        self.escaped = False
+        self.memo = {}
+        self.result = None
+        # Position of self.buf in the whole document
+        self.offset = 0
+        self.lineno = 1
+        self.linestart = 0
+
+    def feed(self, data, _PY3=PY3):
+        if isinstance(data, text_type):
+            text = data
+        elif (isinstance(data, bytes) or
+              (_PY3 and isinstance(data, (bytearray, memoryview)))):
+            if self.bytes_decoder is None:
+                self.bytes_decoder = codecs.getincrementaldecoder(
+                    self.decoder.encoding)()
+            text = self.bytes_decoder.decode(data)
+        else:
+            raise TypeError("Input must be text or bytes, not %s"
+                            % (type(data).__name__,))
+        if self.offset == 0 and not self.buf and text[:1] == u'\ufeff':
+            # strip BOM
+            text = text[1:]
+            self.offset = self.linestart = 1
+        pending = self.pending
+        if pending is not None:
+            if self.waiting(text, 0, self.buf[:1] == '"'):
+                # Only the new text has been scanned, the rest is known
+                # not to complete the value
+                pending.append(text)
+                return
+            pending.append(text)
+            text = u''.join(pending)
+            self.pending = None
+        self.buf += text
+        self.parse()
+
+    def close(self):
+        if self.pending is not None:
+            self.buf += u''.join(self.pending)
+            self.pending = None
+        if self.bytes_decoder is not None:
+            self.buf += self.bytes_decoder.decode(b'', True)
+        self.closed = True
+        self.parse()
+        if self.state != _DONE:
+            msg = _EOF_MESSAGES.get(self.state)
+            if msg is None:
+                # _COMMA_OR_CLOSE
+                if self.stack[-1][0] is dict:
+                    msg = "Expecting ',' delimiter or '}'"
+                else:
+                    msg = "Expecting ',' delimiter or ']'"
+            raise self.error(msg, len(self.buf))
+        return self.result
+
+    def error(self, msg, pos, end=None):
+        """Return a JSONDecodeError for the buffer positions pos and end,
+        reported as positions in the whole document"""
+        return _moved_error(msg, self.buf, pos, end, self.linecol)
+
+    def linecol(self, pos):
+        s = self.buf
+        newlines = s.count('\n', 0, pos)
+        if newlines:
+            linestart = self.offset + s.rindex('\n', 0, pos) + 1
+        else:
+            linestart = self.linestart
+        pos += self.offset
+        return pos, self.lineno + newlines, pos - linestart + 1
+
+    def incomplete(self, s, pos):
+        """Return True if the value at s[pos] may be cut off by the end of
+        the input received so far, and wait for more input to complete it
+        if so"""
+        if self.closed:
+            return False
+        self.escaped = False
+        if s[pos] == '"':
+            if not self.waiting(s, pos + 1, True):
+                return False
+        elif not self.waiting(s, pos, False):
+            return False
+        self.pending = []
+        return True
+
+    def waiting(self, s, pos, string, _string_rest=STRING_REST.match,
+                _scalar=SCALAR.match):
+        """Return True if s[pos:] continues a string, after its opening
+        quote, or a number or constant without completing it"""
+        n = len(s)
+        if not string:
+            return _scalar(s, pos).end() == n
+        if self.escaped:
+            if pos == n:
+                return True
+            pos += 1
+        end = _string_rest(s, pos).end()
+        # Stopped at the closing quote, or at a backslash that ends s
+        self.escaped = end < n and s[end] == '\\'
+        return end == n or self.escaped
+
+    def prefix(self):
+        """Return the path prefix of the value that comes next"""
+        if not self.stack:
+            return ''
+        kind, _, key, prefix = self.stack[-1]
+        if kind is list:
+            key = 'item'
+        return prefix + '.' + key if prefix else key
+
+    def add_value(self, value):
+        stack = self.stack
+        if not stack:
+            self.result = value
+            self.state = _DONE
+            return
+        frame = stack[-1]
+        if self.events is None:
+            if frame[0] is dict:
+                frame[1].append((frame[2], value))
+            else:
+                frame[1].append(value)
+        self.state = _COMMA_OR_CLOSE
+
+    def close_container(self):
+        decoder = self.decoder
+        kind, items, _, prefix = self.stack.pop()
+        if len(self.stack) < self.fast_depth:
+            self.fast_depth = sys.maxsize
+        if self.array_items and not self.stack:
+            # The elements have already been given out, there's no array
+            # for array_hook
+            pass
+        elif self.events is not None:
+            self.events.append(
+                ('end_array' if kind is list else 'end_map', None, prefix))
+        elif kind is list:
+            if items and decoder.make_numeric_array is not None:
+                items = _numeric_array(items, decoder.make_numeric_array)
+            if decoder.array_hook is not None:
+                items = decoder.array_hook(items)
+        elif decoder.object_pairs_hook is not None:
+            items = decoder.object_pairs_hook(items)
+        else:
+            items = dict(items)
+            if decoder.object_hook is not None:
+                items = decoder.object_hook(items)
+        self.add_value(items)
+
+    def parse(self, _w=WHITESPACE.match):
+        decoder = self.decoder
+        scan_once = decoder.scan_once
+        stack = self.stack
+        s = self.buf
+        n = len(s)
+        pos = 0
+        # The C scanner tokenizes for the events up to the first token
+        # that is invalid or cut off, which is then dealt with here
+        tokenize = None
+        if self.events is not None:
+            tokenize = getattr(scan_once, 'events', None)
+        while True:
+            if tokenize is not None:
+                self.state, pos = tokenize(s, pos, self.state, stack,
+                                           self.events, self.memo,
+                                           self.closed)
+            pos = _w(s, pos).end()
+            if pos == n:
+                break
+            state = self.state
+            c = s[pos]
+            if state == _COMMA_OR_CLOSE:
+                kind = stack[-1][0]
+                if c == ',':
+                    self.state = _KEY if kind is dict else _VALUE
+                elif c == (u'}' if kind is dict else u']'):
+                    self.close_container()
+                elif kind is dict:
+                    raise self.error("Expecting ',' delimiter or '}'", pos)
+                else:
+                    raise self.error("Expecting ',' delimiter or ']'", pos)
+                pos += 1
+            elif state == _KEY_OR_CLOSE or state == _KEY:
+                if c == '"':
+                    try:
+                        key, end = decoder.parse_string(
+                            s, pos + 1, decoder.encoding, decoder.strict)
+                    except JSONDecodeError as e:
+                        if self.incomplete(s, pos):
+                            break
+                        raise self.error(e.msg, e.pos, e.end)
+                    key = stack[-1][2] = self.memo.setdefault(key, key)
+                    if self.events is not None:
+                        self.events.append(('map_key', key, stack[-1][3]))
+                    self.state = _COLON
+                    pos = end
+                elif c == '}' and state == _KEY_OR_CLOSE:
+                    self.close_container()
+                    pos += 1
+                elif c == '}':
+                    raise self.error(
+                        "Illegal trailing comma before end of object", pos)
+                else:
+                    raise self.error(_EOF_MESSAGES[state], pos)
+            elif state == _COLON:
+                if c != ':':
+                    raise self.error("Expecting ':' delimiter", pos)
+                self.state = _VALUE
+                pos += 1
+            elif state == _DONE:
+                raise self.error("Extra data", pos)
+            elif self.array_items and not stack:
+                if c != '[':
+                    raise self.error("Expecting '['", pos)
+                self.push(c)
+                pos += 1
+            elif c == ']' and state == _VALUE_OR_CLOSE:
+                self.close_container()
+                pos += 1
+            elif c == ']' and stack and stack[-1][0] is list:
+                raise self.error(
+                    "Illegal trailing comma before end of array", pos)
+            elif (c not in '{[' or
+                  (self.fast and len(stack) <= self.fast_depth)):
+                if c not in '"{[' and self.incomplete(s, pos):
+                    # A number or constant may continue in the next chunk
+                    break
+                try:
+                    value, end = scan_once(s, pos)
+                except (JSONDecodeError, RuntimeError) as e:
+                    if c == '{' or c == '[':
+                        # Not complete yet, invalid or too deeply nested,
+                        # parse it token by token
+                        if not isinstance(e, JSONDecodeError):
+                            self.fast_depth = len(stack)
+                        self.push(c)
+                        pos += 1
+                        continue
+                    if not isinstance(e, JSONDecodeError):
+                        raise
+                    if self.incomplete(s, pos):
+                        break
+                    raise self.error(e.msg, e.pos, e.end)
+                if self.events is not None:
+                    self.events.append((_SCALAR_EVENTS.get(c, 'number'),
+                                        value, self.prefix()))
+                self.add_value(value)
+                pos = end
+            else:
+                self.push(c)
+                pos += 1
+        # Only keep what hasn't been parsed yet
+        newlines = s.count('\n', 0, pos)
+        if newlines:
+            self.lineno += newlines
+            self.linestart = self.offset + s.rindex('\n', 0, pos) + 1
+        self.offset += pos
+        self.buf = s[pos:]
+
+    def push(self, c):
+        if c == '{':
+            kind = dict
+            self.state = _KEY_OR_CLOSE
+        else:
+            kind = list
+            self.state = _VALUE_OR_CLOSE
+        if self.events is None:
+            self.stack.append([kind, [], None, None])
+            return
+        prefix = self.prefix()
+        self.events.append(
+            ('start_map' if kind is dict else 'start_array', None, prefix))
+        self.stack.append([kind, None, None, prefix])
+
+
+KeyCacheInfo = namedtuple('KeyCacheInfo', 'hits misses maxsize currsize')
+
+
+_MISSING = object()
+
+
+def _parse_select_path(path):
+    """Return ``(label, keys)`` for a *select* path: a string of keys
+    separated by dots, labelled by itself, or a sequence of keys, labelled
+    by the tuple of them.
+
+    """
+    if isinstance(path, string_types):
+        label = path
+        keys = path.split('.')
+    else:
+        label = keys = tuple(path)
+        if not keys:
+            raise ValueError("select paths must not be empty")
+    for key in keys:
+        if not (isinstance(key, string_types) or
+                (isinstance(key, integer_types) and
+                 not isinstance(key, bool) and key >= 0)):
+            raise TypeError(
+                "select path keys must be strings or indexes, not %r"
+                % (key,))
+    return label, keys
+
+
+def _compile_select(select):
+    """Return ``(tree, nested)`` for the *select* paths of JSONDecoder.
+
+    ``tree`` maps the object keys (str) and array indexes (int) to select
+    to either the tree below them, or the label of a selected value, for
+    the ``select`` method of the scanner. ``nested`` lists the
+    ``(label, prefix, keys)`` of the paths below another selected path,
+    which are found in the value of ``prefix`` after the scan.
+
+    """
+    paths = [_parse_select_path(path) for path in select]
+    # A path is added after the paths that are a prefix of it
+    paths.sort(key=lambda path: len(path[1]))
+    tree = {}
+    nested = []
+    for label, keys in paths:
+        node = tree
+        for i, key in enumerate(keys):
+            # A number in a dotted path is an object key or an array index
+            if (isinstance(key, string_types) and key.isdigit() and
+                    str(int(key)) == key):
+                branches = (key, int(key))
+            else:
+                branches = (key,)
+            child = node.get(key)
+            if child is None:
+                child = label if i == len(keys) - 1 else {}
+                for branch in branches:
+                    node[branch] = child
+            elif type(child) is not dict:
+                nested.append((label, child, keys[i + 1:]))
+                break
+            node = child
+    return tree, nested
+
+
+def _select_path(value, keys):
+    """Return the value at the path ``keys`` below ``value``, or
+    ``_MISSING``.
+
+    """
+    for key in keys:
+        if isinstance(value, dict):
+            if not isinstance(key, string_types) or key not in value:
+                return _MISSING
+            value = value[key]
+        elif isinstance(value, list):
+            if isinstance(key, string_types):
+                if not (key.isdigit() and str(int(key)) == key):
+                    return _MISSING
+                key = int(key)
+            if key >= len(value):
+                return _MISSING
+            value = value[key]
+        else:
+            return _MISSING
+    return value
+
+
+def _select_values(value, node, rval):
+    """Store the values below the decoded ``value`` that the select tree
+    ``node`` selects in ``rval``, like the ``select`` method of the
+    scanner does while scanning.
+
+    """
+    if isinstance(value, dict):
+        keys = [key for key in node
+                if isinstance(key, string_types) and key in value]
+    elif isinstance(value, list):
+        keys = [key for key in node
+                if isinstance(key, integer_types) and key < len(value)]
+    else:
+        return
+    for key in keys:
+        child = node[key]
+        if type(child) is dict:
+            _select_values(value[key], child, rval)
+        else:
+            rval[child] = value[key]
+
+
+class StructuralIndex(object):
+    """The structural index of a JSON document, made by
+    :meth:`JSONDecoder.index`: the offsets of its brackets, colons, commas
+    and strings, which are all found in one pass over the document. The
+    values at any number of paths are then decoded without reading the
+    rest of the document again, as the arrays and objects before them are
+    skipped by jumping to their closing bracket.
+
+    The values are decoded with the options of the decoder, and only what
+    is decoded is validated.
+
+    """
+    def __init__(self, decoder, doc, index, root):
+        self.decoder = decoder
+        self._doc = doc
+        self._index = index
+        self._root = root
+
+    def __len__(self):
+        """Return the number of structural characters in the index."""
+        return len(self._index)
+
+    def _find(self, keys):
+        # The offset of the value at the path keys, or -1
+        idx = self._root
+        lookup = self._index.lookup
+        for key in keys:
+            found = lookup(idx, key)
+            # A number in a dotted path is an object key or an array index
+            if (found < 0 and isinstance(key, string_types) and
+                    key.isdigit() and str(int(key)) == key):
+                found = lookup(idx, int(key))
+            if found < 0:
+                return -1
+            idx = found
+        return idx
+
+    def decode(self, _w=WHITESPACE.match, _wb=WHITESPACE_BYTES.match):
+        """Return the Python representation of the whole document, as
+        :meth:`JSONDecoder.decode` would return it.
+
+        """
+        obj, end = self._index.decode(self._root)
+        s = self._doc
+        end = (_w if isinstance(s, text_type) else _wb)(s, end).end()
+        if end != len(s):
+            raise JSONDecodeError("Extra data", s, end, len(s))
+        return obj
+
+    def get(self, path, default=None):
+        """Return the value at ``path``, a string of object keys and array
+        indexes separated by dots or a sequence of them as for the *select*
+        option of :class:`JSONDecoder`, or ``default`` if there is none.
+
+        """
+        idx = self._find(_parse_select_path(path)[1])
+        if idx < 0:
+            return default
+        return self._index.decode(idx)[0]
+
+    def select(self, paths):
+        """Return a dict of the values that are found at ``paths`` by
+        their path, as ``JSONDecoder(select=paths)`` would return it.
+
+        """
+        rval = {}
+        for path in paths:
+            label, keys = _parse_select_path(path)
+            idx = self._find(keys)
+            if idx >= 0:
+                rval[label] = self._index.decode(idx)[0]
+        return rval
+
+
 class JSONDecoder(object):
     """Simple JSON <http://json.org> decoder
 
@@ -323,7 +947,8 @@ class JSONDecoder(object):
     def __init__(self, encoding=None, object_hook=None, parse_float=None,
             parse_int=None, parse_constant=None, strict=True,
             object_pairs_hook=None, allow_nan=False,
-            array_hook=None):
+            array_hook=None, key_cache_size=None, numeric_arrays=None,
+            select=None, lazy=False, raw_depth=None, raw_keys=None):
         """
         *encoding* determines the encoding used to interpret any
         :class:`str` objects decoded by this instance (``'utf-8'`` by
@@ -369,7 +994,64 @@ class JSONDecoder(object):
         ``True`` means that unescaped control characters are parse errors, if
         ``False`` then control characters will be allowed in strings.
 
+        *key_cache_size*, if specified, keeps up to that many object keys
+        across calls, so that a key seen in an earlier document is reused
+        instead of being allocated again. By default keys are only shared
+        within a document. :meth:`key_cache_info` reports how well the
+        cache is doing.
+
+        *numeric_arrays*, if ``'array'`` or ``'numpy'``, decodes each
+        non-empty JSON array whose elements are all numbers as an
+        :class:`array.array` or a NumPy array instead of a list: of
+        typecode ``'q'`` if they are all integers that fit in 64 bits,
+        or ``'d'`` if any of them is a float and a double holds each
+        integer exactly. It has no effect with a custom *parse_float* or
+        *parse_int*.
+
+        *select*, if specified, is a list of the paths of the values to
+        decode, each a string of object keys and array indexes separated
+        by dots (``'user.id'``, ``'items.0'``) or a tuple of them. The
+        result is then a dict of the values that are found by path, and
+        everything else in the document is skipped over without being
+        built or fully validated.
+
+        *lazy*, if true, decodes JSON objects and arrays as
+        :class:`LazyObject` and :class:`LazyArray` containers, which only
+        record where their values are in the document, and decode each
+        value when it is first accessed. The encoders write the source of
+        a container back as it is unless it has been changed, whatever
+        their *ensure_ascii*, *indent*, *separators* or *sort_keys*. Like
+        the source of a :class:`RawJSON`, it is written without being
+        validated: a value is only checked when it is accessed, so invalid
+        source that never is gets written back without an error. It cannot
+        be combined with the hooks, *numeric_arrays* or *select*.
+
+        *raw_depth*, if specified, decodes each JSON object and array that
+        is nested that deep as a :class:`RawJSON` of its source instead,
+        where ``0`` is the document itself. *raw_keys*, if specified, does
+        the same for the objects and arrays that are the values of those
+        object keys. The encoders write a :class:`RawJSON` back as it is.
+        Its source is validated when it is captured, with the same errors
+        as decoding it. Neither can be combined with *select* or *lazy*,
+        nor used with :meth:`feed` or :meth:`iter_array`, and
+        :meth:`iterparse` does not build containers to capture.
+
         """
+        if numeric_arrays not in (None, 'array', 'numpy'):
+            raise ValueError(
+                "numeric_arrays must be None, 'array' or 'numpy'")
+        if lazy and (object_hook or object_pairs_hook or array_hook or
+                     numeric_arrays or select is not None):
+            raise ValueError(
+                "lazy cannot be combined with object_hook, "
+                "object_pairs_hook, array_hook, numeric_arrays or select")
+        if ((raw_depth is not None or raw_keys is not None) and
+                (lazy or select is not None)):
+            raise ValueError(
+                "raw_depth and raw_keys cannot be combined with select or lazy")
+        if raw_depth is not None and (not isinstance(raw_depth, integer_types)
+                                      or raw_depth < 0):
+            raise ValueError("raw_depth must be a non-negative integer")
         if encoding is None:
             encoding = DEFAULT_ENCODING
         self.encoding = encoding
@@ -380,18 +1062,90 @@ class JSONDecoder(object):
         self.parse_constant = parse_constant or (allow_nan and _CONSTANTS.__getitem__ or None)
         self.strict = strict
         self.array_hook = array_hook
+        self.numeric_arrays = numeric_arrays
+        if (numeric_arrays is not None and self.parse_float is float and
+                self.parse_int in (int, bounded_int)):
+            self.make_numeric_array = _numeric_array_maker(numeric_arrays)
+        else:
+            self.make_numeric_array = None
         self.parse_object = JSONObject
         self.parse_array = JSONArray
         self.parse_string = scanstring
         self.memo = {}
+        if key_cache_size is None:
+            self.key_cache = None
+        else:
+            self.key_cache = make_key_cache(key_cache_size)
+        self.select = select
+        if select is None:
+            self._select_tree = self._select_nested = None
+        else:
+            self._select_tree, self._select_nested = _compile_select(select)
+        self.lazy = lazy
+        self.raw_depth = raw_depth
+        self.raw_keys = None if raw_keys is None else frozenset(raw_keys)
         self.scan_once = make_scanner(self)
+        self._feed_parser = None
 
-    def decode(self, s, _w=WHITESPACE.match, _PY3=PY3):
+    def key_cache_info(self):
+        """Return a :class:`KeyCacheInfo` named tuple ``(hits, misses,
+        maxsize, currsize)`` for the key cache, or None if there is no
+        *key_cache_size*.
+
+        """
+        if self.key_cache is None:
+            return None
+        return KeyCacheInfo(*self.key_cache.info())
+
+    def _scan(self, s, idx):
+        # scan_once, the values of the select paths, or a lazy container
+        if self.lazy:
+            spans, end = self.scan_once.spans(s, idx)
+            if spans is None:
+                return self.scan_once(s, idx)
+            if isinstance(s, memoryview):
+                # The containers keep the document
+                s = s.tobytes()
+            return make_lazy(self, s, idx, end, spans), end
+        if self._select_tree is None:
+            return self.scan_once(s, idx)
+        rval, end = self.scan_once.select(s, idx, self._select_tree)
+        return self._select_nested_values(rval), end
+
+    def _select_nested_values(self, rval):
+        # Add the select paths below other select paths to rval
+        for label, prefix, keys in self._select_nested:
+            value = rval.get(prefix, _MISSING)
+            if value is not _MISSING:
+                value = _select_path(value, keys)
+                if value is not _MISSING:
+                    rval[label] = value
+        return rval
+
+    def _scans_utf8(self):
+        # The C scanner reads UTF-8 bytes directly, everything else needs
+        # the document to be decoded to text first
+        return (c_make_scanner is not None and
+                isinstance(self.scan_once, c_make_scanner) and
+                codecs.lookup(self.encoding).name == 'utf-8')
+
+    def decode(self, s, _w=WHITESPACE.match, _wb=WHITESPACE_BYTES.match,
+               _PY3=PY3):
         """Return the Python representation of ``s`` (a ``str`` or ``unicode``
-        instance containing a JSON document)
+        instance containing a JSON document). On Python 3, ``s`` may also
+        be a ``bytes``, ``bytearray`` or ``memoryview`` instance encoded
+        with ``self.encoding``.
 
         """
-        if _PY3 and isinstance(s, bytes):
+        if _PY3 and isinstance(s, (bytes, bytearray, memoryview)):
+            if not isinstance(s, bytes):
+                s = memoryview(s).cast('B')
+            if self._scans_utf8():
+                obj, end = self.raw_decode(s)
+                end = _wb(s, end).end()
+                if end != len(s):
+                    raise JSONDecodeError("Extra data", s, end, len(s))
+                return obj
             s = str(s, self.encoding)
         obj, end = self.raw_decode(s)
         end = _w(s, end).end()
@@ -399,7 +1153,368 @@ class JSONDecoder(object):
             raise JSONDecodeError("Extra data", s, end, len(s))
         return obj
 
-    def raw_decode(self, s, idx=0, _w=WHITESPACE.match, _PY3=PY3):
+    def validate(self, s, _w=WHITESPACE.match, _wb=WHITESPACE_BYTES.match,
+                 _PY3=PY3):
+        """Check that ``s`` is a valid JSON document, and raise the same
+        :exc:`JSONDecodeError` as :meth:`decode` if it is not.
+
+        With the C extension nothing is built and no hook is called,
+        large documents are checked without holding the GIL, and arrays
+        and objects may be nested deeper than :meth:`decode` could recurse.
+
+        """
+        validate = self.scan_once.validate
+        if _PY3 and isinstance(s, (bytes, bytearray, memoryview)):
+            if not isinstance(s, bytes):
+                s = memoryview(s).cast('B')
+            if self._scans_utf8():
+                idx = 3 if s[:3] == b'\xef\xbb\xbf' else 0
+                end = _wb(s, validate(s, _wb(s, idx).end())).end()
+                if end != len(s):
+                    raise JSONDecodeError("Extra data", s, end, len(s))
+                return
+            s = str(s, self.encoding)
+        elif (not _PY3 and isinstance(s, str) and
+                codecs.lookup(self.encoding).name != 'utf-8'):
+            # Only the decoder knows how to check the strings
+            self.decode(s)
+            return
+        # strip UTF-8 bom
+        idx = 0
+        if s:
+            ord0 = ord(s[0])
+            if ord0 == 0xfeff:
+                idx = 1
+            elif ord0 == 0xef and s[:3] == '\xef\xbb\xbf':
+                idx = 3
+        end = _w(s, validate(s, _w(s, idx).end())).end()
+        if end != len(s):
+            raise JSONDecodeError("Extra data", s, end, len(s))
+
+    def index(self, s, _w=WHITESPACE.match, _wb=WHITESPACE_BYTES.match,
+              _PY3=PY3):
+        """Return a :class:`StructuralIndex` of the JSON document ``s``, to
+        decode the values at several paths of a large document without
+        scanning all of it each time. ``s`` is a string as for
+        :meth:`decode`, and as there, data after the document is an error.
+
+        With the C extension on Python 3 the index is made by a fast scan
+        of the UTF-8 bytes of the document, without holding the GIL for
+        large documents. Otherwise each array and object is scanned once,
+        when it is first looked up in. Either way a :exc:`JSONDecodeError`
+        reports character offsets into the decoded document, as
+        :meth:`decode` does. The *select* and *lazy* options do not apply,
+        and *raw_depth* cannot be used.
+
+        """
+        if self.raw_depth is not None:
+            raise ValueError("index cannot be used with raw_depth")
+        if _PY3 and isinstance(s, (bytes, bytearray, memoryview)):
+            if not isinstance(s, bytes):
+                # The index keeps the document
+                s = bytes(s)
+            if not self._scans_utf8():
+                s = str(s, self.encoding)
+        elif _PY3 and self._scans_utf8():
+            try:
+                s = s.encode('utf-8')
+            except UnicodeEncodeError:
+                # A lone surrogate, which only a text document can hold
+                pass
+        elif not _PY3 and isinstance(s, str):
+            s = s.decode(self.encoding)
+        if _PY3 and isinstance(s, bytes):
+            idx = _wb(s, 3 if s[:3] == b'\xef\xbb\xbf' else 0).end()
+            index = self.scan_once.index(s)
+        else:
+            idx = _w(s, 1 if s[:1] == u'\ufeff' else 0).end()
+            index = py_make_index(self.scan_once, s)
+        if index is None:
+            # A string or bracket is not closed
+            self.validate(s)
+        if index is None or idx == len(s):
+            raise JSONDecodeError('Expecting value', s, idx)
+        end = index.skip(idx)
+        if end < 0:
+            # The document is a single string, number or constant
+            end = index.decode(idx)[1]
+        end = (_wb if _PY3 and isinstance(s, bytes) else _w)(s, end).end()
+        if end != len(s):
+            raise JSONDecodeError("Extra data", s, end, len(s))
+        return StructuralIndex(self, s, index, idx)
+
+    def decode_many(self, docs, return_exceptions=False):
+        """Return a list of the Python representations of the JSON
+        documents in the iterable ``docs``, each as :meth:`decode` would
+        return it.
+
+        With the C extension the documents are decoded in a single loop
+        that interns object keys across the whole batch. If
+        *return_exceptions* is true, an :exc:`Exception` raised for a
+        document is put in its place in the list instead of being raised.
+
+        """
+        docs = list(docs)
+        cls = type(self)
+        if (c_make_scanner is not None and
+                isinstance(self.scan_once, c_make_scanner) and
+                self._select_tree is None and not self.lazy and
+                cls.decode is JSONDecoder.decode and
+                cls.raw_decode is JSONDecoder.raw_decode):
+            return self.scan_once.decode_many(
+                docs, PY3 and self._scans_utf8(), self.decode,
+                return_exceptions)
+        decode = self.decode
+        if not return_exceptions:
+            return [decode(s) for s in docs]
+        rval = []
+        for s in docs:
+            try:
+                rval.append(decode(s))
+            except Exception:
+                rval.append(sys.exc_info()[1])
+        return rval
+
+    def feed(self, data):
+        """Feed ``data``, the next chunk of a JSON document, to the
+        incremental parser. ``data`` may be text, or bytes encoded with
+        ``self.encoding`` that may end in the middle of a character.
+
+        Parsing continues across chunk boundaries, including inside
+        strings and numbers, and only the part of the input that has not
+        been parsed yet is kept. Call :meth:`close` once all of the
+        document has been fed to get its Python representation.
+
+        """
+        parser = self._feed_parser
+        if parser is None:
+            parser = self._feed_parser = _FeedParser(self)
+        try:
+            parser.feed(data)
+        except:
+            self._feed_parser = None
+            raise
+
+    def close(self):
+        """Finish the document given to :meth:`feed` and return its
+        Python representation. The decoder can then be used for another
+        document.
+
+        """
+        parser = self._feed_parser
+        self._feed_parser = None
+        if parser is None:
+            parser = _FeedParser(self)
+        rval = parser.close()
+        if self._select_tree is None:
+            return rval
+        selected = {}
+        _select_values(rval, self._select_tree, selected)
+        return self._select_nested_values(selected)
+
+    def iterparse(self, s, chunk_size=READ_CHUNK_SIZE):
+        """Generate ``(event, value, prefix)`` tuples for the tokens of the
+        JSON document ``s``, which is either a ``.read()``-supporting
+        file-like object (read ``chunk_size`` at a time) or text or bytes.
+
+        The events are ``'start_map'``, ``'map_key'``, ``'end_map'``,
+        ``'start_array'``, ``'end_array'``, ``'string'``, ``'number'``,
+        ``'boolean'`` and ``'null'``. ``value`` is the key for
+        ``'map_key'``, the decoded scalar for scalar events and None
+        otherwise. ``prefix`` is the path of the value from the top level
+        of the document, with the keys of the enclosing objects and
+        ``item`` for array elements separated by dots (``''`` for the
+        top-level value). Containers are not built, so memory does not
+        depend on the size of the document. The C scanner, when there is
+        one, makes the events of the tokens of each chunk.
+
+        """
+        events = []
+        parser = _FeedParser(self, events)
+        for chunk in _read_chunks(s, chunk_size):
+            parser.feed(chunk)
+            for event in events:
+                yield event
+            del events[:]
+        parser.close()
+        for event in events:
+            yield event
+
+    def iter_array(self, s, chunk_size=READ_CHUNK_SIZE):
+        """Generate the elements of the JSON array ``s``, which is either a
+        ``.read()``-supporting file-like object (read ``chunk_size`` at a
+        time) or text or bytes, as soon as each of them is complete.
+
+        Only the elements that have been parsed but not generated yet and
+        the unparsed part of the input are kept, so memory is bounded by
+        the largest element rather than the size of the array.
+        *array_hook* is not called for the array itself.
+
+        """
+        parser = _FeedParser(self, array_items=True)
+        items = None
+        for chunk in _read_chunks(s, chunk_size):
+            parser.feed(chunk)
+            if items is None:
+                if not parser.stack:
+                    continue
+                items = parser.stack[0][1]
+            for item in items:
+                yield item
+            del items[:]
+        parser.close()
+        if items is None:
+            items = parser.result
+        for item in items:
+            yield item
+
+    def iter_lines(self, s, chunk_size=READ_CHUNK_SIZE, _PY3=PY3,
+                   _w=WHITESPACE.match, _wb=WHITESPACE_BYTES.match):
+        """Generate the Python representation of each JSON document in the
+        JSON lines (newline-delimited JSON) input ``s``, which is either a
+        ``.read()``-supporting file-like object (read ``chunk_size`` at a
+        time) or text or bytes. Blank lines are skipped.
+
+        Every line is scanned in place in the buffer it was read into,
+        except that with *lazy* the containers keep a copy of their line.
+        The C scanner, when there is one, splits and scans the lines of
+        each buffer, unless *lazy* or *select* is used.
+        A :exc:`JSONDecodeError` has the line as its ``doc`` and the line
+        number in ``s`` as its ``lineno``.
+
+        """
+        scan = self._scan
+        lazy = self.lazy
+        # The C scanner splits and scans the lines of a chunk, up to the
+        # first one that is not a valid document, which is reported here
+        lines = None
+        if not lazy and self._select_tree is None:
+            lines = getattr(self.scan_once, 'lines', None)
+        utf8 = None
+        bytes_decoder = None
+        read = getattr(s, 'read', None)
+        if read is None:
+            chunks = iter((s,))
+        else:
+            chunks = _read_chunks(s, chunk_size)
+        # The chunks of the line that is not complete yet
+        pending = None
+        lineno = 1
+        while True:
+            chunk = next(chunks, None)
+            last = chunk is None
+            if last:
+                if pending is None:
+                    break
+                if bytes_decoder is not None:
+                    pending.append(bytes_decoder.decode(b'', True))
+            elif isinstance(chunk, text_type):
+                pass
+            elif utf8 is None and _PY3 and self._scans_utf8():
+                # Scan the UTF-8 bytes directly
+                utf8 = True
+                if not isinstance(chunk, bytes):
+                    chunk = bytes(chunk)
+            elif utf8:
+                if not isinstance(chunk, bytes):
+                    chunk = bytes(chunk)
+            else:
+                if bytes_decoder is None:
+                    bytes_decoder = codecs.getincrementaldecoder(
+                        self.encoding)()
+                chunk = bytes_decoder.decode(chunk)
+            if utf8:
+                newline = b'\n'
+                ws = b' \t\r'
+                w = _wb
+            else:
+                newline = '\n'
+                ws = ' \t\r'
+                w = _w
+            if pending is None:
+                # strip BOM
+                if chunk[:1] == u'\ufeff':
+                    chunk = chunk[1:]
+                elif utf8 and chunk[:3] == b'\xef\xbb\xbf':
+                    chunk = chunk[3:]
+                pending = []
+            if last or read is None:
+                buf = pending[0][:0].join(pending) if last else chunk
+                stop = len(buf)
+            else:
+                # Only the new chunk can end the line
+                stop = chunk.rfind(newline) + 1
+                if not stop:
+                    pending.append(chunk)
+                    continue
+                pending.append(chunk)
+                buf = chunk[:0].join(pending)
+                stop += len(buf) - len(chunk)
+            pos = 0
+            while pos < stop:
+                if lines is not None:
+                    values, pos, count = lines(buf, pos, stop)
+                    lineno += count
+                    for obj in values:
+                        yield obj
+                    if pos >= stop:
+                        break
+                line_end = buf.find(newline, pos, stop)
+                if line_end == -1:
+                    line_end = stop
+                idx = pos
+                if buf[idx:idx + 1] in ws:
+                    idx = w(buf, idx, line_end).end()
+                if idx != line_end:
+                    if lazy:
+                        # The containers keep their line, not the buffer
+                        doc = buf[pos:line_end]
+                        base = pos
+                    else:
+                        doc = buf
+                        base = 0
+                    try:
+                        obj, end = scan(doc, idx - base)
+                        end += base
+                    except JSONDecodeError:
+                        end = -1
+                    if end < 0 or end > line_end:
+                        # A document must not span lines
+                        raise self._line_error(buf[pos:line_end], idx - pos,
+                                               None, lineno)
+                    end = w(buf, end, line_end).end()
+                    if end != line_end:
+                        raise self._line_error(buf[pos:line_end], idx - pos,
+                                               end - pos, lineno)
+                    yield obj
+                pos = line_end + 1
+                lineno += 1
+            if last or read is None:
+                break
+            pending = [buf[stop:]]
+
+    def _line_error(self, line, idx, end, lineno):
+        # The error for the document at line[idx] of the line number
+        # lineno, which is found by scanning the line alone, or which is
+        # followed by other data at end if that is not None. Offsets stay
+        # those of line, bytes or text, until the one JSONDecodeError that
+        # converts them is made.
+        err = None
+        if end is None:
+            try:
+                self._scan(line, idx)
+            except JSONDecodeError as e:
+                err = e
+        if err is None:
+            err = JSONDecodeError("Extra data", line,
+                                  len(line) if end is None else end,
+                                  len(line))
+        def linecol(pos):
+            return pos, lineno, pos + 1
+        return _moved_error(err.msg, err.doc, err.pos, err.end, linecol)
+
+    def raw_decode(self, s, idx=0, _w=WHITESPACE.match,
+                   _wb=WHITESPACE_BYTES.match, _PY3=PY3):
         """Decode a JSON document from ``s`` (a ``str`` or ``unicode``
         beginning with a JSON document) and return a 2-tuple of the Python
         representation and the index in ``s`` where the document ended.
@@ -409,13 +1524,29 @@ class JSONDecoder(object):
         This can be used to decode a JSON document from a string that may
         have extraneous data at the end.
 
+        On Python 3, ``s`` may also be a ``bytes``, ``bytearray`` or
+        ``memoryview`` instance, in which case ``idx`` and the returned
+        index are byte offsets.
+
         """
         if idx < 0:
             # Ensure that raw_decode bails on negative indexes, the regex
             # would otherwise mask this behavior. #98
             raise JSONDecodeError('Expecting value', s, idx)
         if _PY3 and not isinstance(s, str):
-            raise TypeError("Input string must be text, not bytes")
+            if not isinstance(s, (bytes, bytearray, memoryview)):
+                raise TypeError("Input string must be text or bytes, not %s"
+                                % (type(s).__name__,))
+            if not isinstance(s, bytes):
+                s = memoryview(s).cast('B')
+            if not self._scans_utf8():
+                text = str(s, self.encoding)
+                obj, end = self.raw_decode(
+                    text, len(str(s[:idx], self.encoding)))
+                return obj, len(text[:end].encode(self.encoding))
+            if s[idx:idx + 3] == b'\xef\xbb\xbf':
+                idx += 3
+            return self._scan(s, _wb(s, idx).end())
         # strip UTF-8 bom
         if len(s) > idx:
             ord0 = ord(s[idx])
@@ -423,4 +1554,4 @@ class JSONDecoder(object):
                 idx += 1
             elif ord0 == 0xef and s[idx:idx + 3] == '\xef\xbb\xbf':
                 idx += 3
-        return self.scan_once(s, idx=_w(s, idx).end())
+        return self._scan(s, _w(s, idx).end())
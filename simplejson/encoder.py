@@ -2,9 +2,13 @@
 """
 from __future__ import absolute_import
 import re
+from collections import OrderedDict
 from operator import itemgetter
+import base64
+import datetime
 # Do not import Decimal directly to avoid reload issues
 import decimal
+import struct
 import sys
 from .compat import binary_type, text_type, string_types, integer_types, PY3
 
@@ -24,6 +28,7 @@ c_encode_basestring_ascii, c_encode_basestring, c_make_encoder = (
 
 from .decoder import PosInf
 from .raw_json import RawJSON
+from .lazy import _LazyContainer
 
 ESCAPE = re.compile(r'[\x00-\x1f\\"]')
 ESCAPE_ASCII = re.compile(r'([\\"]|[^\ -~])')
@@ -153,6 +158,15 @@ class JSONEncoder(object):
     """
     item_separator = ', '
     key_separator = ': '
+    # (options, dict) of the encoded keys kept by the C encoder across
+    # calls, see _get_key_memo
+    _key_memo = None
+    # The sorted key orders of the dicts encoded with sort_keys, kept by
+    # the C encoder across calls
+    _shape_memo = None
+    # (options, type_encoders, dict) of what the C encoder learned about each type
+    # it has seen, kept across calls, see _get_type_memo
+    _type_memo = None
 
     def __init__(self, skipkeys=False, ensure_ascii=True,
                  check_circular=True, allow_nan=False, sort_keys=False,
@@ -160,7 +174,10 @@ class JSONEncoder(object):
                  use_decimal=True, namedtuple_as_object=True,
                  tuple_as_array=True, bigint_as_string=False,
                  item_sort_key=None, for_json=False, ignore_nan=False,
-                 int_as_string_bitcount=None, iterable_as_array=False):
+                 int_as_string_bitcount=None, iterable_as_array=False,
+                 type_encoders=None, datetime_format=None, uuid_as_str=False,
+                 enum_as_value=False, bytes_as=None,
+                 dataclass_as_object=False, buffer_as_array=False):
         """Constructor for JSONEncoder, with sensible defaults.
 
         If skipkeys is false, then it is a TypeError to attempt
@@ -241,6 +258,44 @@ class JSONEncoder(object):
         as ``null`` in compliance with the ECMA-262 specification. If true,
         this will override *allow_nan*.
 
+        If specified, *type_encoders* is a dict mapping types to functions
+        that each return a JSON encodable version of an instance of that
+        type. It is consulted before ``for_json()``, ``_asdict()`` and
+        *default*, and the function of the nearest class in
+        ``type(o).__mro__`` is used, unless a type that is encoded natively
+        (such as ``dict``, ``list``, ``str``, ``int``, ``float`` or, with
+        *tuple_as_array*, ``tuple``) comes first. So a function registered
+        for a subclass of ``str``, ``int`` or ``float`` is used for its
+        instances, but one registered for ``str``, ``int``, ``float`` or
+        ``bool`` themselves is not.
+
+        If *datetime_format* is ``'iso'`` (default: ``None``),
+        ``datetime.datetime``, ``datetime.date`` and ``datetime.time``
+        objects will be encoded as strings of their ``isoformat()``.
+
+        If *uuid_as_str* is true (default: ``False``), ``uuid.UUID``
+        objects will be encoded as strings of their ``str()``.
+
+        If *enum_as_value* is true (default: ``False``), ``enum.Enum``
+        members will be encoded as their ``value``.
+
+        If *bytes_as* is ``'base64'`` (default: ``None``), ``bytes`` and
+        ``bytearray`` objects will be encoded as strings of their standard
+        base64 encoding instead of being decoded with *encoding*. On
+        Python 2 this applies to ``bytearray`` only.
+
+        If *dataclass_as_object* is true (default: ``False``), instances
+        of dataclasses and attrs classes will be encoded as JSON objects
+        of their fields, in field order. The fields of each class are
+        looked up once, and this comes after *type_encoders* but before
+        ``for_json()`` and ``_asdict()``.
+
+        If *buffer_as_array* is true (default: ``False``), objects that
+        export a buffer of plain numbers, such as ``array.array``,
+        ``memoryview`` and NumPy arrays and scalars, will be encoded as
+        (nested) JSON arrays of those numbers, or as a single number when
+        the buffer has no dimensions.
+
         """
 
         self.skipkeys = skipkeys
@@ -257,6 +312,17 @@ class JSONEncoder(object):
         self.for_json = for_json
         self.ignore_nan = ignore_nan
         self.int_as_string_bitcount = int_as_string_bitcount
+        self.type_encoders = type_encoders
+        if datetime_format not in (None, 'iso'):
+            raise ValueError("datetime_format must be None or 'iso'")
+        self.datetime_format = datetime_format
+        self.uuid_as_str = uuid_as_str
+        self.enum_as_value = enum_as_value
+        if bytes_as not in (None, 'base64'):
+            raise ValueError("bytes_as must be None or 'base64'")
+        self.bytes_as = bytes_as
+        self.dataclass_as_object = dataclass_as_object
+        self.buffer_as_array = buffer_as_array
         if indent is not None and not isinstance(indent, string_types):
             indent = indent * ' '
         self.indent = indent
@@ -298,7 +364,7 @@ class JSONEncoder(object):
 
         """
         # This is for extremely simple cases and benchmarks.
-        if isinstance(o, binary_type):
+        if isinstance(o, binary_type) and not (PY3 and self.bytes_as):
             _encoding = self.encoding
             if (_encoding is not None and not (_encoding == 'utf-8')):
                 o = text_type(o, _encoding)
@@ -318,7 +384,7 @@ class JSONEncoder(object):
         else:
             return u''.join(chunks)
 
-    def iterencode(self, o):
+    def iterencode(self, o, chunk_size=None):
         """Encode the given object and yield each string
         representation as available.
 
@@ -327,6 +393,144 @@ class JSONEncoder(object):
             for chunk in JSONEncoder().iterencode(bigobject):
                 mysocket.write(chunk)
 
+        If *chunk_size* is given, the output is produced incrementally
+        in strings of roughly *chunk_size* characters each (a chunk may
+        run past it by at most one scalar value), so the complete
+        document never has to be held in memory at once.
+
+        """
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+        _iterencode = self._make_encoder()
+        if chunk_size is None:
+            return _iterencode(o, 0)
+        if c_make_encoder is not None:
+            return _iterencode.iterencode(o, 0, chunk_size)
+        return _chunked(_iterencode(o, 0), chunk_size)
+
+    def encode_bytes(self, o):
+        """Return a JSON representation of a Python data structure as
+        UTF-8 encoded bytes.
+
+        >>> from simplejson import JSONEncoder
+        >>> JSONEncoder().encode_bytes({"foo": ["bar"]}) == b'{"foo": ["bar"]}'
+        True
+
+        This is equivalent to ``self.encode(o).encode('utf-8')``, but
+        with the C extension the UTF-8 output is written directly,
+        without building the intermediate ``str``.
+
+        """
+        cls = type(self)
+        if (not PY3 or c_make_encoder is None or
+                cls.encode is not JSONEncoder.encode or
+                cls.iterencode is not JSONEncoder.iterencode):
+            # Also keeps the output of subclasses that post-process
+            # encode() or iterencode(), such as JSONEncoderForHTML
+            s = self.encode(o)
+            if isinstance(s, text_type):
+                s = s.encode('utf-8')
+            return s
+        return self._make_encoder().encode_bytes(o, 0)
+
+    def iterencode_lines(self, iterable, chunk_size=None, as_bytes=False):
+        """Encode each object of *iterable* as one line of JSON lines
+        (newline-delimited JSON) and yield the output.
+
+        For example::
+
+            for chunk in JSONEncoder().iterencode_lines(records, 65536):
+                fp.write(chunk)
+
+        Every document is followed by ``'\\n'``. If *chunk_size* is None
+        each line is yielded on its own, otherwise the lines are joined
+        into strings of roughly *chunk_size* characters, and with the C
+        extension a single encoder writes all of them into one buffer.
+        If *as_bytes* is true the output is UTF-8 encoded bytes.
+
+        """
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+        if self.indent is not None:
+            raise ValueError("indent can not be used with JSON lines")
+        cls = type(self)
+        if (chunk_size is not None and c_make_encoder is not None and
+                (PY3 or not as_bytes) and
+                cls.encode is JSONEncoder.encode and
+                cls.iterencode is JSONEncoder.iterencode):
+            return self._make_encoder().iterencode_lines(
+                iterable, chunk_size, as_bytes)
+        if as_bytes:
+            return _lines(self.encode_bytes, iterable, chunk_size, b'\n')
+        return _lines(self.encode, iterable, chunk_size, '\n')
+
+    def encode_many(self, objs, return_exceptions=False):
+        """Return a list of the JSON representations of the objects in the
+        iterable ``objs``, each as :meth:`encode` would return it.
+
+        With the C extension a single encoder is created for the whole
+        batch and the objects are encoded in one loop. If
+        *return_exceptions* is true, an :exc:`Exception` raised for an
+        object is put in its place in the list instead of being raised.
+
+        """
+        objs = list(objs)
+        cls = type(self)
+        if (c_make_encoder is not None and
+                cls.encode is JSONEncoder.encode and
+                cls.iterencode is JSONEncoder.iterencode):
+            return self._make_encoder().encode_many(objs, return_exceptions)
+        encode = self.encode
+        if not return_exceptions:
+            return [encode(o) for o in objs]
+        rval = []
+        for o in objs:
+            try:
+                rval.append(encode(o))
+            except Exception:
+                rval.append(sys.exc_info()[1])
+        return rval
+
+    def _get_key_memo(self):
+        """Return the dict of encoded keys (each followed by the key
+        separator) that the C encoder shares across calls. The C encoder
+        clears it when it is full. A new one is made if the options the
+        encoded keys depend on have changed since the last call.
+
+        """
+        options = (self.ensure_ascii, self.encoding, self.key_separator)
+        key_memo = self._key_memo
+        if key_memo is None or key_memo[0] != options:
+            key_memo = self._key_memo = (options, {})
+        return key_memo[1]
+
+    def _get_type_memo(self):
+        """Return ``(type_encoders, type_memo)``: a copy of
+        :attr:`type_encoders`, and the dict in which the C encoder keeps
+        across calls the type encoder or dataclass fields of each type it
+        has seen, or which of ``for_json()`` and ``_asdict()`` its
+        instances may have. A new
+        pair is made if :attr:`type_encoders` or the options the entries
+        depend on have changed since the last call.
+
+        """
+        type_encoders = self.type_encoders
+        options = (self.tuple_as_array, self.use_decimal,
+                   self.dataclass_as_object)
+        type_memo = self._type_memo
+        if (type_memo is None or type_memo[0] != options or
+                type_memo[1] != type_encoders):
+            if type_encoders is not None:
+                type_encoders = dict(type_encoders)
+            type_memo = self._type_memo = (options, type_encoders, {})
+        return type_memo[1:]
+
+    def _make_encoder(self):
+        """Return the encoder for the current options: the C extension's
+        ``Encoder`` if available, otherwise the ``_iterencode`` generator
+        function from :func:`_make_iterencode`. Both are called as
+        ``_iterencode(o, _current_indent_level)``.
+
         """
         if self.check_circular:
             markers = {}
@@ -369,31 +573,50 @@ class JSONEncoder(object):
 
             return text
 
-        key_memo = {}
         int_as_string_bitcount = (
             53 if self.bigint_as_string else self.int_as_string_bitcount)
+        type_encoders, type_memo = self._get_type_memo()
+        UUID = Enum = None
+        if self.uuid_as_str:
+            import uuid
+            UUID = uuid.UUID
+        if self.enum_as_value:
+            try:
+                import enum
+            except ImportError:
+                pass
+            else:
+                Enum = enum.Enum
+        if self.dataclass_as_object:
+            dataclass_fields = _dataclass_fields
+        else:
+            dataclass_fields = None
         if c_make_encoder is not None:
-            _iterencode = c_make_encoder(
+            shape_memo = self._shape_memo
+            if shape_memo is None:
+                shape_memo = self._shape_memo = {}
+            return c_make_encoder(
                 markers, self.default, _encoder, self.indent,
                 self.key_separator, self.item_separator, self.sort_keys,
-                self.skipkeys, self.allow_nan, key_memo, self.use_decimal,
+                self.skipkeys, self.allow_nan, self._get_key_memo(),
+                self.use_decimal,
                 self.namedtuple_as_object, self.tuple_as_array,
                 int_as_string_bitcount,
                 self.item_sort_key, self.encoding, self.for_json,
-                self.ignore_nan, decimal.Decimal, self.iterable_as_array)
-        else:
-            _iterencode = _make_iterencode(
-                markers, self.default, _encoder, self.indent, floatstr,
-                self.key_separator, self.item_separator, self.sort_keys,
-                self.skipkeys, self.use_decimal,
-                self.namedtuple_as_object, self.tuple_as_array,
-                int_as_string_bitcount,
-                self.item_sort_key, self.encoding, self.for_json,
-                self.iterable_as_array, Decimal=decimal.Decimal)
-        try:
-            return _iterencode(o, 0)
-        finally:
-            key_memo.clear()
+                self.ignore_nan, decimal.Decimal, self.iterable_as_array,
+                shape_memo, type_encoders, type_memo, self.datetime_format,
+                UUID, Enum, self.bytes_as, dataclass_fields,
+                self.buffer_as_array)
+        return _make_iterencode(
+            markers, self.default, _encoder, self.indent, floatstr,
+            self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, self.use_decimal,
+            self.namedtuple_as_object, self.tuple_as_array,
+            int_as_string_bitcount,
+            self.item_sort_key, self.encoding, self.for_json,
+            self.iterable_as_array, type_encoders, self.datetime_format,
+            UUID, Enum, self.bytes_as, dataclass_fields,
+            self.buffer_as_array, Decimal=decimal.Decimal)
 
 
 class JSONEncoderForHTML(JSONEncoder):
@@ -419,8 +642,8 @@ class JSONEncoderForHTML(JSONEncoder):
         else:
             return u''.join(chunks)
 
-    def iterencode(self, o):
-        chunks = super(JSONEncoderForHTML, self).iterencode(o)
+    def iterencode(self, o, chunk_size=None):
+        chunks = super(JSONEncoderForHTML, self).iterencode(o, chunk_size)
         for chunk in chunks:
             chunk = chunk.replace('&', '\\u0026')
             chunk = chunk.replace('<', '\\u003c')
@@ -433,12 +656,114 @@ class JSONEncoderForHTML(JSONEncoder):
             yield chunk
 
 
+def _chunked(chunks, chunk_size):
+    """Coalesce the pieces yielded by an ``_iterencode`` generator into
+    strings of at least *chunk_size* characters (the last may be shorter).
+    """
+    buf = []
+    length = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= chunk_size:
+            yield ''.join(buf)
+            del buf[:]
+            length = 0
+    if length:
+        yield ''.join(buf)
+
+
+def _lines(encode, iterable, chunk_size, newline):
+    """Yield ``encode(obj) + newline`` for each object in *iterable*,
+    coalesced into strings of at least *chunk_size* characters unless
+    *chunk_size* is None.
+    """
+    name = type(iterable).__name__
+    buf = []
+    length = 0
+    for i, obj in enumerate(iterable):
+        try:
+            chunk = encode(obj)
+        except BaseException as exc:
+            if _HAS_ADD_NOTE:
+                exc.add_note('when serializing %s item %d' % (name, i))
+            raise
+        if chunk_size is None:
+            yield chunk + newline
+            continue
+        buf.append(chunk)
+        buf.append(newline)
+        length += len(chunk) + 1
+        if length >= chunk_size:
+            yield newline[:0].join(buf)
+            del buf[:]
+            length = 0
+    if length:
+        yield newline[:0].join(buf)
+
+
+def _dataclass_fields(cls):
+    """Return the tuple of the field names of the dataclass or attrs class
+    *cls*, or None if it is neither.
+    """
+    if hasattr(cls, '__dataclass_fields__'):
+        import dataclasses
+        return tuple(f.name for f in dataclasses.fields(cls))
+    attrs = getattr(cls, '__attrs_attrs__', None)
+    if attrs is not None:
+        return tuple(a.name for a in attrs)
+    return None
+
+
+def _buffer_values(o):
+    """Return ``(values,)``, where *values* is the (nested) list of the
+    numbers in the buffer of *o*, or the number of a zero-dimensional
+    buffer, or None if *o* does not export a buffer of plain numbers.
+    """
+    if isinstance(o, (binary_type, bytearray, text_type)):
+        return None
+    try:
+        view = memoryview(o)
+    except TypeError:
+        return None
+    fmt = view.format
+    if fmt[:1] in ('@', '=', '<', '>', '!'):
+        prefix, code = fmt[:1], fmt[1:]
+    else:
+        prefix, code = '@', fmt
+    if (len(code) != 1 or code not in 'bBhHiIlLqQnNfd?' or
+            (code in 'nN' and prefix != '@') or
+            struct.calcsize(prefix + code) != view.itemsize):
+        return None
+    shape = view.shape or ()
+    data = view.tobytes()
+    values = struct.unpack(
+        prefix + str(len(data) // view.itemsize) + code, data)
+    if not shape:
+        return (values[0],)
+    values = list(values)
+    for dim in range(len(shape) - 1, 0, -1):
+        n = shape[dim]
+        groups = 1
+        for size in shape[:dim]:
+            groups *= size
+        values = [values[i * n:(i + 1) * n] for i in range(groups)]
+    return (values,)
+
+
 def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
         _key_separator, _item_separator, _sort_keys, _skipkeys,
         _use_decimal, _namedtuple_as_object, _tuple_as_array,
         _int_as_string_bitcount, _item_sort_key,
         _encoding,_for_json,
         _iterable_as_array,
+        _type_encoders=None,
+        _datetime_format=None,
+        _UUID=None,
+        _Enum=None,
+        _bytes_as=None,
+        _dataclass_fields=None,
+        _buffer_as_array=False,
         ## HACK: hand-optimized bytecode; turn globals into locals
         _PY3=PY3,
         ValueError=ValueError,
@@ -453,6 +778,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
         list=list,
         str=str,
         tuple=tuple,
+        type=type,
         iter=iter,
     ):
     if _use_decimal and Decimal is None:
@@ -476,6 +802,88 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                 pass
         return None
 
+    # The scalar types that are encoded natively. An instance of a subclass
+    # of one is converted by its type encoder first if it has one.
+    _scalar_types = (text_type, float) + integer_types
+    if not _PY3:
+        _scalar_types += (binary_type,)
+    # The search of _type_encoders along an MRO ends at these
+    _native_types = (list, RawJSON, _LazyContainer) + _scalar_types + (
+        _dict_types if isinstance(_dict_types, tuple) else (_dict_types,))
+    if _tuple_as_array:
+        _native_types += (tuple,)
+    if _use_decimal:
+        _native_types += (Decimal,)
+    _type_encoder_memo = {}
+    _fields_memo = {}
+
+    # The types encoded by _encode_extra
+    _extra_types = ()
+    if _datetime_format is not None:
+        _datetime_types = (datetime.date, datetime.time)
+        _extra_types += _datetime_types
+    else:
+        _datetime_types = None
+    if _UUID is not None:
+        _extra_types += (_UUID,)
+    if _Enum is not None:
+        _extra_types += (_Enum,)
+    if _bytes_as is not None:
+        _extra_types += (bytes, bytearray) if _PY3 else (bytearray,)
+
+    def _encode_extra(o):
+        if _datetime_types and isinstance(o, _datetime_types):
+            return _encoder(o.isoformat())
+        elif _UUID is not None and isinstance(o, _UUID):
+            return _encoder(str(o))
+        else:
+            o = base64.b64encode(o)
+            if _PY3:
+                o = o.decode('ascii')
+            return '"' + o + '"'
+
+    def _fields(o):
+        # The field names of o if it is a dataclass, else None
+        cls = type(o)
+        try:
+            return _fields_memo[cls]
+        except KeyError:
+            pass
+        fields = _fields_memo[cls] = _dataclass_fields(cls)
+        return fields
+
+    def _fields_dict(o):
+        dct = OrderedDict()
+        for name in _fields(o):
+            dct[name] = getattr(o, name)
+        return dct
+
+    def _type_encoder(o):
+        # The function of the nearest class of o in _type_encoders
+        cls = type(o)
+        try:
+            return _type_encoder_memo[cls]
+        except KeyError:
+            pass
+        fn = None
+        for base in cls.__mro__:
+            if base in _native_types:
+                break
+            if base in _type_encoders:
+                fn = _type_encoders[base]
+                break
+        _type_encoder_memo[cls] = fn
+        return fn
+
+    def _subclass_encoder(o):
+        # The type encoder of o if it is an instance of a subclass of one
+        # of _scalar_types
+        cls = type(o)
+        if (cls in _scalar_types or cls is bool or
+                not isinstance(o, _scalar_types)):
+            return None
+        return _type_encoder(o)
+
     def _encode_int(value):
         skip_quoting = (
             _int_as_string_bitcount is None
@@ -519,9 +927,14 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
             else:
                 buf = separator
             try:
-                if isinstance(value, string_types):
+                if _type_encoders and _subclass_encoder(value) is not None:
+                    yield buf
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif isinstance(value, string_types):
                     yield buf + _encoder(value)
-                elif _PY3 and isinstance(value, bytes) and _encoding is not None:
+                elif (_PY3 and isinstance(value, bytes) and _encoding is not None
+                        and _bytes_as is None):
                     yield buf + _encoder(value)
                 elif isinstance(value, RawJSON):
                     yield buf + value.encoded_json
@@ -537,6 +950,18 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                     yield buf + _floatstr(value)
                 elif _use_decimal and isinstance(value, Decimal):
                     yield buf + str(value)
+                elif _extra_types and isinstance(value, _extra_types):
+                    yield buf
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif _type_encoders and _type_encoder(value) is not None:
+                    yield buf
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif _dataclass_fields and _fields(value) is not None:
+                    yield buf
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
                 else:
                     yield buf
                     for_json = _for_json and call_method(value, 'for_json')
@@ -604,15 +1029,19 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                             'not %s' % key.__class__.__name__)
         return key
 
-    def _iterencode_dict(dct, _current_indent_level):
+    def _iterencode_dict(dct, _current_indent_level, _obj=None):
+        # _obj is the object dct holds the fields of, if any, which is
+        # checked for circular references and named in notes in its place
         if not dct:
             yield '{}'
             return
+        if _obj is None:
+            _obj = dct
         if markers is not None:
-            markerid = id(dct)
+            markerid = id(_obj)
             if markerid in markers:
                 raise ValueError("Circular reference detected")
-            markers[markerid] = dct
+            markers[markerid] = _obj
         yield '{'
         if _indent is not None:
             _current_indent_level += 1
@@ -651,9 +1080,13 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
             yield _encoder(key)
             yield _key_separator
             try:
-                if isinstance(value, string_types):
+                if _type_encoders and _subclass_encoder(value) is not None:
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif isinstance(value, string_types):
                     yield _encoder(value)
-                elif _PY3 and isinstance(value, bytes) and _encoding is not None:
+                elif (_PY3 and isinstance(value, bytes) and _encoding is not None
+                        and _bytes_as is None):
                     yield _encoder(value)
                 elif isinstance(value, RawJSON):
                     yield value.encoded_json
@@ -669,6 +1102,15 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                     yield _floatstr(value)
                 elif _use_decimal and isinstance(value, Decimal):
                     yield str(value)
+                elif _extra_types and isinstance(value, _extra_types):
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif _type_encoders and _type_encoder(value) is not None:
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
+                elif _dataclass_fields and _fields(value) is not None:
+                    for chunk in _iterencode(value, _current_indent_level):
+                        yield chunk
                 else:
                     for_json = _for_json and call_method(value, 'for_json')
                     if for_json:
@@ -695,7 +1137,7 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                 if _HAS_ADD_NOTE:
                     exc.add_note(
                         'when serializing %s item %r'
-                        % (type(dct).__name__, key))
+                        % (type(_obj).__name__, key))
                 raise
         if newline_indent is not None:
             _current_indent_level -= 1
@@ -704,13 +1146,41 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
         if markers is not None:
             del markers[markerid]
 
+    def _iterencode_converted(o, _convert, _current_indent_level):
+        if markers is not None:
+            markerid = id(o)
+            if markerid in markers:
+                raise ValueError("Circular reference detected")
+            markers[markerid] = o
+        try:
+            o = _convert(o)
+            for chunk in _iterencode(o, _current_indent_level):
+                yield chunk
+        except BaseException as exc:
+            if _HAS_ADD_NOTE:
+                exc.add_note(
+                    'when serializing %s object'
+                    % type(o).__name__)
+            raise
+        if markers is not None:
+            del markers[markerid]
+
     def _iterencode(o, _current_indent_level):
-        if isinstance(o, string_types):
+        if _type_encoders and _subclass_encoder(o) is not None:
+            for chunk in _iterencode_converted(
+                    o, _type_encoder(o), _current_indent_level):
+                yield chunk
+        elif isinstance(o, string_types):
             yield _encoder(o)
-        elif _PY3 and isinstance(o, bytes) and _encoding is not None:
+        elif (_PY3 and isinstance(o, bytes) and _encoding is not None
+                and _bytes_as is None):
             yield _encoder(o)
         elif isinstance(o, RawJSON):
             yield o.encoded_json
+        elif isinstance(o, _LazyContainer):
+            for chunk in _iterencode_converted(
+                    o, _LazyContainer._encodable, _current_indent_level):
+                yield chunk
         elif o is None:
             yield 'null'
         elif o is True:
@@ -721,6 +1191,20 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
             yield _encode_int(o)
         elif isinstance(o, float):
             yield _floatstr(o)
+        elif _extra_types and isinstance(o, _extra_types):
+            if _Enum is not None and isinstance(o, _Enum):
+                for chunk in _iterencode(o.value, _current_indent_level):
+                    yield chunk
+            else:
+                yield _encode_extra(o)
+        elif _type_encoders and _type_encoder(o) is not None:
+            for chunk in _iterencode_converted(
+                    o, _type_encoder(o), _current_indent_level):
+                yield chunk
+        elif _dataclass_fields and _fields(o) is not None:
+            for chunk in _iterencode_dict(
+                    _fields_dict(o), _current_indent_level, o):
+                yield chunk
         else:
             for_json = _for_json and call_method(o, 'for_json')
             if for_json:
@@ -746,6 +1230,12 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                 elif _use_decimal and isinstance(o, Decimal):
                     yield str(o)
                 else:
+                    values = _buffer_as_array and _buffer_values(o)
+                    if values:
+                        for chunk in _iterencode(values[0],
+                                                 _current_indent_level):
+                            yield chunk
+                        return
                     while _iterable_as_array:
                         # Markers are not checked here because it is valid for
                         # an iterable to return self.
@@ -756,22 +1246,8 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr,
                         for chunk in _iterencode_list(o, _current_indent_level):
                             yield chunk
                         return
-                    if markers is not None:
-                        markerid = id(o)
-                        if markerid in markers:
-                            raise ValueError("Circular reference detected")
-                        markers[markerid] = o
-                    try:
-                        o = _default(o)
-                        for chunk in _iterencode(o, _current_indent_level):
-                            yield chunk
-                    except BaseException as exc:
-                        if _HAS_ADD_NOTE:
-                            exc.add_note(
-                                'when serializing %s object'
-                                % type(o).__name__)
-                        raise
-                    if markers is not None:
-                        del markers[markerid]
+                    for chunk in _iterencode_converted(
+                            o, _default, _current_indent_level):
+                        yield chunk
 
     return _iterencode
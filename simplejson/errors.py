@@ -1,8 +1,21 @@
 """Error classes used by simplejson
 """
+import sys
 __all__ = ['JSONDecodeError']
 
 
+def _utf8_doc(doc, pos, end):
+    """Convert a UTF-8 encoded doc and byte offsets (as reported when
+    scanning bytes directly) to text and character offsets
+    """
+    doc = bytes(doc)
+    text = doc.decode('utf-8', 'replace')
+    pos = len(doc[:pos].decode('utf-8', 'replace'))
+    if end is not None:
+        end = len(doc[:end].decode('utf-8', 'replace'))
+    return text, pos, end
+
+
 def linecol(doc, pos):
     lineno = doc.count('\n', 0, pos) + 1
     if lineno == 1:
@@ -38,6 +51,9 @@ class JSONDecodeError(ValueError):
     """
     # Note that this exception is used from _speedups
     def __init__(self, msg, doc, pos, end=None):
+        if (sys.version_info[0] >= 3 and
+                isinstance(doc, (bytes, bytearray, memoryview))):
+            doc, pos, end = _utf8_doc(doc, pos, end)
         ValueError.__init__(self, errmsg(msg, doc, pos, end=end))
         self.msg = msg
         self.doc = doc
@@ -0,0 +1,198 @@
+"""Implementation of LazyObject and LazyArray
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+try:
+    from collections.abc import MutableMapping, MutableSequence
+except ImportError:
+    from collections import MutableMapping, MutableSequence
+
+from .compat import PY3, text_type
+from .raw_json import RawJSON
+
+_MISSING = object()
+
+# The members of a LazyObject are kept in document order
+_member_dict = dict if PY3 else OrderedDict
+
+
+def make_lazy(decoder, doc, start, end, spans=None):
+    """Return the value of the JSON term ``doc[start:end]`` for
+    ``JSONDecoder(lazy=True)``: a :class:`LazyObject` or :class:`LazyArray`
+    for an object or an array, or the decoded value of anything else.
+    ``spans`` are those of the container if they are already known.
+
+    """
+    c = doc[start:start + 1]
+    if not isinstance(c, text_type):
+        c = c.decode('latin-1')
+    if c == '{':
+        return LazyObject(decoder, doc, start, end, spans)
+    elif c == '[':
+        return LazyArray(decoder, doc, start, end, spans)
+    return decoder.scan_once(doc, start)[0]
+
+
+class _LazyContainer(object):
+    """The source of a :class:`LazyObject` or :class:`LazyArray`, and how
+    the encoders write it.
+
+    A slot ``[start, end, value]`` is kept for each value of the container,
+    where ``doc[start:end]`` is its source and ``value`` is ``_MISSING``
+    until it is first accessed. A value that is set or inserted has no
+    source (``start`` is None).
+
+    """
+    def __init__(self, decoder, doc, start, end, spans=None):
+        self._decoder = decoder
+        self._doc = doc
+        self._start = start
+        self._end = end
+        self._slots = None if spans is None else self._make_slots(spans)
+        self._changed = False
+
+    def _load(self):
+        if self._slots is None:
+            spans = self._decoder.scan_once.spans(self._doc, self._start)[0]
+            self._slots = self._make_slots(spans)
+        return self._slots
+
+    def _value(self, slot):
+        value = slot[2]
+        if value is _MISSING:
+            value = slot[2] = make_lazy(
+                self._decoder, self._doc, slot[0], slot[1])
+        return value
+
+    def _text(self, start, end):
+        text = self._doc[start:end]
+        if not isinstance(text, text_type):
+            text = text.decode(self._decoder.encoding)
+        return text
+
+    def _is_unchanged(self):
+        if self._changed:
+            return False
+        if self._slots is not None:
+            for slot in self._slot_values():
+                value = slot[2]
+                if (isinstance(value, _LazyContainer) and
+                        not value._is_unchanged()):
+                    return False
+        return True
+
+    def _encodable(self):
+        # What the encoders write in place of this container: its source
+        # if nothing in it was changed, or else a dict or list where the
+        # values that still have a source are written as it
+        if self._is_unchanged():
+            return RawJSON(self._text(self._start, self._end))
+        return self._from_slots(self._encodable_value)
+
+    def _encodable_value(self, slot):
+        value = slot[2]
+        if slot[0] is None or isinstance(value, _LazyContainer):
+            return value
+        return RawJSON(self._text(slot[0], slot[1]))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._from_slots(self._value))
+
+
+class LazyObject(_LazyContainer, MutableMapping):
+    """A JSON object, decoded by ``JSONDecoder(lazy=True)``, whose member
+    values are only decoded when they are first accessed.
+
+    """
+    __hash__ = None
+
+    def _make_slots(self, spans):
+        slots = _member_dict()
+        for key, start, end in spans:
+            slots[key] = [start, end, _MISSING]
+        return slots
+
+    def _slot_values(self):
+        return self._slots.values()
+
+    def _from_slots(self, value):
+        rval = _member_dict()
+        for key, slot in self._load().items():
+            rval[key] = value(slot)
+        return rval
+
+    def __getitem__(self, key):
+        return self._value(self._load()[key])
+
+    def __setitem__(self, key, value):
+        self._load()[key] = [None, None, value]
+        self._changed = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self._changed = True
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+class LazyArray(_LazyContainer, MutableSequence):
+    """A JSON array, decoded by ``JSONDecoder(lazy=True)``, whose elements
+    are only decoded when they are first accessed.
+
+    """
+    __hash__ = None
+
+    def _make_slots(self, spans):
+        return [[start, end, _MISSING] for start, end in spans]
+
+    def _slot_values(self):
+        return self._slots
+
+    def _from_slots(self, value):
+        return [value(slot) for slot in self._load()]
+
+    def __getitem__(self, index):
+        slots = self._load()
+        if isinstance(index, slice):
+            return [self._value(slot) for slot in slots[index]]
+        return self._value(slots[index])
+
+    def __setitem__(self, index, value):
+        slots = self._load()
+        if isinstance(index, slice):
+            slots[index] = [[None, None, v] for v in value]
+        else:
+            slots[index] = [None, None, value]
+        self._changed = True
+
+    def __delitem__(self, index):
+        del self._load()[index]
+        self._changed = True
+
+    def insert(self, index, value):
+        self._load().insert(index, [None, None, value])
+        self._changed = True
+
+    def __iter__(self):
+        for slot in self._load():
+            yield self._value(slot)
+
+    def __len__(self):
+        return len(self._load())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyArray)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, (list, LazyArray)):
+            return list(self) != list(other)
+        return NotImplemented
@@ -1,7 +1,10 @@
 """JSON token scanner
 """
 import re
+import threading
+from .compat import integer_types, string_types, text_type
 from .errors import JSONDecodeError
+from .raw_json import RawJSON
 
 def _import_c_make_scanner():
     try:
@@ -11,11 +14,144 @@ def _import_c_make_scanner():
         return None
 c_make_scanner = _import_c_make_scanner()
 
+def _import_c_make_key_cache():
+    try:
+        from ._speedups import make_key_cache
+        return make_key_cache
+    except ImportError:
+        return None
+c_make_key_cache = _import_c_make_key_cache()
+
 __all__ = ['make_scanner', 'JSONDecodeError']
 
 NUMBER_RE = re.compile(
     r'(-?(?:0|[1-9][0-9]*))(\.[0-9]+)?([eE][-+]?[0-9]+)?',
     (re.VERBOSE | re.MULTILINE | re.DOTALL))
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+SKIP_SCALAR = re.compile(r'[^,\]} \t\n\r]*')
+SKIP_STRING = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+SKIP_CONTAINER = re.compile(r'[^"\[\]{}]*')
+STRUCTURAL = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|["{}\[\]:,]', re.DOTALL)
+
+
+def py_skip_value(string, idx):
+    """Return the index after the JSON term at ``string[idx]`` without
+    building it. Strings are skipped to their closing quote and arrays and
+    objects to their matching bracket, without validating what is in
+    between.
+
+    """
+    start = idx
+    nextchar = string[idx:idx + 1] if idx >= 0 else ''
+    if nextchar != '"' and nextchar != '{' and nextchar != '[':
+        # A number, a literal or a named constant
+        idx = SKIP_SCALAR.match(string, idx).end() if nextchar else idx
+        if idx == start:
+            raise JSONDecodeError('Expecting value', string, start)
+        return idx
+    depth = 0
+    while True:
+        if nextchar == '"':
+            m = SKIP_STRING.match(string, idx + 1)
+            if m is None:
+                raise JSONDecodeError(
+                    'Unterminated string starting at', string, idx)
+            idx = m.end()
+        elif nextchar == '{' or nextchar == '[':
+            depth += 1
+            idx += 1
+        elif nextchar == '}' or nextchar == ']':
+            depth -= 1
+            idx += 1
+        else:
+            raise JSONDecodeError(
+                'Unterminated %s starting at' % (
+                    'object' if string[start] == '{' else 'array',),
+                string, start)
+        if depth == 0:
+            return idx
+        idx = SKIP_CONTAINER.match(string, idx).end()
+        nextchar = string[idx:idx + 1]
+
+
+def py_scan_raw(string, idx, encoding, check_once):
+    """Return ``(RawJSON, end)`` for the JSON term at ``string[idx]``,
+    holding its source. The term is checked by decoding it with
+    *check_once*, a scan_once that captures nothing, so a malformed term
+    raises the same error as it would without capturing.
+
+    """
+    end = check_once(string, idx)[1]
+    encoded = string[idx:end]
+    if not isinstance(encoded, text_type):
+        encoded = encoded.decode(encoding)
+    return RawJSON(encoded), end
+
+
+class PyStructuralIndex(object):
+    """The Python version of the StructuralIndex of the C scanner, made by
+    :func:`py_make_index`. The members or elements of each object or array
+    that is looked up are found by the ``spans`` method of the scanner
+    and kept for the next lookup.
+
+    """
+    def __init__(self, scan_once, string, count):
+        self._scan_once = scan_once
+        self._string = string
+        self._count = count
+        self._tables = {}
+
+    def __len__(self):
+        return self._count
+
+    def decode(self, idx):
+        return self._scan_once(self._string, idx)
+
+    def skip(self, idx):
+        if self._string[idx:idx + 1] not in ('{', '['):
+            return -1
+        return py_skip_value(self._string, idx)
+
+    def lookup(self, idx, key):
+        table = self._tables.get(idx)
+        if table is None:
+            spans = self._scan_once.spans(self._string, idx)[0]
+            if spans is None:
+                table = ()
+            elif self._string[idx] == '{':
+                table = dict((name, start) for name, start, end in spans)
+            else:
+                table = [start for start, end in spans]
+            self._tables[idx] = table
+        if isinstance(table, dict):
+            if isinstance(key, string_types):
+                return table.get(key, -1)
+        elif (isinstance(key, integer_types) and not isinstance(key, bool)
+                and 0 <= key < len(table)):
+            return table[key]
+        return -1
+
+
+def py_make_index(scan_once, string):
+    """Return the :class:`PyStructuralIndex` of ``string`` for
+    ``scan_once``, or None if a string or bracket in it is not closed.
+
+    """
+    count = 0
+    stack = []
+    for m in STRUCTURAL.finditer(string):
+        c = string[m.start()]
+        if c == '{' or c == '[':
+            stack.append(c)
+        elif c == '}' or c == ']':
+            if not stack or stack.pop() != ('{' if c == '}' else '['):
+                return None
+        elif c == '"' and m.end() - m.start() == 1:
+            return None
+        count += 1
+    if stack:
+        return None
+    return PyStructuralIndex(scan_once, string, count)
 
 
 def py_make_scanner(context):
@@ -31,9 +167,32 @@ def py_make_scanner(context):
     object_hook = context.object_hook
     object_pairs_hook = context.object_pairs_hook
     array_hook = context.array_hook
+    make_numeric_array = getattr(context, 'make_numeric_array', None)
+    raw_depth = getattr(context, 'raw_depth', None)
+    raw_keys = getattr(context, 'raw_keys', None)
     memo = context.memo
+    key_cache = getattr(context, 'key_cache', None)
+    if key_cache is not None:
+        memo = key_cache
+    # The scan_once of each depth below raw_depth, for the values of the
+    # objects and arrays at that depth
+    depth_scanners = []
 
-    def _scan_once(string, idx):
+    def _check_once(string, idx):
+        # Decodes without raw_depth, raw_keys or the hooks, to check the
+        # terms that are captured
+        return _scan_once(string, idx, None)
+
+    def _depth_scanner(depth):
+        if raw_depth is None:
+            return _scan_once
+        while len(depth_scanners) <= depth:
+            depth_scanners.append(
+                lambda string, idx, _depth=len(depth_scanners):
+                    _scan_once(string, idx, _depth))
+        return depth_scanners[depth]
+
+    def _scan_once(string, idx, depth=0):
         errmsg = 'Expecting value'
         try:
             nextchar = string[idx]
@@ -42,11 +201,29 @@ def py_make_scanner(context):
 
         if nextchar == '"':
             return parse_string(string, idx + 1, encoding, strict)
+        elif (nextchar == '{' or nextchar == '[') and (
+                raw_depth is not None and depth is not None and
+                depth >= raw_depth):
+            return py_scan_raw(string, idx, encoding, _check_once)
         elif nextchar == '{':
+            if depth is None:
+                return parse_object((string, idx + 1), encoding, strict,
+                    _check_once, None, None, memo)
+            if raw_keys is None:
+                return parse_object((string, idx + 1), encoding, strict,
+                    _depth_scanner(depth + 1), object_hook, object_pairs_hook,
+                    memo)
             return parse_object((string, idx + 1), encoding, strict,
-                _scan_once, object_hook, object_pairs_hook, memo)
+                _depth_scanner(depth + 1), object_hook, object_pairs_hook,
+                memo, raw_keys, _check_once)
         elif nextchar == '[':
-            return parse_array((string, idx + 1), _scan_once, array_hook)
+            if depth is None:
+                return parse_array((string, idx + 1), _check_once, None)
+            if make_numeric_array is None:
+                return parse_array((string, idx + 1),
+                                   _depth_scanner(depth + 1), array_hook)
+            return parse_array((string, idx + 1), _depth_scanner(depth + 1),
+                               array_hook, make_numeric_array)
         elif nextchar == 'n' and string[idx:idx + 4] == 'null':
             return None, idx + 4
         elif nextchar == 't' and string[idx:idx + 4] == 'true':
@@ -71,17 +248,207 @@ def py_make_scanner(context):
         else:
             raise JSONDecodeError(errmsg, string, idx)
 
+    def _select(string, idx, node, rval, _w=WHITESPACE.match):
+        nextchar = string[idx:idx + 1] if idx >= 0 else ''
+        if nextchar == '{':
+            close = '}'
+        elif nextchar == '[':
+            close = ']'
+        else:
+            return py_skip_value(string, idx)
+        idx = _w(string, idx + 1).end()
+        if string[idx:idx + 1] == close:
+            return idx + 1
+        i = 0
+        while True:
+            if close == '}':
+                if string[idx:idx + 1] != '"':
+                    raise JSONDecodeError(
+                        'Expecting property name enclosed in double quotes'
+                        + ('' if i else " or '}'"), string, idx)
+                key, idx = parse_string(string, idx + 1, encoding, strict)
+                idx = _w(string, idx).end()
+                if string[idx:idx + 1] != ':':
+                    raise JSONDecodeError("Expecting ':' delimiter",
+                                          string, idx)
+                idx = _w(string, idx + 1).end()
+            else:
+                key = i
+            child = node.get(key)
+            if child is None:
+                idx = py_skip_value(string, idx)
+            elif type(child) is dict:
+                idx = _select(string, idx, child, rval)
+            else:
+                value, idx = _scan_once(string, idx)
+                rval[child] = value
+            idx = _w(string, idx).end()
+            nextchar = string[idx:idx + 1]
+            if nextchar == close:
+                return idx + 1
+            if nextchar != ',':
+                raise JSONDecodeError(
+                    "Expecting ',' delimiter or '%s'" % (close,), string, idx)
+            idx = _w(string, idx + 1).end()
+            if string[idx:idx + 1] == close:
+                raise JSONDecodeError(
+                    'Illegal trailing comma before end of %s' % (
+                        'object' if close == '}' else 'array',),
+                    string, idx)
+            i += 1
+
+    def select(string, idx, tree):
+        rval = {}
+        if key_cache is not None:
+            return rval, _select(string, idx, tree, rval)
+        try:
+            return rval, _select(string, idx, tree, rval)
+        finally:
+            memo.clear()
+
+    def _spans(string, idx, _w=WHITESPACE.match):
+        nextchar = string[idx:idx + 1] if idx >= 0 else ''
+        if nextchar == '{':
+            close = '}'
+        elif nextchar == '[':
+            close = ']'
+        else:
+            return None, idx
+        rval = []
+        idx = _w(string, idx + 1).end()
+        if string[idx:idx + 1] == close:
+            return rval, idx + 1
+        while True:
+            if close == '}':
+                if string[idx:idx + 1] != '"':
+                    raise JSONDecodeError(
+                        'Expecting property name enclosed in double quotes'
+                        + (" or '}'" if not rval else ''), string, idx)
+                key, idx = parse_string(string, idx + 1, encoding, strict)
+                key = memo.setdefault(key, key)
+                idx = _w(string, idx).end()
+                if string[idx:idx + 1] != ':':
+                    raise JSONDecodeError("Expecting ':' delimiter",
+                                          string, idx)
+                idx = _w(string, idx + 1).end()
+                start = idx
+                idx = py_skip_value(string, idx)
+                rval.append((key, start, idx))
+            else:
+                if not rval and idx >= len(string):
+                    raise JSONDecodeError("Expecting value or ']'",
+                                          string, idx)
+                start = idx
+                idx = py_skip_value(string, idx)
+                rval.append((start, idx))
+            idx = _w(string, idx).end()
+            nextchar = string[idx:idx + 1]
+            if nextchar == close:
+                return rval, idx + 1
+            if nextchar != ',':
+                raise JSONDecodeError(
+                    "Expecting ',' delimiter or '%s'" % (close,), string, idx)
+            idx = _w(string, idx + 1).end()
+            if string[idx:idx + 1] == close:
+                raise JSONDecodeError(
+                    'Illegal trailing comma before end of %s' % (
+                        'object' if close == '}' else 'array',),
+                    string, idx)
+
+    def spans(string, idx):
+        if key_cache is not None:
+            return _spans(string, idx)
+        try:
+            return _spans(string, idx)
+        finally:
+            memo.clear()
+
     def scan_once(string, idx):
         if idx < 0:
             # Ensure the same behavior as the C speedup, otherwise
             # this would work for *some* negative string indices due
             # to the behavior of __getitem__ for strings. #98
             raise JSONDecodeError('Expecting value', string, idx)
+        if key_cache is not None:
+            return _scan_once(string, idx)
         try:
             return _scan_once(string, idx)
         finally:
             memo.clear()
 
+    def validate(string, idx):
+        # There is no decoding without building the objects here
+        return scan_once(string, idx)[1]
+
+    scan_once.select = select
+    scan_once.spans = spans
+    scan_once.validate = validate
     return scan_once
 
+
+class PyKeyCache(object):
+    """Intern table for object keys that is kept across documents, holding
+    at most *maxsize* keys. Keys are evicted with the CLOCK algorithm, an
+    approximation of least recently used: a hit sets the referenced flag
+    of the key's slot, and the hand clears the flags of the slots it
+    passes until it reaches one that is not set.
+
+    """
+    def __init__(self, maxsize):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0")
+        self.maxsize = maxsize
+        self.slots = {}
+        self.keys = []
+        self.values = []
+        self.referenced = []
+        self.hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def setdefault(self, key, default):
+        # The same protocol as the dict memo of a single document
+        with self.lock:
+            i = self.slots.get(key)
+            if i is not None:
+                self.hits += 1
+                self.referenced[i] = True
+                return self.values[i]
+            self.misses += 1
+            if len(self.keys) < self.maxsize:
+                i = len(self.keys)
+                self.keys.append(key)
+                self.values.append(default)
+                self.referenced.append(False)
+            else:
+                referenced = self.referenced
+                hand = self.hand
+                while referenced[hand]:
+                    referenced[hand] = False
+                    hand = (hand + 1) % self.maxsize
+                i = hand
+                self.hand = (hand + 1) % self.maxsize
+                del self.slots[self.keys[i]]
+                self.keys[i] = key
+                self.values[i] = default
+            self.slots[key] = i
+            return default
+
+    def info(self):
+        """Return ``(hits, misses, maxsize, currsize)``"""
+        with self.lock:
+            return self.hits, self.misses, self.maxsize, len(self.slots)
+
+    def clear(self):
+        """Remove every key and reset the counters"""
+        with self.lock:
+            self.slots.clear()
+            del self.keys[:], self.values[:], self.referenced[:]
+            self.hand = self.hits = self.misses = 0
+
 make_scanner = c_make_scanner or py_make_scanner
+make_key_cache = c_make_key_cache or PyKeyCache
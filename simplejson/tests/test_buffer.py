@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+import array
+import ctypes
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+from simplejson.compat import PY3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@skipUnless(PY3, 'array.array exports no buffer on Python 2')
+class TestBufferAsArray(TestCase):
+    def assertEncodes(self, obj, expect, **kw):
+        encoder = json.JSONEncoder(buffer_as_array=True, **kw)
+        self.assertEqual(encoder.encode(obj), expect)
+        self.assertEqual(''.join(encoder.iterencode(obj, chunk_size=2)),
+                         expect)
+        self.assertEqual(encoder.encode_bytes(obj), expect.encode('ascii'))
+
+    def test_array(self):
+        for code in 'bBhHiIlLqQ':
+            self.assertEncodes(array.array(code, [0, 1, 127]), '[0, 1, 127]')
+        self.assertEncodes(array.array('q', [-1, -2 ** 63]),
+                           '[-1, %d]' % (-2 ** 63,))
+        self.assertEncodes(array.array('Q', [2 ** 64 - 1]),
+                           '[%d]' % (2 ** 64 - 1,))
+        self.assertEncodes(array.array('d', [1.5, 0.1, 1e100, -0.0]),
+                           '[1.5, 0.1, 1e+100, -0.0]')
+        self.assertEncodes(array.array('f', [0.1]), '[%r]' % (
+            array.array('f', [0.1])[0],))
+        self.assertEncodes({'a': array.array('i'), 'b': [array.array('i')]},
+                           '{"a": [], "b": [[]]}')
+        self.assertRaises(TypeError, json.dumps, array.array('i'))
+        self.assertRaises(TypeError, json.dumps, array.array('u', u'a'),
+                          buffer_as_array=True)
+
+    def test_memoryview(self):
+        view = memoryview(array.array('h', range(6))).cast('B')
+        self.assertEncodes(view.cast('h', [2, 3]),
+                           '[[0, 1, 2], [3, 4, 5]]')
+        self.assertEncodes(view.cast('h', [3, 2])[::2],
+                           '[[0, 1], [4, 5]]')
+        self.assertEncodes(memoryview(b'\x01\x00').cast('?'),
+                           '[true, false]')
+        self.assertEncodes(memoryview(b'ab'), '[97, 98]')
+        self.assertEncodes([view.cast('h', [2, 3])],
+                           '[\n  [\n    [\n      0,\n      1,\n      2\n'
+                           '    ],\n    [\n      3,\n      4,\n      5\n'
+                           '    ]\n  ]\n]',
+                           indent=2)
+
+    def test_byte_order(self):
+        big = (ctypes.c_int32.__ctype_be__ * 2)(1, -2)
+        little = (ctypes.c_double.__ctype_le__ * 2)(1.5, -0.25)
+        self.assertEncodes([big, little], '[[1, -2], [1.5, -0.25]]')
+
+    def test_scalar(self):
+        # A zero-dimensional buffer, like that of a NumPy scalar
+        self.assertEncodes([ctypes.c_double(2.5), ctypes.c_int16(-3)],
+                           '[2.5, -3]')
+
+    def test_options(self):
+        floats = array.array('d', [float('nan'), float('inf')])
+        self.assertRaises(ValueError, json.dumps, floats,
+                          buffer_as_array=True)
+        self.assertEncodes(floats, '[NaN, Infinity]', allow_nan=True)
+        self.assertEncodes(floats, '[null, null]', ignore_nan=True)
+        self.assertEncodes(array.array('q', [1, 2 ** 53]),
+                           '[1, "%d"]' % (2 ** 53,), bigint_as_string=True)
+        # bytes are strings, not arrays
+        self.assertEqual(json.dumps([b'a', bytearray(b'b')],
+                                    buffer_as_array=True, bytes_as='base64'),
+                         '["YQ==", "Yg=="]')
+
+    @skipUnless(numpy is not None, 'requires numpy')
+    def test_numpy(self):
+        self.assertEncodes(
+            [numpy.arange(6).reshape(2, 3), numpy.int64(7),
+             numpy.float32(0.5), numpy.bool_(True),
+             numpy.array([1.5, 2.5], dtype='>f8')],
+            '[[[0, 1, 2], [3, 4, 5]], 7, 0.5, true, [1.5, 2.5]]')
@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+import sys
+from collections import namedtuple
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+
+try:
+    import dataclasses
+except ImportError:
+    dataclasses = None
+
+
+if dataclasses is not None:
+    # Defined with exec so this module still compiles on Python 2
+    exec('''
+import typing
+
+@dataclasses.dataclass
+class Point(object):
+    y: int
+    x: object = None
+    kind: typing.ClassVar[str] = 'point'
+
+@dataclasses.dataclass
+class Slotted(object):
+    __slots__ = ('b', 'a')
+    b: object
+    a: object
+
+@dataclasses.dataclass
+class Empty(object):
+    pass
+
+@dataclasses.dataclass
+class ForJson(object):
+    a: int
+
+    def for_json(self):
+        return 'for_json'
+''')
+
+
+class AttrsPoint(object):
+    # What the attrs package puts on a class, as far as the encoder cares
+    Attribute = namedtuple('Attribute', ['name'])
+    __attrs_attrs__ = (Attribute('y'), Attribute('x'))
+
+    def __init__(self, y, x):
+        self.y = y
+        self.x = x
+
+
+@skipUnless(dataclasses is not None, 'requires dataclasses')
+class TestDataclass(TestCase):
+    def assertEncodes(self, obj, expect, **kw):
+        encoder = json.JSONEncoder(dataclass_as_object=True, **kw)
+        self.assertEqual(encoder.encode(obj), expect)
+        self.assertEqual(''.join(encoder.iterencode(obj)), expect)
+        self.assertEqual(''.join(encoder.iterencode(obj, chunk_size=3)),
+                         expect)
+
+    def test_dataclass_as_object(self):
+        self.assertEncodes(Point(1), '{"y": 1, "x": null}')
+        self.assertEncodes([Point(1, Point(2, [3]))],
+                           '[{"y": 1, "x": {"y": 2, "x": [3]}}]')
+        self.assertEncodes({'a': Slotted(1, Empty())},
+                           '{"a": {"b": 1, "a": {}}}')
+        self.assertEncodes(AttrsPoint(1, 2), '{"y": 1, "x": 2}')
+        self.assertRaises(TypeError, json.dumps, Point(1))
+
+    def test_sort_keys(self):
+        self.assertEncodes([Point(1, Slotted(2, 3))],
+                           '[{"x": {"a": 3, "b": 2}, "y": 1}]',
+                           sort_keys=True)
+        self.assertEncodes(Point(1, 2), '{"x": 2, "y": 1}',
+                           item_sort_key=lambda kv: -kv[1])
+
+    def test_indent(self):
+        self.assertEncodes([Point(1, Empty())],
+                           '[\n  {\n    "y": 1,\n    "x": {}\n  }\n]',
+                           indent=2)
+
+    def test_precedence(self):
+        self.assertEncodes([ForJson(1)], '[{"a": 1}]', for_json=True)
+        self.assertEncodes([ForJson(1)], '["type"]', for_json=True,
+                           type_encoders={ForJson: lambda o: 'type'})
+        self.assertEqual(json.dumps([ForJson(1)], for_json=True),
+                         '["for_json"]')
+
+    def test_changed_options(self):
+        encoder = json.JSONEncoder(default=lambda o: 'default')
+        self.assertEqual(encoder.encode(Point(1)), '"default"')
+        encoder.dataclass_as_object = True
+        self.assertEqual(encoder.encode(Point(1)), '{"y": 1, "x": null}')
+
+    def test_errors(self):
+        point = Point(1)
+        point.x = [point]
+        self.assertRaises(ValueError, json.dumps, point,
+                          dataclass_as_object=True)
+        encoder = json.JSONEncoder(dataclass_as_object=True)
+        self.assertRaises(ValueError, encoder.encode, point)
+        self.assertRaises(ValueError, list, encoder.iterencode(point, 8))
+        # The object is no longer marked once it has been encoded
+        shared = Point(1)
+        self.assertEqual(encoder.encode([shared, shared]),
+                         '[{"y": 1, "x": null}, {"y": 1, "x": null}]')
+
+    @skipUnless(sys.version_info >= (3, 11), 'add_note requires Python 3.11+')
+    def test_error_notes(self):
+        encoder = json.JSONEncoder(dataclass_as_object=True)
+        for encode in (encoder.encode,
+                       lambda o: list(encoder.iterencode(o, 8))):
+            try:
+                encode([Point(1, {1j: 2})])
+            except TypeError as exc:
+                self.assertEqual(exc.__notes__,
+                                 ["when serializing Point item 'x'",
+                                  'when serializing list item 0'])
+            else:
+                self.fail('Expected TypeError')
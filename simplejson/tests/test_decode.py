@@ -1,10 +1,10 @@
 from __future__ import absolute_import
 import decimal
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 
 import sys
 import simplejson as json
-from simplejson.compat import StringIO, b, binary_type
+from simplejson.compat import StringIO, b, binary_type, PY3
 from simplejson import OrderedDict
 
 class MisbehavingBytesSubtype(binary_type):
@@ -177,3 +177,97 @@ class TestDecode(TestCase):
         s = '1' + '0' * (max_str_digits - 1)
         self.assertEqual(json.loads(s), int(s))
         self.assertRaises(ValueError, json.loads, s + '0')
+
+    @skipUnless(PY3, 'bytes are text on Python 2')
+    def test_bytes_like_decode(self):
+        doc = (u'{"a\\u00e9": [1, -2.5e3, "\u00e9\\n\\ud83d\\ude00\u20ac",'
+               u' null, true, false, {}, []], "\U0001f600": "\\"\\/\\t"}')
+        expect = json.loads(doc)
+        data = doc.encode('utf-8')
+        for s in [data, bytearray(data), memoryview(data),
+                  b'\xef\xbb\xbf' + data, b' \r\n' + data + b'\t ']:
+            self.assertEqual(json.loads(s), expect)
+            self.assertEqual(json.JSONDecoder().decode(s), expect)
+        # keys and values decoded from bytes are still str
+        self.assertEqual(json.loads(b'{"k": "v", "n": 1.5}'),
+                         {u'k': u'v', u'n': 1.5})
+        self.assertEqual(json.loads(b'"\xc3\xa9"'), u'\u00e9')
+        self.assertEqual(json.loads(b'"\\ud83dx"'), u'\ud83dx')
+        self.assertTrue(isinstance(json.loads(b'1.5', parse_float=decimal.Decimal),
+                                   decimal.Decimal))
+
+    @skipUnless(PY3, 'bytes are text on Python 2')
+    def test_bytes_raw_decode(self):
+        cls = json.decoder.JSONDecoder
+        data = u'["\u20ac"] ["x"]'.encode('utf-8')
+        self.assertEqual(cls().raw_decode(data), ([u'\u20ac'], 7))
+        self.assertEqual(cls().raw_decode(data, 7), ([u'x'], 13))
+        self.assertEqual(cls().raw_decode(bytearray(data), 7), ([u'x'], 13))
+        # the fallback for other encodings also reports byte offsets
+        data = u'["\u00e9"] 1'.encode('latin1')
+        self.assertEqual(cls(encoding='latin1').raw_decode(data),
+                         ([u'\u00e9'], 5))
+        self.assertEqual(cls(encoding='latin1').raw_decode(data, 5),
+                         (1, 7))
+        self.assertRaises(TypeError, cls().raw_decode, object())
+
+    @skipUnless(PY3, 'bytes are text on Python 2')
+    def test_bytes_errors(self):
+        # error positions are reported as character offsets
+        for doc in [u'["\u20ac\u20ac", x]', u'{"\u20ac": 1,\n "a" 2}',
+                    u'["\u20ac\\q"]', u'"\u20ac\x01"', u'["\u20ac"] 1',
+                    u'"\u20ac\\ud83d\\u12"', u'["\u20ac"']:
+            try:
+                json.loads(doc)
+            except json.JSONDecodeError as e:
+                expect = e
+            else:
+                self.fail('Expected JSONDecodeError for %r' % (doc,))
+            try:
+                json.loads(doc.encode('utf-8'))
+            except json.JSONDecodeError as e:
+                self.assertEqual((e.msg, e.doc, e.pos, e.end, e.lineno, e.colno),
+                                 (expect.msg, expect.doc, expect.pos,
+                                  expect.end, expect.lineno, expect.colno))
+            else:
+                self.fail('Expected JSONDecodeError for %r' % (doc,))
+        self.assertRaises(ValueError, json.loads, b'"\xff"')
+        self.assertRaises(ValueError, json.loads, b'["\xe2\x82"]')
+
+    @skipUnless(PY3, 'bytes are text on Python 2')
+    def test_bytes_unicode_errors(self):
+        # Malformed UTF-8 raises the error of decoding the whole document
+        for data in (b'{"a": [1, "ok", "x\xff"]}', b'["\xc3\xa9", "a\xc3"]',
+                     b'["\xc3\xa9\\n\xed\xa0\x80"]',
+                     b'[' + b'"\xc3\xa9", ' * 2000 + b'"\xe2\x82"]'):
+            try:
+                data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                expect = (e.object, e.start, e.end, e.reason)
+            for s in (data, bytearray(data), memoryview(data)):
+                for func in (json.loads, json.validate):
+                    try:
+                        func(s)
+                    except UnicodeDecodeError as e:
+                        self.assertEqual((e.object, e.start, e.end, e.reason),
+                                         expect)
+                    else:
+                        self.fail('Expected UnicodeDecodeError for %r'
+                                  % (data,))
+
+    def test_decoder_cache(self):
+        # loads() calls with the same options share a decoder
+        json._decoder_cache.clear()
+        for _ in range(2):
+            self.assertEqual(json.loads('[1.5]', parse_float=str), ['1.5'])
+            self.assertEqual(
+                list(json.iter_lines('{}\n[]', object_pairs_hook=list)),
+                [[], []])
+            # The same options as iter_lines() above
+            self.assertEqual(json.loads('{}', object_pairs_hook=list), [])
+        self.assertEqual(len(json._decoder_cache), 2)
+        for i in range(json._MAXCACHE + 1):
+            json.loads('1', parse_int=lambda s: 1)
+        self.assertTrue(len(json._decoder_cache) <= json._MAXCACHE)
+        self.assertRaises(TypeError, json.loads, '1', use_decimal=True,
+                          parse_float=str)
@@ -311,6 +311,37 @@ class TestDictEncodingPaths(TestCase):
             json.dumps(d, sort_keys=True),
             '{"a": 1, "b": 2, "c": 3}')
 
+    def test_sorted_shape_memo(self):
+        """Dicts with the key order of an earlier dict are sorted the
+        same way, from the order the encoder remembers."""
+        records = [dict([('b', i), ('a', [i]), ('c', {'y': 1, 'x': 2})])
+                   for i in range(3)]
+        records.append(dict([('a', 0), ('c', None), ('b', 1)]))
+        records.append({1: 'x', '0': 'y'})
+        for kw in [{}, {'indent': 2}]:
+            encoder = json.JSONEncoder(sort_keys=True, **kw)
+            expect = [json.JSONEncoder(sort_keys=True, **kw).encode(r)
+                      for r in records]
+            for _ in range(2):
+                self.assertEqual([encoder.encode(r) for r in records],
+                                 expect)
+                self.assertEqual(''.join(encoder.iterencode(records[0], 4)),
+                                 expect[0])
+        encoder = json.JSONEncoder(sort_keys=True)
+        for _ in range(2):
+            self.assertEqual(encoder.encode({'b': 1, 'a': 2}),
+                             '{"a": 2, "b": 1}')
+            self.assertRaises(TypeError, encoder.encode, {'b': object()})
+
+    def test_sorted_shape_memo_bounded(self):
+        """A stream of distinct key sets does not grow the memo of sorted
+        key orders without limit."""
+        encoder = json.JSONEncoder(sort_keys=True)
+        for i in range(300):
+            self.assertEqual(encoder.encode({'k%d' % i: 1, 'a': 2}),
+                             '{"a": 2, "k%d": 1}' % i)
+        self.assertTrue(len(encoder._shape_memo or ()) <= 256)
+
     def test_dict_subclass_unsorted(self):
         """Slow path: dict subclass falls back to iterator path."""
         class MyDict(dict):
@@ -393,6 +424,44 @@ class TestDictEncodingPaths(TestCase):
         result = json.loads(json.dumps(items))
         self.assertEqual(result, items)
 
+    def test_key_memo_across_calls(self):
+        """The encoded keys are kept by the encoder between calls, and
+        forgotten when the options they depend on change."""
+        encoder = json.JSONEncoder()
+        d = {u'k\u00e9': {u'k\u00e9': 1}}
+        for _ in range(2):
+            self.assertEqual(encoder.encode(d),
+                             '{"k\\u00e9": {"k\\u00e9": 1}}')
+        encoder.ensure_ascii = False
+        self.assertEqual(encoder.encode(d), u'{"k\u00e9": {"k\u00e9": 1}}')
+        encoder.key_separator = ':'
+        self.assertEqual(encoder.encode(d), u'{"k\u00e9":{"k\u00e9":1}}')
+        self.assertEqual(encoder.encode_bytes(d),
+                         u'{"k\u00e9":{"k\u00e9":1}}'.encode('utf-8'))
+
+    def test_encoder_cache(self):
+        """dumps() calls with the same options share an encoder."""
+        json._encoder_cache.clear()
+        for _ in range(2):
+            self.assertEqual(json.dumps({'a': [1]}, separators=(',', ':')),
+                             '{"a":[1]}')
+            self.assertEqual(json.dumpb([1], sort_keys=True), b'[1]')
+        self.assertEqual(len(json._encoder_cache), 2)
+        # unhashable options are not cached
+        self.assertEqual(json.dumps([1], separators=[',', ':']), '[1]')
+        self.assertEqual(len(json._encoder_cache), 2)
+        for i in range(json._MAXCACHE + 1):
+            self.assertEqual(json.dumps([], indent=i), '[]')
+        self.assertTrue(len(json._encoder_cache) <= json._MAXCACHE)
+
+    def test_key_memo_bounded(self):
+        """A stream of distinct keys does not grow the key memo without
+        limit."""
+        encoder = json.JSONEncoder()
+        d = dict(('key_%d' % i, i) for i in range(3000))
+        self.assertEqual(json.loads(encoder.encode(d)), d)
+        self.assertTrue(len(encoder._get_key_memo()) <= 1024)
+
     def test_large_dict(self):
         """Large dict stresses the PyDict_Next iteration path."""
         d = {"key_%d" % i: i for i in range(1000)}
@@ -451,3 +520,52 @@ class TestListEncodingPaths(TestCase):
         """Large list stresses the indexed fast path."""
         data = list(range(1000))
         self.assertEqual(json.loads(json.dumps(data)), data)
+
+
+class TestDumpb(TestCase):
+    data = {
+        'ascii': ['text', 1, 2.5, None, True, False],
+        u'n\u00e9': u'\u00e9\u1234\U0001f600 "quoted" \\ \n\t\x01\x7f',
+        'nested': {'a': [{}, [], [u'\u2028']]},
+        'raw': json.RawJSON(u'"\u00e9"'),
+    }
+
+    def test_matches_dumps(self):
+        for kw in [{}, {'ensure_ascii': False},
+                   {'indent': 2, 'sort_keys': True, 'ensure_ascii': False},
+                   {'separators': (',', ':')}]:
+            for obj in [self.data, u'\u00e9', 'x' * 1000, [], 1]:
+                expect = json.dumps(obj, **kw)
+                if isinstance(expect, text_type):
+                    expect = expect.encode('utf-8')
+                self.assertEqual(json.dumpb(obj, **kw), expect)
+                self.assertTrue(isinstance(json.dumpb(obj, **kw), binary_type))
+
+    def test_bytes_values(self):
+        self.assertEqual(
+            json.dumpb([b('\xc3\xa9')], ensure_ascii=False),
+            b('["\xc3\xa9"]'))
+        self.assertEqual(
+            json.dumpb([b('\xe9')], encoding='iso-8859-1'),
+            b('["\\u00e9"]'))
+
+    def test_lone_surrogate(self):
+        self.assertEqual(json.dumpb(u'\ud800'), b('"\\ud800"'))
+        if PY3:
+            self.assertRaises(
+                UnicodeEncodeError, json.dumpb, u'\ud800', ensure_ascii=False)
+
+    def test_cls(self):
+        self.assertEqual(
+            json.dumpb({'<': u'\u2028'}, cls=json.JSONEncoderForHTML,
+                       ensure_ascii=False),
+            b('{"\\u003c": "\\u2028"}'))
+
+        class Upper(json.JSONEncoder):
+            def encode(self, o):
+                return json.JSONEncoder.encode(self, o).upper()
+        self.assertEqual(json.dumpb(['a'], cls=Upper), b('["A"]'))
+
+    def test_errors(self):
+        self.assertRaises(TypeError, json.dumpb, [object()])
+        self.assertRaises(ValueError, json.dumpb, float('nan'))
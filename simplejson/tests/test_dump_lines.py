@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+import sys
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+from simplejson.compat import BytesIO, StringIO
+
+
+class Unserializable(object):
+    pass
+
+
+class TestDumpLines(TestCase):
+    RECORDS = [{'a': [1, 2.5, None]}, u'x\u00e9\u20ac', 3, [], {'b': {}}]
+
+    def expect(self, **kw):
+        return ''.join(json.dumps(obj, **kw) + '\n' for obj in self.RECORDS)
+
+    def test_dump_lines(self):
+        sio = StringIO()
+        json.dump_lines(self.RECORDS, sio)
+        self.assertEqual(sio.getvalue(), self.expect())
+        sio = StringIO()
+        json.dump_lines(iter(self.RECORDS), sio, separators=(',', ':'),
+                        sort_keys=True)
+        self.assertEqual(sio.getvalue(),
+                         self.expect(separators=(',', ':'), sort_keys=True))
+        sio = StringIO()
+        json.dump_lines([], sio)
+        self.assertEqual(sio.getvalue(), '')
+
+    def test_as_bytes(self):
+        for kw in [{}, {'ensure_ascii': False}]:
+            bio = BytesIO()
+            json.dump_lines(self.RECORDS, bio, as_bytes=True, **kw)
+            self.assertEqual(bio.getvalue(),
+                             self.expect(**kw).encode('utf-8'))
+
+    def test_chunks(self):
+        for kw in [{}, {'ensure_ascii': False}]:
+            encoder = json.JSONEncoder(**kw)
+            expect = self.expect(**kw)
+            lines = list(encoder.iterencode_lines(self.RECORDS))
+            self.assertEqual(lines, expect.splitlines(True))
+            for chunk_size in (1, 4, 1 << 16):
+                chunks = list(encoder.iterencode_lines(self.RECORDS,
+                                                       chunk_size))
+                self.assertEqual(''.join(chunks), expect)
+                for chunk in chunks[:-1]:
+                    self.assertTrue(len(chunk) >= chunk_size)
+                chunks = list(encoder.iterencode_lines(
+                    self.RECORDS, chunk_size, as_bytes=True))
+                self.assertEqual(b''.join(chunks), expect.encode('utf-8'))
+
+    def test_subclass(self):
+        # iterencode() overrides are honoured
+        records = ['<b>', {'a': '&'}]
+        sio = StringIO()
+        json.dump_lines(records, sio, cls=json.JSONEncoderForHTML)
+        self.assertEqual(
+            sio.getvalue(),
+            ''.join(json.JSONEncoderForHTML().encode(obj) + '\n'
+                    for obj in records))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, json.dump_lines, [1], StringIO(),
+                          indent=2)
+        self.assertRaises(ValueError, json.JSONEncoder().iterencode_lines,
+                          [1], 0)
+        self.assertRaises(TypeError, json.dump_lines, [1, Unserializable()],
+                          StringIO())
+        self.assertRaises(TypeError, json.dump_lines, 1, StringIO())
+
+    @skipUnless(sys.version_info >= (3, 11), 'add_note requires Python 3.11+')
+    def test_error_notes(self):
+        try:
+            json.dump_lines([1, {'a': Unserializable()}], StringIO())
+        except TypeError as exc:
+            self.assertEqual(exc.__notes__[-1], 'when serializing list item 1')
+        else:
+            self.fail('Expected TypeError')
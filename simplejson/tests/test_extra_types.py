@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+import base64
+import datetime
+import uuid
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+from simplejson.compat import PY3
+
+try:
+    import enum
+except ImportError:
+    enum = None
+
+
+class TZ(datetime.tzinfo):
+    def utcoffset(self, dt):
+        return datetime.timedelta(hours=5, minutes=30)
+
+    def dst(self, dt):
+        return None
+
+
+class Date(datetime.date):
+    def isoformat(self):
+        return 'date'
+
+
+class UUID(uuid.UUID):
+    def __str__(self):
+        return 'uuid'
+
+
+class TestExtraTypes(TestCase):
+    def assertEncodes(self, objs, expect, **kw):
+        encoder = json.JSONEncoder(**kw)
+        self.assertEqual(json.loads(encoder.encode(objs)), expect)
+        self.assertEqual(json.loads(encoder.encode({'a': objs})),
+                         {'a': expect})
+        self.assertEqual(
+            json.loads(''.join(encoder.iterencode(objs, chunk_size=4))),
+            expect)
+        self.assertEqual(json.loads(encoder.encode_bytes(objs)), expect)
+        self.assertEqual([json.loads(encoder.encode(obj)) for obj in objs],
+                         expect)
+
+    def test_datetime_format(self):
+        objs = [datetime.datetime(2020, 1, 2, 3, 4, 5),
+                datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+                datetime.datetime(2020, 1, 2, tzinfo=TZ()),
+                datetime.date(5, 1, 2),
+                datetime.time(1, 2, 3),
+                datetime.time(1, 2, 3, 400),
+                datetime.time(1, tzinfo=TZ()),
+                Date(2020, 1, 2)]
+        self.assertEncodes(objs, [obj.isoformat() for obj in objs],
+                           datetime_format='iso')
+        self.assertRaises(TypeError, json.dumps, objs)
+
+    def test_uuid_as_str(self):
+        objs = [uuid.UUID(int=0), uuid.UUID(int=1 << 127 | 5),
+                uuid.UUID(int=(1 << 128) - 1), uuid.uuid4(), UUID(int=1)]
+        self.assertEncodes(objs, [str(obj) for obj in objs],
+                           uuid_as_str=True)
+        self.assertRaises(TypeError, json.dumps, objs)
+
+    @skipUnless(enum is not None, 'requires enum')
+    def test_enum_as_value(self):
+        class Color(enum.Enum):
+            RED = 1
+            BLUE = [2, 'x']
+        class Size(enum.IntEnum):
+            SMALL = 3
+        self.assertEncodes([Color.RED, Color.BLUE, Size.SMALL],
+                           [1, [2, 'x'], 3], enum_as_value=True)
+        self.assertRaises(TypeError, json.dumps, [Color.RED])
+
+    def test_bytes_as(self):
+        objs = [bytearray(b''), bytearray(b'a'), bytearray(b'ab'),
+                bytearray(b'abc'), bytearray(b'\xff\xfe\x00\x01')]
+        if PY3:
+            objs.extend([b'', b'abcd', b'\x00' * 100])
+        expect = [base64.b64encode(bytes(obj)).decode('ascii')
+                  for obj in objs]
+        self.assertEncodes(objs, expect, bytes_as='base64')
+        self.assertEncodes(objs, expect, bytes_as='base64', encoding=None)
+        if PY3:
+            # Keys are still decoded with the encoding
+            self.assertEqual(json.dumps({b'k': b'v'}, bytes_as='base64'),
+                             '{"k": "dg=="}')
+            self.assertEqual(json.dumps(b'v', bytes_as='base64'), '"dg=="')
+        else:
+            self.assertEqual(json.dumps('v', bytes_as='base64'), '"v"')
+
+    def test_precedence(self):
+        # The options come before type_encoders and default
+        u = uuid.UUID(int=1)
+        self.assertEqual(
+            json.dumps([u], uuid_as_str=True, default=repr,
+                       type_encoders={uuid.UUID: lambda o: o.int}),
+            '["%s"]' % (u,))
+        self.assertEqual(
+            json.dumps([u], type_encoders={uuid.UUID: lambda o: o.int}), '[1]')
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, json.JSONEncoder,
+                          datetime_format='%Y')
+        self.assertRaises(ValueError, json.JSONEncoder, bytes_as='hex')
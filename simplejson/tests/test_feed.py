@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson import OrderedDict
+
+
+def feed(decoder, data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        decoder.feed(data[i:i + chunk_size])
+    return decoder.close()
+
+
+class TestFeed(TestCase):
+    DOCS = [
+        u'{"a\\u00e9": [1, -2.5e3, "\\u00e9\\n\\ud83d\\ude00\\u20ac", null,'
+        u' true, false, {}, [], [[{"x": {"y": [1e5, 0]}}]]], "b": "\\"\\\\"}',
+        u'1234',
+        u'-0.5E-10',
+        u'"a string"',
+        u' [ ] ',
+        u'\n{ "a" :\n 1 }\n',
+        u'\ufeff[1, 2]',
+    ]
+
+    def test_chunks(self):
+        for doc in self.DOCS:
+            expect = json.loads(doc)
+            for chunk_size in (1, 2, 3, 7, 1000):
+                self.assertEqual(
+                    feed(json.JSONDecoder(), doc, chunk_size), expect)
+                self.assertEqual(
+                    feed(json.JSONDecoder(), doc.encode('utf-8'), chunk_size),
+                    expect)
+
+    def test_encoding(self):
+        data = u'["\u00e9"]'.encode('latin1')
+        self.assertEqual(feed(json.JSONDecoder(encoding='latin1'), data, 1),
+                         [u'\u00e9'])
+
+    def test_hooks(self):
+        doc = '{"b": [1, {"z": 2, "a": [3]}], "a": 1.5, "n": NaN}'
+        kw = dict(object_pairs_hook=OrderedDict, array_hook=tuple,
+                  parse_float=str, allow_nan=True)
+        expect = json.loads(doc, **kw)
+        for chunk_size in (1, 4, 100):
+            rval = feed(json.JSONDecoder(**kw), doc, chunk_size)
+            self.assertEqual(rval, expect)
+            self.assertEqual(list(rval), ['b', 'a', 'n'])
+
+    def test_reuse(self):
+        decoder = json.JSONDecoder()
+        self.assertEqual(feed(decoder, '[1]', 1), [1])
+        self.assertEqual(feed(decoder, '{"a": 2}', 3), {'a': 2})
+        self.assertRaises(json.JSONDecodeError, decoder.feed, '[1 2')
+        self.assertEqual(feed(decoder, '3', 1), 3)
+
+    def test_deep_nesting(self):
+        # Open containers are kept on a stack rather than the C stack
+        doc = '[' * 100000 + ']' * 100000
+        rval = feed(json.JSONDecoder(), doc, 65536)
+        for _ in range(99999):
+            rval, = rval
+        self.assertEqual(rval, [])
+
+    def test_large_values(self):
+        # Values over many chunks are scanned once, not from their start
+        # again on each chunk
+        value = (u'x' * 60 + u'\\"\u00e9\n') * (1 << 14)
+        doc = json.dumps({value: [value, 1]})
+        expect = {value: [value, 1]}
+        for data in (doc, doc.encode('utf-8')):
+            for chunk_size in (65536, 65537):
+                self.assertEqual(
+                    feed(json.JSONDecoder(), data, chunk_size), expect)
+        self.assertEqual(
+            list(json.JSONDecoder().iter_array(json.dumps([value]), 65536)),
+            [value])
+        doc = u'[%s]' % (u'1' * (1 << 20),)
+        self.assertEqual(
+            feed(json.JSONDecoder(parse_int=len), doc, 65536), [1 << 20])
+        doc = u'["%s\\x"]' % (u'a' * (1 << 20),)
+        with self.assertRaises(json.JSONDecodeError) as expect:
+            json.loads(doc)
+        with self.assertRaises(json.JSONDecodeError) as cm:
+            feed(json.JSONDecoder(), doc, 65536)
+        self.assertEqual((cm.exception.msg, cm.exception.pos),
+                         (expect.exception.msg, expect.exception.pos))
+
+    def test_errors(self):
+        for doc in ['[1 2]', '{"a" 1}', '[1,\n  x]',
+                    '[', '{"a"', '"abc', '[1] 2', '', 'tru', '"\\q"',
+                    '{"a":\n\n [1,\n {"b" 2}]}', '[1,\n "\\u12"]']:
+            try:
+                json.loads(doc)
+            except json.JSONDecodeError as e:
+                expect = e
+            else:
+                self.fail('Expected JSONDecodeError for %r' % (doc,))
+            for chunk_size in (1, 3, 100):
+                try:
+                    feed(json.JSONDecoder(), doc, chunk_size)
+                except json.JSONDecodeError as e:
+                    self.assertEqual(
+                        (e.msg, e.pos, e.lineno, e.colno),
+                        (expect.msg, expect.pos, expect.lineno, expect.colno))
+                else:
+                    self.fail('Expected JSONDecodeError for %r' % (doc,))
+
+    def test_trailing_comma(self):
+        for doc, msg in [('[1,]', 'Illegal trailing comma before end of array'),
+                         ('{"a": 1 , }',
+                          'Illegal trailing comma before end of object')]:
+            for chunk_size in (1, 3, 100):
+                try:
+                    feed(json.JSONDecoder(), doc, chunk_size)
+                except json.JSONDecodeError as e:
+                    self.assertEqual(e.msg, msg)
+                else:
+                    self.fail('Expected JSONDecodeError for %r' % (doc,))
+
+    def test_invalid_type(self):
+        self.assertRaises(TypeError, json.JSONDecoder().feed, 1)
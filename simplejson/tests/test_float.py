@@ -44,3 +44,22 @@ class TestFloat(TestCase):
         except AttributeError:
             float_range = [2.2250738585072014e-308, 1.7976931348623157e+308]
         self.assertEqual(json.loads(json.dumps(float_range)), float_range)
+
+    def test_rounding(self):
+        # Exactly halfway cases, subnormals, overflow, more digits than
+        # fit in 64 bits and exponents out of range all round as float()
+        docs = ['9007199254740993.0', '9007199254740995.0',
+                '7.2057594037927933e16', '1e22', '1e23', '-0.0', '0e99999',
+                '2.2250738585072011e-308', '4.9e-324', '2.4703282292062328e-324',
+                '1.7976931348623159e308', '1e400', '-1e-400', '1E+2',
+                '1.00000000000000011102230246251565404236316680908203125',
+                '123456789012345678901234567890.0', '0.000000000000000000001',
+                '-65.613616999999977', '43.420273000000009', '1.5e-5',
+                '0.1', '0.3', '2.0000000000000004', '1.9999999999999998']
+        for doc in docs:
+            expect = float(doc)
+            for s in (doc, doc.encode('ascii'), '[%s]' % (doc,)):
+                rval = json.loads(s)
+                if isinstance(rval, list):
+                    rval = rval[0]
+                self.assertEqual(repr(rval), repr(expect))
@@ -98,3 +98,24 @@ class TestFreeThreading(TestCase):
                 self.assertEqual(dec.decode(raw), data)
 
         self._run_threads(worker)
+
+    @skip_if_speedups_missing
+    def test_shared_scanner_key_memo(self):
+        """Keys are interned per call, not through shared scanner state."""
+        scan_once = simplejson.decoder.JSONDecoder().scan_once
+        counter = [0]
+        lock = threading.Lock()
+
+        def worker():
+            with lock:
+                n = counter[0]
+                counter[0] += 1
+            raw = '[{"k%d": 1}, {"k%d": 2}]' % (n, n)
+            for _ in range(self.N_ITER):
+                (a, b), end = scan_once(raw, 0)
+                self.assertEqual(end, len(raw))
+                (ka,), (kb,) = list(a), list(b)
+                self.assertEqual(ka, 'k%d' % (n,))
+                self.assertTrue(ka is kb)
+
+        self._run_threads(worker)
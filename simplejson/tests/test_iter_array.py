@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import BytesIO, StringIO
+
+
+class TestIterArray(TestCase):
+    def test_elements(self):
+        items = [1, {'a': [2, {'b': None}]}, u'x\u00e9', [], {}, 2.5, True]
+        doc = json.dumps(items, ensure_ascii=False)
+        for chunk_size in (1, 3, 8, 1000):
+            self.assertEqual(
+                list(json.iter_array(doc, chunk_size=chunk_size)), items)
+            self.assertEqual(
+                list(json.iter_array(BytesIO(doc.encode('utf-8')),
+                                     chunk_size=chunk_size)),
+                items)
+            self.assertEqual(
+                list(json.iter_array(StringIO(json.dumps(items)),
+                                     chunk_size=chunk_size)),
+                items)
+
+    def test_empty(self):
+        self.assertEqual(list(json.iter_array(' [ ] ')), [])
+        self.assertEqual(list(json.iter_array(BytesIO(b'[]'))), [])
+
+    def test_incremental(self):
+        # elements are generated before the rest of the file is read
+        data = BytesIO(b'[{"a": 1}, [2], 3, ')
+        gen = json.iter_array(data, chunk_size=4)
+        self.assertEqual(next(gen), {'a': 1})
+        self.assertEqual(next(gen), [2])
+        self.assertEqual(next(gen), 3)
+        self.assertRaises(json.JSONDecodeError, next, gen)
+
+    def test_hooks(self):
+        doc = '[{"b": 1, "a": [2]}, [3]]'
+        self.assertEqual(
+            list(json.iter_array(doc, object_pairs_hook=json.OrderedDict,
+                                 array_hook=tuple, chunk_size=2)),
+            [json.OrderedDict([('b', 1), ('a', (2,))]), (3,)])
+
+    def test_errors(self):
+        for doc, msg, pos in [('{"a": 1}', "Expecting '['", 0),
+                              (' 1', "Expecting '['", 1),
+                              ('', 'Expecting value', 0),
+                              ('[1, 2', "Expecting ',' delimiter or ']'", 5),
+                              ('[1] [2]', 'Extra data', 4)]:
+            try:
+                list(json.iter_array(doc, chunk_size=2))
+            except json.JSONDecodeError as e:
+                self.assertEqual((e.msg, e.pos), (msg, pos))
+            else:
+                self.fail('Expected JSONDecodeError for %r' % (doc,))
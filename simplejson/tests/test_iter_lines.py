@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import BytesIO, StringIO
+
+
+class TestIterLines(TestCase):
+    DOCS = [{'a': 1}, [1, 2.5, None], u'x\u00e9\u20ac', 3, {}]
+    TEXT = (u'{"a": 1}\n\n  [1, 2.5, null]  \r\n"x\\u00e9\u20ac"\n'
+            u'\t\n3\n{}')
+
+    def test_lines(self):
+        data = self.TEXT.encode('utf-8')
+        self.assertEqual(list(json.iter_lines(self.TEXT)), self.DOCS)
+        self.assertEqual(list(json.iter_lines(self.TEXT + u'\n')), self.DOCS)
+        self.assertEqual(list(json.iter_lines(data)), self.DOCS)
+        self.assertEqual(list(json.iter_lines(u'\ufeff' + self.TEXT)),
+                         self.DOCS)
+        self.assertEqual(list(json.iter_lines(b'\xef\xbb\xbf' + data)),
+                         self.DOCS)
+        for chunk_size in (1, 2, 7, 1000):
+            self.assertEqual(
+                list(json.iter_lines(BytesIO(data), chunk_size=chunk_size)),
+                self.DOCS)
+            self.assertEqual(
+                list(json.iter_lines(StringIO(json.dumps(self.DOCS[0])),
+                                     chunk_size=chunk_size)),
+                self.DOCS[:1])
+
+    def test_long_lines(self):
+        # A line over many chunks is joined once, when its end is read
+        value = [u'x' * 99 + u'\u00e9'] * 5000
+        data = (json.dumps(value) + u'\n' + json.dumps(value)).encode('utf-8')
+        for chunk_size in (4096, 65537):
+            self.assertEqual(
+                list(json.iter_lines(BytesIO(data), chunk_size=chunk_size)),
+                [value, value])
+        data = b'1\n' * 10000 + b'[' + b'1, ' * 5000
+        try:
+            list(json.iter_lines(BytesIO(data), chunk_size=4096))
+        except json.JSONDecodeError as e:
+            self.assertEqual((e.lineno, e.colno), (10001, 15002))
+        else:
+            self.fail('Expected JSONDecodeError')
+
+    def test_empty(self):
+        self.assertEqual(list(json.iter_lines('')), [])
+        self.assertEqual(list(json.iter_lines(' \n\n')), [])
+        self.assertEqual(list(json.iter_lines(BytesIO(b''))), [])
+
+    def test_options(self):
+        self.assertEqual(
+            list(json.iter_lines('{"b": 1.5, "a": 2}\n[]',
+                                 object_pairs_hook=json.OrderedDict,
+                                 array_hook=tuple, parse_float=str)),
+            [json.OrderedDict([('b', '1.5'), ('a', 2)]), ()])
+        self.assertEqual(
+            list(json.iter_lines(u'"\u00e9"\n'.encode('latin1'),
+                                 encoding='latin1')),
+            [u'\u00e9'])
+
+    def test_select_lazy(self):
+        text = u'{"a": {"b": 1}, "c": [2]}\n{"c": 3}\n'
+        data = text.encode('utf-8')
+        for s in (text, data, BytesIO(data)):
+            self.assertEqual(
+                list(json.iter_lines(s, chunk_size=5, select=['c', 'a.b'])),
+                [{'c': [2], 'a.b': 1}, {'c': 3}])
+        for s in (text, data, BytesIO(data)):
+            objs = list(json.iter_lines(s, chunk_size=5, lazy=True))
+            self.assertTrue(isinstance(objs[0], json.LazyObject))
+            self.assertEqual(objs[0]['a']['b'], 1)
+            self.assertEqual(objs, [{'a': {'b': 1}, 'c': [2]}, {'c': 3}])
+            self.assertEqual(json.dumps(objs[1]), '{"c": 3}')
+        self.assertRaises(json.JSONDecodeError, list,
+                          json.iter_lines('{"c": 1} 2\n', select=['c']))
+        self.assertRaises(json.JSONDecodeError, list,
+                          json.iter_lines('1\n{"c": 1\n', lazy=True))
+
+    def test_errors(self):
+        for text, msg, lineno, colno in [
+                ('1\n2\n[3,\n4]\n', 'Expecting value', 3, 4),
+                ('1\n {"a" 1}', "Expecting ':' delimiter", 2, 7),
+                ('1\n\n2 3\n', 'Extra data', 3, 3),
+                ('[1]\n{', "Expecting property name enclosed in double "
+                           "quotes", 2, 2)]:
+            for chunk_size in (1, 1000):
+                try:
+                    list(json.iter_lines(BytesIO(text.encode('utf-8')),
+                                         chunk_size=chunk_size))
+                except json.JSONDecodeError as e:
+                    self.assertEqual(e.msg[:len(msg)], msg)
+                    self.assertEqual((e.lineno, e.colno), (lineno, colno))
+                    self.assertEqual(e.doc, text.splitlines()[lineno - 1])
+                else:
+                    self.fail('Expected JSONDecodeError for %r' % (text,))
+
+    def test_non_ascii_errors(self):
+        # Offsets are characters of the line however the input is encoded
+        for text, msg, pos in [(u'1\n"\xe9\xe9\xe9" x\n', 'Extra data', 6),
+                               (u'1\n["\xe9\xe9", x]\n', 'Expecting value', 7)]:
+            data = text.encode('utf-8')
+            sources = [text, data] + [(BytesIO(data), chunk_size)
+                                      for chunk_size in (1, 5, 1000)]
+            for s in sources:
+                try:
+                    if isinstance(s, tuple):
+                        list(json.iter_lines(s[0], chunk_size=s[1]))
+                    else:
+                        list(json.iter_lines(s))
+                except json.JSONDecodeError as e:
+                    self.assertEqual(e.msg, msg)
+                    self.assertEqual((e.pos, e.lineno, e.colno),
+                                     (pos, 2, pos + 1))
+                    self.assertEqual(e.doc, text.splitlines()[1])
+                else:
+                    self.fail('Expected JSONDecodeError for %r' % (s,))
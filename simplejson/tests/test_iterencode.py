@@ -0,0 +1,152 @@
+import sys
+import unittest
+from collections import namedtuple
+import decimal
+
+import simplejson as json
+from simplejson.compat import StringIO
+
+Point = namedtuple('Point', ['x', 'y'])
+
+
+class ForJson(object):
+    def for_json(self):
+        return {'for_json': [1, Point(2, 3)]}
+
+
+class Unserializable(object):
+    pass
+
+
+def default(o):
+    if isinstance(o, set):
+        return sorted(o)
+    if isinstance(o, Unserializable):
+        return 'unserializable'
+    raise TypeError(repr(o))
+
+
+class TestIterencode(unittest.TestCase):
+    def make_doc(self):
+        # decimal.Decimal is looked up late, test_decimal reloads it
+        return {
+            'a': [1, 2.5, None, True, False, u'x\u1234', {'b': [], 'c': {}}],
+            'nested': [[[[]]], [[{'deep': [1, [2, [3]]]}]]],
+            'decimal': decimal.Decimal('1.10'),
+            'tuple': (1, 2),
+            'point': Point(3, 4),
+            'raw': json.RawJSON('[9, 9]'),
+            'for_json': ForJson(),
+            'set': set([3, 1, 2]),
+            'obj': Unserializable(),
+            'long': 'x' * 1000,
+        }
+
+    def assertChunked(self, obj, **kw):
+        encoder = json.JSONEncoder(**kw)
+        expect = encoder.encode(obj)
+        for chunk_size in (1, 2, 7, 64, 1 << 20):
+            chunks = list(encoder.iterencode(obj, chunk_size))
+            self.assertEqual(expect, ''.join(chunks))
+            # every chunk but the last reaches the target size
+            for chunk in chunks[:-1]:
+                self.assertTrue(len(chunk) >= chunk_size)
+            self.assertTrue(all(chunks))
+
+    def test_same_output(self):
+        for kw in [
+                {},
+                {'indent': 2},
+                {'indent': '\t', 'sort_keys': True},
+                {'separators': (',', ':'), 'ensure_ascii': False},
+                {'item_sort_key': lambda kv: kv[0]},
+                {'for_json': True, 'namedtuple_as_object': False},
+                {'iterable_as_array': True, 'tuple_as_array': False}]:
+            kw.setdefault('default', default)
+            kw.setdefault('for_json', True)
+            self.assertChunked(self.make_doc(), **kw)
+
+    def test_scalars(self):
+        for obj in [None, 1, 1.5, u'text', decimal.Decimal('3'), json.RawJSON('7'),
+                    [], {}]:
+            self.assertChunked(obj, iterable_as_array=True)
+
+    def test_iterable_as_array(self):
+        encoder = json.JSONEncoder(iterable_as_array=True, indent=1)
+        expect = encoder.encode({'gen': list(range(50)), 'empty': []})
+        for chunk_size in (1, 5, 1 << 20):
+            obj = {'gen': (i for i in range(50)), 'empty': iter(())}
+            self.assertEqual(
+                expect, ''.join(encoder.iterencode(obj, chunk_size)))
+
+    def test_skipkeys(self):
+        self.assertChunked({1: 1, (1, 2): 2, 'a': 3, None: 4},
+                           skipkeys=True, sort_keys=False)
+
+    def test_lazy(self):
+        # items are not converted before the iterator gets to them
+        seen = []
+        def record(o):
+            seen.append(o)
+            return o.n
+        class N(object):
+            def __init__(self, n):
+                self.n = n
+        chunks = json.JSONEncoder(default=record).iterencode(
+            [N(i) for i in range(100)], 16)
+        first = next(chunks)
+        self.assertTrue(len(seen) < 100)
+        self.assertEqual(
+            first + ''.join(chunks), json.dumps(list(range(100))))
+        self.assertEqual(len(seen), 100)
+
+    def test_invalid_chunk_size(self):
+        for chunk_size in (0, -1):
+            self.assertRaises(
+                ValueError, json.JSONEncoder().iterencode, [], chunk_size)
+
+    def test_circular(self):
+        x = []
+        x.append(x)
+        self.assertRaises(
+            ValueError, list, json.JSONEncoder().iterencode(x, 4))
+        y = []
+        # the marker is released once y has been encoded
+        self.assertEqual(
+            ''.join(json.JSONEncoder().iterencode([y, y, {'y': y}], 1)),
+            '[[], [], {"y": []}]')
+
+    def test_deep_nesting(self):
+        obj = []
+        for _ in range(100000):
+            obj = [obj]
+        self.assertRaises(
+            RecursionError if sys.version_info >= (3, 5) else RuntimeError,
+            list, json.JSONEncoder().iterencode(obj, 1024))
+
+    @unittest.skipIf(sys.version_info < (3, 11), 'add_note requires Python 3.11+')
+    def test_error_notes(self):
+        obj = {'a': [1, {'b': Unserializable()}]}
+        try:
+            list(json.JSONEncoder().iterencode(obj, 1))
+        except TypeError as exc:
+            self.assertEqual(exc.__notes__, [
+                'when serializing Unserializable object',
+                "when serializing dict item 'b'",
+                'when serializing list item 1',
+                "when serializing dict item 'a'",
+            ])
+        else:
+            self.fail('Expected TypeError')
+
+    def test_html(self):
+        obj = {'a': ['<script>&</script>'] * 20}
+        encoder = json.JSONEncoderForHTML()
+        self.assertEqual(
+            encoder.encode(obj), ''.join(encoder.iterencode(obj, 8)))
+
+    def test_dump_streams(self):
+        sio = StringIO()
+        obj = [{'key': i} for i in range(20000)]
+        json.dump(obj, sio)
+        self.assertEqual(sio.getvalue(), json.dumps(obj))
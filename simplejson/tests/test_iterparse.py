@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+import decimal
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import BytesIO, StringIO
+from simplejson.scanner import py_make_scanner
+from simplejson.tests._helpers import skip_if_speedups_missing
+
+
+def build(events):
+    # Rebuild the document from its events
+    stack = [[]]
+    keys = []
+    for event, value, prefix in events:
+        if event == 'map_key':
+            keys.append(value)
+            continue
+        if event in ('start_map', 'start_array'):
+            stack.append({} if event == 'start_map' else [])
+            continue
+        if event in ('end_map', 'end_array'):
+            value = stack.pop()
+        container = stack[-1]
+        if isinstance(container, dict):
+            container[keys.pop()] = value
+        else:
+            container.append(value)
+    return stack[0][0]
+
+
+class TestIterparse(TestCase):
+    DOC = (u'{"a": [1, true, {"b": null, "c": ["x\\u00e9", 1.5]}],'
+           u' "d": {}, "e": [], "f": false, "g": -3e2}')
+
+    def test_events(self):
+        self.assertEqual(list(json.iterparse(self.DOC)), [
+            ('start_map', None, ''),
+            ('map_key', 'a', ''),
+            ('start_array', None, 'a'),
+            ('number', 1, 'a.item'),
+            ('boolean', True, 'a.item'),
+            ('start_map', None, 'a.item'),
+            ('map_key', 'b', 'a.item'),
+            ('null', None, 'a.item.b'),
+            ('map_key', 'c', 'a.item'),
+            ('start_array', None, 'a.item.c'),
+            ('string', u'x\u00e9', 'a.item.c.item'),
+            ('number', 1.5, 'a.item.c.item'),
+            ('end_array', None, 'a.item.c'),
+            ('end_map', None, 'a.item'),
+            ('end_array', None, 'a'),
+            ('map_key', 'd', ''),
+            ('start_map', None, 'd'),
+            ('end_map', None, 'd'),
+            ('map_key', 'e', ''),
+            ('start_array', None, 'e'),
+            ('end_array', None, 'e'),
+            ('map_key', 'f', ''),
+            ('boolean', False, 'f'),
+            ('map_key', 'g', ''),
+            ('number', -300.0, 'g'),
+            ('end_map', None, ''),
+        ])
+
+    def test_scalar(self):
+        self.assertEqual(list(json.iterparse('"s"')), [('string', 's', '')])
+        self.assertEqual(list(json.iterparse(' 12 ')), [('number', 12, '')])
+
+    def test_chunks(self):
+        expect = list(json.iterparse(self.DOC))
+        data = self.DOC.encode('utf-8')
+        for chunk_size in (1, 2, 5, 100):
+            self.assertEqual(
+                list(json.iterparse(self.DOC, chunk_size=chunk_size)), expect)
+            self.assertEqual(
+                list(json.iterparse(data, chunk_size=chunk_size)), expect)
+            self.assertEqual(
+                list(json.iterparse(BytesIO(data), chunk_size=chunk_size)),
+                expect)
+            self.assertEqual(
+                list(json.iterparse(StringIO(self.DOC),
+                                    chunk_size=chunk_size)),
+                expect)
+        self.assertEqual(build(expect), json.loads(self.DOC))
+
+    def test_options(self):
+        events = list(json.iterparse('[1.1, NaN]', use_decimal=True,
+                                     allow_nan=True))
+        self.assertEqual(events[1], ('number', decimal.Decimal('1.1'), 'item'))
+        self.assertEqual(events[2][0], 'number')
+        self.assertTrue(events[2][1] != events[2][1])
+        # hooks are not called, there are no objects to give them
+        events = list(json.iterparse('{"a": []}', object_hook=list))
+        self.assertEqual(events[0], ('start_map', None, ''))
+
+    def test_errors(self):
+        # events are generated up to the error
+        events = []
+        try:
+            for event in json.iterparse('[1, 2 3]', chunk_size=1):
+                events.append(event)
+        except json.JSONDecodeError as e:
+            self.assertEqual(e.msg, "Expecting ',' delimiter or ']'")
+            self.assertEqual(e.pos, 6)
+        else:
+            self.fail('Expected JSONDecodeError')
+        self.assertEqual(events, [('start_array', None, ''),
+                                  ('number', 1, 'item'),
+                                  ('number', 2, 'item')])
+        self.assertRaises(json.JSONDecodeError, list, json.iterparse('[1'))
+        self.assertRaises(json.JSONDecodeError, list, json.iterparse(''))
+
+    def outcome(self, decoder, doc, chunk_size):
+        events = []
+        try:
+            for event in decoder.iterparse(doc, chunk_size=chunk_size):
+                events.append(event)
+        except json.JSONDecodeError as e:
+            events.append((e.msg, e.pos, e.end))
+        return events
+
+    @skip_if_speedups_missing
+    def test_tokenizer(self):
+        # The C scanner tokenizes like the Python parser it falls back to
+        decoder = json.JSONDecoder(allow_nan=True)
+        self.assertTrue(hasattr(decoder.scan_once, 'events'))
+        py_decoder = json.JSONDecoder(allow_nan=True)
+        py_decoder.scan_once = py_make_scanner(py_decoder)
+        docs = [self.DOC, u' [[[]], {"a": {"a": [{}]}}, "\\"", -0.5e1] ',
+                u'{"\u00e9": [NaN, -Infinity, 1e400, 12345678901234567890]}',
+                u'[1, 2 3]', u'[1,]', u'{"a": 1,}', u'{"a" 1}', u'{1: 2}',
+                u'[tru]', u'["a\\x"]', u'[1] 2', u'{"a": [1}', u'[-]',
+                u'[1, "a', u'{"a":', u'[nul']
+        for doc in docs:
+            for chunk_size in (1, 3, 1000):
+                self.assertEqual(self.outcome(decoder, doc, chunk_size),
+                                 self.outcome(py_decoder, doc, chunk_size))
+        doc = json.dumps([{'id': i, 's': u'\xe9' * (i % 7), 'v': i / 4.0,
+                           'n': [None, True, [i]]} for i in range(2000)])
+        for chunk_size in (4096, 65536):
+            events = self.outcome(decoder, doc, chunk_size)
+            self.assertEqual(events, self.outcome(py_decoder, doc, chunk_size))
+            self.assertEqual(build(events), json.loads(doc))
@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+import threading
+from unittest import TestCase
+
+import simplejson as json
+
+
+class TestKeyCache(TestCase):
+    DOCS = ['{"a": 1, "b": {"a": 2, "c": [{"b": 3}]}}',
+            u'{"x\u00e9": 1, "a\\n": 2, "\u20ac": {"a": 3}}',
+            b'{"a": {"b\\u00e9": 1, "c": 2}}',
+            u'{"a": "\u20ac", "b": 1}']
+
+    def test_decode(self):
+        decoder = json.JSONDecoder(key_cache_size=3)
+        for doc in self.DOCS * 3:
+            self.assertEqual(decoder.decode(doc), json.loads(doc))
+        info = decoder.key_cache_info()
+        self.assertEqual(info.maxsize, 3)
+        self.assertEqual(info.currsize, 3)
+        self.assertEqual(len(decoder.key_cache), 3)
+        self.assertTrue(info.hits > 0)
+        self.assertEqual(info.hits + info.misses, 42)
+
+    def test_shared_keys(self):
+        decoder = json.JSONDecoder(key_cache_size=10)
+        a = decoder.decode('{"key": 1}')
+        b = decoder.decode(b'[{"key": 2}]')[0]
+        self.assertTrue(list(a)[0] is list(b)[0])
+        self.assertEqual(decoder.key_cache_info(), (1, 1, 10, 1))
+        decoder.key_cache.clear()
+        self.assertEqual(decoder.key_cache_info(), (0, 0, 10, 0))
+
+    def test_clock_eviction(self):
+        decoder = json.JSONDecoder(key_cache_size=2)
+        decoder.decode('{"a": 1, "b": 2}')
+        decoder.decode('{"a": 1}')
+        # "a" was referenced, so "b" makes room for "c"
+        decoder.decode('{"c": 1}')
+        decoder.decode('{"a": 1}')
+        self.assertEqual(decoder.key_cache_info(), (2, 3, 2, 2))
+        decoder.decode('{"b": 1}')
+        self.assertEqual(decoder.key_cache_info(), (2, 4, 2, 2))
+
+    def test_no_cache(self):
+        self.assertEqual(json.JSONDecoder().key_cache_info(), None)
+        self.assertRaises(ValueError, json.JSONDecoder, key_cache_size=0)
+        self.assertEqual(json.loads('{"a": {"a": 1}}', key_cache_size=1),
+                         {'a': {'a': 1}})
+
+    def test_threads(self):
+        decoder = json.JSONDecoder(key_cache_size=8)
+        docs = [json.dumps(dict(('k%d' % ((i + j) % 12), j)
+                                for j in range(5)))
+                for i in range(12)]
+        expect = [json.loads(doc) for doc in docs]
+        errors = []
+
+        def work():
+            try:
+                for _ in range(50):
+                    for doc, obj in zip(docs, expect):
+                        if decoder.decode(doc) != obj:
+                            errors.append(doc)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        info = decoder.key_cache_info()
+        self.assertEqual(info.hits + info.misses, 4 * 50 * 12 * 5)
+        self.assertEqual(info.currsize, 8)
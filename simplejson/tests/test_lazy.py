@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3
+
+
+class TestLazy(TestCase):
+    doc = ('{"a": [1, 2.5, {"b": "x}"}],  "c" : {"d": [ ]}, '
+           '"e": null, "f": "\\u00e9"}')
+    expect = {'a': [1, 2.5, {'b': 'x}'}], 'c': {'d': []}, 'e': None,
+              'f': u'\xe9'}
+
+    def docs(self):
+        rval = [self.doc]
+        if PY3:
+            rval.extend([self.doc.encode('utf-8'),
+                         memoryview(bytearray(self.doc.encode('utf-8')))])
+        return rval
+
+    def test_access(self):
+        for doc in self.docs():
+            obj = json.loads(doc, lazy=True)
+            self.assertTrue(isinstance(obj, json.LazyObject))
+            self.assertTrue(isinstance(obj['a'], json.LazyArray))
+            self.assertEqual(list(obj), ['a', 'c', 'e', 'f'])
+            self.assertEqual(len(obj['a']), 3)
+            self.assertEqual(obj['a'][-1]['b'], 'x}')
+            self.assertEqual(obj['a'][:2], [1, 2.5])
+            self.assertTrue('e' in obj)
+            self.assertFalse('x' in obj)
+            self.assertRaises(KeyError, obj.__getitem__, 'x')
+            self.assertRaises(IndexError, obj['a'].__getitem__, 3)
+            self.assertEqual(obj, self.expect)
+            self.assertEqual(self.expect, obj)
+            self.assertEqual(json.loads(json.dumps(obj)), self.expect)
+        self.assertEqual(json.loads(' 1 ', lazy=True), 1)
+        self.assertEqual(json.loads('"a"', lazy=True), 'a')
+        self.assertEqual(json.loads('[]', lazy=True), [])
+
+    def test_unchanged_source(self):
+        for doc in self.docs():
+            obj = json.loads(doc, lazy=True)
+            self.assertEqual(json.dumps(obj), self.doc)
+            self.assertEqual(json.dumps(obj, indent=2, sort_keys=True),
+                             self.doc)
+            self.assertEqual(json.dumps(obj, separators=(',', ':'),
+                                        ensure_ascii=False), self.doc)
+            obj['a'][2]['b']
+            self.assertEqual(json.dumps(obj), self.doc)
+            self.assertEqual(json.dumps([obj['c']]), '[{"d": [ ]}]')
+            self.assertEqual(
+                ''.join(json.JSONEncoder().iterencode(obj, chunk_size=2)),
+                self.doc)
+
+    def test_changed(self):
+        obj = json.loads(self.doc, lazy=True)
+        obj['a'][2]['b'] = 'y'
+        self.assertEqual(json.dumps(obj),
+                         '{"a": [1, 2.5, {"b": "y"}], "c": {"d": [ ]}, '
+                         '"e": null, "f": "\\u00e9"}')
+        self.assertEqual(json.dumps(obj, separators=(',', ':')),
+                         '{"a":[1,2.5,{"b":"y"}],"c":{"d": [ ]},'
+                         '"e":null,"f":"\\u00e9"}')
+        del obj['c']
+        obj['g'] = [True]
+        obj['a'].insert(0, 0)
+        obj['a'][1:3] = [5]
+        del obj['a'][-1]
+        self.assertEqual(obj, {'a': [0, 5], 'e': None, 'f': u'\xe9',
+                               'g': [True]})
+        self.assertEqual(json.dumps(obj),
+                         '{"a": [0, 5], "e": null, "f": "\\u00e9", '
+                         '"g": [true]}')
+        self.assertEqual(
+            ''.join(json.JSONEncoder().iterencode(obj, chunk_size=2)),
+            json.dumps(obj))
+
+    def test_errors(self):
+        for doc in ('{"a" 1}', '[1 2]', '[1,]', '[', '{"a": [}',
+                    '{"a": "b', '[1] 2'):
+            self.assertRaises(json.JSONDecodeError, json.loads, doc,
+                              lazy=True)
+        # The values are only checked when they are decoded
+        obj = json.loads('{"a": [1, 2 3], "b": 1}', lazy=True)
+        self.assertEqual(obj['b'], 1)
+        self.assertRaises(json.JSONDecodeError, obj['a'].__len__)
+        # and source that is never accessed is written back as it is
+        obj = json.loads('{"a": [1,,2]}', lazy=True)
+        self.assertEqual(json.dumps(obj), '{"a": [1,,2]}')
+        self.assertRaises(json.JSONDecodeError, json.loads, json.dumps(obj))
+        self.assertRaises(ValueError, json.JSONDecoder, lazy=True,
+                          object_hook=dict)
+        self.assertRaises(ValueError, json.JSONDecoder, lazy=True,
+                          select=['a'])
+
+    def test_options(self):
+        obj = json.loads('{"a": 1.5, "b": [NaN]}', lazy=True, use_decimal=True,
+                         allow_nan=True)
+        self.assertEqual(repr(obj['a']), "Decimal('1.5')")
+        self.assertTrue(obj['b'][0] != obj['b'][0])
@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+import decimal
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3
+
+
+class Unserializable(object):
+    pass
+
+
+class TestLoadsMany(TestCase):
+    DOCS = ['{"a": [1, 2.5, null]}', ' [true] \n', u'"x\u00e9"', '3',
+            u'\ufeff{}', b'{"b": "\\u00e9"}', b'\xef\xbb\xbf 4 ',
+            u'"\u20ac"'.encode('utf-8')]
+    if PY3:
+        DOCS.append(bytearray(b'[5]'))
+
+    def test_loads_many(self):
+        expect = [json.loads(doc) for doc in self.DOCS]
+        self.assertEqual(json.loads_many(self.DOCS), expect)
+        self.assertEqual(json.loads_many(iter(self.DOCS)), expect)
+        self.assertEqual(json.loads_many(self.DOCS, workers=4), expect)
+        self.assertEqual(json.loads_many([]), [])
+
+    def test_options(self):
+        docs = ['{"b": 1.5, "a": [2]}', '{"c": {}}']
+        kw = dict(object_pairs_hook=json.OrderedDict, array_hook=tuple,
+                  parse_float=str)
+        rval = json.loads_many(docs, **kw)
+        self.assertEqual(rval, [json.loads(doc, **kw) for doc in docs])
+        self.assertEqual(list(rval[0]), ['b', 'a'])
+        self.assertEqual(rval[0]['b'], '1.5')
+        self.assertEqual(
+            json.loads_many([u'"\u00e9"'.encode('latin1')], encoding='latin1'),
+            [u'\u00e9'])
+
+    def test_errors(self):
+        docs = ['[1]', '[1, 2', '1 2', '', b'{"a" 1}', '"\\q"']
+        self.assertRaises(json.JSONDecodeError, json.loads_many, docs)
+        rval = json.loads_many(docs, return_exceptions=True)
+        self.assertEqual(rval[0], [1])
+        for doc, err in zip(docs[1:], rval[1:]):
+            try:
+                json.loads(doc)
+            except json.JSONDecodeError as e:
+                expect = e
+            self.assertTrue(isinstance(err, json.JSONDecodeError))
+            self.assertEqual((err.msg, err.pos, err.end),
+                             (expect.msg, expect.pos, expect.end))
+        self.assertTrue(isinstance(
+            json.loads_many([1], return_exceptions=True)[0], TypeError))
+        self.assertRaises(ValueError, json.loads_many, ['1'], workers=0)
+
+
+class TestDumpsMany(TestCase):
+    def test_dumps_many(self):
+        objs = [{'a': [1, 2.5, None]}, u'x\u00e9', 3, [], {'b': {}},
+                decimal.Decimal('1.5'), (1, 2)]
+        for kw in [{}, {'sort_keys': True, 'ensure_ascii': False},
+                   {'indent': 2}]:
+            expect = [json.dumps(obj, **kw) for obj in objs]
+            self.assertEqual(json.dumps_many(objs, **kw), expect)
+            self.assertEqual(json.dumps_many(iter(objs), workers=3,
+                                             **kw),
+                             expect)
+        self.assertEqual(json.dumps_many([]), [])
+
+    def test_subclass(self):
+        objs = ['<b>', {'a': '&'}]
+        self.assertEqual(
+            json.dumps_many(objs, cls=json.JSONEncoderForHTML),
+            [json.JSONEncoderForHTML().encode(obj) for obj in objs])
+
+    def test_errors(self):
+        shared = [1, [2]]
+        circular = []
+        circular.append(circular)
+        objs = [shared, {'a': [Unserializable()]}, circular, shared]
+        self.assertRaises(TypeError, json.dumps_many, objs)
+        rval = json.dumps_many(objs, return_exceptions=True)
+        self.assertEqual(rval[0], '[1, [2]]')
+        self.assertTrue(isinstance(rval[1], TypeError))
+        self.assertTrue(isinstance(rval[2], ValueError))
+        # the containers of a failed object are no longer marked
+        self.assertEqual(rval[3], '[1, [2]]')
+        rval = json.dumps_many([float('nan')], return_exceptions=True)
+        self.assertTrue(isinstance(rval[0], ValueError))
+        self.assertEqual(json.dumps_many([float('nan')], allow_nan=True),
+                         ['NaN'])
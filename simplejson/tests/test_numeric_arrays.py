@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+import array
+import decimal
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+from simplejson.compat import PY3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def feed(decoder, data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        decoder.feed(data[i:i + chunk_size])
+    return decoder.close()
+
+
+def int_array(values):
+    if PY3:
+        return array.array('q', values)
+    # The array module of Python 2 has no 64-bit integer type
+    return list(values)
+
+
+class TestNumericArrays(TestCase):
+    def assertDecodes(self, doc, expect, **kw):
+        decoder = json.JSONDecoder(numeric_arrays='array', **kw)
+        for rval in (decoder.decode(doc),
+                     decoder.decode(doc.encode('utf-8')),
+                     feed(json.JSONDecoder(numeric_arrays='array', **kw),
+                          doc, 3)):
+            self.assertEqual(rval, expect)
+            self.assertEqual(type(rval), type(expect))
+
+    def test_ints(self):
+        self.assertDecodes('[1, -2, 0]', int_array([1, -2, 0]))
+        self.assertDecodes('[ 9223372036854775807 , -9223372036854775808 ]',
+                           int_array([2 ** 63 - 1, -2 ** 63]))
+        self.assertDecodes('[9223372036854775808]', [2 ** 63])
+        self.assertDecodes('[12345678901234567890123]',
+                           [12345678901234567890123])
+
+    def test_floats(self):
+        self.assertDecodes('[1.5, -2, 1e3, 0.1]',
+                           array.array('d', [1.5, -2.0, 1000.0, 0.1]))
+        self.assertDecodes('[1, 2E-2]', array.array('d', [1.0, 0.02]))
+        rval = json.loads('[NaN, -Infinity, 1]', numeric_arrays='array',
+                          allow_nan=True)
+        self.assertEqual(rval.typecode, 'd')
+        self.assertEqual(rval[1:].tolist(), [float('-inf'), 1.0])
+        self.assertNotEqual(rval[0], rval[0])
+
+    def test_inexact_ints(self):
+        # Mixed with floats, an int that a double can't hold exactly
+        # keeps the array a list
+        self.assertDecodes('[9007199254740993, 1.5]',
+                           [9007199254740993, 1.5])
+        self.assertDecodes('[1.5, -9223372036854775807]',
+                           [1.5, -9223372036854775807])
+        self.assertDecodes('[9223372036854775807, 0.5]',
+                           [9223372036854775807, 0.5])
+        self.assertDecodes('[9007199254740992, -9223372036854775808, 1.5]',
+                           array.array('d', [2.0 ** 53, -2.0 ** 63, 1.5]))
+        self.assertDecodes('[9007199254740993]',
+                           int_array([9007199254740993]))
+
+    def test_fallback(self):
+        self.assertDecodes('[]', [])
+        self.assertDecodes('[1, "2"]', [1, '2'])
+        self.assertDecodes('[1, true]', [1, True])
+        self.assertDecodes('[1.5, null]', [1.5, None])
+        self.assertDecodes('[[1, 2], [3.5], {"a": [1]}, 4]',
+                           [int_array([1, 2]), array.array('d', [3.5]),
+                            {'a': int_array([1])}, 4])
+        self.assertRaises(json.JSONDecodeError, json.loads, '[1, 2',
+                          numeric_arrays='array')
+        self.assertRaises(json.JSONDecodeError, json.loads, '[1, 2,]',
+                          numeric_arrays='array')
+        self.assertRaises(json.JSONDecodeError, json.loads, '[1 2]',
+                          numeric_arrays='array')
+
+    def test_hooks(self):
+        self.assertDecodes('[[1, 2], [1.5]]',
+                           (tuple(int_array([1, 2])), (1.5,)),
+                           array_hook=tuple)
+        # Custom number types are never packed into arrays
+        self.assertDecodes('[1, 2.5]', [1, decimal.Decimal('2.5')],
+                           parse_float=decimal.Decimal)
+        self.assertDecodes('[1, 2.5]', ['1', 2.5], parse_int=str)
+        self.assertRaises(ValueError, json.JSONDecoder,
+                          numeric_arrays='list')
+
+    @skipUnless(numpy is not None, 'requires numpy')
+    def test_numpy(self):
+        rval = json.loads('{"a": [1, 2], "b": [[0.5, 1]], "c": [1, "x"]}',
+                          numeric_arrays='numpy')
+        self.assertEqual(rval['a'].dtype, numpy.int64)
+        self.assertEqual(rval['a'].tolist(), [1, 2])
+        self.assertEqual(rval['b'][0].dtype, numpy.float64)
+        self.assertEqual(rval['b'][0].tolist(), [0.5, 1.0])
+        self.assertEqual(rval['c'], [1, 'x'])
+        rval['a'][0] = 5
+        self.assertEqual(rval['a'].tolist(), [5, 2])
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3
+
+
+class TestRawCapture(TestCase):
+    doc = ('{"id": 1, "payload": {"x": [1, 2 ], "y": "\\u00e9"}, '
+           '"list": [[1], {"a": [ ]}, "b"], "empty": [ ]}')
+
+    def docs(self):
+        rval = [self.doc]
+        if PY3:
+            rval.extend([self.doc.encode('utf-8'),
+                         memoryview(self.doc.encode('utf-8'))])
+        return rval
+
+    def test_raw_keys(self):
+        for doc in self.docs():
+            rval = json.loads(doc, raw_keys=['payload', 'id', 'a'],
+                              object_pairs_hook=OrderedDict)
+            self.assertTrue(isinstance(rval['payload'], json.RawJSON))
+            self.assertEqual(rval['payload'].encoded_json,
+                             '{"x": [1, 2 ], "y": "\\u00e9"}')
+            # Only objects and arrays are captured
+            self.assertEqual(rval['id'], 1)
+            self.assertEqual(rval['list'][1]['a'].encoded_json, '[ ]')
+            self.assertEqual(rval['list'][0], [1])
+            self.assertEqual(json.dumps(rval, separators=(', ', ': ')),
+                             '{"id": 1, "payload": {"x": [1, 2 ], '
+                             '"y": "\\u00e9"}, "list": [[1], {"a": [ ]}, '
+                             '"b"], "empty": []}')
+
+    def test_raw_depth(self):
+        for doc in self.docs():
+            rval = json.loads(doc, raw_depth=0)
+            self.assertEqual(rval.encoded_json, self.doc)
+            rval = json.loads(doc, raw_depth=1,
+                              object_pairs_hook=OrderedDict)
+            self.assertEqual(rval['id'], 1)
+            self.assertEqual(rval['list'].encoded_json,
+                             '[[1], {"a": [ ]}, "b"]')
+            self.assertEqual(json.dumps(rval), self.doc)
+            rval = json.loads(doc, raw_depth=2)
+            self.assertEqual(rval['payload']['x'].encoded_json, '[1, 2 ]')
+            self.assertEqual(rval['list'][0].encoded_json, '[1]')
+            self.assertEqual(rval['list'][2], 'b')
+            self.assertEqual(json.loads(doc, raw_depth=5),
+                             json.loads(self.doc))
+        self.assertEqual(json.loads('[1, "a"]', raw_depth=1), [1, 'a'])
+        self.assertEqual(json.loads('"a"', raw_depth=0), 'a')
+
+    def test_options(self):
+        rval = json.loads('[{"a": {"b": 1}, "c": {}}]', raw_keys=['a'],
+                          object_pairs_hook=list)
+        self.assertEqual(rval[0][0][1].encoded_json, '{"b": 1}')
+        self.assertEqual(rval[0][1], ('c', []))
+        rval = json.JSONDecoder(raw_depth=1).decode_many(
+            ['[[1], 2]', '{"a": [2]}', '3'])
+        self.assertEqual(rval[0][0].encoded_json, '[1]')
+        self.assertEqual(rval[1]['a'].encoded_json, '[2]')
+        self.assertEqual(rval[2], 3)
+
+    def test_errors(self):
+        for doc in ('{"a": [1, 2}', '{"a": [1, "]}'):
+            self.assertRaises(json.JSONDecodeError, json.loads, doc,
+                              raw_keys=['a'])
+            self.assertRaises(json.JSONDecodeError, json.loads, doc,
+                              raw_depth=1)
+        self.assertRaises(json.JSONDecodeError, json.loads, '[[1] 2]',
+                          raw_depth=1)
+        self.assertRaises(ValueError, json.JSONDecoder, raw_depth=-1)
+        self.assertRaises(ValueError, json.JSONDecoder, raw_depth='1')
+        self.assertRaises(ValueError, json.JSONDecoder, raw_depth=1,
+                          lazy=True)
+        self.assertRaises(ValueError, json.JSONDecoder, raw_keys=['a'],
+                          select=['a'])
+
+    def test_malformed(self):
+        # The captured source is validated, with the same errors as
+        # decoding it
+        for doc in (u'{"a": [1 2]}', u'{"a": {"b": [tru]}}',
+                    u'{"a": ["x", 1,]}', u'{"a": {"b" 1}}',
+                    u'{"a": ["\u00e9", "\\x"]}', u'{"a": [NaN]}'):
+            for s in (doc, doc.encode('utf-8')):
+                try:
+                    json.loads(s)
+                except json.JSONDecodeError as e:
+                    expect = (e.msg, e.pos)
+                for kw in ({'raw_keys': ['a']}, {'raw_depth': 1}):
+                    try:
+                        json.loads(s, **kw)
+                    except json.JSONDecodeError as e:
+                        self.assertEqual((e.msg, e.pos), expect)
+                    else:
+                        self.fail('Expected JSONDecodeError for %r' % (s,))
+        self.assertEqual(
+            json.loads('{"a": [NaN]}', raw_depth=1,
+                       allow_nan=True)['a'].encoded_json,
+            '[NaN]')
+
+    def test_incremental(self):
+        # Containers parsed token by token have no source to capture
+        for decoder in (json.JSONDecoder(raw_depth=1),
+                        json.JSONDecoder(raw_keys=['a'])):
+            self.assertRaises(ValueError, decoder.feed, '[{"a": {}}]')
+            self.assertRaises(ValueError, decoder.close)
+            self.assertRaises(ValueError, list,
+                              decoder.iter_array('[{"a": {}}]'))
+            self.assertEqual(
+                [event for event, _, _ in decoder.iterparse('{"a": {}}')],
+                ['start_map', 'map_key', 'start_map', 'end_map', 'end_map'])
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3
+
+
+class TestSelect(TestCase):
+    DOC = ('{"id": 7, "skip": {"a": [1, {"b": "}]\\"[{"}], "c": null},'
+           ' "user": {"name": "x", "id": 42, "tags": [1, 2, 3]},'
+           ' "meta": {"trace": "abc", "z": [[[]]]},'
+           ' "items": [{"id": 1}, {"id": 2}, true], "0": "zero"}')
+
+    def assertSelects(self, doc, select, expect, **kw):
+        decoder = json.JSONDecoder(select=select, **kw)
+        self.assertEqual(decoder.decode(doc), expect)
+        self.assertEqual(json.loads(doc, select=select, **kw), expect)
+        if PY3:
+            self.assertEqual(decoder.decode(doc.encode('utf-8')), expect)
+        decoder.feed(doc)
+        self.assertEqual(decoder.close(), expect)
+
+    def test_select(self):
+        self.assertSelects(
+            self.DOC, ['id', 'user.id', 'meta.trace', 'missing', 'id.x'],
+            {'id': 7, 'user.id': 42, 'meta.trace': 'abc'})
+        self.assertSelects('[1, [2, 3]]', ['1.0', '5'], {'1.0': 2})
+        self.assertSelects('"a"', ['a'], {})
+        self.assertSelects('{}', [], {})
+
+    def test_indexes(self):
+        self.assertSelects(
+            self.DOC, ['items.1.id', ('items', 0), ('items', 2, 'id'), '0'],
+            {'items.1.id': 2, ('items', 0): {'id': 1}, '0': 'zero'})
+        # An index in a tuple path doesn't match object keys
+        self.assertSelects(self.DOC, [(0,), ('0',)], {('0',): 'zero'})
+
+    def test_nested_paths(self):
+        self.assertSelects(
+            self.DOC, ['user.tags.2', 'user', ['user', 'tags']],
+            {'user': {'name': 'x', 'id': 42, 'tags': [1, 2, 3]},
+             ('user', 'tags'): [1, 2, 3], 'user.tags.2': 3})
+
+    def test_hooks(self):
+        self.assertSelects(
+            self.DOC, ['user.tags', 'meta'],
+            {'user.tags': (1, 2, 3), 'meta': {'trace': 'abc', 'z': (((),),)}},
+            array_hook=tuple)
+        # Duplicate keys are resolved as by loads, the last one wins
+        self.assertSelects('{"a": 1, "b": 2, "a": 3}', ['a'], {'a': 3})
+
+    def test_errors(self):
+        for doc in ['{"id": 1, "x": [1, 2}', '{"x": "abc', '{"x": [1, 2',
+                    '{"x": {"y": 1}', '{"x": }', '{"x": 1,}', '{"id" 1}',
+                    '{"id": 1} x', '[1, 2,]', '[1 2]', '{1: 2}', '']:
+            self.assertRaises(json.JSONDecodeError, json.loads, doc,
+                              select=['id'])
+        # Skipped values are not validated
+        self.assertEqual(json.loads('{"x": [1, tru, {]], "id": 1}',
+                                    select=['id']), {'id': 1})
+        self.assertRaises(ValueError, json.JSONDecoder, select=[()])
+        self.assertRaises(TypeError, json.JSONDecoder, select=[('a', -1)])
+        self.assertRaises(TypeError, json.JSONDecoder, select=[('a', None)])
+
+    def test_raw_decode(self):
+        decoder = json.JSONDecoder(select=['a'])
+        self.assertEqual(decoder.raw_decode(' {"a": [1], "b": 2} [3]', 1),
+                         ({'a': [1]}, 19))
+        self.assertEqual(decoder.decode_many(['{"a": 1}', '[]']),
+                         [{'a': 1}, {}])
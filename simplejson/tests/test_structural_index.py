@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3, b
+
+
+def outcome(func, doc):
+    try:
+        return func(doc)
+    except json.JSONDecodeError as exc:
+        return (exc.msg, exc.pos)
+
+
+class TestStructuralIndex(TestCase):
+    doc = ('{"a": [1, {"b\\"": "x}"}, [ ], 2.5], "c" : {"d": null}, '
+           '"e\\u0041": [3], "c": {"d": [true, "\\u00e9"]}}')
+    expect = {'a': [1, {'b"': 'x}'}, [], 2.5], 'c': {'d': [True, u'\xe9']},
+              'eA': [3]}
+
+    def docs(self):
+        rval = [self.doc, u'\ufeff ' + self.doc]
+        if PY3:
+            rval.extend([self.doc.encode('utf-8'),
+                         b'\xef\xbb\xbf' + self.doc.encode('utf-8'),
+                         memoryview(bytearray(self.doc.encode('utf-8')))])
+        return rval
+
+    def test_get(self):
+        for doc in self.docs():
+            index = json.JSONDecoder().index(doc)
+            self.assertTrue(isinstance(index, json.StructuralIndex))
+            self.assertEqual(index.decode(), self.expect)
+            self.assertEqual(index.get('a.1'), {'b"': 'x}'})
+            self.assertEqual(index.get(('a', 3)), 2.5)
+            self.assertEqual(index.get('a.2'), [])
+            # The last member of a name is the one found
+            self.assertEqual(index.get('c.d.1'), u'\xe9')
+            self.assertEqual(index.get('eA.0'), 3)
+            self.assertEqual(index.get('a.4'), None)
+            self.assertEqual(index.get('a.0.x', 0), 0)
+            self.assertEqual(index.get('x'), None)
+            self.assertEqual(
+                index.select(['a.1.b"', 'c.d', ('a', 0), 'x']),
+                {'a.1.b"': 'x}', 'c.d': [True, u'\xe9'], ('a', 0): 1})
+        index = json.JSONDecoder().index('{"0": 1, "1": [2]}')
+        self.assertEqual(index.get('0'), 1)
+        self.assertEqual(index.get('1.0'), 2)
+        self.assertEqual(index.get((0,)), None)
+        self.assertRaises(ValueError, index.get, ())
+        self.assertRaises(TypeError, index.get, ('a', -1))
+
+    def test_scalars(self):
+        for doc in (' 1 ', '"a"', '[]', '{}', '[1]', '[[], {}]', '[ "a" ]'):
+            index = json.JSONDecoder().index(doc)
+            self.assertEqual(index.decode(), json.loads(doc))
+            value = json.loads(doc)
+            self.assertEqual(index.get((0,), 'x'),
+                             value[0] if isinstance(value, list) and value
+                             else 'x')
+
+    def test_options(self):
+        decoder = json.JSONDecoder(object_pairs_hook=OrderedDict,
+                                   parse_float=str, array_hook=tuple)
+        for doc in self.docs():
+            index = decoder.index(doc)
+            self.assertEqual(list(index.get('c')), ['d'])
+            self.assertTrue(isinstance(index.get('c'), OrderedDict))
+            self.assertEqual(index.get('a'), (1, {'b"': 'x}'}, (), '2.5'))
+        index = json.JSONDecoder(raw_keys=['d']).index(self.doc)
+        self.assertEqual(index.get('c')['d'].encoded_json,
+                         '[true, "\\u00e9"]')
+        self.assertRaises(ValueError, json.JSONDecoder(raw_depth=1).index,
+                          self.doc)
+        index = json.JSONDecoder(allow_nan=True).index(b('[NaN, 1]'))
+        self.assertTrue(index.get('0') != index.get('0'))
+
+    def test_errors(self):
+        decoder = json.JSONDecoder()
+        for doc in ('', ' ', '[', '[1', '"a', '{"a": [1, 2}', '[1] 2',
+                    '[1] x', '{"a": 1} "b"', '1 2', '"a" [', '[1,2]]',
+                    '[1 2]', '[1,]', '{"a" 1}', '{"a": 1,}', '[,1]',
+                    '{1: 2}', '[}', ']', '"\\"', '[-]'):
+            self.assertEqual(outcome(lambda s: decoder.index(s).decode(), doc),
+                             outcome(decoder.decode, doc))
+            if PY3:
+                doc = doc.encode('utf-8')
+                self.assertEqual(
+                    outcome(lambda s: decoder.index(s).decode(), doc),
+                    outcome(decoder.decode, doc))
+        # Offsets are those of the characters, not of the UTF-8 bytes
+        doc = u'{"\u00e9\u00e9": [1 2], "\u20ac": 1} x'
+        for s in (doc, doc.encode('utf-8')):
+            index = decoder.index(s[:-2])
+            self.assertEqual(outcome(index.get, u'\u00e9\u00e9'),
+                             ("Expecting ',' delimiter or ']'", 10))
+            self.assertEqual(outcome(decoder.index, s), ('Extra data', 22))
+        # Data after the document is found when it is indexed
+        self.assertEqual(outcome(decoder.index, '[1] x'), ('Extra data', 4))
+        self.assertEqual(outcome(decoder.index, ' "a" 1'), ('Extra data', 5))
+        # Only what is looked up in or decoded is validated
+        index = decoder.index('{"a": [1 2], "b": {"c": 1}, "d": [1,]}')
+        self.assertEqual(index.get('b.c'), 1)
+        self.assertRaises(json.JSONDecodeError, index.get, 'a')
+        self.assertRaises(json.JSONDecodeError, index.get, 'd')
+        self.assertRaises(json.JSONDecodeError, index.decode)
+
+    def test_large(self):
+        # Large enough to be indexed without holding the GIL, with strings
+        # and escapes across the 64 byte blocks of the C index
+        doc = json.dumps([{'id': i, 's': 'x\\"' * (i % 40), 'n': [i] * 3}
+                          for i in range(2000)])
+        for s in (doc, doc.encode('utf-8')):
+            index = json.JSONDecoder().index(s)
+            self.assertEqual(index.get('1999.id'), 1999)
+            self.assertEqual(index.get('1234.s'), 'x\\"' * 34)
+            self.assertEqual(index.get('37.n.2'), 37)
+            self.assertEqual(index.decode(), json.loads(doc))
+            self.assertEqual(len(index), 2000 * 16 + 1)
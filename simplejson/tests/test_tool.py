@@ -99,3 +99,18 @@ class TestTool(unittest.TestCase):
                 os.unlink(outfile_name)
         finally:
             os.unlink(infile_name)
+
+    def test_validate(self):
+        self.assertEqual(self.runTool(args=['--validate'],
+                                      data=self.data.encode()), [])
+        proc = subprocess.Popen([sys.executable, '-m', 'simplejson.tool',
+                                 '--validate'],
+                                stdin=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        out, err = proc.communicate(b'[1, 2')
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(out, b'')
+        self.assertEqual(strip_python_stderr(err).decode('utf8'),
+                         "Expecting ',' delimiter or ']': "
+                         "line 1 column 6 (char 5)")
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+import datetime
+import sys
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from unittest import TestCase, skipUnless
+
+import simplejson as json
+from simplejson.compat import StringIO
+
+Point = namedtuple('Point', ['x', 'y'])
+
+
+class Date(datetime.date):
+    pass
+
+
+class ForJson(object):
+    def for_json(self):
+        return 'for_json'
+
+
+class Slotted(object):
+    __slots__ = ()
+
+
+class Int(int):
+    pass
+
+
+class Float(float):
+    pass
+
+
+class Str(str):
+    pass
+
+
+class TestTypeEncoders(TestCase):
+    TYPE_ENCODERS = {uuid.UUID: str,
+                     datetime.date: lambda d: d.isoformat()}
+
+    def test_type_encoders(self):
+        u = uuid.UUID(int=1)
+        obj = {'a': u, 'b': [Date(2020, 1, 2), datetime.datetime(2020, 1, 2)]}
+        expect = {'a': str(u), 'b': ['2020-01-02', '2020-01-02T00:00:00']}
+        for kw in [{}, {'indent': 2}, {'sort_keys': True}]:
+            encoder = json.JSONEncoder(type_encoders=self.TYPE_ENCODERS, **kw)
+            self.assertEqual(json.loads(encoder.encode(obj)), expect)
+            self.assertEqual(json.loads(''.join(encoder.iterencode(obj))),
+                             expect)
+            self.assertEqual(encoder.encode(u), '"%s"' % (u,))
+        self.assertEqual(
+            json.dumps([u], type_encoders=self.TYPE_ENCODERS),
+            '["%s"]' % (u,))
+        sio = StringIO()
+        json.dump({'a': u}, sio, type_encoders=self.TYPE_ENCODERS)
+        self.assertEqual(sio.getvalue(), '{"a": "%s"}' % (u,))
+
+    def test_precedence(self):
+        type_encoders = {ForJson: lambda o: 'type', Point: list,
+                         Slotted: lambda o: 'type'}
+        self.assertEqual(
+            json.dumps([ForJson(), Point(1, 2), Slotted()], for_json=True,
+                       default=repr, type_encoders=type_encoders),
+            '["type", [1, 2], "type"]')
+
+    def test_native_types(self):
+        # A catch-all for object does not take over the types that are
+        # encoded natively
+        obj = [1, 'a', None, {'a': (1,)}, json.RawJSON('2'), set()]
+        self.assertEqual(
+            json.dumps(obj, type_encoders={object: lambda o: 'object'}),
+            '[1, "a", null, {"a": [1]}, 2, "object"]')
+        self.assertEqual(
+            json.dumps([(1,), Decimal('3')], tuple_as_array=False,
+                       use_decimal=False, type_encoders={object: str}),
+            '["(1,)", "3"]')
+        self.assertEqual(
+            json.dumps([json.OrderedDict(a=1), Point(1, 2)],
+                       type_encoders={json.OrderedDict: list,
+                                      Point: lambda p: p.x}),
+            '[["a"], 1]')
+
+    def test_scalar_subclasses(self):
+        # A subclass of a natively encoded scalar type is looked up, but
+        # the lookup ends at the type itself
+        type_encoders = {Int: lambda o: 'int', Float: lambda o: 'float',
+                         Str: lambda o: 'str', int: str, float: str,
+                         str: len, bool: str}
+        obj = [Int(1), {'a': Float(1.5)}, Str('x'), 2, 2.5, 'y', True]
+        expect = '["int", {"a": "float"}, "str", 2, 2.5, "y", true]'
+        encoder = json.JSONEncoder(type_encoders=type_encoders)
+        self.assertEqual(encoder.encode(obj), expect)
+        self.assertEqual(''.join(encoder.iterencode(obj)), expect)
+        self.assertEqual(''.join(encoder.iterencode(obj, chunk_size=4)),
+                         expect)
+        self.assertEqual(json.dumpb(obj, type_encoders=type_encoders),
+                         expect.encode('ascii'))
+        self.assertEqual(encoder.encode(Int(3)), '"int"')
+        self.assertEqual(
+            json.dumps([Int(1), Str('x')], type_encoders={object: repr}),
+            '[1, "x"]')
+
+    def test_changed_options(self):
+        encoder = json.JSONEncoder(type_encoders={uuid.UUID: str})
+        u = uuid.UUID(int=2)
+        self.assertEqual(encoder.encode(u), '"%s"' % (u,))
+        encoder.type_encoders[uuid.UUID] = lambda o: o.int
+        self.assertEqual(encoder.encode(u), '2')
+        encoder.type_encoders = None
+        self.assertRaises(TypeError, encoder.encode, u)
+        encoder = json.JSONEncoder(type_encoders={object: str})
+        self.assertEqual(encoder.encode((1,)), '[1]')
+        encoder.tuple_as_array = False
+        self.assertEqual(encoder.encode((1,)), '"(1,)"')
+
+    def test_for_json_added_later(self):
+        class Later(object):
+            __slots__ = ()
+        encoder = json.JSONEncoder(for_json=True, default=lambda o: 'default')
+        self.assertEqual(encoder.encode([Later()]), '["default"]')
+        Later.for_json = lambda self: 'for_json'
+        self.assertEqual(encoder.encode([Later()]), '["for_json"]')
+
+    def test_errors(self):
+        def fail(o):
+            raise ValueError('fail')
+        circular = []
+        circular.append(Slotted())
+        encoder = json.JSONEncoder(type_encoders={Slotted: lambda o: circular})
+        self.assertRaises(ValueError, encoder.encode, circular)
+        self.assertRaises(ValueError, json.dumps, [Slotted()],
+                          type_encoders={Slotted: fail})
+
+    @skipUnless(sys.version_info >= (3, 11), 'add_note requires Python 3.11+')
+    def test_error_notes(self):
+        def fail(o):
+            raise ValueError('fail')
+        try:
+            json.dumps({'a': Slotted()}, type_encoders={Slotted: fail})
+        except ValueError as exc:
+            self.assertEqual(exc.__notes__,
+                             ['when serializing Slotted object',
+                              "when serializing dict item 'a'"])
+        else:
+            self.fail('Expected ValueError')
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import simplejson as json
+from simplejson.compat import PY3, b
+
+
+def outcome(func, doc, **kw):
+    try:
+        func(doc, **kw)
+    except json.JSONDecodeError as exc:
+        return (exc.msg, exc.pos)
+    except UnicodeDecodeError as exc:
+        return (exc.start, exc.end, exc.reason)
+
+
+class TestValidate(TestCase):
+    docs = [
+        '{"a": [1, 2.5e-3, -0, true, false, null], "b": {}}',
+        ' [[], {}, [[[{"k": "v"}]]], 1E+5, 0.0] ',
+        '"x\\"\\u00e9\\ud834\\udd1e\\n\\/"',
+        u'\ufeff{"x": 1}',
+        '',
+        ' ',
+        '[',
+        '[1,]',
+        '[1 2]',
+        '{"a" 1}',
+        '{"a": 1,}',
+        '{1: 2}',
+        '{"a": 1',
+        '[1, 2] 3',
+        '"abc',
+        '"a\\x"',
+        '"\\u12"',
+        '"a\tb"',
+        '-',
+        '01',
+        '1.',
+        '1e',
+        '1.5e+',
+        'tru',
+        'NaN',
+        '[-Infinity]',
+        '[1, NaN',
+    ]
+
+    def assertSameOutcome(self, doc, **kw):
+        self.assertEqual(outcome(json.validate, doc, **kw),
+                         outcome(json.loads, doc, **kw))
+
+    def test_valid(self):
+        for doc in self.docs[:4]:
+            self.assertEqual(json.validate(doc), None)
+            self.assertEqual(json.validate(doc.encode('utf-8')), None)
+
+    def test_errors(self):
+        for doc in self.docs:
+            for kw in ({}, {'strict': False}, {'allow_nan': True}):
+                self.assertSameOutcome(doc, **kw)
+                self.assertSameOutcome(doc.encode('utf-8'), **kw)
+        self.assertRaises(json.JSONDecodeError, json.validate, '[1, 2,]')
+
+    def test_bytes(self):
+        for doc in (b('"\xc3\xa9\xe2\x82\xac\xf0\x9f\x98\x80"'),
+                    b('["\xff"]'), b('["a\xc3"]'), b('"\xed\xa0\x80"'),
+                    b('["\xe2\x82"]')):
+            self.assertSameOutcome(doc)
+        if PY3:
+            self.assertEqual(json.validate(bytearray(b'[1]')), None)
+            self.assertEqual(json.validate(memoryview(b'[1, 2]')), None)
+            self.assertRaises(json.JSONDecodeError, json.validate,
+                              memoryview(b'[1, 2'))
+
+    def test_large(self):
+        # Large enough to be checked without holding the GIL
+        doc = json.dumps([{'a': [1.5, 'x' * 10, None]}] * 1000)
+        self.assertEqual(json.validate(doc.encode('utf-8')), None)
+        self.assertSameOutcome(doc[:-1])
+        self.assertSameOutcome(doc[:-1].encode('utf-8'))
+        self.assertSameOutcome(b('["\xff"') + b(' ') * 5000)
+
+    def test_deep_nesting(self):
+        self.assertSameOutcome('[' * 100)
+        self.assertSameOutcome('[' * 100 + ']' * 99 + '}')
+        self.assertSameOutcome('{"a": ' * 100 + '1' + '}' * 99 + ']')
+        if json.decoder.make_scanner is json.scanner.py_make_scanner:
+            self.skipTest('the Python scanner is recursive')
+        for doc in ('[' * 1000 + ']' * 1000,
+                    '{"a": ' * 100 + '1' + '}' * 100):
+            self.assertEqual(json.validate(doc), None)
+
+    def test_decoder(self):
+        if json.decoder.make_scanner is json.scanner.py_make_scanner:
+            self.skipTest('the Python scanner builds the objects')
+        decoder = json.JSONDecoder(object_hook=self.fail, parse_float=self.fail)
+        self.assertEqual(decoder.validate('[{"a": 1.5}]'), None)
@@ -9,11 +9,32 @@ Usage::
     $ echo '{ 1.2:3.4}' | python -m simplejson.tool
     Expecting property name: line 1 column 2 (char 2)
 
+With ``--validate``, the input is only checked and nothing is written::
+
+    $ echo '[1, 2' | python -m simplejson.tool --validate
+    Expecting ',' delimiter or ']': line 2 column 1 (char 6)
+
 """
 import sys
 import simplejson as json
 
+def validate(args):
+    if len(args) == 0:
+        infile = getattr(sys.stdin, 'buffer', sys.stdin)
+    elif len(args) == 1:
+        infile = open(args[0], 'rb')
+    else:
+        raise SystemExit(sys.argv[0] + " --validate [infile]")
+    with infile:
+        try:
+            json.validate(infile.read())
+        except ValueError:
+            raise SystemExit(sys.exc_info()[1])
+
+
 def main():
+    if sys.argv[1:2] == ['--validate']:
+        return validate(sys.argv[2:])
     if len(sys.argv) == 1:
         infile = sys.stdin
         outfile = sys.stdout
@@ -24,7 +45,7 @@ def main():
         infile = open(sys.argv[1], 'r')
         outfile = open(sys.argv[2], 'w')
     else:
-        raise SystemExit(sys.argv[0] + " [infile [outfile]]")
+        raise SystemExit(sys.argv[0] + " [--validate] [infile [outfile]]")
     with infile:
         try:
             obj = json.load(infile,
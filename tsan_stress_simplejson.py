@@ -35,8 +35,8 @@ Configuration (environment variables)
 What this exercises
 -------------------
   - Scenario 1: N threads share ONE make_scanner() instance; each parses
-    different-but-overlapping JSON (dict/list/string cases). Targets scanner
-    s->memo (PyDict_SetItem/Clear) under concurrent scan_once().
+    different-but-overlapping JSON (dict/list/string cases). The scanner
+    takes no lock; each scan_once() call interns keys in its own memo.
   - Scenario 2: N threads share ONE make_encoder() instance; each encodes
     distinct nested dict/list objects. Targets self->markers and
     self->key_memo mutation on concurrent calls.
@@ -299,7 +299,7 @@ def _run_scenario_threads(target_fns, thread_counts=None):
 # --------------------------- scenarios -------------------------------------- #
 
 def scenario_shared_scanner():
-    """N threads share ONE scanner; race on s->memo (SetItem/Clear)."""
+    """N threads share ONE scanner, which keeps no per-call state."""
     scanner = _make_shared_scanner()
     samples = JSON_SAMPLES
 
@@ -316,7 +316,7 @@ def scenario_shared_scanner():
             if time.monotonic() > deadline:
                 break
 
-    run_scenario("shared scanner (scanner s->memo races)", [worker])
+    run_scenario("shared scanner (lock-free scan_once)", [worker])
 
 
 def scenario_shared_encoder_distinct_inputs():